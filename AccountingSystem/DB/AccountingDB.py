@@ -608,6 +608,27 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    recordsPerType = {}
+    for record in recordTuples:
+      recordsPerType.setdefault( record[1], [] ).append( record )
+    for typeName in recordsPerType:
+      records = recordsPerType[ typeName ]
+      inTableName = _getTableName( "in", typeName )
+      result = self.insertRecordBundleDirectly( typeName, [ ( record[2], record[3], record[4] ) for record in records ] )
+      if not result[ 'OK' ]:
+        #Find out the faulty records inserting them one by one
+        self.log.error( "Can't insert bundle, inserting the records one by one", result[ 'Message' ] )
+        self.__insertFromINTableOneByOne( records )
+        continue
+      idList = [ str( record[0] ) for record in records ]
+      result = self._update( "DELETE FROM `%s` WHERE id in (%s)" % ( inTableName, ", ".join( idList ) ) )
+      if not result[ 'OK' ]:
+        self.log.error( "Can't delete rows from the IN table", result[ 'Message' ] )
+      now = Time.toEpoch()
+      for record in records:
+        gMonitor.addMark( "insertiontime", now - record[5] )
+
+  def __insertFromINTableOneByOne( self, recordTuples ):
     for record in recordTuples:
       iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
       result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
@@ -620,47 +641,89 @@ class AccountingDB( DB ):
         self.log.error( "Can't delete row from the IN table", result[ 'Message' ] )
       gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
 
-
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
     """
     Add an entry to the type contents
     """
+    return self.insertRecordBundleDirectly( typeName, [ ( startTime, endTime, valuesList ) ] )
+
+  def insertRecordBundleDirectly( self, typeName, recordsList ):
+    """
+    Add a list of ( startTime, endTime, valuesList ) entries to the type contents.
+    The contributions to the buckets are summed in memory and written with one
+    INSERT ... ON DUPLICATE KEY UPDATE per batch of buckets in a single transaction,
+    the whole transaction is restarted on dead locks
+    """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    gMonitor.addMark( "registeradded", 1 )
-    gMonitor.addMark( "registeradded:%s" % typeName, 1 )
-    self.log.info( "Adding record", "for type %s\n [%s -> %s]" % ( typeName, Time.fromEpoch( startTime ), Time.fromEpoch( endTime ) ) )
     if not typeName in self.dbCatalog:
       return S_ERROR( "Type %s has not been defined in the db" % typeName )
-    #Discover key indexes
-    for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-      keyName = self.dbCatalog[ typeName ][ 'keys' ][ keyPos ]
-      keyValue = valuesList[ keyPos ]
-      retVal = self.__addKeyValue( typeName, keyName, keyValue )
-      if not retVal[ 'OK' ]:
-        return retVal
-      self.log.verbose( "Value %s for key %s has id %s" % ( keyValue, keyName, retVal[ 'Value' ] ) )
-      valuesList[ keyPos ] = retVal[ 'Value' ]
-    insertList = list( valuesList )
-    insertList.append( startTime )
-    insertList.append( endTime )
+    if not recordsList:
+      return S_OK()
+    gMonitor.addMark( "registeradded", len( recordsList ) )
+    gMonitor.addMark( "registeradded:%s" % typeName, len( recordsList ) )
+    self.log.info( "Adding %s records" % len( recordsList ), "for type %s" % typeName )
+    keyNames = self.dbCatalog[ typeName ][ 'keys' ]
+    numKeys = len( keyNames )
+    numValues = len( self.dbCatalog[ typeName ][ 'values' ] )
+    nowEpoch = int( Time.toEpoch( Time.dateTime() ) )
+    typeRows = []
+    #( bucketStartTime, bucketLength, keyIds ) -> [ sum of values ] + [ entries ]
+    buckets = {}
+    for startTime, endTime, valuesList in recordsList:
+      if len( valuesList ) != numKeys + numValues:
+        return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
+                                                                                       len( valuesList ),
+                                                                                       numKeys + numValues ) )
+      #Discover key indexes
+      keyIds = []
+      for keyPos in range( numKeys ):
+        retVal = self.__addKeyValue( typeName, keyNames[ keyPos ], valuesList[ keyPos ] )
+        if not retVal[ 'OK' ]:
+          return retVal
+        keyIds.append( retVal[ 'Value' ] )
+      values = list( valuesList[ numKeys: ] )
+      typeRows.append( keyIds + values + [ startTime, endTime ] )
+      #HACK: One more record to split in the buckets to be able to count total entries
+      values = [ float( value ) for value in values ] + [ 1.0 ]
+      keyIds = tuple( keyIds )
+      for bucketStartTime, proportion, bucketLength in self.calculateBuckets( typeName, startTime, endTime, nowEpoch ):
+        bucketKey = ( bucketStartTime, bucketLength, keyIds )
+        bucketValues = buckets.get( bucketKey )
+        if bucketValues is None:
+          buckets[ bucketKey ] = [ value * proportion for value in values ]
+        else:
+          for pos in range( len( values ) ):
+            bucketValues[ pos ] += values[ pos ] * proportion
+
+    for retry in range( max( 1, self.__deadLockRetries ) ):
+      retVal = self.__writeBundle( typeName, typeRows, buckets )
+      #A dead lock rolls back the transaction, the bundle has to be written again
+      if retVal[ 'OK' ] or retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+        break
+      self.log.warn( "Dead lock while inserting the bundle, restarting it", retVal[ 'Message' ] )
+    return retVal
+
+  def __writeBundle( self, typeName, typeRows, buckets ):
+    """
+    Insert the raw rows and add the contributions to the buckets in one transaction
+    """
     retVal = self._getConnection()
     if not retVal[ 'OK' ]:
       return retVal
     connObj = retVal[ 'Value' ]
     try:
-      retVal = self.insertFields( _getTableName( "type", typeName ),
-                             self.dbCatalog[ typeName ][ 'typeFields' ],
-                             insertList,
-                             conn = connObj )
+      retVal = self.__startTransaction( connObj )
       if not retVal[ 'OK' ]:
         return retVal
-      #HACK: One more record to split in the buckets to be able to count total entries
-      valuesList.append( 1 )
-      retVal = self.__startTransaction( connObj )
+      retVal = self.insertFieldsBulk( _getTableName( "type", typeName ),
+                                      self.dbCatalog[ typeName ][ 'typeFields' ],
+                                      typeRows,
+                                      conn = connObj )
       if not retVal[ 'OK' ]:
+        self.__rollbackTransaction( connObj )
         return retVal
-      retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj = connObj )
+      retVal = self.__writeBuckets( typeName, buckets, connObj )
       if not retVal[ 'OK' ]:
         self.__rollbackTransaction( connObj )
         return retVal
@@ -668,6 +731,31 @@ class AccountingDB( DB ):
     finally:
       connObj.close()
 
+  def __writeBuckets( self, typeName, buckets, connObj, batchSize = 500 ):
+    """
+    Add the summed contributions to the buckets, { ( startTime, bucketLength, keyIds ) : values + [ entries ] }
+    """
+    tableName = _getTableName( "bucket", typeName )
+    keyFields = [ "`%s`" % keyField for keyField in self.dbCatalog[ typeName ][ 'keys' ] ]
+    valueFields = [ "`%s`" % valueField for valueField in self.dbCatalog[ typeName ][ 'values' ] ]
+    valueFields.append( '`entriesInBucket`' )
+    sqlFields = [ '`startTime`', '`bucketLength`' ] + keyFields + valueFields
+    cmd = "INSERT INTO `%s` ( %s ) VALUES " % ( tableName, ", ".join( sqlFields ) )
+    sqlUpData = ", ".join( [ "%s=%s+VALUES(%s)" % ( field, field, field ) for field in valueFields ] )
+    rows = []
+    for bucketKey in sorted( buckets ):
+      bucketStartTime, bucketLength, keyIds = bucketKey
+      sqlValues = [ str( int( bucketStartTime ) ), str( int( bucketLength ) ) ]
+      sqlValues.extend( [ str( int( keyId ) ) for keyId in keyIds ] )
+      sqlValues.extend( [ repr( value ) for value in buckets[ bucketKey ] ] )
+      rows.append( "( %s )" % ", ".join( sqlValues ) )
+    for i in range( 0, len( rows ), batchSize ):
+      batchCmd = "%s%s ON DUPLICATE KEY UPDATE %s" % ( cmd, ", ".join( rows[ i:i + batchSize ] ), sqlUpData )
+      result = self._update( batchCmd, conn = connObj )
+      if not result[ 'OK' ]:
+        return S_ERROR( "Cannot update buckets: %s" % result[ 'Message' ] )
+    return S_OK()
+
   def deleteRecord( self, typeName, startTime, endTime, valuesList ):
     """
     Add an entry to the type contents
@@ -0,0 +1,125 @@
+""" Unit tests of the bundled record insertion of the AccountingDB,
+    the MySQL statements are run on an in memory sqlite database
+"""
+
+import unittest, re, sqlite3
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities import Time
+from DIRAC.AccountingSystem.DB.AccountingDB import AccountingDB
+
+DEADLOCK = "Deadlock found when trying to get lock; try restarting transaction"
+
+class FakeConnection:
+
+  def close( self ):
+    pass
+
+class FakeAccountingDB( AccountingDB ):
+  """ Type Job, key Site, value CPUTime. Hourly buckets for two days, daily ones before
+  """
+
+  def __init__( self ):
+    self.conn = sqlite3.connect( ':memory:' )
+    self.conn.execute( "CREATE TABLE ac_type_Job( Site, CPUTime, startTime, endTime )" )
+    self.conn.execute( "CREATE TABLE ac_bucket_Job( startTime, bucketLength, Site, CPUTime, entriesInBucket, "
+                       "PRIMARY KEY( startTime, bucketLength, Site ) )" )
+    self.log = gLogger.getSubLogger( "FakeAccountingDB" )
+    self.maxBucketTime = 604800
+    self.dbCatalog = {}
+    self.dbBucketsLength = {}
+    self._AccountingDB__readOnly = False
+    self._AccountingDB__oldBucketMethod = False
+    self._AccountingDB__deadLockRetries = 2
+    self._AccountingDB__addToCatalog( 'Job', [ 'Site' ], [ 'CPUTime' ], [ ( 172800, 3600 ), ( 2592000, 86400 ) ] )
+    self.siteIds = {}
+    #Statements failing with a dead lock
+    self.deadLocks = []
+
+  def _AccountingDB__addKeyValue( self, typeName, keyName, keyValue ):
+    return S_OK( self.siteIds.setdefault( keyValue, len( self.siteIds ) + 1 ) )
+
+  def _getConnection( self ):
+    return S_OK( FakeConnection() )
+
+  def _query( self, cmd, conn = False, debug = False ):
+    if cmd == "COMMIT":
+      self.conn.commit()
+    elif cmd == "ROLLBACK":
+      self.conn.rollback()
+    elif cmd != "START TRANSACTION":
+      return S_OK( tuple( self.conn.execute( cmd ).fetchall() ) )
+    return S_OK( () )
+
+  def _update( self, cmd, conn = False, debug = False ):
+    for pattern in self.deadLocks:
+      if cmd.find( pattern ) > -1:
+        self.deadLocks.remove( pattern )
+        #MySQL rolls back the whole transaction
+        self.conn.rollback()
+        return S_ERROR( DEADLOCK )
+    cmd = cmd.replace( "ON DUPLICATE KEY UPDATE", "ON CONFLICT( startTime, bucketLength, Site ) DO UPDATE SET" )
+    cmd = re.sub( r"VALUES\((`\w+`)\)", r"excluded.\1", cmd )
+    return S_OK( self.conn.execute( cmd ).rowcount )
+
+  def table( self, tableName ):
+    return self.conn.execute( "SELECT * FROM %s ORDER BY 1, 2, 3" % tableName ).fetchall()
+
+class AccountingDBTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    now = int( Time.toEpoch() )
+    hour = now - now % 3600
+    self.records = [ ( hour - 7200, hour - 7200, [ 'Site1', 10 ] ),
+                     #Spanning several hourly buckets
+                     ( hour - 18000, hour - 3600 + 1800, [ 'Site1', 90 ] ),
+                     ( hour - 14400, hour - 10800, [ 'Site2', 30 ] ),
+                     #From the daily buckets to the hourly ones
+                     ( hour - 86400 * 3, hour - 86400, [ 'Site1', 200 ] ),
+                     ( hour - 86400 * 3, hour - 86400, [ 'Site2', 300 ] ) ]
+
+  def perRecord( self ):
+    """ The buckets written by the former insertion, one record at a time """
+    db = FakeAccountingDB()
+    for startTime, endTime, valuesList in self.records:
+      keyId = db._AccountingDB__addKeyValue( 'Job', 'Site', valuesList[0] )['Value']
+      db._AccountingDB__splitInBuckets( 'Job', startTime, endTime, [ keyId, valuesList[1], 1 ] )
+    db.conn.commit()
+    return db.table( 'ac_bucket_Job' )
+
+  def assertSameBuckets( self, buckets, expected ):
+    self.assertEqual( len( buckets ), len( expected ) )
+    for bucket, expectedBucket in zip( buckets, expected ):
+      self.assertEqual( bucket[:3], expectedBucket[:3] )
+      for pos in ( 3, 4 ):
+        self.assertAlmostEqual( bucket[pos], expectedBucket[pos] )
+
+  def test_bundle( self ):
+    """ the buckets summed in memory are the ones of the per record insertion """
+    db = FakeAccountingDB()
+    self.assert_( db.insertRecordBundleDirectly( 'Job', self.records )['OK'] )
+    self.assertEqual( len( db.table( 'ac_type_Job' ) ), len( self.records ) )
+    buckets = db.table( 'ac_bucket_Job' )
+    self.assertSameBuckets( buckets, self.perRecord() )
+    self.assert_( len( buckets ) > len( self.records ) )
+    self.assertAlmostEqual( sum( [ bucket[4] for bucket in buckets ] ), len( self.records ) )
+    #Adding to the existing buckets
+    self.assert_( db.insertRecordBundleDirectly( 'Job', self.records[:1] )['OK'] )
+    self.assertAlmostEqual( sum( [ bucket[4] for bucket in db.table( 'ac_bucket_Job' ) ] ), len( self.records ) + 1 )
+
+  def test_deadLock( self ):
+    """ the whole bundle is written again after a dead lock """
+    db = FakeAccountingDB()
+    db.deadLocks = [ "INSERT INTO `ac_bucket_Job`" ]
+    self.assert_( db.insertRecordBundleDirectly( 'Job', self.records )['OK'] )
+    self.assertEqual( len( db.table( 'ac_type_Job' ) ), len( self.records ) )
+    self.assertSameBuckets( db.table( 'ac_bucket_Job' ), self.perRecord() )
+    #Not retried forever
+    db.deadLocks = [ "INSERT INTO `ac_bucket_Job`" ] * 2
+    result = db.insertRecordBundleDirectly( 'Job', self.records )
+    self.failIf( result['OK'] )
+    self.assertEqual( len( db.table( 'ac_type_Job' ) ), len( self.records ) )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( AccountingDBTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
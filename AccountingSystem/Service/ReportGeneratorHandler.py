@@ -41,6 +41,9 @@ def initializeReportGeneratorHandler( serviceInfo ):
   except IOError:
     gLogger.fatal( "Can't write to %s" % dataPath )
     return S_ERROR( "Data location is not writable" )
+  gDataCache.setCacheLimits( maxCacheSize = gConfig.getValue( "%s/MaxCacheSize" % reportSection, 1024 ) * 1024 * 1024,
+                             closedRangeLifeTime = gConfig.getValue( "%s/ClosedRangeLifeTime" % reportSection, 86400 * 7 ),
+                             openTimeWindow = gConfig.getValue( "%s/OpenTimeWindow" % reportSection, 86400 * 7 ) )
   gDataCache.setGraphsLocation( dataPath )
   gMonitor.registerActivity( "plotsDrawn", "Drawn plot images", "Accounting reports", "plots", gMonitor.OP_SUM )
   gMonitor.registerActivity( "reportsRequested", "Generated reports", "Accounting reports", "reports", gMonitor.OP_SUM )
@@ -1,4 +1,5 @@
 import types
+import numpy
 from DIRAC.Core.Utilities import Time
 
 class DBUtils:
@@ -145,6 +146,83 @@ class DBUtils:
       del( normData[ bDate ][-1] )
     return normData
 
+  def _bucketsToMatrix( self, granularity, bucketsData, checkNone = False ):
+    """
+    Span the buckets to granularity and sum them into time x group matrices
+    bucketsData must be a list of lists where each list contains
+      - field 0: grouping key
+      - field 1: datetime
+      - field 2: bucketLength
+      - fields 3-n: numericalFields
+    Returns ( groups, times, values, weights, present ):
+      - groups : list of grouping keys
+      - times : array of bucket epochs
+      - values : groups x times x fields array with the summed data
+      - weights : groups x times array with the summed bucket proportions
+      - present : groups x times boolean array, True where there is data
+    """
+    groups = []
+    groupIndex = {}
+    rowGroups = []
+    for row in bucketsData:
+      key = row[0]
+      if key not in groupIndex:
+        groupIndex[ key ] = len( groups )
+        groups.append( key )
+      rowGroups.append( groupIndex[ key ] )
+    if not groups:
+      return ( [], numpy.zeros( 0, dtype = numpy.int64 ), numpy.zeros( ( 0, 0, 0 ) ),
+               numpy.zeros( ( 0, 0 ) ), numpy.zeros( ( 0, 0 ), dtype = bool ) )
+    nFields = len( bucketsData[0] ) - 3
+    rowGroups = numpy.array( rowGroups, dtype = numpy.int64 )
+    starts = numpy.array( [ row[1] for row in bucketsData ], dtype = numpy.int64 )
+    lengths = numpy.array( [ row[2] for row in bucketsData ], dtype = numpy.int64 )
+    #None values are loaded as NaN
+    data = numpy.array( [ row[3:] for row in bucketsData ], dtype = numpy.float64 ).reshape( len( starts ), nFields )
+    if checkNone:
+      data[ numpy.isnan( data ) ] = 0
+    #Buckets of the right size or without length go as they are, the rest is spread among the new buckets
+    ends = starts + lengths
+    asIs = ( lengths == granularity ) | ( lengths == 0 )
+    firstBins = numpy.where( lengths == granularity, starts, starts - starts % granularity )
+    numPieces = numpy.where( asIs, 1, ( ends - firstBins + granularity - 1 ) // granularity )
+    pieceRows = numpy.repeat( numpy.arange( len( starts ) ), numPieces )
+    pieceOffsets = numpy.arange( len( pieceRows ) ) - numpy.repeat( numpy.cumsum( numPieces ) - numPieces, numPieces )
+    pieceBins = firstBins[ pieceRows ] + pieceOffsets * granularity
+    pieceLengths = numpy.minimum( pieceBins + granularity, ends[ pieceRows ] ) - numpy.maximum( pieceBins, starts[ pieceRows ] )
+    safeLengths = numpy.where( lengths == 0, 1, lengths ).astype( numpy.float64 )
+    proportions = numpy.where( asIs[ pieceRows ], 1.0, pieceLengths / safeLengths[ pieceRows ] )
+    #Sum the pieces into the cells of the matrix
+    times, timeIndex = numpy.unique( pieceBins, return_inverse = True )
+    nCells = len( groups ) * len( times )
+    cells = rowGroups[ pieceRows ] * len( times ) + timeIndex
+    weights = numpy.bincount( cells, weights = proportions, minlength = nCells )
+    present = numpy.bincount( cells, minlength = nCells ) > 0
+    values = numpy.zeros( ( nCells, nFields ) )
+    for iField in range( nFields ):
+      values[ :, iField ] = numpy.bincount( cells, weights = data[ pieceRows, iField ] * proportions,
+                                            minlength = nCells )
+    return ( groups, times,
+             values.reshape( len( groups ), len( times ), nFields ),
+             weights.reshape( len( groups ), len( times ) ),
+             present.reshape( len( groups ), len( times ) ) )
+
+  def _matrixToDict( self, groups, times, values, present ):
+    """
+    Convert a groups x times x fields matrix into
+      - dataDict = { 'key' : { time1 : [ field1, field2 ], time2 : ... }, 'key2'.. }
+    Only the cells with data are kept
+    """
+    dataDict = {}
+    timeList = times.tolist()
+    for iGroup in range( len( groups ) ):
+      rowValues = values[ iGroup ].tolist()
+      groupDict = {}
+      for iTime in numpy.flatnonzero( present[ iGroup ] ).tolist():
+        groupDict[ timeList[ iTime ] ] = rowValues[ iTime ]
+      dataDict[ groups[ iGroup ] ] = groupDict
+    return dataDict
+
   def _convertNoneToZero( self, bucketsData ):
     """
     Convert None to 0
@@ -310,6 +388,26 @@ class DBUtils:
 
     return dataDict
 
+  def _matrixProportionalGauges( self, values, present ):
+    """
+    Same as _calculateProportionalGauges for a groups x times x fields matrix
+    """
+    if values.shape[2] < 2 and present.any():
+      raise Exception( "Matrix must have at least two fields" )
+    if values.shape[2] < 2:
+      return values[ :, :, :1 ]
+    total = numpy.where( present, values[ :, :, 0 ], 0 )
+    count = numpy.where( present, values[ :, :, 1 ], 0 )
+    oldSettings = numpy.seterr( divide = 'ignore', invalid = 'ignore' )
+    try:
+      #Cells without data have a zero ratio
+      ratios = numpy.where( present, total / numpy.where( present, count, 1 ), 0 )
+      sumTotal = total.sum( axis = 0 )
+      factors = numpy.where( sumTotal == 0, 0, ( sumTotal / count.sum( axis = 0 ) ) / ratios.sum( axis = 0 ) )
+    finally:
+      numpy.seterr( **oldSettings )
+    return ( ratios * factors )[ :, :, numpy.newaxis ]
+
   def _getBucketTotals( self, dataDict ):
     """
     Sum key data and get totals for each bucket
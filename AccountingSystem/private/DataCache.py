@@ -1,14 +1,34 @@
 # $HeadURL$
+""" Cache of the accounting reports and plots
+
+    Entries are kept in memory and in the graphs location, so they are shared
+    by all the ReportGenerator processes using the same location and survive
+    restarts. Files are named after the report hash:
+
+    - <hash>.data : report data
+    - <hash>.plot : plot description, the images are <hash>.png and <hash>.thb.png
+
+    Reports of time ranges ending before the open time window are not going to
+    change any more and are kept for closedRangeLifeTime seconds. The records of
+    a job are sent when it ends and fill the buckets since its start, so the
+    window has to cover the longest jobs. Records arriving even later, e.g.
+    through the failover requests, are missing from the closed range reports
+    cached before they arrived until these expire. The disk cache is bounded in
+    size, the least recently used entries are removed first.
+"""
 __RCSID__ = "$Id$"
 
 import os
 import os.path
+import re
 import time
+import zlib
 import threading
 
 from DIRAC import S_OK, S_ERROR, gLogger, rootPath, gConfig
-from DIRAC.Core.Utilities import DictCache
+from DIRAC.Core.Utilities import DictCache, DEncode
 
+gHashFileRE = re.compile( "^([0-9a-f]{32})\.(.*)$" )
 
 class DataCache:
 
@@ -20,35 +40,114 @@ class DataCache:
     self.purgeThread.setDaemon( 1 )
     self.purgeThread.start()
     self.__dataCache = DictCache()
-    self.__graphCache = DictCache( deleteFunction = self._deleteGraph )
+    self.__graphCache = DictCache()
     self.__dataLifeTime = 600
     self.__graphLifeTime = 3600
+    self.__closedRangeLifeTime = 86400 * 7
+    #Longest jobs
+    self.__openTimeWindow = 86400 * 7
+    self.__maxCacheSize = 1024 * 1024 * 1024
+    self.__purgeLock = threading.Lock()
 
   def setGraphsLocation( self, graphsDir ):
     self.graphsLocation = graphsDir
-    for graphName in os.listdir( self.graphsLocation ):
-      if graphName.find( ".png" ) > 0:
-        graphLocation = "%s/%s" % ( self.graphsLocation, graphName )
-        gLogger.verbose( "Purging %s" % graphLocation )
-        os.unlink( graphLocation )
+    self.purgeDisk()
+
+  def setCacheLimits( self, maxCacheSize = None, closedRangeLifeTime = None, openTimeWindow = None ):
+    """
+    Set the maximum size of the disk cache in bytes, the lifetime of the reports of closed time
+    ranges and the time window before now whose data can still change
+    """
+    if maxCacheSize is not None:
+      self.__maxCacheSize = max( 0, maxCacheSize )
+    if closedRangeLifeTime is not None:
+      self.__closedRangeLifeTime = max( 0, closedRangeLifeTime )
+    if openTimeWindow is not None:
+      self.__openTimeWindow = max( 0, openTimeWindow )
 
   def purgeExpired( self ):
     while self.alive:
       time.sleep( 600 )
       self.__graphCache.purgeExpired()
       self.__dataCache.purgeExpired()
+      try:
+        self.purgeDisk()
+      except Exception:
+        gLogger.exception( "Error while purging the accounting plots cache" )
+
+  def __getLifeTime( self, reportRequest, openLifeTime ):
+    """
+    Reports with data that can still change get the normal lifetime
+    """
+    try:
+      endTime = int( reportRequest[ 'endTime' ] )
+    except ( KeyError, TypeError, ValueError ):
+      return openLifeTime
+    if endTime + self.__openTimeWindow < time.time():
+      return max( openLifeTime, self.__closedRangeLifeTime )
+    return openLifeTime
+
+  def __readEntry( self, fileName ):
+    """
+    Read a cache entry from disk, False if it does not exist or has expired
+    """
+    filePath = os.path.join( self.graphsLocation, fileName )
+    try:
+      fd = file( filePath, "rb" )
+      try:
+        expiration = float( fd.readline() )
+        if expiration < time.time():
+          return False
+        value = DEncode.decode( zlib.decompress( fd.read() ) )[0]
+      finally:
+        fd.close()
+      #Keep track of the last use for the LRU purge
+      os.utime( filePath, None )
+    except Exception:
+      return False
+    return ( value, expiration )
+
+  def __writeEntry( self, fileName, lifeTime, value ):
+    """
+    Write a cache entry to disk. It is renamed into place so other processes never read half a file
+    """
+    filePath = os.path.join( self.graphsLocation, fileName )
+    tmpPath = "%s.tmp.%s.%s" % ( filePath, os.getpid(), threading.currentThread().getName() )
+    try:
+      data = zlib.compress( DEncode.encode( value ) )
+      fd = file( tmpPath, "wb" )
+      try:
+        fd.write( "%d\n" % ( time.time() + lifeTime ) )
+        fd.write( data )
+      finally:
+        fd.close()
+      os.rename( tmpPath, filePath )
+    except Exception, e:
+      gLogger.warn( "Can't write cache entry %s: %s" % ( fileName, str( e ) ) )
+      try:
+        os.unlink( tmpPath )
+      except OSError:
+        pass
 
   def getReportData( self, reportRequest, reportHash, dataFunc ):
     """
     Get report data from cache if exists, else generate it
     """
     reportData = self.__dataCache.get( reportHash )
-    if reportData == False:
-      retVal = dataFunc( reportRequest )
-      if not retVal[ 'OK' ]:
-        return retVal
-      reportData = retVal[ 'Value' ]
-      self.__dataCache.add( reportHash, self.__dataLifeTime, reportData )
+    if reportData is not False:
+      return S_OK( reportData )
+    fileName = "%s.data" % reportHash
+    entry = self.__readEntry( fileName )
+    if entry:
+      reportData, expiration = entry
+      self.__dataCache.add( reportHash, min( self.__dataLifeTime, expiration - time.time() ), reportData )
+      return S_OK( reportData )
+    retVal = dataFunc( reportRequest )
+    if not retVal[ 'OK' ]:
+      return retVal
+    reportData = retVal[ 'Value' ]
+    self.__dataCache.add( reportHash, self.__dataLifeTime, reportData )
+    self.__writeEntry( fileName, self.__getLifeTime( reportRequest, self.__dataLifeTime ), reportData )
     return S_OK( reportData )
 
   def getReportPlot( self, reportRequest, reportHash, reportData, plotFunc ):
@@ -56,17 +155,33 @@ class DataCache:
     Get report data from cache if exists, else generate it
     """
     plotDict = self.__graphCache.get( reportHash )
-    if plotDict == False:
-      basePlotFileName = "%s/%s" % ( self.graphsLocation, reportHash )
-      retVal = plotFunc( reportRequest, reportData, basePlotFileName )
-      if not retVal[ 'OK' ]:
-        return retVal
-      plotDict = retVal[ 'Value' ]
-      if plotDict[ 'plot' ]:
-        plotDict[ 'plot' ] = "%s.png" % reportHash
+    #The images may have been removed by the purge of another process
+    if plotDict is not False and os.path.isfile( os.path.join( self.graphsLocation, "%s.png" % reportHash ) ):
+      return S_OK( plotDict )
+    fileName = "%s.plot" % reportHash
+    entry = self.__readEntry( fileName )
+    if entry and os.path.isfile( os.path.join( self.graphsLocation, "%s.png" % reportHash ) ):
+      plotDict, expiration = entry
+      self.__graphCache.add( reportHash, min( self.__graphLifeTime, expiration - time.time() ), plotDict )
+      return S_OK( plotDict )
+    #Draw in temporary files and move them into place when done
+    tmpName = "%s.tmp.%s.%s" % ( reportHash, os.getpid(), threading.currentThread().getName() )
+    basePlotFileName = "%s/%s" % ( self.graphsLocation, tmpName )
+    retVal = plotFunc( reportRequest, reportData, basePlotFileName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    plotDict = retVal[ 'Value' ]
+    try:
       if plotDict[ 'thumbnail' ]:
+        os.rename( "%s.thb.png" % basePlotFileName, os.path.join( self.graphsLocation, "%s.thb.png" % reportHash ) )
         plotDict[ 'thumbnail' ] = "%s.thb.png" % reportHash
-      self.__graphCache.add( reportHash, self.__graphLifeTime, plotDict )
+      if plotDict[ 'plot' ]:
+        os.rename( "%s.png" % basePlotFileName, os.path.join( self.graphsLocation, "%s.png" % reportHash ) )
+        plotDict[ 'plot' ] = "%s.png" % reportHash
+    except OSError, e:
+      return S_ERROR( "Can't store plot %s: %s" % ( reportHash, str( e ) ) )
+    self.__graphCache.add( reportHash, self.__graphLifeTime, plotDict )
+    self.__writeEntry( fileName, self.__getLifeTime( reportRequest, self.__graphLifeTime ), plotDict )
     return S_OK( plotDict )
 
   def getPlotData( self, plotFileName ):
@@ -77,22 +192,86 @@ class DataCache:
       fd.close()
     except Exception, e:
       return S_ERROR( "Can't open file %s: %s" % ( plotFileName, str( e ) ) )
+    try:
+      os.utime( filename, None )
+    except OSError:
+      pass
     return S_OK( data )
 
-  def _deleteGraph( self, plotDict ):
+  def __isExpired( self, filePath, now ):
     try:
-      for key in plotDict:
-        value = plotDict[ key ]
-        if value:
-          fPath = os.path.join( self.graphsLocation, str( value ) )
-          if os.path.isfile( fPath ):
-            gLogger.info( "Deleting plot from cache", value )
-            os.unlink( fPath )
-          else:
-            gLogger.info( "Plot has already been deleted", value )
-    except:
-      pass
+      fd = file( filePath, "rb" )
+      try:
+        return float( fd.readline() ) < now
+      finally:
+        fd.close()
+    except Exception:
+      return True
 
+  def purgeDisk( self ):
+    """
+    Remove the expired entries, leftovers of interrupted writes and, if the cache is
+    bigger than the maximum size, the least recently used entries
+    """
+    self.__purgeLock.acquire()
+    try:
+      try:
+        fileNames = os.listdir( self.graphsLocation )
+      except OSError:
+        return S_OK()
+      now = time.time()
+      entries = {}
+      for fileName in fileNames:
+        match = gHashFileRE.match( fileName )
+        if not match:
+          continue
+        reportHash, suffix = match.groups()
+        filePath = os.path.join( self.graphsLocation, fileName )
+        try:
+          fileStat = os.stat( filePath )
+        except OSError:
+          continue
+        entries.setdefault( reportHash, {} )[ suffix ] = ( filePath, fileStat.st_size, fileStat.st_mtime )
+      toDelete = []
+      lruList = []
+      totalSize = 0
+      for reportHash in entries:
+        files = entries[ reportHash ]
+        for suffix in files.keys():
+          filePath, size, mtime = files[ suffix ]
+          if suffix.find( ".tmp." ) > -1 or suffix.find( "tmp." ) == 0:
+            if mtime < now - self.__graphLifeTime:
+              toDelete.append( filePath )
+            del( files[ suffix ] )
+          elif suffix in ( "data", "plot" ) and self.__isExpired( filePath, now ):
+            toDelete.append( filePath )
+            del( files[ suffix ] )
+        #Images without a plot description are from an old or failed generation
+        if "plot" not in files:
+          for suffix in files.keys():
+            if suffix != "data" and files[ suffix ][2] < now - self.__graphLifeTime:
+              toDelete.append( files[ suffix ][0] )
+              del( files[ suffix ] )
+        if files:
+          entrySize = sum( [ files[ suffix ][1] for suffix in files ] )
+          totalSize += entrySize
+          lruList.append( ( max( [ files[ suffix ][2] for suffix in files ] ), entrySize,
+                            [ files[ suffix ][0] for suffix in files ] ) )
+      lruList.sort()
+      for lastUse, entrySize, filePaths in lruList:
+        if totalSize <= self.__maxCacheSize:
+          break
+        toDelete.extend( filePaths )
+        totalSize -= entrySize
+      for filePath in toDelete:
+        gLogger.verbose( "Purging %s" % filePath )
+        try:
+          os.unlink( filePath )
+        except OSError:
+          pass
+      return S_OK( len( toDelete ) )
+    finally:
+      self.__purgeLock.release()
 
 
 gDataCache = DataCache()
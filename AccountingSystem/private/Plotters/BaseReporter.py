@@ -1,4 +1,5 @@
 import time, copy, types
+import numpy
 from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.AccountingSystem.private.DBUtils import DBUtils
 from DIRAC.AccountingSystem.private.DataCache import gDataCache
@@ -156,20 +157,18 @@ class BaseReporter( DBUtils ):
                                           )
     if not retVal[ 'OK' ]:
       return retVal
-    dataDict = self._groupByField( 0, retVal[ 'Value' ] )
     coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
-    #Transform!
-    for keyField in dataDict:
-      if metadataDict[ self._PARAM_CHECK_FOR_NONE ]:
-        dataDict[ keyField ] = self._convertNoneToZero( dataDict[ keyField ] )
-      if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "average":
-        dataDict[ keyField ] = self._averageToGranularity( coarsestGranularity, dataDict[ keyField ] )
-      if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "sum":
-        dataDict[ keyField ] = self._sumToGranularity( coarsestGranularity, dataDict[ keyField ] )
-      if self._PARAM_CONSOLIDATION_FUNCTION in metadataDict:
-        dataDict[ keyField ] = self._executeConsolidation( metadataDict[ self._PARAM_CONSOLIDATION_FUNCTION ], dataDict[ keyField ] )
+    #Transform! All the groups at once in time x group matrices
+    groups, times, values, weights, present = self._bucketsToMatrix( coarsestGranularity,
+                                                                     retVal[ 'Value' ],
+                                                                     metadataDict[ self._PARAM_CHECK_FOR_NONE ] )
+    if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "average":
+      values[ present ] /= weights[ present ][ :, numpy.newaxis ]
+    if self._PARAM_CONSOLIDATION_FUNCTION in metadataDict:
+      values = self._consolidateMatrix( metadataDict[ self._PARAM_CONSOLIDATION_FUNCTION ], values, present )
     if metadataDict[ self._PARAM_CALCULATE_PROPORTIONAL_GAUGES ]:
-      dataDict = self._calculateProportionalGauges( dataDict )
+      values = self._matrixProportionalGauges( values, present )
+    dataDict = self._matrixToDict( groups, times, values, present )
     return S_OK( ( dataDict, coarsestGranularity ) )
 
   def _executeConsolidation( self, functor, dataDict ):
@@ -177,6 +176,26 @@ class BaseReporter( DBUtils ):
       dataDict[ timeKey ] = [ functor( *dataDict[ timeKey ] ) ]
     return dataDict
 
+  def _consolidateMatrix( self, functor, values, present ):
+    """
+    Apply the consolidation function to all the cells of a groups x times x fields matrix
+    The known consolidation functions are vectorized, any other is called cell by cell
+    """
+    function = getattr( functor, 'im_func', None )
+    if function in ( BaseReporter._averageConsolidation.im_func, BaseReporter._efficiencyConsolidation.im_func ) \
+       and values.shape[2] == 2:
+      total = values[ :, :, 0 ]
+      count = values[ :, :, 1 ]
+      consolidated = total / numpy.where( count == 0, 1, count )
+      consolidated[ count == 0 ] = 0
+      if function == BaseReporter._efficiencyConsolidation.im_func:
+        consolidated *= 100.0
+      return consolidated[ :, :, numpy.newaxis ]
+    consolidated = numpy.zeros( values.shape[:2] + ( 1, ) )
+    for iGroup, iTime in zip( *numpy.nonzero( present ) ):
+      consolidated[ iGroup, iTime, 0 ] = functor( *values[ iGroup, iTime ].tolist() )
+    return consolidated
+
   def _getSummaryData( self, startTime, endTime, selectFields, preCondDict, groupingFields, metadataDict = None, reduceFunc = False ):
     condDict = {}
     #Make safe selections
@@ -0,0 +1,101 @@
+""" Test cases for the disk cache of the accounting reports shared by the
+    ReportGenerator processes
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from DIRAC import S_OK
+import DIRAC.AccountingSystem.private.DataCache as DataCacheModule
+
+HASH1 = "0" * 32
+HASH2 = "1" * 32
+HASH3 = "2" * 32
+
+class DataCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.location = tempfile.mkdtemp()
+    self.cache = self.newCache()
+    self.calls = 0
+
+  def tearDown( self ):
+    shutil.rmtree( self.location )
+
+  def newCache( self ):
+    """ Another ReportGenerator process using the same location """
+    cache = DataCacheModule.DataCache()
+    cache.alive = False
+    cache.setGraphsLocation( self.location )
+    return cache
+
+  def generate( self, reportRequest ):
+    self.calls += 1
+    return S_OK( { 'data' : self.calls } )
+
+  def expiration( self, fileName ):
+    fd = file( os.path.join( self.location, fileName ) )
+    try:
+      return float( fd.readline() )
+    finally:
+      fd.close()
+
+  def test_write( self ):
+    """ the entries are renamed into place and read by the other processes """
+    request = { 'endTime' : time.time() }
+    self.assertEqual( self.cache.getReportData( request, HASH1, self.generate ), S_OK( { 'data' : 1 } ) )
+    self.assertEqual( os.listdir( self.location ), [ "%s.data" % HASH1 ] )
+    self.assertEqual( self.newCache().getReportData( request, HASH1, self.generate ), S_OK( { 'data' : 1 } ) )
+    self.assertEqual( self.calls, 1 )
+    # An interrupted write leaves neither a partial entry nor the temporary file
+    rename = DataCacheModule.os.rename
+    def failRename( src, dst ):
+      raise OSError( "No space left on device" )
+    DataCacheModule.os.rename = failRename
+    try:
+      self.assert_( self.cache.getReportData( request, HASH2, self.generate )['OK'] )
+    finally:
+      DataCacheModule.os.rename = rename
+    self.assertEqual( os.listdir( self.location ), [ "%s.data" % HASH1 ] )
+
+  def test_expired( self ):
+    """ the expired entries on disk are generated again and purged """
+    self.cache._DataCache__writeEntry( "%s.data" % HASH1, -10, { 'data' : 0 } )
+    self.assertEqual( self.cache.getReportData( {}, HASH1, self.generate ), S_OK( { 'data' : 1 } ) )
+    self.cache._DataCache__writeEntry( "%s.data" % HASH2, -10, { 'data' : 0 } )
+    self.assertEqual( self.cache.purgeDisk(), S_OK( 1 ) )
+    self.assertEqual( os.listdir( self.location ), [ "%s.data" % HASH1 ] )
+
+  def test_lru( self ):
+    """ the least recently used entries are purged down to the maximum size """
+    now = time.time()
+    for age, reportHash in ( ( 300, HASH1 ), ( 200, HASH2 ), ( 100, HASH3 ) ):
+      self.cache.getReportData( {}, reportHash, self.generate )
+      filePath = os.path.join( self.location, "%s.data" % reportHash )
+      os.utime( filePath, ( now - age, now - age ) )
+    entrySize = os.stat( filePath ).st_size
+    # Reading the oldest one makes it the most recent
+    self.assertEqual( self.newCache().getReportData( {}, HASH1, self.generate ), S_OK( { 'data' : 1 } ) )
+    self.cache.setCacheLimits( maxCacheSize = entrySize * 2 )
+    self.assertEqual( self.cache.purgeDisk(), S_OK( 1 ) )
+    self.assertEqual( sorted( os.listdir( self.location ) ), [ "%s.data" % HASH1, "%s.data" % HASH3 ] )
+    self.cache.setCacheLimits( maxCacheSize = 0 )
+    self.cache.purgeDisk()
+    self.assertEqual( os.listdir( self.location ), [] )
+
+  def test_lifeTimes( self ):
+    """ the reports of closed time ranges are kept longer """
+    self.cache.setCacheLimits( closedRangeLifeTime = 86400 * 7, openTimeWindow = 86400 * 7 )
+    now = time.time()
+    self.cache.getReportData( { 'endTime' : now - 86400 * 8 }, HASH1, self.generate )
+    self.cache.getReportData( { 'endTime' : now - 86400 * 6 }, HASH2, self.generate )
+    self.cache.getReportData( {}, HASH3, self.generate )
+    self.assert_( self.expiration( "%s.data" % HASH1 ) > now + 86400 * 6 )
+    for reportHash in ( HASH2, HASH3 ):
+      self.assert_( self.expiration( "%s.data" % reportHash ) < now + 700 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DataCacheTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,124 @@
+""" Test cases for the timed report data built as time x group matrices. The results
+    have to be the same as spanning the buckets of every key with the per key helpers
+"""
+
+import types
+import random
+import unittest
+from DIRAC import S_OK
+
+try:
+  import numpy
+  from DIRAC.AccountingSystem.private.Plotters.BaseReporter import BaseReporter
+except Exception:
+  #numpy or the plotting library are missing
+  BaseReporter = None
+
+GRANULARITY = 3600
+
+def getRows( checkNone = False ):
+  """ Buckets of 15 minutes, one hour, one day and without length, the values of
+      the second field are never 0 for the proportional gauges
+  """
+  rand = random.Random( 1234 )
+  rows = []
+  for key in ( 'LCG.CERN.ch', 'LCG.PIC.es', 'LCG.RAL.uk' ):
+    for bucketLength in ( 900, 3600, 86400, 0 ):
+      for _i in range( 20 ):
+        if bucketLength:
+          start = 1350000000 - 1350000000 % bucketLength + rand.randint( 0, 40 ) * bucketLength
+        else:
+          start = 1350000000 + rand.randint( 0, 86400 )
+        total = rand.randint( 0, 1000 ) * 1.5
+        if checkNone and rand.random() < 0.2:
+          total = None
+        rows.append( [ key, start, bucketLength, total, rand.randint( 1, 50 ) ] )
+  return rows
+
+if BaseReporter:
+
+  class FakeReporter( BaseReporter ):
+    """ Reporter over fixed bucket rows
+    """
+
+    _typeName = 'Test'
+
+    def __init__( self, rows ):
+      BaseReporter.__init__( self, None, 'Test' )
+      self.rows = rows
+
+    def _retrieveBucketedData( self, *args ):
+      return S_OK( [ list( row ) for row in self.rows ] )
+
+    def _getBucketLengthForTime( self, typeName, startTime ):
+      return GRANULARITY
+
+class TimedDataTestCase( unittest.TestCase ):
+  """ Matrix path of _getTimedData against the per key helpers
+  """
+
+  def legacyTimedData( self, reporter, metadataDict ):
+    """ _getTimedData as it was done for every key
+    """
+    dataDict = reporter._groupByField( 0, [ list( row ) for row in reporter.rows ] )
+    for keyField in dataDict:
+      if metadataDict.get( 'checkNone' ):
+        dataDict[ keyField ] = reporter._convertNoneToZero( dataDict[ keyField ] )
+      if metadataDict.get( 'convertToGranularity', 'sum' ) == "average":
+        dataDict[ keyField ] = reporter._averageToGranularity( GRANULARITY, dataDict[ keyField ] )
+      else:
+        dataDict[ keyField ] = reporter._sumToGranularity( GRANULARITY, dataDict[ keyField ] )
+      if 'consolidationFunction' in metadataDict:
+        dataDict[ keyField ] = reporter._executeConsolidation( metadataDict[ 'consolidationFunction' ],
+                                                              dataDict[ keyField ] )
+    if metadataDict.get( 'calculateProportionalGauges' ):
+      dataDict = reporter._calculateProportionalGauges( dataDict )
+    return dataDict
+
+  def check( self, metadataDict, checkNone = False ):
+    reporter = FakeReporter( getRows( checkNone ) )
+    #The consolidation functions of the reporter are given by name
+    if type( metadataDict.get( 'consolidationFunction' ) ) == types.StringType:
+      metadataDict[ 'consolidationFunction' ] = getattr( reporter, metadataDict[ 'consolidationFunction' ] )
+    expected = self.legacyTimedData( reporter, metadataDict )
+    result = reporter._getTimedData( None, None, None, {}, ( '%s', [] ), dict( metadataDict ) )
+    self.assert_( result[ 'OK' ] )
+    dataDict, granularity = result[ 'Value' ]
+    self.assertEqual( granularity, GRANULARITY )
+    self.assertEqual( sorted( dataDict ), sorted( expected ) )
+    for key in expected:
+      self.assertEqual( sorted( dataDict[ key ] ), sorted( expected[ key ] ) )
+      for bucketTime in expected[ key ]:
+        values = dataDict[ key ][ bucketTime ]
+        expectedValues = expected[ key ][ bucketTime ]
+        self.assertEqual( len( values ), len( expectedValues ) )
+        for value, expectedValue in zip( values, expectedValues ):
+          #Only the order of the float additions differs
+          self.assert_( abs( value - expectedValue ) <= 1e-9 * max( 1, abs( expectedValue ) ),
+                        "%s at %s: %s != %s" % ( key, bucketTime, values, expectedValues ) )
+
+  def test_sum( self ):
+    self.check( {} )
+
+  def test_average( self ):
+    self.check( { 'convertToGranularity' : 'average' } )
+
+  def test_checkNone( self ):
+    self.check( { 'checkNone' : True }, checkNone = True )
+
+  def test_consolidation( self ):
+    for functionName in ( '_averageConsolidation', '_efficiencyConsolidation' ):
+      self.check( { 'consolidationFunction' : functionName } )
+    #Called cell by cell
+    self.check( { 'consolidationFunction' : lambda total, count: total - count } )
+
+  def test_proportionalGauges( self ):
+    self.check( { 'calculateProportionalGauges' : True } )
+    self.check( { 'convertToGranularity' : 'average', 'calculateProportionalGauges' : True } )
+
+if not BaseReporter:
+  TimedDataTestCase = unittest.skip( "numpy and the plotting library are needed" )( TimedDataTestCase )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TimedDataTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
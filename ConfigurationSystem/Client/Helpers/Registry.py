@@ -4,18 +4,74 @@ __RCSID__ = "$Id$"
 import types
 from DIRAC import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.ConfigurationSystem.Client.Helpers.CSGlobals import getVO
+from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
+from DIRAC.Core.Utilities import List
 
 gBaseSecuritySection = "/Registry"
 
+def __getRegistryIndex():
+  """
+  Reverse index of the Registry. It is kept with the options index of the configuration,
+  so it is built once and dropped whenever a new configuration version is loaded
+  """
+  gRefresher.refreshConfigurationIfNeeded()
+  optionsDict, derivedCache = gConfigurationData.getOptionsIndex()
+  try:
+    return derivedCache[ ( gBaseSecuritySection, ) ]
+  except KeyError:
+    pass
+
+  def listValue( path ):
+    value = optionsDict.get( path )
+    if value is None:
+      return None
+    return List.fromChar( value, "," )
+
+  def sections( path ):
+    sectionList = gConfigurationData.getSectionsFromCFG( path )
+    if type( sectionList ) != types.ListType:
+      return []
+    return sectionList
+
+  index = { 'usernameForDN' : {}, 'usernamesForDN' : {}, 'hostnameForDN' : {},
+            'groupsWithAttr' : {}, 'groupProperties' : {} }
+  #The first entity in the section order owns a DN, as when looping over the sections
+  for indexKey, entitySection in ( ( 'usernameForDN', 'Users' ), ( 'hostnameForDN', 'Hosts' ) ):
+    for name in sections( "%s/%s" % ( gBaseSecuritySection, entitySection ) ):
+      for dn in listValue( "%s/%s/%s/DN" % ( gBaseSecuritySection, entitySection, name ) ) or []:
+        index[ indexKey ].setdefault( dn, name )
+        if entitySection == 'Users':
+          #All the users sharing the DN, to look it up among a given list of users
+          index[ 'usernamesForDN' ].setdefault( dn, [] ).append( name )
+  groupsWithAttr = index[ 'groupsWithAttr' ]
+  for group in sections( "%s/Groups" % gBaseSecuritySection ):
+    for attrName in ( 'Users', 'VO', 'Properties' ):
+      values = listValue( "%s/Groups/%s/%s" % ( gBaseSecuritySection, group, attrName ) )
+      if values is None:
+        continue
+      if attrName == 'Properties':
+        index[ 'groupProperties' ][ group ] = values
+      for value in values:
+        groupList = groupsWithAttr.setdefault( ( attrName, value ), [] )
+        if group not in groupList:
+          groupList.append( group )
+  for groupList in groupsWithAttr.values():
+    groupList.sort()
+  derivedCache[ ( gBaseSecuritySection, ) ] = index
+  return index
+
 def getUsernameForDN( dn, usersList = False ):
   if not usersList:
-    retVal = gConfig.getSections( "%s/Users" % gBaseSecuritySection )
-    if not retVal[ 'OK' ]:
-      return retVal
-    usersList = retVal[ 'Value' ]
+    username = __getRegistryIndex()[ 'usernameForDN' ].get( dn )
+    if username:
+      return S_OK( username )
+    return S_ERROR( "No username found for dn %s" % dn )
+  #The first user of the list having the DN
+  usernames = __getRegistryIndex()[ 'usernamesForDN' ].get( dn, [] )
   for username in usersList:
-    if dn in gConfig.getValue( "%s/Users/%s/DN" % ( gBaseSecuritySection, username ), [] ):
+    if username in usernames:
       return S_OK( username )
   return S_ERROR( "No username found for dn %s" % dn )
 
@@ -32,18 +88,10 @@ def getGroupsForDN( dn ):
   return getGroupsForUser( retVal[ 'Value' ] )
 
 def __getGroupsWithAttr( attrName, value ):
-  retVal = gConfig.getSections( "%s/Groups" % gBaseSecuritySection )
-  if not retVal[ 'OK' ]:
-    return retVal
-  groupsList = retVal[ 'Value' ]
-  groups = []
-  for group in groupsList:
-    if value in gConfig.getValue( "%s/Groups/%s/%s" % ( gBaseSecuritySection, group, attrName ), [] ):
-      groups.append( group )
+  groups = __getRegistryIndex()[ 'groupsWithAttr' ].get( ( attrName, value ) )
   if not groups:
     return S_ERROR( "No groups found for %s=%s" % ( attrName,value ) )
-  groups.sort()
-  return S_OK( groups )
+  return S_OK( list( groups ) )
 
 def getGroupsForUser( username ):
   return __getGroupsWithAttr( 'Users', username )
@@ -57,13 +105,9 @@ def getGroupsWithProperty( propName ):
   return __getGroupsWithAttr( "Properties", propName )
 
 def getHostnameForDN( dn ):
-  retVal = gConfig.getSections( "%s/Hosts" % gBaseSecuritySection )
-  if not retVal[ 'OK' ]:
-    return retVal
-  hostList = retVal[ 'Value' ]
-  for hostname in hostList:
-    if dn in gConfig.getValue( "%s/Hosts/%s/DN" % ( gBaseSecuritySection, hostname ), [] ):
-      return S_OK( hostname )
+  hostname = __getRegistryIndex()[ 'hostnameForDN' ].get( dn )
+  if hostname:
+    return S_OK( hostname )
   return S_ERROR( "No hostname found for dn %s" % dn )
 
 def getDefaultUserGroup():
@@ -111,8 +155,10 @@ def getDNsInGroup( groupName ):
 def getPropertiesForGroup( groupName, defaultValue = None ):
   if defaultValue == None:
     defaultValue = []
-  option = "%s/Groups/%s/Properties" % ( gBaseSecuritySection, groupName )
-  return gConfig.getValue( option, defaultValue )
+  properties = __getRegistryIndex()[ 'groupProperties' ].get( groupName )
+  if properties is None:
+    return defaultValue
+  return list( properties )
 
 def getPropertiesForHost( hostName, defaultValue = None ):
   if defaultValue == None:
@@ -31,6 +31,22 @@ class ConfigurationHandler( RequestHandler ):
       retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
     return S_OK( retDict )
 
+  types_getDeltaIfNewer = [ types.StringType ]
+  def export_getDeltaIfNewer( self, sClientVersion ):
+    """ Get the modifications from the client version to the newest one. If the
+        client version is too old the full compressed data is sent instead
+    """
+    sVersion = gServiceInterface.getVersion()
+    retDict = { 'newestVersion' : sVersion }
+    if sClientVersion < sVersion:
+      retDict[ 'hash' ] = gServiceInterface.getConfigurationHash()
+      result = gServiceInterface.getDeltaSinceVersion( sClientVersion )
+      if result[ 'OK' ]:
+        retDict[ 'delta' ] = result[ 'Value' ]
+      else:
+        retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
+    return S_OK( retDict )
+
   types_publishSlaveServer = [ types.StringType ]
   def export_publishSlaveServer( self, sURL ):
     gServiceInterface.publishSlaveServer( sURL )
@@ -98,7 +98,10 @@ class ConfigurationClient:
 
   def getOption( self, optionPath, typeValue = None ):
     gRefresher.refreshConfigurationIfNeeded()
-    optionValue = gConfigurationData.extractOptionFromCFG( optionPath )
+    optionsDict, castCache = gConfigurationData.getOptionsIndex()
+    optionValue = optionsDict.get( optionPath )
+    if optionValue is None:
+      optionValue = gConfigurationData.getOptionFromIndex( optionPath )
 
     if optionValue == None:
       return S_ERROR( "Path %s does not exist or it's not an option" % optionPath )
@@ -112,6 +115,23 @@ class ConfigurationClient:
     if not type( typeValue ) == types.TypeType:
       requestedType = type( typeValue )
 
+    #Casted values are kept until the configuration changes
+    cacheKey = ( optionPath, requestedType )
+    try:
+      castValue = castCache[ cacheKey ]
+    except KeyError:
+      result = self.__castValue( optionValue, typeValue, requestedType )
+      if not result[ 'OK' ]:
+        return result
+      castValue = result[ 'Value' ]
+      if len( castCache ) < 10000:
+        castCache[ cacheKey ] = castValue
+    if requestedType == types.ListType:
+      #Do not let the caller modify the cached list
+      return S_OK( list( castValue ) )
+    return S_OK( castValue )
+
+  def __castValue( self, optionValue, typeValue, requestedType ):
     if requestedType == types.ListType:
       try:
         return S_OK( List.fromChar( optionValue, ',' ) )
@@ -128,7 +148,6 @@ class ConfigurationClient:
       except:
         return S_ERROR( "Type mismatch between default (%s) and configured value (%s) " % ( str( typeValue ), optionValue ) )
 
-
   def getSections( self, sectionPath, listOrdered = True ):
     gRefresher.refreshConfigurationIfNeeded()
     sectionList = gConfigurationData.getSectionsFromCFG( sectionPath, ordered = listOrdered )
@@ -6,6 +6,10 @@ import zlib
 import zipfile
 import threading, thread
 import time
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.Utilities import List, Time
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
@@ -29,6 +33,15 @@ class ConfigurationData:
     self.remoteCFG = CFG()
     self.mergedCFG = CFG()
     self.remoteServerList = []
+    self.remoteCFGHash = ""
+    #Services keep the modifications between the last versions to serve deltas
+    self.__deltaHistory = []
+    self.__deltaSnapshot = None
+    self.__deltaSnapshotVersion = False
+    self.__deltaLock = threading.Lock()
+    #Flattened path -> value index of the merged CFG, built on demand after every sync
+    self.__optionsIndex = None
+    self.__optionsIndexLock = threading.Lock()
     if loadDefaultCFG:
       defaultCFGFile = os.path.join( DIRAC.rootPath, "etc", "dirac.cfg" )
       gLogger.debug( "dirac.cfg should be at", "%s" % defaultCFGFile )
@@ -42,7 +55,13 @@ class ConfigurationData:
 
   def sync( self ):
     gLogger.debug( "Updating configuration internals" )
-    self.mergedCFG = self.remoteCFG.mergeWith( self.localCFG )
+    mergedCFG = self.remoteCFG.mergeWith( self.localCFG )
+    self.__optionsIndexLock.acquire()
+    try:
+      self.mergedCFG = mergedCFG
+      self.__optionsIndex = None
+    finally:
+      self.__optionsIndexLock.release()
     self.remoteServerList = []
     localServers = self.extractOptionFromCFG( "%s/Servers" % self.configurationPath,
                                         self.localCFG,
@@ -55,7 +74,74 @@ class ConfigurationData:
     if remoteServers:
       self.remoteServerList.extend( List.fromChar( remoteServers, "," ) )
     self.remoteServerList = List.uniqueElements( self.remoteServerList )
-    self.compressedConfigurationData = zlib.compress( str( self.remoteCFG ), 9 )
+    remoteData = str( self.remoteCFG )
+    self.compressedConfigurationData = zlib.compress( remoteData, 9 )
+    self.remoteCFGHash = md5( remoteData ).hexdigest()
+    if self._isService:
+      self.__recordVersionDelta()
+
+  def __recordVersionDelta( self ):
+    """
+    Keep the modifications done to the remote CFG for every new version
+    """
+    self.__deltaLock.acquire()
+    try:
+      version = self.__getRemoteVersion( self.remoteCFG )
+      if version == self.__deltaSnapshotVersion:
+        return
+      if self.__deltaSnapshot is not None:
+        modList = self.__deltaSnapshot.getModifications( self.remoteCFG )
+        self.__deltaHistory.append( ( self.__deltaSnapshotVersion, modList ) )
+        historySize = self.getDeltaHistorySize()
+        if len( self.__deltaHistory ) > historySize:
+          self.__deltaHistory = self.__deltaHistory[ len( self.__deltaHistory ) - historySize: ]
+      self.__deltaSnapshot = self.remoteCFG.clone()
+      self.__deltaSnapshotVersion = version
+    finally:
+      self.__deltaLock.release()
+
+  def __getRemoteVersion( self, cfg ):
+    """
+    Version of a remote CFG, without waiting for the lock so it can be used in sync
+    """
+    return self.extractOptionFromCFG( "%s/Version" % self.configurationPath, cfg,
+                                      disableDangerZones = True ) or "0"
+
+  def getDeltaSinceVersion( self, version ):
+    """
+    Get the list of modification lists to apply in order to go from version to
+    the current remote CFG. Fails if the version is not in the history
+    """
+    self.__deltaLock.acquire()
+    try:
+      if version == self.__deltaSnapshotVersion:
+        return S_OK( [] )
+      for iPos in range( len( self.__deltaHistory ) ):
+        if self.__deltaHistory[ iPos ][0] == version:
+          return S_OK( [ modList for fromVersion, modList in self.__deltaHistory[ iPos: ] ] )
+      return S_ERROR( "Version %s is not in the delta history" % version )
+    finally:
+      self.__deltaLock.release()
+
+  def applyRemoteModifications( self, deltaList, newestVersion, cfgHash ):
+    """
+    Apply the deltas received from a configuration server to the remote CFG.
+    The result has to be the same as the server's, otherwise nothing is changed
+    """
+    newRemoteCFG = self.remoteCFG.clone()
+    for modList in deltaList:
+      result = newRemoteCFG.applyModifications( modList )
+      if not result[ 'OK' ]:
+        return result
+    if self.__getRemoteVersion( newRemoteCFG ) != newestVersion:
+      return S_ERROR( "Version after applying the delta is not %s" % newestVersion )
+    if md5( str( newRemoteCFG ) ).hexdigest() != cfgHash:
+      return S_ERROR( "Configuration after applying the delta differs from the server's one" )
+    self.lock()
+    self.remoteCFG = newRemoteCFG
+    self.unlock()
+    self.sync()
+    return S_OK()
 
   def loadFile( self, fileName ):
     try:
@@ -103,6 +189,52 @@ class ConfigurationData:
     self.unlock()
     self.sync()
 
+  def getOptionsIndex( self ):
+    """
+    Get the index of the merged CFG as a tuple ( { path : value }, { cacheKey : value } ).
+    The second dict can be used to keep values derived from the options. Both are
+    replaced when the configuration changes
+    """
+    optionsIndex = self.__optionsIndex
+    if optionsIndex is not None:
+      return optionsIndex
+    mergedCFG = self.mergedCFG
+    optionsDict = {}
+    self.__indexCFG( mergedCFG, "", optionsDict )
+    optionsIndex = ( optionsDict, {} )
+    self.__optionsIndexLock.acquire()
+    try:
+      #Do not install an index of an already replaced CFG
+      if self.mergedCFG is mergedCFG:
+        self.__optionsIndex = optionsIndex
+    finally:
+      self.__optionsIndexLock.release()
+    return optionsIndex
+
+  def __indexCFG( self, cfg, path, optionsDict ):
+    for option in cfg.listOptions():
+      optionsDict[ "%s/%s" % ( path, option ) ] = cfg[ option ]
+    for section in cfg.listSections():
+      self.__indexCFG( cfg[ section ], "%s/%s" % ( path, section ), optionsDict )
+
+  def getOptionFromIndex( self, path ):
+    """
+    Get the value of an option in the merged CFG, None if it does not exist
+    """
+    optionsDict, derivedCache = self.getOptionsIndex()
+    value = optionsDict.get( path )
+    if value is not None:
+      return value
+    #Not normalized or missing paths are remembered as well
+    cacheKey = ( None, path )
+    if cacheKey in derivedCache:
+      return derivedCache[ cacheKey ]
+    levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
+    value = optionsDict.get( "/%s" % "/".join( levelList ) )
+    if len( derivedCache ) < 10000:
+      derivedCache[ cacheKey ] = value
+    return value
+
   def getCommentFromCFG( self, path, cfg = False ):
     if not cfg:
       cfg = self.mergedCFG
@@ -144,7 +276,8 @@ class ConfigurationData:
 
   def extractOptionFromCFG( self, path, cfg = False, disableDangerZones = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      #The index of the merged CFG is replaced atomically, no need to lock
+      return self.getOptionFromIndex( path )
     if not disableDangerZones:
       self.dangerZoneStart()
     try:
@@ -152,7 +285,10 @@ class ConfigurationData:
       for section in levelList[:-1]:
         cfg = cfg[ section ]
       if levelList[-1] in cfg.listOptions():
-        return self.dangerZoneEnd( cfg[ levelList[ -1 ] ] )
+        value = cfg[ levelList[ -1 ] ]
+        if not disableDangerZones:
+          self.dangerZoneEnd()
+        return value
     except Exception:
       pass
     if not disableDangerZones:
@@ -234,6 +370,13 @@ class ConfigurationData:
     except:
       return 300
 
+  def getDeltaHistorySize( self ):
+    try:
+      return int( self.extractOptionFromCFG( "%s/DeltaHistorySize" % self.configurationPath,
+                                        self.mergedCFG, disableDangerZones = True ) )
+    except:
+      return 20
+
   def getSlavesGraceTime( self ):
     try:
       return int( self.extractOptionFromCFG( "%s/SlavesGraceTime" % self.configurationPath,
@@ -286,6 +429,9 @@ class ConfigurationData:
   def getCompressedData( self ):
     return self.compressedConfigurationData
 
+  def getRemoteCFGHash( self ):
+    return self.remoteCFGHash
+
   def isMaster( self ):
     value = self.extractOptionFromCFG( "%s/Master" % self.configurationPath,
                                             self.localCFG )
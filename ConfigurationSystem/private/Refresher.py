@@ -15,17 +15,40 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 def _updateFromRemoteLocation( serviceClient ):
   gLogger.debug( "", "Trying to refresh from %s" % serviceClient.serviceURL )
   localVersion = gConfigurationData.getVersion()
+  retVal = serviceClient.getDeltaIfNewer( localVersion )
+  if retVal[ 'OK' ]:
+    dataDict = retVal[ 'Value' ]
+    if localVersion >= dataDict[ 'newestVersion' ]:
+      return S_OK()
+    if 'delta' in dataDict:
+      gLogger.debug( "New version available", "Applying delta up to version %s..." % dataDict[ 'newestVersion' ] )
+      result = gConfigurationData.applyRemoteModifications( dataDict[ 'delta' ], dataDict[ 'newestVersion' ],
+                                                            dataDict[ 'hash' ] )
+      if result[ 'OK' ]:
+        gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
+        gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
+        return S_OK()
+      gLogger.warn( "Cannot apply the configuration delta, getting the full configuration", result[ 'Message' ] )
+    else:
+      return _loadCompressedData( dataDict )
+  elif retVal[ 'Message' ].find( "Unknown method" ) == -1:
+    return retVal
+  #The server does not serve deltas or the delta could not be applied
   retVal = serviceClient.getCompressedDataIfNewer( localVersion )
   if retVal[ 'OK' ]:
     dataDict = retVal[ 'Value' ]
     if localVersion < dataDict[ 'newestVersion' ] :
-      gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
-      gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
-      gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
-      gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
+      return _loadCompressedData( dataDict )
     return S_OK()
   return retVal
 
+def _loadCompressedData( dataDict ):
+  gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
+  gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
+  gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
+  gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
+  return S_OK()
+
 
 class Refresher( threading.Thread ):
 
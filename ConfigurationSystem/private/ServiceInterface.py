@@ -162,6 +162,12 @@ class ServiceInterface( threading.Thread ):
   def getVersion( self ):
     return gConfigurationData.getVersion()
 
+  def getConfigurationHash( self ):
+    return gConfigurationData.getRemoteCFGHash()
+
+  def getDeltaSinceVersion( self, sVersion ):
+    return gConfigurationData.getDeltaSinceVersion( sVersion )
+
   def getCommitHistory( self ):
     files = self.__getCfgBackups( gConfigurationData.getBackupDir() )
     backups = [ ".".join( fileName.split( "." )[1:3] ).split( "@" ) for fileName in files ]
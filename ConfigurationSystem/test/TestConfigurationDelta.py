@@ -0,0 +1,78 @@
+# $HeadURL$
+""" Test the configuration deltas served by the configuration servers
+"""
+__RCSID__ = "$Id$"
+
+import unittest
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+
+BASE_CFG = """
+DIRAC
+{
+  Configuration
+  {
+    Name = Test
+  }
+  Setup = Production
+}
+Resources
+{
+  Sites
+  {
+    LCG
+    {
+      LCG.CERN.ch
+      {
+        CE = ce1.cern.ch, ce2.cern.ch
+      }
+    }
+  }
+}
+"""
+
+class ConfigurationDeltaTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.server = ConfigurationData( False )
+    self.server.setAsService()
+    self.server.loadRemoteCFGFromMem( BASE_CFG )
+    self.server.setVersion( "2012-01-01 00:00:00" )
+    self.client = ConfigurationData( False )
+    self.client.loadRemoteCFGFromCompressedMem( self.server.getCompressedData() )
+
+  def newVersion( self, version, path, value ):
+    self.server.setOptionInCFG( path, value, self.server.getRemoteCFG() )
+    self.server.setVersion( version )
+
+  def update( self ):
+    result = self.server.getDeltaSinceVersion( self.client.getVersion() )
+    self.assert_( result[ 'OK' ] )
+    return self.client.applyRemoteModifications( result[ 'Value' ], self.server.getVersion(),
+                                                 self.server.getRemoteCFGHash() )
+
+  def test_delta( self ):
+    self.newVersion( "2012-01-02 00:00:00", "/Resources/Sites/LCG/LCG.CERN.ch/CE", "ce1.cern.ch" )
+    self.newVersion( "2012-01-03 00:00:00", "/Resources/Sites/LCG/LCG.PIC.es/CE", "ce.pic.es" )
+    self.assert_( self.update()[ 'OK' ] )
+    self.assertEqual( self.client.getVersion(), "2012-01-03 00:00:00" )
+    self.assertEqual( str( self.client.getRemoteCFG() ), str( self.server.getRemoteCFG() ) )
+    self.assertEqual( self.server.getDeltaSinceVersion( self.client.getVersion() )[ 'Value' ], [] )
+
+  def test_history( self ):
+    for day in range( 2, 30 ):
+      self.newVersion( "2012-01-%02d 00:00:00" % day, "/DIRAC/Counter", str( day ) )
+    #Only the last DeltaHistorySize versions are kept
+    self.failIf( self.server.getDeltaSinceVersion( "2012-01-01 00:00:00" )[ 'OK' ] )
+    self.assertEqual( len( self.server.getDeltaSinceVersion( "2012-01-09 00:00:00" )[ 'Value' ] ), 20 )
+
+  def test_mismatch( self ):
+    self.newVersion( "2012-01-02 00:00:00", "/DIRAC/Setup", "Certification" )
+    #The client has diverged, the delta can not reproduce the server configuration
+    self.client.setOptionInCFG( "/DIRAC/Extra", "yes", self.client.getRemoteCFG() )
+    before = str( self.client.getRemoteCFG() )
+    self.failIf( self.update()[ 'OK' ] )
+    self.assertEqual( str( self.client.getRemoteCFG() ), before )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConfigurationDeltaTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
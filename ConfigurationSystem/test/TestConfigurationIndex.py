@@ -0,0 +1,56 @@
+# $HeadURL$
+""" Test the indexed option lookups of the configuration client
+"""
+__RCSID__ = "$Id$"
+
+import unittest
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.Core.Utilities.CFG import CFG
+
+TEST_CFG = """
+TestIndex
+{
+  Agent
+  {
+    PollingTime = 120
+    Sites = LCG.CERN.ch, LCG.PIC.es
+    Enabled = yes
+  }
+}
+"""
+
+class ConfigurationIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    gConfig.loadCFG( CFG().loadFromBuffer( TEST_CFG ) )
+
+  def tearDown( self ):
+    gConfigurationData.deleteLocalOption( "/TestIndex" )
+
+  def test_lookups( self ):
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/PollingTime", 0 ), 120 )
+    self.assertEqual( gConfig.getValue( "TestIndex//Agent/ PollingTime" ), "120" )
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/Enabled", False ), True )
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent", "section" ), "section" )
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/Missing", 5 ), 5 )
+    self.assertEqual( gConfig.getOptionsDict( "/TestIndex/Agent" )[ 'Value' ][ 'Enabled' ], "yes" )
+
+  def test_castCache( self ):
+    sites = gConfig.getValue( "/TestIndex/Agent/Sites", [] )
+    self.assertEqual( sites, [ "LCG.CERN.ch", "LCG.PIC.es" ] )
+    sites.append( "LCG.RAL.uk" )
+    #The cached list is not modified by the caller
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/Sites", [] ), [ "LCG.CERN.ch", "LCG.PIC.es" ] )
+    self.failIf( gConfig.getOption( "/TestIndex/Agent/Sites", 0 )[ 'OK' ] )
+
+  def test_invalidation( self ):
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/PollingTime", 0 ), 120 )
+    gConfig.setOptionValue( "/TestIndex/Agent/PollingTime", "60" )
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/PollingTime", 0 ), 60 )
+    gConfigurationData.deleteLocalOption( "/TestIndex/Agent/PollingTime" )
+    self.assertEqual( gConfig.getValue( "/TestIndex/Agent/PollingTime", 0 ), 0 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConfigurationIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,91 @@
+# $HeadURL$
+""" Test the reverse index of the Registry helpers
+"""
+__RCSID__ = "$Id$"
+
+import unittest
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.Helpers import Registry
+from DIRAC.Core.Utilities.CFG import CFG
+
+TEST_CFG = """
+Registry
+{
+  DefaultGroup = dirac_user
+  Users
+  {
+    alice
+    {
+      DN = /O=Test/CN=Alice, /O=Test/CN=Alice Robot
+    }
+    bob
+    {
+      DN = /O=Test/CN=Bob
+    }
+    bob_robot
+    {
+      DN = /O=Test/CN=Alice Robot
+    }
+  }
+  Groups
+  {
+    dirac_user
+    {
+      Users = alice, bob
+      Properties = NormalUser
+    }
+    dirac_admin
+    {
+      Users = alice
+      Properties = AlarmsManagement, ServiceAdministrator
+    }
+  }
+  Hosts
+  {
+    host.test.org
+    {
+      DN = /O=Test/CN=host.test.org
+      Properties = TrustedHost
+    }
+  }
+}
+"""
+
+class RegistryIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    gConfig.loadCFG( CFG().loadFromBuffer( TEST_CFG ) )
+
+  def tearDown( self ):
+    gConfigurationData.deleteLocalOption( "/Registry" )
+
+  def test_lookups( self ):
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Alice Robot" )[ 'Value' ], "alice" )
+    self.failIf( Registry.getUsernameForDN( "/O=Test/CN=Nobody" )[ 'OK' ] )
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Bob", [ "alice" ] )[ 'OK' ], False )
+    #Among the given users, in their order
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Alice Robot", [ "bob", "bob_robot", "alice" ] )[ 'Value' ],
+                      "bob_robot" )
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Alice Robot", [ "alice", "bob_robot" ] )[ 'Value' ],
+                      "alice" )
+    self.failIf( Registry.getUsernameForDN( "/O=Test/CN=Alice Robot", [ "bob", "carol" ] )[ 'OK' ] )
+    self.assertEqual( Registry.getGroupsForDN( "/O=Test/CN=Alice" )[ 'Value' ], [ "dirac_admin", "dirac_user" ] )
+    self.assertEqual( Registry.getGroupsWithProperty( "NormalUser" )[ 'Value' ], [ "dirac_user" ] )
+    self.assertEqual( Registry.findDefaultGroupForDN( "/O=Test/CN=Bob" )[ 'Value' ], "dirac_user" )
+    self.assertEqual( Registry.getHostnameForDN( "/O=Test/CN=host.test.org" )[ 'Value' ], "host.test.org" )
+    self.assertEqual( Registry.getPropertiesForGroup( "dirac_admin" ),
+                      [ "AlarmsManagement", "ServiceAdministrator" ] )
+    self.assertEqual( Registry.getPropertiesForGroup( "missing", [ "x" ] ), [ "x" ] )
+
+  def test_invalidation( self ):
+    self.failIf( Registry.getUsernameForDN( "/O=Test/CN=Carol" )[ 'OK' ] )
+    gConfig.setOptionValue( "/Registry/Users/carol/DN", "/O=Test/CN=Carol" )
+    gConfig.setOptionValue( "/Registry/Groups/dirac_user/Users", "alice, bob, carol" )
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Carol" )[ 'Value' ], "carol" )
+    self.assertEqual( Registry.getUsernameForDN( "/O=Test/CN=Carol", [ "bob", "carol" ] )[ 'Value' ], "carol" )
+    self.assertEqual( Registry.getGroupsForUser( "carol" )[ 'Value' ], [ "dirac_user" ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( RegistryIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
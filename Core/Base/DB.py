@@ -72,9 +72,14 @@ class DB( MySQL ):
     result = gConfig.getOption( self.cs_path + '/MaxQueueSize' )
     if result['OK']:
       self.maxQueueSize = int( result['Value'] )
+    self.minQueueSize = 1
+    result = gConfig.getOption( self.cs_path + '/MinQueueSize' )
+    if result['OK']:
+      self.minQueueSize = int( result['Value'] )
 
     MySQL.__init__( self, self.dbHost, self.dbUser, self.dbPass,
-                   self.dbName, self.dbPort, maxQueueSize = maxQueueSize, debug = debug )
+                   self.dbName, self.dbPort, maxQueueSize = self.maxQueueSize, debug = debug,
+                   minQueueSize = self.minQueueSize )
 
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % dbname )
@@ -88,6 +93,7 @@ class DB( MySQL ):
     #self.log.info("Password:       "+self.dbPass)
     self.log.info( "DBName:         " + self.dbName )
     self.log.info( "MaxQueue:       " + str( self.maxQueueSize ) )
+    self.log.info( "MinQueue:       " + str( self.minQueueSize ) )
     self.log.info( "==================================================" )
 
 #############################################################################
@@ -3,10 +3,13 @@ __RCSID__ = "$Id$"
 
 import types
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Security import CS
 from DIRAC.Core.Security import Properties
 from DIRAC.Core.Utilities import List
+from DIRAC.Core.Utilities.DictCache import DictCache
 
 class AuthManager:
   """
@@ -20,20 +23,62 @@ class AuthManager:
   KW_EXTRA_CREDENTIALS = 'extraCredentials'
   KW_PROPERTIES = 'properties'
   KW_USERNAME = 'username'
+  #Fields of the credentials dictionary that are resolved by authQuery
+  __resolvedFields = ( KW_DN, KW_GROUP, KW_EXTRA_CREDENTIALS, KW_PROPERTIES, KW_USERNAME )
+  __missingField = ( 'missing', )
 
-
-  def __init__( self, authSection ):
+  def __init__( self, authSection, cacheSize = 10000, cacheLifeTime = 300 ):
     """
     Constructor
 
     @type authSection: string
     @param authSection: Section containing the authorization rules
+    @type cacheSize: int
+    @param cacheSize: Maximum number of authorization decisions to remember, 0 to disable the cache
+    @type cacheLifeTime: int
+    @param cacheLifeTime: Seconds an authorization decision is remembered
     """
     self.authSection = authSection
+    self.__cacheSize = cacheSize
+    self.__cacheLifeTime = cacheLifeTime
+
+  def __getDecisionCache( self ):
+    """
+    Get the cache of decisions for the current configuration version. It is kept with the
+    options index of the configuration so it is dropped when a new version is loaded
+    """
+    gRefresher.refreshConfigurationIfNeeded()
+    derivedCache = gConfigurationData.getOptionsIndex()[1]
+    cacheKey = ( "AuthManager", self.authSection )
+    decisionCache = derivedCache.get( cacheKey )
+    if decisionCache is None:
+      decisionCache = derivedCache.setdefault( cacheKey, DictCache( maxSize = self.__cacheSize ) )
+    return decisionCache
+
+  def __getDecisionKey( self, methodQuery, credDict, defaultProperties ):
+    """
+    Key of the decision for a method and credentials, None if it can't be cached
+    """
+    if type( defaultProperties ) == types.ListType:
+      defaultProperties = tuple( defaultProperties )
+    decisionKey = [ methodQuery, defaultProperties ]
+    for field in ( self.KW_DN, self.KW_GROUP, self.KW_EXTRA_CREDENTIALS, self.KW_PROPERTIES ):
+      value = credDict.get( field, self.__missingField )
+      #Tuples of extra credentials are forwarded credentials, only the properties are converted
+      if field == self.KW_PROPERTIES and type( value ) == types.ListType:
+        value = tuple( value )
+      decisionKey.append( value )
+    decisionKey = tuple( decisionKey )
+    try:
+      hash( decisionKey )
+    except TypeError:
+      return None
+    return decisionKey
 
   def authQuery( self, methodQuery, credDict, defaultProperties = False ):
     """
-    Check if the query is authorized for a credentials dictionary
+    Check if the query is authorized for a credentials dictionary. Decisions and the
+    resolved credentials are remembered for repeated queries from the same client
 
     @type  methodQuery: string
     @param methodQuery: Method to test
@@ -42,6 +87,35 @@ class AuthManager:
                         and selected group.
     @return: Boolean result of test
     """
+    decisionKey = None
+    if self.__cacheSize:
+      decisionKey = self.__getDecisionKey( methodQuery, credDict, defaultProperties )
+    if decisionKey is None:
+      return self.__authQuery( methodQuery, credDict, defaultProperties )
+    decisionCache = self.__getDecisionCache()
+    decision = decisionCache.get( decisionKey )
+    if decision:
+      authorized, resolvedCred = decision
+      for field in self.__resolvedFields:
+        value = resolvedCred[ field ]
+        if value is self.__missingField:
+          credDict.pop( field, None )
+        elif field == self.KW_PROPERTIES:
+          credDict[ field ] = list( value )
+        else:
+          credDict[ field ] = value
+      return authorized
+    authorized = self.__authQuery( methodQuery, credDict, defaultProperties )
+    resolvedCred = {}
+    for field in self.__resolvedFields:
+      value = credDict.get( field, self.__missingField )
+      if field == self.KW_PROPERTIES and value is not self.__missingField:
+        value = tuple( value )
+      resolvedCred[ field ] = value
+    decisionCache.add( decisionKey, self.__cacheLifeTime, ( authorized, resolvedCred ) )
+    return authorized
+
+  def __authQuery( self, methodQuery, credDict, defaultProperties = False ):
     userString = ""
     if self.KW_DN in credDict:
       userString += "DN=%s" % credDict[ self.KW_DN ]
@@ -68,7 +142,7 @@ class AuthManager:
     if self.forwardedCredentials( credDict ):
       self.__authLogger.verbose( "Query comes from a gateway" )
       self.unpackForwardedCredentials( credDict )
-      return self.authQuery( methodQuery, credDict )
+      return self.__authQuery( methodQuery, credDict )
     #Get the properties
     #Check for invalid forwarding
     if self.KW_EXTRA_CREDENTIALS in credDict:
@@ -147,11 +147,22 @@ class RequestHandler( object ):
       raise RequestHandler.ConnectionError( "Error while receiving file description %s %s" % ( self.srv_getFormattedRemoteCredentials(),
                                                                                 retVal[ 'Message' ] ) )
     fileInfo = retVal[ 'Value' ]
+    #Clients able to pipeline the transfer propose a window, old ones wait for each acknowledgement
+    windowSize = 1
+    if 'TransferWindow' in retVal:
+      try:
+        windowSize = max( 1, min( int( retVal[ 'TransferWindow' ] ),
+                                  int( self.srv_getCSOption( "TransferWindow", 8 ) ) ) )
+      except ( TypeError, ValueError ):
+        windowSize = 1
     sDirection = "%s%s" % ( sDirection[0].lower(), sDirection[1:] )
     if "transfer_%s" % sDirection not in dir( self ):
       self.__trPool.send( self.__trid, S_ERROR( "Service can't transfer files %s" % sDirection ) )
       return
-    retVal = self.__trPool.send( self.__trid, S_OK( "Accepted" ) )
+    acceptMsg = S_OK( "Accepted" )
+    if 'TransferWindow' in retVal:
+      acceptMsg[ 'TransferWindow' ] = windowSize
+    retVal = self.__trPool.send( self.__trid, acceptMsg )
     if not retVal[ 'OK' ]:
       return retVal
     self.__logRemoteQuery( "FileTransfer/%s" % sDirection, fileInfo )
@@ -160,6 +171,8 @@ class RequestHandler( object ):
     try:
       try:
         fileHelper = FileHelper( self.__trPool.get( self.__trid ) )
+        fileHelper.setWindowSize( windowSize )
+        fileHelper.setPacketSize( self.srv_getCSOption( "TransferChunkSize", fileHelper.packetSize ) )
         if sDirection == "fromClient":
           fileHelper.setDirection( "fromClient" )
           uRetVal = self.transfer_fromClient( fileInfo[0], fileInfo[1], fileInfo[2], fileHelper )
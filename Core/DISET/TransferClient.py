@@ -10,6 +10,18 @@ from DIRAC.Core.Utilities import File
 
 class TransferClient( BaseClient ):
 
+  KW_TRANSFER_WINDOW = "transferWindow"
+  KW_TRANSFER_CHUNK_SIZE = "transferChunkSize"
+
+  def _getFileHelper( self, transport = None ):
+    """
+    Get a FileHelper sending chunks of the configured size
+    """
+    fileHelper = FileHelper( transport )
+    if self.KW_TRANSFER_CHUNK_SIZE in self.kwargs:
+      fileHelper.setPacketSize( self.kwargs[ self.KW_TRANSFER_CHUNK_SIZE ] )
+    return fileHelper
+
   def _sendTransferHeader( self, actionName, fileInfo ):
     """
     Send the header of the transfer
@@ -29,13 +41,19 @@ class TransferClient( BaseClient ):
       retVal = self._proposeAction( transport, ( "FileTransfer", actionName ) )
       if not retVal[ 'OK' ]:
         return retVal
-      retVal = transport.sendData( S_OK( fileInfo ) )
+      #Propose sending several chunks before waiting for the acknowledgements,
+      #servers not supporting it don't include the window in the answer
+      headerMsg = S_OK( fileInfo )
+      headerMsg[ 'TransferWindow' ] = self.kwargs.get( self.KW_TRANSFER_WINDOW, 8 )
+      retVal = transport.sendData( headerMsg )
       if not retVal[ 'OK' ]:
         return retVal
       retVal = transport.receiveData()
       if not retVal[ 'OK' ]:
         return retVal
-      return S_OK( ( trid, transport ) )
+      result = S_OK( ( trid, transport ) )
+      result[ 'TransferWindow' ] = retVal.get( 'TransferWindow', 1 )
+      return result
     except Exception, e:
       self._disconnect( trid )
       return S_ERROR( "Cound not request transfer: %s" % str( e ) )
@@ -52,7 +70,7 @@ class TransferClient( BaseClient ):
     @param token : Optional token for the file
     @return : S_OK/S_ERROR
     """
-    fileHelper = FileHelper()
+    fileHelper = self._getFileHelper()
     retVal = fileHelper.getFileDescriptor( filename, "r" )
     if not retVal[ 'OK' ]:
       return retVal
@@ -63,6 +81,7 @@ class TransferClient( BaseClient ):
     trid, transport = retVal[ 'Value' ]
     try:
       fileHelper.setTransport( transport )
+      fileHelper.setWindowSize( retVal[ 'TransferWindow' ] )
       retVal = fileHelper.FDToNetwork( fd )
       if not retVal[ 'OK' ]:
         return retVal
@@ -83,7 +102,7 @@ class TransferClient( BaseClient ):
     @param token : Optional token for the file
     @return : S_OK/S_ERROR
     """
-    fileHelper = FileHelper()
+    fileHelper = self._getFileHelper()
     retVal = fileHelper.getDataSink( filename )
     if not retVal[ 'OK' ]:
       return retVal
@@ -95,6 +114,7 @@ class TransferClient( BaseClient ):
     trid, transport = retVal[ 'Value' ]
     try:
       fileHelper.setTransport( transport )
+      fileHelper.setWindowSize( retVal[ 'TransferWindow' ] )
       retVal = fileHelper.networkToDataSink( dS )
       if not retVal[ 'OK' ]:
         return retVal
@@ -140,11 +160,13 @@ class TransferClient( BaseClient ):
       return retVal
     trid, transport = retVal[ 'Value' ]
     try:
-      fileHelper = FileHelper( transport )
+      fileHelper = self._getFileHelper( transport )
+      fileHelper.setWindowSize( retVal[ 'TransferWindow' ] )
       retVal = fileHelper.bulkToNetwork( fileList, compress, onthefly )
       if not retVal[ 'OK' ]:
         return retVal
-      retVal = transport.receiveData()      return retVal
+      retVal = transport.receiveData()
+      return retVal
     finally:
       self._disconnect( trid )
 
@@ -173,7 +195,8 @@ class TransferClient( BaseClient ):
       return retVal
     trid, transport = retVal[ 'Value' ]
     try:
-      fileHelper = FileHelper( transport )
+      fileHelper = self._getFileHelper( transport )
+      fileHelper.setWindowSize( retVal[ 'TransferWindow' ] )
       retVal = fileHelper.networkToBulk( destDir, compress )
       if not retVal[ 'OK' ]:
         return retVal
@@ -1,8 +1,13 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import os
 import types
 import thread
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
@@ -10,7 +15,7 @@ from DIRAC.Core.Utilities import List, Network
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL
-from DIRAC.Core.Security import CS
+from DIRAC.Core.Security import CS, Locations
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 
@@ -31,6 +36,7 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_REUSE_CONNECTIONS = "reuseConnections"
 
   __threadConfig = ThreadConfig()
 
@@ -213,12 +219,46 @@ and this is thread %s
       #raise Exception( msgTxt )
 
 
-  def _connect( self ):
+  def _reuseConnections( self ):
+    if self.KW_REUSE_CONNECTIONS in self.kwargs:
+      return self.kwargs[ self.KW_REUSE_CONNECTIONS ]
+    return True
+
+  def __getConnectionKey( self ):
+    """
+    Connections can only be shared between clients with the same destination and credentials
+    """
+    credKey = [ self.kwargs.get( kw, False ) for kw in ( self.KW_USE_CERTIFICATES,
+                                                         self.KW_SKIP_CA_CHECK,
+                                                         self.KW_TIMEOUT ) ]
+    if self.KW_PROXY_STRING in self.kwargs:
+      credKey.append( md5( self.kwargs[ self.KW_PROXY_STRING ] ).hexdigest() )
+    elif not self.useCertificates:
+      if self.KW_PROXY_LOCATION in self.kwargs:
+        proxyLocation = self.kwargs[ self.KW_PROXY_LOCATION ]
+      else:
+        proxyLocation = Locations.getProxyLocation()
+      #A renewed proxy requires a new connection
+      try:
+        credKey.append( ( proxyLocation, os.stat( proxyLocation ).st_mtime ) )
+      except:
+        credKey.append( ( proxyLocation, 0 ) )
+    return ( self.serviceURL, tuple( credKey ), str( self.__extraCredentials ), self.setup, self.vo )
+
+  def _connect( self, reuse = False ):
     self.__discoverExtraCredentials()
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    if reuse:
+      trPool = getGlobalTransportPool()
+      trid = trPool.getIdleTransport( self.__getConnectionKey() )
+      if trid:
+        gLogger.debug( "Reusing connection to: %s" % self.serviceURL )
+        result = S_OK( ( trid, trPool.get( trid ) ) )
+        result[ 'reused' ] = True
+        return result
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
@@ -230,15 +270,21 @@ and this is thread %s
     trid = getGlobalTransportPool().add( transport )
     return S_OK( ( trid, transport ) )
 
-  def _disconnect( self, trid ):
-    getGlobalTransportPool().close( trid )
+  def _disconnect( self, trid, keepConnected = False ):
+    if keepConnected:
+      getGlobalTransportPool().setIdleTransport( self.__getConnectionKey(), trid )
+    else:
+      getGlobalTransportPool().close( trid )
 
-  def _proposeAction( self, transport, action ):
+  def _proposeAction( self, transport, action, keepConnected = False ):
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
                          action,
                          self.__extraCredentials )
+    if keepConnected:
+      #Old servers ignore the extra field and close the connection as usual
+      stConnectionInfo += ( { 'keepConnected' : True }, )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
     if not retVal[ 'OK' ]:
       return retVal
@@ -28,6 +28,8 @@ class FileHelper:
     self.bReceivedEOF = False
     self.direction = False
     self.packetSize = 1048576
+    self.windowSize = 1
+    self.__pendingAcks = 0
     self.__fileBytes = 0
     self.__log = gLogger.getSubLogger( "FileHelper" )
 
@@ -41,6 +43,15 @@ class FileHelper:
       else:
         self.direction = direction
 
+  def setWindowSize( self, windowSize ):
+    """ Number of chunks sent before waiting for the acknowledgement of the first one.
+        Only use more than one if the peer has accepted it in the transfer header
+    """
+    self.windowSize = max( 1, int( windowSize ) )
+
+  def setPacketSize( self, packetSize ):
+    self.packetSize = max( 1, int( packetSize ) )
+
   def getHash( self ):
     return self.__oMD5.hexdigest()
 
@@ -52,10 +63,47 @@ class FileHelper:
     retVal = self.oTransport.sendData( S_OK( ( True, sBuffer ) ) )
     if not retVal[ 'OK' ]:
       return retVal
+    self.__pendingAcks += 1
+    if self.__pendingAcks < self.windowSize:
+      return S_OK()
+    return self.__receiveAck()
+
+  def __receiveAck( self ):
     retVal = self.oTransport.receiveData()
+    self.__pendingAcks -= 1
+    #The receiver does not acknowledge anything after an error or an abort
+    if not retVal[ 'OK' ] or ( 'AbortTransfer' in retVal and retVal[ 'AbortTransfer' ] ):
+      self.__pendingAcks = 0
+      if self.windowSize > 1:
+        #Tell the receiver discarding the chunks in flight that no more are coming
+        endTrans = S_OK( ( False, "" ) )
+        endTrans[ 'AbortTransfer' ] = True
+        self.oTransport.sendData( endTrans )
     return retVal
 
+  def __discardChunksInFlight( self ):
+    """ After stopping a windowed transfer, read the chunks already sent until the
+        sender confirms it has stopped, so the connection can still carry the result
+    """
+    if self.windowSize < 2:
+      return
+    while True:
+      retVal = self.oTransport.receiveData()
+      if not retVal[ 'OK' ] or ( 'AbortTransfer' in retVal and retVal[ 'AbortTransfer' ] ):
+        return
+      if not retVal[ 'Value' ][0]:
+        return
+
   def sendEOF( self ):
+    #Wait for the acknowledgement of the chunks in flight
+    while self.__pendingAcks:
+      retVal = self.__receiveAck()
+      if not retVal[ 'OK' ]:
+        return retVal
+      if 'AbortTransfer' in retVal and retVal[ 'AbortTransfer' ]:
+        self.__log.verbose( "Transfer aborted" )
+        self.__finishedTransmission()
+        return S_OK()
     retVal = self.oTransport.sendData( S_OK( ( False, self.__oMD5.hexdigest() ) ) )
     if not retVal[ 'OK' ]:
       return retVal
@@ -96,17 +144,23 @@ class FileHelper:
   def markAsTransferred( self ):
     if not self.bFinishedTransmission:
       if self.direction == "receive":
-        self.oTransport.receiveData()
-        abortTrans = S_OK()
-        abortTrans[ 'AbortTransfer' ] = True
-        self.oTransport.sendData( abortTrans )
+        retVal = self.oTransport.receiveData()
+        #An empty transfer has already ended with the EOF, there is nothing to abort
+        if not retVal[ 'OK' ] or retVal[ 'Value' ][0]:
+          abortTrans = S_OK()
+          abortTrans[ 'AbortTransfer' ] = True
+          self.oTransport.sendData( abortTrans )
+          self.__discardChunksInFlight()
       else:
         abortTrans = S_OK( ( False, "" ) )
         abortTrans[ 'AbortTransfer' ] = True
         retVal = self.oTransport.sendData( abortTrans )
         if not retVal[ 'OK' ]:
           return retVal
-        self.oTransport.receiveData()
+        #Acknowledgements of the chunks in flight come before the one of the abort
+        for i in range( self.__pendingAcks + 1 ):
+          self.oTransport.receiveData()
+        self.__pendingAcks = 0
     self.__finishedTransmission()
 
   def __finishedTransmission( self ):
@@ -154,6 +208,7 @@ class FileHelper:
       while not self.receivedEOF():
         if maxFileSize > 0 and receivedBytes > maxFileSize:
           self.sendError( "Exceeded maximum file size" )
+          self.__discardChunksInFlight()
           return S_ERROR( "Received file exceeded maximum size of %s bytes" % ( maxFileSize ) )
         dataSink.write( strBuffer )
         result = self.receiveData( maxBufferSize = ( maxFileSize - len( strBuffer ) ) )
@@ -191,7 +246,9 @@ class FileHelper:
           self.__log.verbose( "Transfer aborted" )
           return S_OK()
         ioffset += iPacketSize
-      self.sendEOF()
+      result = self.sendEOF()
+      if not result[ 'OK' ]:
+        return result
     except Exception, e:
       return S_ERROR( "Error while sending string: %s" % str( e ) )
     try:
@@ -202,6 +259,7 @@ class FileHelper:
 
   def FDToNetwork( self, iFD ):
     self.__oMD5 = md5.md5()
+    self.__pendingAcks = 0
     iPacketSize = self.packetSize
     self.__fileBytes = 0
     sentBytes = 0
@@ -216,7 +274,9 @@ class FileHelper:
           return S_OK()
         sentBytes += len( sBuffer )
         sBuffer = os.read( iFD, iPacketSize )
-      self.sendEOF()
+      result = self.sendEOF()
+      if not result[ 'OK' ]:
+        return result
     except Exception, e:
       gLogger.exception( "Error while sending file" )
       return S_ERROR( "Error while sending file: %s" % str( e ) )
@@ -234,6 +294,7 @@ class FileHelper:
     if "read" not in dir( dataSource ):
       return S_ERROR( "%s data source object does not have a read method" % str( dataSource ) )
     self.__oMD5 = md5.md5()
+    self.__pendingAcks = 0
     iPacketSize = self.packetSize
     try:
       sBuffer = dataSource.read( iPacketSize )
@@ -245,7 +306,9 @@ class FileHelper:
           self.__log.verbose( "Transfer aborted" )
           return S_OK()
         sBuffer = dataSource.read( iPacketSize )
-      self.sendEOF()
+      result = self.sendEOF()
+      if not result[ 'OK' ]:
+        return result
     except Exception, e:
       gLogger.exception( "Error while sending file" )
       return S_ERROR( "Error while sending file: %s" % str( e ) )
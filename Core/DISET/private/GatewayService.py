@@ -79,6 +79,10 @@ class GatewayService( Service ):
       self._transportPool.close( trid )
     return result
 
+  def _acceptsKeepConnected( self, proposalTuple ):
+    #Forwarded connections are not kept open
+    return False
+
   def _receiveAndCheckProposal( self, trid ):
     clientTransport = self._transportPool.get( trid )
     #Get the peer credentials
@@ -286,9 +290,10 @@ class TransferRelay( TransferClient ):
       self.errMsg( "Could not send header", result[ 'Message' ] )
       return result
     self.infoMsg( "Starting to send data to service" )
-    srvTransport = result[ 'Value' ]
+    trid, srvTransport = result[ 'Value' ]
     srvFileHelper = FileHelper( srvTransport )
     srvFileHelper.setDirection( "send" )
+    srvFileHelper.setWindowSize( result[ 'TransferWindow' ] )
     result = srvFileHelper.BufferToNetwork( data )
     if not result[ 'OK' ]:
       self.errMsg( "Could send data to server", result[ 'Message' ] )
@@ -309,6 +314,7 @@ class TransferRelay( TransferClient ):
     trid, srvTransport = result[ 'Value' ]
     srvFileHelper = FileHelper( srvTransport )
     srvFileHelper.setDirection( "receive" )
+    srvFileHelper.setWindowSize( result[ 'TransferWindow' ] )
     sIO = cStringIO.StringIO()
     result = srvFileHelper.networkToDataSink( sIO, self.__transferBytesLimit )
     if not result[ 'OK' ]:
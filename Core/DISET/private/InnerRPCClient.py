@@ -10,23 +10,39 @@ class InnerRPCClient( BaseClient ):
 
   def executeRPC( self, functionName, args ):
     stub = ( self._getBaseStub(), functionName, args )
-    retVal = self._connect()
+    retVal = self.__connectAndPropose( functionName )
     if not retVal[ 'OK' ]:
       retVal[ 'rpcStub' ] = stub
       return retVal
-    trid, transport = retVal[ 'Value' ]
+    trid, transport, keepConnected = retVal[ 'Value' ]
     try:
-      retVal = self._proposeAction( transport, ( "RPC", functionName ) )
-      if not retVal[ 'OK' ]:
-        retVal[ 'rpcStub' ] = stub
-        return retVal
       retVal = transport.sendData( S_OK( args ) )
       if not retVal[ 'OK' ]:
+        keepConnected = False
         return retVal
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
         receivedData[ 'rpcStub' ] = stub
+        #Errors returned by the service keep the connection, transport errors don't
+        keepConnected = keepConnected and not transport.lastReceiveFailed()
+      else:
+        keepConnected = False
       return receivedData
     finally:
-      self._disconnect( trid )
+      self._disconnect( trid, keepConnected )
 
+  def __connectAndPropose( self, functionName ):
+    reuse = self._reuseConnections()
+    while True:
+      retVal = self._connect( reuse = reuse )
+      if not retVal[ 'OK' ]:
+        return retVal
+      reused = retVal.get( 'reused', False )
+      trid, transport = retVal[ 'Value' ]
+      retVal = self._proposeAction( transport, ( "RPC", functionName ), keepConnected = reuse )
+      if retVal[ 'OK' ]:
+        return S_OK( ( trid, transport, reuse and retVal.get( 'keepConnected', False ) ) )
+      self._disconnect( trid )
+      #The server may have dropped an idle connection. Retry with a new one
+      if not reused:
+        return retVal
@@ -1,6 +1,9 @@
 
 import os
 import time
+import types
+import select
+import socket
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
@@ -45,6 +48,10 @@ class Service:
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self.__idleTransports = {}
+    self.__idleLock = threading.Lock()
+    self.__watchingIdleTransports = False
+    self.__idleWakeUp = os.pipe()
 
   def setCloneProcessId( self, cloneId ):
     self.__cloneId = cloneId
@@ -282,7 +289,7 @@ class Service:
                                              args = ( clientTransport, ) )
 
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, trid = False ):
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
     self._lockManager.lockGlobal()
     try:
@@ -290,18 +297,27 @@ class Service:
     except Exception, e:
       monReport = False
     try:
-      #Handshake
-      try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
-          return
-      except:
-        return
-      #Add to the transport pool
-      trid = self._transportPool.add( clientTransport )
       if not trid:
-        return
+        #Handshake
+        try:
+          result = clientTransport.handshake()
+          if not result[ 'OK' ]:
+            clientTransport.close()
+            return
+        except:
+          return
+        #Add to the transport pool
+        trid = self._transportPool.add( clientTransport )
+        if not trid:
+          return
+        #Keep the handshake credentials for the next proposals in this connection
+        self._transportPool.associateData( trid, 'handshakeCredentials',
+                                           dict( clientTransport.getConnectingCredentials() ) )
+      else:
+        #Connection kept from a previous proposal. Start from the handshake credentials
+        credDict = clientTransport.getConnectingCredentials()
+        credDict.clear()
+        credDict.update( self._transportPool.getAssociatedData( trid, 'handshakeCredentials' ) or {} )
       #Receive and check proposal
       result = self._receiveAndCheckProposal( trid )
       if not result[ 'OK' ]:
@@ -321,12 +337,87 @@ class Service:
         if not result[ 'OK' ]:
           gLogger.error( "Error processing proposal: %s" % result[ 'Message' ] )
         self._transportPool.close( trid )
+      elif result.get( 'keepConnected', False ):
+        self.__addIdleTransport( trid )
       return result
     finally:
       self._lockManager.unlockGlobal()
       if monReport:
         self.__endReportToMonitoring( *monReport )
 
+  #Connections kept open waiting for the next proposal
+
+  def _acceptsKeepConnected( self, proposalTuple ):
+    if proposalTuple[1][0] != 'RPC' or len( proposalTuple ) < 4:
+      return False
+    if type( proposalTuple[3] ) != types.DictType or not proposalTuple[3].get( 'keepConnected', False ):
+      return False
+    return len( self.__idleTransports ) < self._cfg.getMaxIdleConnections()
+
+  def __addIdleTransport( self, trid ):
+    self.__idleLock.acquire()
+    try:
+      self.__idleTransports[ trid ] = time.time()
+      #Make the watcher select again including this transport
+      os.write( self.__idleWakeUp[1], "x" )
+      if not self.__watchingIdleTransports:
+        self.__watchingIdleTransports = True
+        watchThread = threading.Thread( target = self.__watchIdleTransports )
+        watchThread.setDaemon( True )
+        watchThread.start()
+    finally:
+      self.__idleLock.release()
+
+  def __watchIdleTransports( self ):
+    while True:
+      now = time.time()
+      lifeTime = self._cfg.getIdleConnectionLifeTime()
+      sIdList = []
+      self.__idleLock.acquire()
+      try:
+        for trid in list( self.__idleTransports ):
+          tr = self._transportPool.get( trid )
+          if not tr or now - tr.getLastActionTimestamp() > lifeTime:
+            del( self.__idleTransports[ trid ] )
+            if tr:
+              self._transportPool.close( trid )
+            continue
+          sIdList.append( ( trid, tr ) )
+        if not sIdList:
+          self.__watchingIdleTransports = False
+          return
+      finally:
+        self.__idleLock.release()
+      readyList = [ pos for pos in sIdList if pos[1].hasPendingData() ]
+      if not readyList:
+        try:
+          inList = select.select( [ self.__idleWakeUp[0] ] + [ pos[1].getSocket() for pos in sIdList ],
+                                  [], [], 1 )[0]
+        except ( select.error, socket.error ):
+          time.sleep( 0.001 )
+          continue
+        if self.__idleWakeUp[0] in inList:
+          os.read( self.__idleWakeUp[0], 4096 )
+        readyList = [ pos for pos in sIdList if pos[1].getSocket() in inList ]
+      for trid, tr in readyList:
+        self.__idleLock.acquire()
+        try:
+          del( self.__idleTransports[ trid ] )
+        finally:
+          self.__idleLock.release()
+        #Read in the thread pool, a slow client must not hold the other idle connections
+        self._threadPool.generateJobAndQueueIt( self.__receiveFromIdleTransport,
+                                                 args = ( trid, tr ) )
+
+  def __receiveFromIdleTransport( self, trid, tr ):
+    #Keep the proposal in the transport so _receiveAndCheckProposal gets it
+    result = tr.receiveData( 1024, blockAfterKeepAlive = False, idleReceive = True )
+    if not result[ 'OK' ]:
+      self._transportPool.close( trid )
+    elif 'keepAlive' in result:
+      self.__addIdleTransport( trid )
+    else:
+      self._processInThread( tr, trid )
 
   def _createIdentityString( self, credDict, clientTransport = False ):
     if 'username' in credDict:
@@ -450,7 +541,11 @@ class Service:
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
     #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    readyMsg = S_OK()
+    keepConnected = self._acceptsKeepConnected( proposalTuple )
+    if keepConnected:
+      readyMsg[ 'keepConnected' ] = True
+    retVal = self._transportPool.send( trid, readyMsg )
     if not retVal[ 'OK' ]:
       return retVal
 
@@ -478,7 +573,8 @@ class Service:
       if not result[ 'OK' ]:
         self._msgBroker.removeTransport( trid )
 
-    result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    result[ 'closeTransport' ] = not ( messageConnection or keepConnected ) or not result[ 'OK' ]
+    result[ 'keepConnected' ] = keepConnected and result[ 'OK' ]
     return result
 
   def _mbConnect( self, trid, handlerObj = False ):
@@ -1,11 +1,17 @@
 
 import time
+import select
 import threading
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 
 class TransportPool:
 
+  #Max idle client connections kept per connection key
+  iMaxIdlePerKey = 4
+  #Seconds a client connection can stay idle before being closed
+  iIdleLifeTime = 300
+
   def __init__( self, logger = False ):
     if logger:
       self.log = logger
@@ -15,6 +21,9 @@ class TransportPool:
     self.__transports = {}
     self.__listenPersistConn = False
     self.__msgCounter = 0
+    self.__idleLock = threading.Lock()
+    self.__idleTransports = {}
+    self.__idleTrids = {}
     result = gThreadScheduler.addPeriodicTask( 5, self.__sendKeepAlives )
     if not result[ 'OK' ]:
       self.log.fatal( "Cannot add task to thread scheduler", result[ 'Message' ] )
@@ -33,6 +42,9 @@ class TransportPool:
     except RuntimeError:
       self.__sendKeepAlives( retries - 1 )
     for trid in tridList:
+      #Idle connections are taken care of while purging them
+      if trid in self.__idleTrids:
+        continue
       try:
         tr = self.__transports[ trid ][0]
       except KeyError:
@@ -45,6 +57,94 @@ class TransportPool:
         continue
       except:
         gLogger.exception( "Cannot send keep alive" )
+    self.__purgeIdleTransports()
+
+  #
+  # Idle client connections
+  #
+
+  def getIdleTransport( self, idleKey ):
+    """
+    Get the id of an idle connection stored with idleKey. False if there's none
+    """
+    self.__idleLock.acquire()
+    try:
+      idleList = self.__idleTransports.get( idleKey, [] )
+      while idleList:
+        trid = idleList.pop()[0]
+        del( self.__idleTrids[ trid ] )
+        if self.exists( trid ):
+          return trid
+      return False
+    finally:
+      self.__idleLock.release()
+
+  def setIdleTransport( self, idleKey, trid ):
+    """
+    Keep the connection open to be reused by the next client with the same idleKey
+    """
+    if not self.exists( trid ):
+      return S_ERROR( "No transport with id %s defined" % trid )
+    self.__idleLock.acquire()
+    try:
+      idleList = self.__idleTransports.setdefault( idleKey, [] )
+      if trid not in self.__idleTrids and len( idleList ) < self.iMaxIdlePerKey:
+        idleList.append( ( trid, time.time() ) )
+        self.__idleTrids[ trid ] = idleKey
+        return S_OK()
+    finally:
+      self.__idleLock.release()
+    self.close( trid )
+    return S_OK()
+
+  def __purgeIdleTransports( self ):
+    now = time.time()
+    toClose = []
+    self.__idleLock.acquire()
+    try:
+      idleTuples = []
+      for idleKey in self.__idleTransports:
+        for idleTuple in self.__idleTransports[ idleKey ]:
+          tr = self.get( idleTuple[0] )
+          if not tr or now - idleTuple[1] > self.iIdleLifeTime:
+            toClose.append( ( idleKey, idleTuple ) )
+          else:
+            idleTuples.append( ( idleKey, idleTuple, tr ) )
+      readable = self.__getReadableTransports( [ idleTuple[2] for idleTuple in idleTuples ] )
+      toClose += [ idleTuple[:2] for idleTuple in idleTuples if idleTuple[2] in readable ]
+      for idleKey, idleTuple in toClose:
+        self.__idleTransports[ idleKey ].remove( idleTuple )
+        del( self.__idleTrids[ idleTuple[0] ] )
+        if not self.__idleTransports[ idleKey ]:
+          del( self.__idleTransports[ idleKey ] )
+    finally:
+      self.__idleLock.release()
+    for idleKey, idleTuple in toClose:
+      if self.exists( idleTuple[0] ):
+        self.close( idleTuple[0] )
+
+  def __getReadableTransports( self, trList ):
+    """
+    Idle connections only get data when the server closed them or broke the protocol.
+    Check them all at once without blocking, including data buffered in the SSL layer
+    """
+    readable = [ tr for tr in trList if tr.hasPendingData() ]
+    toSelect = [ tr for tr in trList if tr not in readable ]
+    if not toSelect:
+      return readable
+    try:
+      inList = select.select( [ tr.getSocket() for tr in toSelect ], [], [], 0 )[0]
+      return readable + [ tr for tr in toSelect if tr.getSocket() in inList ]
+    except:
+      #Some socket is not valid any more. Find which ones
+      pass
+    for tr in toSelect:
+      try:
+        if select.select( [ tr.getSocket() ], [], [], 0 )[0]:
+          readable.append( tr )
+      except:
+        readable.append( tr )
+    return readable
 
   # exists
 
@@ -9,7 +9,7 @@ except:
   from md5 import md5
 
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
-from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.Utilities import FastDEncode
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 class BaseTransport:
@@ -18,6 +18,8 @@ class BaseTransport:
   iListenQueueSize = 5
   iReadTimeout = 600
   keepAliveMagic = "dka"
+  #Messages bigger than this are decoded while they are received
+  iStreamDecodeSize = 16777216 #16MiB
 
   def __init__( self, stServerAddress, bServerMode = False, **kwargs ):
     self.bServerMode = bServerMode
@@ -33,6 +35,7 @@ class BaseTransport:
     self.receivedMessages = []
     self.sentKeepAlives = 0
     self.waitingForKeepAlivePong = False
+    self.__messageReceived = True
     self.__keepAliveLapse = 0
     if 'keepAliveLapse' in kwargs:
       try:
@@ -91,6 +94,19 @@ class BaseTransport:
   def getSocket( self ):
     return self.oSocket
 
+  def lastReceiveFailed( self ):
+    """
+    True if the last receiveData failed in the transport or the protocol instead of
+    returning a message. The stream can't be trusted after that
+    """
+    return not self.__messageReceived
+
+  def hasPendingData( self ):
+    """
+    Data already read from the socket waiting to be processed
+    """
+    return bool( self.receivedMessages or self.byteStream )
+
   def _write( self, sBuffer ):
     self.oSocket.send( sBuffer )
 
@@ -120,31 +136,48 @@ class BaseTransport:
 
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
-    sCodedData = DEncode.encode( uData )
+    sCodedData = FastDEncode.encode( uData )
     if prefix:
-      dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
+      header = "%s%s:" % ( prefix, len( sCodedData ) )
     else:
-      dataToSend = "%s:%s" % ( len( sCodedData ), sCodedData )
-    for index in range( 0, len( dataToSend ), self.packetSize ):
-      bytesToSend = len( dataToSend[ index : index + self.packetSize ] )
-      packSentBytes = 0
-      while packSentBytes < bytesToSend:
-        try:
-          result = self._write( dataToSend[ index + packSentBytes : index + bytesToSend ] )
-          if not result[ 'OK' ]:
-            return result
-          sentBytes = result[ 'Value' ]
-        except Exception, e:
-          return S_ERROR( "Exception while sending data: %s" % e )
-        if sentBytes == 0:
-          return S_ERROR( "Connection closed by peer" )
-        packSentBytes += sentBytes
+      header = "%s:" % len( sCodedData )
+    if len( sCodedData ) < self.packetSize:
+      #Small messages go in one write
+      return self.__sendBuffer( header + sCodedData )
+    result = self.__sendBuffer( header )
+    if not result[ 'OK' ]:
+      return result
+    #Send views of the data to avoid copying it
+    for index in range( 0, len( sCodedData ), self.packetSize ):
+      result = self.__sendBuffer( buffer( sCodedData, index, self.packetSize ) )
+      if not result[ 'OK' ]:
+        return result
     return S_OK()
 
+  def __sendBuffer( self, dataToSend ):
+    bytesToSend = len( dataToSend )
+    packSentBytes = 0
+    while packSentBytes < bytesToSend:
+      try:
+        if packSentBytes:
+          result = self._write( buffer( dataToSend, packSentBytes ) )
+        else:
+          result = self._write( dataToSend )
+        if not result[ 'OK' ]:
+          return result
+        sentBytes = result[ 'Value' ]
+      except Exception, e:
+        return S_ERROR( "Exception while sending data: %s" % e )
+      if sentBytes == 0:
+        return S_ERROR( "Connection closed by peer" )
+      packSentBytes += sentBytes
+    return S_OK()
 
   def receiveData( self, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
     self.__updateLastActionTimestamp()
+    self.__messageReceived = False
     if self.receivedMessages:
+      self.__messageReceived = True
       return self.receivedMessages.pop( 0 )
     #Buffer size can't be less than 0
     maxBufferSize = max( maxBufferSize, 0 )
@@ -162,8 +195,11 @@ class BaseTransport:
         #If closed return error
         if not retVal[ 'Value' ]:
           return S_ERROR( "Peer closed connection" )
-        #New data!
-        self.byteStream += retVal[ 'Value' ]
+        #New data! The buffer only holds the beginning of a message here
+        if self.byteStream:
+          self.byteStream += retVal[ 'Value' ]
+        else:
+          self.byteStream = retVal[ 'Value' ]
         #Look again for either message length of ka magic string
         iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
         isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
@@ -177,34 +213,75 @@ class BaseTransport:
         self.byteStream = self.byteStream[ keepAliveMagicLen: ]
         return self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive )
       #From here it must be a real message!
-      #Process the size and remove the msg length from the bytestream
       size = int( self.byteStream[ :iSeparatorPosition ] )
-      self.byteStream = self.byteStream[ iSeparatorPosition + 1: ]
-      #Receive while there's still data to be received
-      while len( self.byteStream ) < size:
-        retVal = self._read( min( self.packetSize, size - len( self.byteStream ) ), skipReadyCheck = True )
-        if not retVal[ 'OK' ]:
-          return retVal
-        if not retVal[ 'Value' ]:
-          return S_ERROR( "Peer closed connection" )
-        self.byteStream += retVal[ 'Value' ]
-        if maxBufferSize and len( self.byteStream ) > maxBufferSize:
-          return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
-      #Data is here! take it out from the bytestream, dencode and return
-      data = self.byteStream[ :size ]
-      self.byteStream = self.byteStream[ size: ]
-      try:
-        data = DEncode.decode( data )[0]
-      except Exception, e:
-        return S_ERROR( "Could not decode received data: %s" % str( e ) )
+      if maxBufferSize and size > maxBufferSize:
+        return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+      msgStart = iSeparatorPosition + 1
+      msgEnd = msgStart + size
+      if len( self.byteStream ) >= msgEnd:
+        #The whole message is already buffered. Decode it in place
+        try:
+          data, decodedEnd = FastDEncode.decode( self.byteStream, msgStart )
+          if decodedEnd != msgEnd:
+            raise ValueError( "Message length does not match its contents" )
+        except Exception, e:
+          return S_ERROR( "Could not decode received data: %s" % str( e ) )
+        self.byteStream = self.byteStream[ msgEnd: ]
+      else:
+        result = self.__receiveMessageBody( size, msgStart )
+        if not result[ 'OK' ]:
+          return result
+        data = result[ 'Value' ]
+      self.__messageReceived = True
       if idleReceive:
         self.receivedMessages.append( data )
         return S_OK()
       return data
     except Exception, e:
+      self.__messageReceived = False
       gLogger.exception( "Network error while receiving data" )
       return S_ERROR( "Network error while receiving data: %s" % str( e ) )
 
+  def __receiveMessageBody( self, size, msgStart ):
+    """
+    Receive the rest of a message which is partially in the buffer.
+    Chunks are kept in a list and joined once. Big messages are decoded while they arrive
+    """
+    chunks = [ self.byteStream[ msgStart: ] ]
+    self.byteStream = ""
+    received = len( chunks[0] )
+    streamDecoder = False
+    decoded = False
+    try:
+      if size > self.iStreamDecodeSize:
+        streamDecoder = FastDEncode.StreamDecoder()
+        decoded = streamDecoder.feed( chunks.pop() )
+      while received < size:
+        if decoded:
+          raise ValueError( "Message length does not match its contents" )
+        retVal = self._read( min( self.packetSize, size - received ), skipReadyCheck = True )
+        if not retVal[ 'OK' ]:
+          return retVal
+        if not retVal[ 'Value' ]:
+          return S_ERROR( "Peer closed connection" )
+        received += len( retVal[ 'Value' ] )
+        if streamDecoder:
+          decoded = streamDecoder.feed( retVal[ 'Value' ] )
+        else:
+          chunks.append( retVal[ 'Value' ] )
+      if streamDecoder:
+        if not decoded:
+          decoded = streamDecoder.finish()
+        if not decoded or decoded[1]:
+          raise ValueError( "Message length does not match its contents" )
+        return S_OK( decoded[0] )
+      data, decodedEnd = FastDEncode.decode( "".join( chunks ) )
+      if decodedEnd != size:
+        raise ValueError( "Message length does not match its contents" )
+    except Exception, e:
+      return S_ERROR( "Could not decode received data: %s" % str( e ) )
+    return S_OK( data )
+
   def __processKeepAlive( self, maxBufferSize, blockAfterKeepAlive = True ):
     gLogger.debug( "Received Keep Alive" )
     #Next message down the stream will be the ka data
@@ -218,6 +295,7 @@ class BaseTransport:
       if reqField not in kaData:
         errMsg = "Invalid keep alive, missing %s" % reqField
         gLogger.debug( errMsg )
+        self.__messageReceived = False
         return S_ERROR( errMsg )
     gLogger.debug( "Received keep alive id %s" % kaData )
     #Need to check if it's one of the keep alives we sent or one started from the other side
@@ -22,6 +22,10 @@ class SessionManager:
   def free( self, sessionId ):
     self.sessionsDict[ sessionId ].free()
 
+  def remove( self, sessionId ):
+    if sessionId in self.sessionsDict:
+      del self.sessionsDict[ sessionId ]
+
   def set( self, sessionId, sessionObject ):
     self.sessionsDict[ sessionId ] = sessionObject
 
@@ -4,19 +4,36 @@ __RCSID__ = "$Id$"
 import time
 import copy
 import os.path
+try:
+  import hashlib as md5
+except:
+  import md5
 import GSI
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.Core.Utilities.Network import checkHostsMatch
 from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.Core.Security import Locations
 from DIRAC.Core.Security.X509Chain import X509Chain
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
+#Options of the connections that change the SSL context
+gContextOptions = ( 'clientMode', 'sslMethod', 'skipCACheck', 'gsiEnable', 'IgnoreCRLs', 'SSLSessionTimeout' )
+
 class SocketInfo:
 
   __cachedCAsCRLs = False
   __cachedCAsCRLsLastLoaded = 0
+  __cachedCAsCRLsLastChecked = 0
+  __cachedCAsCRLsSignature = False
   __cachedCAsCRLsLoadLock = LockRing().getLock()
+  __casCheckInterval = 60
+  __casMaxAge = 21600
+
+  #SSL contexts shared by all the connections with the same credentials, options and CAs
+  __cachedContexts = DictCache( maxSize = 200 )
+  __cachedContextsLock = LockRing().getLock()
+  __contextLifeTime = 86400
 
 
   def __init__( self, infoDict, sslContext = False ):
@@ -51,9 +68,15 @@ class SocketInfo:
 
   def gatherPeerCredentials( self ):
     certList = self.sslSocket.get_peer_certificate_chain()
+    #Resumed sessions may not keep the peer chain
+    if certList is None:
+      return False
     #Servers don't receive the whole chain, the last cert comes alone
     if not self.infoDict[ 'clientMode' ]:
-      certList.insert( 0, self.sslSocket.get_peer_certificate() )
+      peerCert = self.sslSocket.get_peer_certificate()
+      if peerCert is None:
+        return False
+      certList = [ peerCert ] + list( certList )
     peerChain = X509Chain( certList = certList )
     isProxyChain = peerChain.isProxy()['Value']
     isLimitedProxyChain = peerChain.isLimitedProxy()['Value']
@@ -123,20 +146,57 @@ class SocketInfo:
   def _serverCallback( self, conn, cert, errnum, depth, ok ):
     return ok
 
-  def __getCAStore( self ):
+  def __getCAsSignature( self, casPath ):
+    """
+    Cheap fingerprint of the CAs location to detect changes of the CAs and CRLs
+    """
+    sigHash = md5.md5()
+    sigHash.update( casPath )
+    try:
+      fileNames = os.listdir( casPath )
+    except OSError:
+      return False
+    fileNames.sort()
+    for fileName in fileNames:
+      try:
+        fileStat = os.stat( os.path.join( casPath, fileName ) )
+      except OSError:
+        continue
+      sigHash.update( "|%s:%s:%s" % ( fileName, fileStat.st_mtime, fileStat.st_size ) )
+    return sigHash.hexdigest()
+
+  def __mustReloadCAs( self ):
+    """
+    The CAs location is checked for changes every minute, the CAs are reloaded anyway
+    every 6 hours to drop the expired ones
+    """
+    now = time.time()
+    if not SocketInfo.__cachedCAsCRLs or now - SocketInfo.__cachedCAsCRLsLastLoaded > SocketInfo.__casMaxAge:
+      return True
+    if now - SocketInfo.__cachedCAsCRLsLastChecked < SocketInfo.__casCheckInterval:
+      return False
+    SocketInfo.__cachedCAsCRLsLastChecked = now
+    casPath = Locations.getCAsLocation()
+    if not casPath:
+      return True
+    return self.__getCAsSignature( casPath ) != SocketInfo.__cachedCAsCRLsSignature
+
+  def __getCAsCRLs( self ):
+    """
+    Get the loaded CAs and CRLs, they are only reloaded when the CAs location changes
+    """
     SocketInfo.__cachedCAsCRLsLoadLock.acquire()
     try:
-      if not SocketInfo.__cachedCAsCRLs or time.time() - SocketInfo.__cachedCAsCRLsLastLoaded > 900:
+      if self.__mustReloadCAs():
         #Need to generate the CA Store
         casDict = {}
-        crlsDict = []
+        crlsDict = {}
         casPath = Locations.getCAsLocation()
         if not casPath:
           return S_ERROR( "No valid CAs location found" )
         gLogger.debug( "CAs location is %s" % casPath )
         casFound = 0
         crlsFound = 0
-        SocketInfo.__caStore = GSI.crypto.X509Store()
         for fileName in os.listdir( casPath ):
           filePath = os.path.join( casPath, fileName )
           if not os.path.isfile( filePath ):
@@ -181,25 +241,82 @@ class SocketInfo:
                 gLogger.exception( "LOADING %s" % filePath )
 
         gLogger.debug( "Loaded %s CAs [%s CRLs]" % ( casFound, crlsFound ) )
-        SocketInfo.__cachedCAsCRLs = ( [ casDict[k][1] for k in casDict ],
-                                       [ crlsDict[k][1] for k in crlsDict ] )
+        SocketInfo.__cachedCAsCRLsSignature = self.__getCAsSignature( casPath )
         SocketInfo.__cachedCAsCRLsLastLoaded = time.time()
+        SocketInfo.__cachedCAsCRLsLastChecked = SocketInfo.__cachedCAsCRLsLastLoaded
+        SocketInfo.__cachedCAsCRLs = ( [ casDict[k][1] for k in casDict ],
+                                       [ crlsDict[k][1] for k in crlsDict ],
+                                       SocketInfo.__cachedCAsCRLsLastLoaded )
+        #Contexts with the old CAs are not handed out any more
+        SocketInfo.__cachedContexts.purgeAll()
     except:
       gLogger.exception( "ASD" )
     finally:
       SocketInfo.__cachedCAsCRLsLoadLock.release()
+    if not SocketInfo.__cachedCAsCRLs:
+      return S_ERROR( "Could not load the CAs" )
+    return S_OK( SocketInfo.__cachedCAsCRLs )
+
+  def __getCAStore( self, casCRLs ):
     #Generate CA Store
     caStore = GSI.crypto.X509Store()
-    caList = SocketInfo.__cachedCAsCRLs[0]
+    caList = casCRLs[0]
     for caCert in caList:
       caStore.add_cert( caCert )
-    crlList = SocketInfo.__cachedCAsCRLs[1]
+    crlList = casCRLs[1]
     for crl in crlList:
       caStore.add_crl( crl )
     return S_OK( caStore )
 
+  def __getFilesID( self, filePaths ):
+    """
+    Identify the credentials files by location and last change, so renewed proxies get a new context
+    """
+    filesID = []
+    for filePath in filePaths:
+      try:
+        fileStat = os.stat( filePath )
+        filesID.append( ( filePath, fileStat.st_mtime, fileStat.st_size ) )
+      except OSError:
+        filesID.append( ( filePath, 0, 0 ) )
+    return tuple( filesID )
 
-  def __createContext( self ):
+  def __getSharedContext( self, credentialsID, loadCredentials ):
+    """
+    Use the context already created for the same credentials, options and CAs, else create it.
+    Connections keep a reference to their context, so contexts dropped from the cache
+    when the CAs change stay alive until the last connection using them is gone
+    """
+    casCRLs = False
+    if not self.__getValue( 'skipCACheck', False ):
+      result = self.__getCAsCRLs()
+      if not result[ 'OK' ]:
+        return result
+      casCRLs = result[ 'Value' ]
+    contextKey = [ credentialsID ]
+    if casCRLs:
+      contextKey.append( casCRLs[2] )
+    for optName in gContextOptions:
+      contextKey.append( self.__getValue( optName, False ) )
+    contextKey = tuple( contextKey )
+    SocketInfo.__cachedContextsLock.acquire()
+    try:
+      sslContext = SocketInfo.__cachedContexts.get( contextKey )
+      if sslContext:
+        self.sslContext = sslContext
+        return S_OK()
+      retVal = self.__createContext( casCRLs )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = loadCredentials()
+      if not retVal[ 'OK' ]:
+        return retVal
+      SocketInfo.__cachedContexts.add( contextKey, SocketInfo.__contextLifeTime, self.sslContext )
+    finally:
+      SocketInfo.__cachedContextsLock.release()
+    return S_OK()
+
+  def __createContext( self, casCRLs ):
     clientContext = self.__getValue( 'clientMode', False )
     # Initialize context
     contextOptions = GSI.SSL.OP_ALL
@@ -208,6 +325,8 @@ class SocketInfo:
     else:
       methodSuffix = "SERVER_METHOD"
       contextOptions |= GSI.SSL.OP_NO_SSLv2 | GSI.SSL.OP_NO_SSLv3
+      #Resumed sessions must carry the peer chain, tickets don't keep it: use the session cache
+      contextOptions |= getattr( GSI.SSL, 'OP_NO_TICKET', 0 )
     if 'sslMethod' in self.infoDict:
       methodName = "%s_%s" % ( self.infoDict[ 'sslMethod' ], methodSuffix )
     else:
@@ -228,7 +347,7 @@ class SocketInfo:
     if not self.__getValue( 'skipCACheck', False ):
       #self.sslContext.set_verify( SSL.VERIFY_PEER|SSL.VERIFY_FAIL_IF_NO_PEER_CERT, self.verifyCallback ) # Demand a certificate
       self.sslContext.set_verify( GSI.SSL.VERIFY_PEER | GSI.SSL.VERIFY_FAIL_IF_NO_PEER_CERT, None, gsiEnable ) # Demand a certificate
-      result = self.__getCAStore()
+      result = self.__getCAStore( casCRLs )
       if not result[ 'OK' ]:
         return result
       caStore = result[ 'Value' ]
@@ -243,13 +362,22 @@ class SocketInfo:
       return S_ERROR( "No valid certificate or key found" )
     self.setLocalCredentialsLocation( certKeyTuple )
     gLogger.debug( "Using certificate %s\nUsing key %s" % certKeyTuple )
-    retVal = self.__createContext()
-    if not retVal[ 'OK' ]:
-      return retVal
+    return self.__getSharedContext( self.__getFilesID( certKeyTuple ),
+                                    lambda: self.__loadCerts( certKeyTuple ) )
+
+  def __loadCerts( self, certKeyTuple ):
     #Verify depth to 20 to ensure accepting proxies of proxies of proxies....
     self.sslContext.set_verify_depth( 50 )
     self.sslContext.use_certificate_chain_file( certKeyTuple[0] )
     self.sslContext.use_privatekey_file( certKeyTuple[1] )
+    if not self.infoDict[ 'clientMode' ]:
+      #Sessions are cached per context, a renewed server context starts with an empty cache
+      self.sslContext.set_session_id( "DISETConnection" )
+      #self.sslContext.get_cert_store().set_flags( GSI.crypto.X509_CRL_CHECK )
+      if 'SSLSessionTimeout' in self.infoDict:
+        timeout = int( self.infoDict['SSLSessionTimeout'] )
+        gLogger.debug( "Setting session timeout to %s" % timeout )
+        self.sslContext.set_session_timeout( timeout )
     return S_OK()
 
   def __generateContextWithProxy( self ):
@@ -263,9 +391,10 @@ class SocketInfo:
         return S_ERROR( "No valid proxy found" )
     self.setLocalCredentialsLocation( ( proxyPath, proxyPath ) )
     gLogger.debug( "Using proxy %s" % proxyPath )
-    retVal = self.__createContext()
-    if not retVal[ 'OK' ]:
-      return retVal
+    return self.__getSharedContext( self.__getFilesID( ( proxyPath, ) ),
+                                    lambda: self.__loadProxyFile( proxyPath ) )
+
+  def __loadProxyFile( self, proxyPath ):
     self.sslContext.use_certificate_chain_file( proxyPath )
     self.sslContext.use_privatekey_file( proxyPath )
     return S_OK()
@@ -274,24 +403,16 @@ class SocketInfo:
     proxyString = self.infoDict[ 'proxyString' ]
     self.setLocalCredentialsLocation( ( proxyString, proxyString ) )
     gLogger.debug( "Using string proxy" )
-    retVal = self.__createContext()
-    if not retVal[ 'OK' ]:
-      return retVal
+    return self.__getSharedContext( md5.md5( proxyString ).hexdigest(),
+                                    lambda: self.__loadProxyString( proxyString ) )
+
+  def __loadProxyString( self, proxyString ):
     self.sslContext.use_certificate_chain_string( proxyString )
     self.sslContext.use_privatekey_string( proxyString )
     return S_OK()
 
   def __generateServerContext( self ):
-    retVal = self.__generateContextWithCerts()
-    if not retVal[ 'OK' ]:
-      return retVal
-    self.sslContext.set_session_id( "DISETConnection%s" % str( time.time() ) )
-    #self.sslContext.get_cert_store().set_flags( GSI.crypto.X509_CRL_CHECK )
-    if 'SSLSessionTimeout' in self.infoDict:
-      timeout = int( self.infoDict['SSLSessionTimeout'] )
-      gLogger.debug( "Setting session timeout to %s" % timeout )
-      self.sslContext.set_session_timeout( timeout )
-    return S_OK()
+    return self.__generateContextWithCerts()
 
   def doClientHandshake( self ):
     self.sslSocket.set_connect_state()
@@ -324,6 +445,9 @@ class SocketInfo:
         gLogger.warn( "Error while handshaking", v )
         return S_ERROR( "Error while handshaking" )
     credentialsDict = self.gatherPeerCredentials()
+    if not credentialsDict:
+      gLogger.warn( "Error while handshaking", "the peer certificate chain is not available" )
+      return S_ERROR( "Error while handshaking: no peer certificate chain" )
     if self.infoDict[ 'clientMode' ]:
       hostnameCN = credentialsDict[ 'CN' ]
       #if hostnameCN.split("/")[-1] != self.infoDict[ 'hostname' ]:
@@ -68,15 +68,9 @@ class SocketInfoFactory:
         return S_ERROR( "Can't connect: %s" % str( ( errno, os.strerror( errno ) ) ) )
     return S_OK( osSocket )
 
-  def __connect( self, socketInfo, hostAddress ):
-    #Connect baby!
-    result = self.__socketConnect( hostAddress, socketInfo.infoDict[ 'timeout' ] )
-    if not result[ 'OK' ]:
-      return result
-    osSocket = result[ 'Value' ]
-    #SSL MAGIC
-    sslSocket = GSI.SSL.Connection( socketInfo.getSSLContext(), osSocket )
-    #Generate sessionId
+  def __getSessionId( self, socketInfo, hostAddress ):
+    """ Sessions are only resumed with the same server and credentials
+    """
     sessionHash = md5.md5()
     sessionHash.update( str( hostAddress ) )
     sessionHash.update( "|%s" % str( socketInfo.getLocalCredentialsLocation() ) )
@@ -85,10 +79,19 @@ class SocketInfoFactory:
         sessionHash.update( "|%s" % str( socketInfo.infoDict[ key ] ) )
     if 'proxyChain' in socketInfo.infoDict:
       sessionHash.update( "|%s" % socketInfo.infoDict[ 'proxyChain' ].dumpAllToString()[ 'Value' ] )
-    sessionId = sessionHash.hexdigest()
-    socketInfo.sslContext.set_session_id( str( hash( sessionId ) ) )
+    return sessionHash.hexdigest()
+
+  def __connect( self, socketInfo, hostAddress, sessionId = False ):
+    #Connect baby!
+    result = self.__socketConnect( hostAddress, socketInfo.infoDict[ 'timeout' ] )
+    if not result[ 'OK' ]:
+      return result
+    osSocket = result[ 'Value' ]
+    #SSL MAGIC
+    sslSocket = GSI.SSL.Connection( socketInfo.getSSLContext(), osSocket )
     socketInfo.setSSLSocket( sslSocket )
-    if gSessionManager.isValid( sessionId ):
+    #Try to resume the previous session with this server
+    if sessionId and gSessionManager.isValid( sessionId ):
       sslSocket.set_session( gSessionManager.get( sessionId ) )
     #Set the real timeout
     if socketInfo.infoDict[ 'timeout' ]:
@@ -102,6 +105,9 @@ class SocketInfoFactory:
     if not retVal[ 'OK' ]:
       return retVal
     socketInfo = retVal[ 'Value' ]
+    sessionId = False
+    if socketInfo.infoDict[ 'enableSessions' ]:
+      sessionId = self.__getSessionId( socketInfo, hostAddress )
     retVal = Network.getIPsForHostName( hostName )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not resolve %s: %s" % ( hostName, retVal[ 'Message' ] ) )
@@ -111,7 +117,7 @@ class SocketInfoFactory:
       errorsList = []
       for ip in ipList :
         ipAddress = ( ip, hostAddress[1] )
-        retVal = self.__connect( socketInfo, ipAddress )
+        retVal = self.__connect( socketInfo, ipAddress, sessionId )
         if retVal[ 'OK' ]:
           sslSocket = retVal[ 'Value' ]
           connected = True
@@ -123,11 +129,13 @@ class SocketInfoFactory:
       if retVal[ 'OK' ]:
         #Everything went ok. Don't need to retry
         break
+      #Retry with a full handshake if the session was not accepted
+      if sessionId:
+        gSessionManager.remove( sessionId )
     #Did the auth or the connection fail?
     if not retVal['OK']:
       return retVal
-    if 'enableSessions' in kwargs and kwargs[ 'enableSessions' ]:
-      sessionId = hash( hostAddress )
+    if sessionId:
       gSessionManager.set( sessionId, sslSocket.get_session() )
     return S_OK( socketInfo )
 
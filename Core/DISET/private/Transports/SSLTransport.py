@@ -69,7 +69,11 @@ class SSLTransport( BaseTransport ):
   def close( self ):
     gLogger.debug( "Closing socket" )
     try:
-      #self.oSocket.shutdown()
+      #Connections closed without a shutdown drop their session from the cache
+      self.oSocket.shutdown()
+    except:
+      pass
+    try:
       os.fsync( self.oSocket.fileno() )
       self.oSocket.close()
     except:
@@ -137,10 +141,19 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def hasPendingData( self ):
+    if BaseTransport.hasPendingData( self ):
+      return True
+    #Data can be buffered in the SSL layer without being visible to select
+    try:
+      return self.oSocket.pending() > 0
+    except:
+      return False
+
   def isLocked( self ):
     return self.__locked
 
-  def _write( self, buffer ):
+  def _write( self, sBuffer ):
     self.__lock()
     try:
       #Renegotiation
@@ -161,12 +174,15 @@ class SSLTransport( BaseTransport ):
       timeout = self.oSocketInfo.infoDict[ 'timeout' ]
       if timeout:
         start = time.time()
-      while sentBytes < len( buffer ):
+      while sentBytes < len( sBuffer ):
         try:
           if timeout:
             if time.time() - start > timeout:
               return S_ERROR( "Socket write timeout exceeded" )
-          sent = self.oSocket.write( buffer[ sentBytes: ] )
+          if sentBytes:
+            sent = self.oSocket.write( buffer( sBuffer, sentBytes ) )
+          else:
+            sent = self.oSocket.write( sBuffer )
           if sent == 0:
             return S_ERROR( "Connection closed by peer" )
           if sent > 0:
@@ -0,0 +1,143 @@
+########################################################################
+# $HeadURL $
+# File: AuthManagerTestCase.py
+########################################################################
+
+""" :mod: AuthManagerTestCase
+    ==========================
+
+    .. module: AuthManagerTestCase
+    :synopsis: test cases for the authorization decision cache of the AuthManager
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+from DIRAC.Core.DISET.AuthManager import AuthManager
+
+AUTH_SECTION = "/Systems/Test/Authorization"
+
+TEST_CFG = """
+DIRAC
+{
+  Configuration
+  {
+    Version = %s
+  }
+}
+Registry
+{
+  DefaultGroup = dirac_user
+  Users
+  {
+    alice
+    {
+      DN = /O=Test/CN=Alice
+    }
+    bob
+    {
+      DN = /O=Test/CN=Bob
+    }
+  }
+  Groups
+  {
+    dirac_user
+    {
+      Users = alice, bob
+      Properties = NormalUser
+    }
+    dirac_admin
+    {
+      Users = alice
+      Properties = ServiceAdministrator
+    }
+  }
+}
+Systems
+{
+  Test
+  {
+    Authorization
+    {
+      ping = NormalUser, ServiceAdministrator
+      admin = %s
+    }
+  }
+}
+"""
+
+########################################################################
+class AuthManagerTestCase( unittest.TestCase ):
+  """py:class AuthManagerTestCase
+  The cached decisions are the ones taken without the cache
+  """
+
+  def setUp( self ):
+    self.loadCS( "1", "ServiceAdministrator" )
+    self.authManager = AuthManager( AUTH_SECTION )
+    self.queries = []
+    authQuery = self.authManager._AuthManager__authQuery
+    def countedAuthQuery( methodQuery, credDict, defaultProperties = False ):
+      self.queries.append( methodQuery )
+      return authQuery( methodQuery, credDict, defaultProperties )
+    self.authManager._AuthManager__authQuery = countedAuthQuery
+
+  def tearDown( self ):
+    gConfigurationData.loadRemoteCFGFromMem( "" )
+
+  def loadCS( self, version, adminProperties ):
+    gConfigurationData.loadRemoteCFGFromMem( TEST_CFG % ( version, adminProperties ) )
+
+  def authQuery( self, method, **credDict ):
+    return self.authManager.authQuery( method, credDict )
+
+  def testCached( self ):
+    """ repeated queries are answered from the cache with the resolved credentials """
+    credDict = { 'DN' : '/O=Test/CN=Alice', 'group' : 'dirac_admin' }
+    self.assert_( self.authManager.authQuery( "admin", credDict ) )
+    cachedDict = { 'DN' : '/O=Test/CN=Alice', 'group' : 'dirac_admin' }
+    self.assert_( self.authManager.authQuery( "admin", cachedDict ) )
+    self.assertEqual( cachedDict, credDict )
+    self.assertEqual( cachedDict[ 'username' ], 'alice' )
+    self.assertEqual( len( self.queries ), 1 )
+    #Another method is another decision
+    self.assert_( self.authQuery( "ping", DN = '/O=Test/CN=Alice', group = 'dirac_admin' ) )
+    self.assertEqual( len( self.queries ), 2 )
+
+  def testCredentialFields( self ):
+    """ a change in any of the credential fields misses the cache """
+    self.assert_( self.authQuery( "admin", DN = '/O=Test/CN=Alice', group = 'dirac_admin' ) )
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Bob', group = 'dirac_admin' ) )
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Alice', group = 'dirac_user' ) )
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Alice' ) )
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Alice', extraCredentials = 'dirac_user' ) )
+    self.assert_( self.authQuery( "admin", DN = '/O=Test/CN=Alice', group = 'dirac_admin',
+                                  properties = [ 'ServiceAdministrator' ] ) )
+    self.assertEqual( len( self.queries ), 6 )
+    #Each one is cached on its own
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Bob', group = 'dirac_admin' ) )
+    self.assert_( self.authQuery( "admin", DN = '/O=Test/CN=Alice', group = 'dirac_admin' ) )
+    self.assertEqual( len( self.queries ), 6 )
+
+  def testUnhashable( self ):
+    """ credentials that can not be a key are always checked """
+    for _i in range( 2 ):
+      self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Alice', extraCredentials = [ 'dirac_admin' ] ) )
+    self.assertEqual( len( self.queries ), 2 )
+
+  def testNewCSVersion( self ):
+    """ the decisions are taken again with a new configuration version """
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Bob', group = 'dirac_user' ) )
+    self.failIf( self.authQuery( "admin", DN = '/O=Test/CN=Bob', group = 'dirac_user' ) )
+    self.assertEqual( len( self.queries ), 1 )
+    self.loadCS( "2", "NormalUser" )
+    self.assert_( self.authQuery( "admin", DN = '/O=Test/CN=Bob', group = 'dirac_user' ) )
+    self.assertEqual( len( self.queries ), 2 )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( AuthManagerTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
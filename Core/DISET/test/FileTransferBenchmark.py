@@ -0,0 +1,201 @@
+########################################################################
+# $HeadURL $
+# File: FileTransferBenchmark.py
+########################################################################
+
+""" :mod: FileTransferBenchmark
+    ==========================
+
+    .. module: FileTransferBenchmark
+    :synopsis: throughput of FileHelper transfers over a loopback link with latency
+
+    Run it with python FileTransferBenchmark.py [ RTT in ms [ size in MB [ window ... ] ] ]
+    from this directory. Every transfer goes through a proxy delaying each direction by
+    half the round trip time. Window 1 is the stop-and-wait transfer
+
+    * FileHelper: the file is sent with FDToNetwork and received with networkToDataSink
+    * SandboxStore: the file is uploaded with TransferClient.sendFile, proposing the window,
+      to a SandboxStoreHandler storing it in a temporary directory. The window is the one
+      accepted by the RequestHandler. The handler runs without a Service and a database
+    """
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import shutil
+import Queue
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
+from DIRAC import gConfig, S_OK, S_ERROR
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.FileHelper import FileHelper
+import DIRAC.WorkloadManagementSystem.Service.SandboxStoreHandler as SandboxStoreModule
+from FileTransferTestCase import LoopbackTransferClient, serveTransfer
+
+MB = 1048576
+SANDBOXSTORE_CS_PATH = "/Systems/WorkloadManagement/Benchmark/Services/SandboxStore"
+
+class BenchmarkSandboxDB:
+  """ Every upload is new content """
+
+  def getSandboxId( self, seName, sePFN, requesterName, requesterGroup ):
+    return S_ERROR( "Sandbox %s:%s does not exist" % ( seName, sePFN ) )
+
+  def acquireBlob( self, blobHash, sbSE, sbPFN, size = 0 ):
+    return S_OK( ( 1, True ) )
+
+  def releaseBlob( self, blobId ):
+    return S_OK()
+
+  def markBlobStored( self, blobId ):
+    return S_OK( True )
+
+  def registerAndGetSandbox( self, owner, ownerDN, ownerGroup, sbSE, sbPFN, size = 0, blobId = 0 ):
+    return S_OK( ( 1, True ) )
+
+  def assignSandboxesToEntities( self, enDict, requesterName, requesterGroup, enSetup, ownerName = "", ownerGroup = "" ):
+    return S_OK( 0 )
+
+def delayedPipe( srcSocket, dstSocket, delay ):
+  """ forward everything read from srcSocket to dstSocket delay seconds later """
+  pending = Queue.Queue()
+  def forward():
+    while True:
+      sendTime, data = pending.get()
+      if not data:
+        break
+      wait = sendTime - time.time()
+      if wait > 0:
+        time.sleep( wait )
+      try:
+        dstSocket.sendall( data )
+      except socket.error:
+        break
+    try:
+      dstSocket.shutdown( socket.SHUT_WR )
+    except socket.error:
+      pass
+  forwarder = threading.Thread( target = forward )
+  forwarder.setDaemon( 1 )
+  forwarder.start()
+  while True:
+    try:
+      data = srcSocket.recv( 65536 )
+    except socket.error:
+      data = ""
+    pending.put( ( time.time() + delay, data ) )
+    if not data:
+      break
+
+def latencyProxy( listenSocket, targetPort, delay ):
+  """ accept connections and relay them to targetPort with the given one way delay """
+  while True:
+    clientSocket = listenSocket.accept()[0]
+    serverSocket = socket.create_connection( ( "localhost", targetPort ) )
+    for src, dst in ( ( clientSocket, serverSocket ), ( serverSocket, clientSocket ) ):
+      pipeThread = threading.Thread( target = delayedPipe, args = ( src, dst, delay ) )
+      pipeThread.setDaemon( 1 )
+      pipeThread.start()
+
+def receiveFile( serverTransport ):
+  """ accept one connection and receive one file """
+  clientTransport = serverTransport.acceptConnection()[ 'Value' ]
+  fileHelper = FileHelper( clientTransport )
+  fileHelper.setDirection( "fromClient" )
+  clientTransport.sendData( fileHelper.networkToDataSink( open( os.devnull, "wb" ) ) )
+  clientTransport.close()
+
+def storeSandbox( serverTransport ):
+  """ accept one connection and serve one sandbox upload """
+  clientTransport = serverTransport.acceptConnection()[ 'Value' ]
+  clientTransport.peerCredentials = { 'username' : 'user', 'group' : 'user_group', 'DN' : '/O=DIRAC/CN=user' }
+  try:
+    serveTransfer( SandboxStoreModule.SandboxStoreHandler, clientTransport, "FromClient",
+                   "WorkloadManagement/SandboxStore", SANDBOXSTORE_CS_PATH )
+  finally:
+    clientTransport.close()
+
+def sendWithFileHelper( clientTransport, filePath, window ):
+  fileHelper = FileHelper( clientTransport )
+  fileHelper.setWindowSize( window )
+  iFD = os.open( filePath, os.O_RDONLY )
+  try:
+    result = fileHelper.FDToNetwork( iFD )
+    if result[ 'OK' ]:
+      result = clientTransport.receiveData()
+    return result
+  finally:
+    os.close( iFD )
+
+def sendWithTransferClient( clientTransport, filePath, window ):
+  client = LoopbackTransferClient( clientTransport, transferWindow = window )
+  fileHash = md5( file( filePath ).read() ).hexdigest()
+  result = client.sendFile( filePath, ( "%s.tar.bz2" % fileHash, {} ) )
+  if result[ 'OK' ] and client.fileHelpers[0].windowSize != window:
+    return S_ERROR( "Window %s accepted instead" % client.fileHelpers[0].windowSize )
+  return result
+
+def benchmark( rtt, sizeMB, windows, port = 19878, proxyPort = 19879 ):
+  serverTransport = PlainTransport( ( "", port ), bServerMode = True )
+  serverTransport.initAsServer()
+  listenSocket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+  listenSocket.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+  listenSocket.bind( ( "localhost", proxyPort ) )
+  listenSocket.listen( 5 )
+  proxyThread = threading.Thread( target = latencyProxy, args = ( listenSocket, port, rtt / 2000. ) )
+  proxyThread.setDaemon( 1 )
+  proxyThread.start()
+
+  basePath = tempfile.mkdtemp()
+  SandboxStoreModule.sandboxDB = BenchmarkSandboxDB()
+  #No purge thread
+  SandboxStoreModule.SandboxStoreHandler._SandboxStoreHandler__purgeCount = 0
+  gConfig.setOptionValue( "%s/BasePath" % SANDBOXSTORE_CS_PATH, basePath )
+  gConfig.setOptionValue( "%s/MaxSandboxSizeMiB" % SANDBOXSTORE_CS_PATH, str( sizeMB + 1 ) )
+  gConfig.setOptionValue( "%s/TransferWindow" % SANDBOXSTORE_CS_PATH, str( max( windows ) ) )
+  fd, filePath = tempfile.mkstemp()
+  os.write( fd, os.urandom( MB ) * sizeMB )
+  os.close( fd )
+  print "RTT %s ms, %s MB file" % ( rtt, sizeMB )
+  print "%12s %8s | %9s %10s" % ( "path", "window", "time", "MB/s" )
+  try:
+    for pathName, serve, send in ( ( "FileHelper", receiveFile, sendWithFileHelper ),
+                                   ( "SandboxStore", storeSandbox, sendWithTransferClient ) ):
+      for window in windows:
+        receiver = threading.Thread( target = serve, args = ( serverTransport, ) )
+        receiver.start()
+        clientTransport = PlainTransport( ( "localhost", proxyPort ) )
+        clientTransport.initAsClient()
+        start = time.time()
+        result = send( clientTransport, filePath, window )
+        elapsed = time.time() - start
+        receiver.join()
+        clientTransport.close()
+        if not result[ 'OK' ]:
+          print "%12s %8s | ERROR %s" % ( pathName, window, result[ 'Message' ] )
+          continue
+        print "%12s %8s | %8.3fs %10.1f" % ( pathName, window, elapsed, sizeMB / max( elapsed, 0.000001 ) )
+  finally:
+    os.unlink( filePath )
+    shutil.rmtree( basePath )
+    serverTransport.close()
+
+if __name__ == "__main__":
+  rtt = 50
+  sizeMB = 50
+  windows = [ 1, 4, 8, 16 ]
+  if len( sys.argv ) > 1:
+    rtt = float( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    sizeMB = int( sys.argv[2] )
+  if len( sys.argv ) > 3:
+    windows = [ int( window ) for window in sys.argv[3:] ]
+  benchmark( rtt, sizeMB, windows )
@@ -0,0 +1,305 @@
+########################################################################
+# $HeadURL $
+# File: FileTransferTestCase.py
+########################################################################
+
+""" :mod: FileTransferTestCase
+    ==========================
+
+    .. module: FileTransferTestCase
+    :synopsis: test cases for the windowed DISET file transfers
+
+    FileHelper transfers over loopback PlainTransports, and the negotiation of the
+    window between the TransferClient and the RequestHandler, with old and new peers.
+    The clients skip the action proposal and the handlers are run without a Service
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import tempfile
+import threading
+import unittest
+import cStringIO
+from DIRAC import gConfig, S_OK, S_ERROR
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.FileHelper import FileHelper
+from DIRAC.Core.DISET.private.LockManager import LockManager
+from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.TransferClient import TransferClient
+
+CS_PATH = "/Systems/Test/Services/Transfer"
+CHUNK = 4096
+DATA = "".join( [ chr( i % 256 ) for i in range( CHUNK * 25 + 100 ) ] )
+
+class FakeTransportPool:
+  """ The single connection of a handler """
+
+  def __init__( self, transport ):
+    self.transport = transport
+
+  def get( self, trid ):
+    return self.transport
+
+  def send( self, trid, msg ):
+    return self.transport.sendData( msg )
+
+  def receive( self, trid, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
+    return self.transport.receiveData( maxBufferSize )
+
+class FakeMessageBroker:
+
+  def __init__( self, transport ):
+    self.trPool = FakeTransportPool( transport )
+
+  def getTransportPool( self ):
+    return self.trPool
+
+def serveTransfer( handlerClass, transport, direction, serviceName = "Test/Transfer", csPath = CS_PATH ):
+  """ Execute a FileTransfer action of a handler on the server side of a connection """
+  srvInfoDict = { 'serviceName' : serviceName, 'csPaths' : [ csPath ],
+                  'URL' : "dips://localhost/%s" % serviceName }
+  handlerClass._rh__initializeClass( srvInfoDict, LockManager(), FakeMessageBroker( transport ), None )
+  handler = handlerClass( { 'clientSetup' : 'Test' }, 0 )
+  handler.initialize()
+  return handler._rh_executeAction( ( None, ( "FileTransfer", direction ) ) )
+
+class LoopbackTransferClient( TransferClient ):
+  """ TransferClient over an already connected transport """
+
+  def __init__( self, transport, **kwargs ):
+    self.kwargs = kwargs
+    self.transport = transport
+    self.fileHelpers = []
+
+  def _connect( self, reuse = False ):
+    return S_OK( ( 0, self.transport ) )
+
+  def _proposeAction( self, transport, action, keepConnected = False ):
+    return S_OK()
+
+  def _disconnect( self, trid, keepConnected = False ):
+    pass
+
+  def _getFileHelper( self, transport = None ):
+    fileHelper = TransferClient._getFileHelper( self, transport )
+    self.fileHelpers.append( fileHelper )
+    return fileHelper
+
+class LoopbackServer:
+  """ Accept loopback connections and serve each one in a thread """
+
+  def __init__( self ):
+    self.listener = PlainTransport( ( "127.0.0.1", 0 ), bServerMode = True )
+    self.listener.initAsServer()
+    self.address = self.listener.getLocalAddress()
+
+  def run( self, serve, client, credDict = None ):
+    """ Run serve( serverTransport ) against client( clientTransport ), returns both results """
+    results = {}
+    def accept():
+      transport = self.listener.acceptConnection()[ 'Value' ]
+      if credDict:
+        transport.peerCredentials = dict( credDict )
+      try:
+        results[ 'server' ] = serve( transport )
+      finally:
+        transport.close()
+    serverThread = threading.Thread( target = accept )
+    serverThread.setDaemon( 1 )
+    serverThread.start()
+    transport = PlainTransport( self.address, timeout = 30 )
+    transport.initAsClient()
+    try:
+      clientResult = client( transport )
+    finally:
+      transport.close()
+    serverThread.join( 30 )
+    return clientResult, results.get( 'server' )
+
+  def close( self ):
+    self.listener.close()
+
+########################################################################
+class FileHelperTestCase( unittest.TestCase ):
+  """py:class FileHelperTestCase
+  Transfers between two FileHelpers, the receiver answers with a final result
+  """
+
+  def setUp( self ):
+    self.server = LoopbackServer()
+
+  def tearDown( self ):
+    self.server.close()
+
+  def newHelper( self, transport, direction, windowSize ):
+    fileHelper = FileHelper( transport )
+    fileHelper.setDirection( direction )
+    fileHelper.setWindowSize( windowSize )
+    fileHelper.setPacketSize( CHUNK )
+    return fileHelper
+
+  def send( self, data, windowSize, receive ):
+    """ Send data from the client, receive( fileHelper ) is the server side,
+        returns the sending result, the final message and the server result
+    """
+    def serve( transport ):
+      result = receive( self.newHelper( transport, "fromClient", windowSize ) )
+      transport.sendData( result )
+      return result
+    def client( transport ):
+      result = self.newHelper( transport, "send", windowSize ).BufferToNetwork( data )
+      return result, transport.receiveData()
+    ( sendResult, finalResult ), serverResult = self.server.run( serve, client )
+    return sendResult, finalResult, serverResult
+
+  def testWindow( self ):
+    """ chunks in flight are all received and checked """
+    for windowSize in ( 1, 8 ):
+      sendResult, finalResult, serverResult = self.send( DATA, windowSize, lambda fileHelper : fileHelper.networkToString() )
+      self.assert_( sendResult[ 'OK' ] )
+      self.assertEqual( serverResult, S_OK( DATA ) )
+      self.assertEqual( finalResult[ 'Value' ], DATA )
+
+  def testSizeLimit( self ):
+    """ the sender stops and both sides get the final result after the size limit """
+    for windowSize in ( 1, 8 ):
+      receive = lambda fileHelper : fileHelper.networkToDataSink( cStringIO.StringIO(), maxFileSize = CHUNK * 3 )
+      sendResult, finalResult, serverResult = self.send( DATA, windowSize, receive )
+      self.failIf( sendResult[ 'OK' ] )
+      self.assertEqual( sendResult[ 'Message' ], "Exceeded maximum file size" )
+      self.failIf( serverResult[ 'OK' ] )
+      self.assertEqual( finalResult, serverResult )
+
+  def testReceiverAbort( self ):
+    """ markAsTransferred on the receiving side stops the sender """
+    def receive( fileHelper ):
+      fileHelper.markAsTransferred()
+      return S_OK( fileHelper.finishedTransmission() )
+    for windowSize in ( 1, 8 ):
+      for data in ( DATA, DATA[:100], "" ):
+        sendResult, finalResult, serverResult = self.send( data, windowSize, receive )
+        self.assert_( sendResult[ 'OK' ] )
+        self.assertEqual( finalResult, S_OK( True ) )
+
+  def testSenderAbort( self ):
+    """ markAsTransferred on the sending side ends the transfer, with chunks in flight or none """
+    for windowSize in ( 1, 8 ):
+      for chunks in ( 0, 3 ):
+        def serve( transport ):
+          fileHelper = self.newHelper( transport, "toClient", windowSize )
+          for i in range( chunks ):
+            fileHelper.sendData( DATA[ i * CHUNK : ( i + 1 ) * CHUNK ] )
+          fileHelper.markAsTransferred()
+          return transport.sendData( S_OK( "Done" ) )
+        def client( transport ):
+          result = self.newHelper( transport, "receive", windowSize ).networkToString()
+          return result, transport.receiveData()
+        ( receiveResult, finalResult ), serverResult = self.server.run( serve, client )
+        self.assertEqual( receiveResult, S_OK( DATA[ : chunks * CHUNK ] ) )
+        self.assertEqual( finalResult, S_OK( "Done" ) )
+
+########################################################################
+class TransferHandler( RequestHandler ):
+  """ Receives into memory and sends DATA, recording the window of each transfer """
+
+  windows = []
+  received = []
+
+  def transfer_fromClient( self, fileId, token, fileSize, fileHelper ):
+    TransferHandler.windows.append( fileHelper.windowSize )
+    result = fileHelper.networkToString()
+    if not result[ 'OK' ]:
+      return result
+    TransferHandler.received.append( result[ 'Value' ] )
+    return S_OK( len( result[ 'Value' ] ) )
+
+  def transfer_toClient( self, fileId, token, fileHelper ):
+    TransferHandler.windows.append( fileHelper.windowSize )
+    return fileHelper.BufferToNetwork( DATA )
+
+class NegotiationTestCase( unittest.TestCase ):
+  """py:class NegotiationTestCase
+  Window proposed in the transfer header by the TransferClient and accepted by the RequestHandler
+  """
+
+  def setUp( self ):
+    self.server = LoopbackServer()
+    TransferHandler.windows = []
+    TransferHandler.received = []
+    gConfig.setOptionValue( "%s/TransferWindow" % CS_PATH, "4" )
+    gConfig.setOptionValue( "%s/TransferChunkSize" % CS_PATH, str( CHUNK ) )
+    fd, self.filePath = tempfile.mkstemp()
+    os.write( fd, DATA )
+    os.close( fd )
+
+  def tearDown( self ):
+    self.server.close()
+    os.unlink( self.filePath )
+
+  def testNegotiation( self ):
+    """ the server caps the proposed window, both sides use the accepted one """
+    serve = lambda transport : serveTransfer( TransferHandler, transport, "FromClient" )
+    for proposed, accepted in ( ( 32, 4 ), ( 2, 2 ), ( 0, 1 ), ( "x", 1 ) ):
+      client = LoopbackTransferClient( None, transferWindow = proposed, transferChunkSize = CHUNK )
+      def send( transport ):
+        client.transport = transport
+        return client.sendFile( self.filePath, "file" )
+      result = self.server.run( serve, send )[0]
+      self.assertEqual( result, S_OK( len( DATA ) ) )
+      self.assertEqual( client.fileHelpers[-1].windowSize, accepted )
+      self.assertEqual( TransferHandler.windows[-1], accepted )
+    self.assertEqual( TransferHandler.received, [ DATA ] * 4 )
+    # And the other way
+    client = LoopbackTransferClient( None )
+    sink = cStringIO.StringIO()
+    def receive( transport ):
+      client.transport = transport
+      return client.receiveFile( sink, "file" )
+    serve = lambda transport : serveTransfer( TransferHandler, transport, "ToClient" )
+    self.assert_( self.server.run( serve, receive )[0][ 'OK' ] )
+    self.assertEqual( sink.getvalue(), DATA )
+    self.assertEqual( TransferHandler.windows[-1], 4 )
+
+  def testOldServer( self ):
+    """ servers not answering with a window get a stop-and-wait transfer """
+    client = LoopbackTransferClient( None )
+    def serve( transport ):
+      header = transport.receiveData()
+      transport.sendData( S_OK( "Accepted" ) )
+      fileHelper = FileHelper( transport )
+      fileHelper.setDirection( "fromClient" )
+      result = fileHelper.networkToString()
+      transport.sendData( S_OK( len( result[ 'Value' ] ) ) )
+      return header
+    def send( transport ):
+      client.transport = transport
+      return client.sendFile( self.filePath, "file" )
+    result, header = self.server.run( serve, send )
+    self.assertEqual( result, S_OK( len( DATA ) ) )
+    self.assertEqual( header[ 'TransferWindow' ], 8 )
+    self.assertEqual( client.fileHelpers[-1].windowSize, 1 )
+
+  def testOldClient( self ):
+    """ clients not proposing a window get a stop-and-wait transfer """
+    def send( transport ):
+      transport.sendData( S_OK( ( "file", "", len( DATA ) ) ) )
+      answer = transport.receiveData()
+      result = FileHelper( transport ).BufferToNetwork( DATA )
+      if not result[ 'OK' ]:
+        return answer, result
+      return answer, transport.receiveData()
+    serve = lambda transport : serveTransfer( TransferHandler, transport, "FromClient" )
+    answer, result = self.server.run( serve, send )[0]
+    self.assertEqual( answer, S_OK( "Accepted" ) )
+    self.failIf( 'TransferWindow' in answer )
+    self.assertEqual( result, S_OK( len( DATA ) ) )
+    self.assertEqual( TransferHandler.windows, [ 1 ] )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( FileHelperTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( NegotiationTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
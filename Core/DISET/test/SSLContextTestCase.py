@@ -0,0 +1,161 @@
+########################################################################
+# $HeadURL $
+# File: SSLContextTestCase.py
+########################################################################
+
+""" :mod: SSLContextTestCase
+    =========================
+
+    .. module: SSLContextTestCase
+    :synopsis: test cases for the shared SSL contexts and the resumed SSL sessions of DISET
+
+    A self-signed host certificate, used as the only CA, is generated with the openssl
+    command in a temporary Grid-Security location
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+from DIRAC import gConfig
+from DIRAC.Core.DISET.private.Transports.SSL.SocketInfo import SocketInfo
+from DIRAC.Core.DISET.private.Transports.SSLTransport import SSLTransport
+
+HOST_DN = "/O=DIRAC/CN=localhost"
+
+def makeGridSecurity():
+  """ Grid-Security location with hostcert.pem, hostkey.pem, the CA and a proxy file """
+  path = tempfile.mkdtemp()
+  certPath = os.path.join( path, "hostcert.pem" )
+  keyPath = os.path.join( path, "hostkey.pem" )
+  subprocess.check_call( [ "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+                           "-subj", HOST_DN, "-keyout", keyPath, "-out", certPath ],
+                         stdout = subprocess.PIPE, stderr = subprocess.PIPE )
+  os.chmod( keyPath, 0400 )
+  certHash = subprocess.Popen( [ "openssl", "x509", "-hash", "-noout", "-in", certPath ],
+                               stdout = subprocess.PIPE ).communicate()[0].strip()
+  os.mkdir( os.path.join( path, "certificates" ) )
+  shutil.copy( certPath, os.path.join( path, "certificates", "%s.0" % certHash ) )
+  proxyFile = file( os.path.join( path, "proxy.pem" ), "w" )
+  for filePath in ( certPath, keyPath ):
+    proxyFile.write( file( filePath ).read() )
+  proxyFile.close()
+  gConfig.setOptionValue( "/DIRAC/Security/Grid-Security", path )
+  return path
+
+def resetSharedContexts():
+  SocketInfo._SocketInfo__cachedContexts.purgeAll()
+  SocketInfo._SocketInfo__cachedCAsCRLs = False
+
+########################################################################
+class ContextCacheTestCase( unittest.TestCase ):
+  """py:class ContextCacheTestCase
+  Contexts shared by the connections with the same credentials, options and CAs
+  """
+
+  def setUp( self ):
+    self.path = makeGridSecurity()
+    self.proxyPath = os.path.join( self.path, "proxy.pem" )
+    resetSharedContexts()
+
+  def tearDown( self ):
+    shutil.rmtree( self.path )
+    resetSharedContexts()
+
+  def getContext( self, **kwargs ):
+    infoDict = { 'clientMode' : True, 'hostname' : 'localhost', 'timeout' : 10,
+                 'proxyLocation' : self.proxyPath }
+    infoDict.update( kwargs )
+    return SocketInfo( infoDict ).getSSLContext()
+
+  def testSameKey( self ):
+    """ the same credentials and options get the same context """
+    context = self.getContext()
+    self.assert_( self.getContext() is context )
+    self.assert_( self.getContext( timeout = 20 ) is context )
+    self.failIf( self.getContext( skipCACheck = True ) is context )
+    self.failIf( self.getContext( useCertificates = True ) is context )
+
+  def testRenewedProxy( self ):
+    """ a renewed proxy file gets a new context """
+    context = self.getContext()
+    proxyFile = file( self.proxyPath, "a" )
+    proxyFile.write( "\n" )
+    proxyFile.close()
+    newContext = self.getContext()
+    self.failIf( newContext is context )
+    self.assert_( self.getContext() is newContext )
+
+  def testCAsChange( self ):
+    """ the contexts are dropped when the CAs change """
+    context = self.getContext()
+    serverContext = SocketInfo( { 'clientMode' : False, 'timeout' : 10 } ).getSSLContext()
+    # Checked again after the check interval only
+    SocketInfo._SocketInfo__cachedCAsCRLsLastChecked = 0
+    self.assert_( self.getContext() is context )
+    shutil.copy( os.path.join( self.path, "hostcert.pem" ), os.path.join( self.path, "certificates", "new.0" ) )
+    self.assert_( self.getContext() is context )
+    SocketInfo._SocketInfo__cachedCAsCRLsLastChecked = 0
+    self.failIf( self.getContext() is context )
+    self.failIf( SocketInfo( { 'clientMode' : False, 'timeout' : 10 } ).getSSLContext() is serverContext )
+
+########################################################################
+class SessionResumptionTestCase( unittest.TestCase ):
+  """py:class SessionResumptionTestCase
+  SSL connections over the loopback interface
+  """
+
+  def setUp( self ):
+    self.path = makeGridSecurity()
+    resetSharedContexts()
+    self.server = SSLTransport( ( "127.0.0.1", 19881 ), bServerMode = True )
+    self.assert_( self.server.initAsServer()[ 'OK' ] )
+
+  def tearDown( self ):
+    self.server.close()
+    shutil.rmtree( self.path )
+    resetSharedContexts()
+
+  def connect( self ):
+    """ Connect a client, returns the client transport, the server side one and the server handshake """
+    serverSide = {}
+    def accept():
+      transport = self.server.acceptConnection()[ 'Value' ]
+      serverSide[ 'transport' ] = transport
+      serverSide[ 'handshake' ] = transport.handshake()
+    acceptThread = threading.Thread( target = accept )
+    acceptThread.start()
+    client = SSLTransport( ( "localhost", 19881 ), useCertificates = True )
+    result = client.initAsClient()
+    acceptThread.join( 30 )
+    self.assert_( result[ 'OK' ] )
+    self.assert_( serverSide[ 'handshake' ][ 'OK' ] )
+    return client, serverSide[ 'transport' ]
+
+  def testResume( self ):
+    """ the second connection resumes the session, both sides still get the peer credentials """
+    for reused in ( False, True ):
+      client, serverSide = self.connect()
+      try:
+        self.assertEqual( bool( client.oSocket.session_reused() ), reused )
+        self.assertEqual( bool( serverSide.oSocket.session_reused() ), reused )
+        credDict = serverSide.getConnectingCredentials()
+        self.assertEqual( credDict[ 'DN' ], HOST_DN )
+        self.assertEqual( credDict[ 'CN' ], "localhost" )
+        self.assertEqual( credDict[ 'isProxy' ], False )
+        self.assertEqual( client.oSocketInfo.infoDict[ 'peerCredentials' ][ 'DN' ], HOST_DN )
+      finally:
+        client.close()
+        serverSide.close()
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ContextCacheTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( SessionResumptionTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,78 @@
+########################################################################
+# $HeadURL $
+# File: TransportBenchmark.py
+########################################################################
+
+""" :mod: TransportBenchmark
+    =======================
+
+    .. module: TransportBenchmark
+    :synopsis: throughput and memory of DISET messages over PlainTransport
+
+    Run it with python TransportBenchmark.py [ size in MB ... ]
+    Each message is received in a forked process to measure its peak RSS
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import sys
+import time
+import resource
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+MB = 1048576
+
+def receiveMessage( serverTransport, resultPipe ):
+  """ accept one connection, receive one message and report time and memory """
+  initialRSS = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+  clientTransport = serverTransport.acceptConnection()[ 'Value' ]
+  start = time.time()
+  result = clientTransport.receiveData()
+  elapsed = time.time() - start
+  peakRSS = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+  if not result[ 'OK' ]:
+    os.write( resultPipe, "ERROR %s" % result[ 'Message' ] )
+  else:
+    os.write( resultPipe, "%s %s %s" % ( elapsed, initialRSS, peakRSS ) )
+  clientTransport.close()
+
+def benchmark( sizes, port = 19877 ):
+  serverTransport = PlainTransport( ( "", port ), bServerMode = True )
+  serverTransport.initAsServer()
+  print "%8s | %9s %10s | %14s" % ( "size MB", "time", "MB/s", "extra RSS MB" )
+  for sizeMB in sizes:
+    payload = { 'OK' : True, 'Value' : "x" * ( sizeMB * MB ) }
+    readPipe, writePipe = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      #Receiving process
+      receiveMessage( serverTransport, writePipe )
+      os._exit( 0 )
+    clientTransport = PlainTransport( ( "localhost", port ) )
+    clientTransport.initAsClient()
+    result = clientTransport.sendData( payload )
+    del( payload )
+    if not result[ 'OK' ]:
+      print "Cannot send: %s" % result[ 'Message' ]
+    os.waitpid( pid, 0 )
+    clientTransport.close()
+    fields = os.read( readPipe, 1024 ).split()
+    os.close( readPipe )
+    os.close( writePipe )
+    if fields[0] == "ERROR":
+      print "%8s | %s" % ( sizeMB, " ".join( fields ) )
+      continue
+    elapsed, initialRSS, peakRSS = float( fields[0] ), int( fields[1] ), int( fields[2] )
+    #ru_maxrss is in KB. The received message itself accounts for sizeMB
+    print "%8s | %8.3fs %10.1f | %14.1f" % ( sizeMB, elapsed, sizeMB / max( elapsed, 0.000001 ),
+                                              ( peakRSS - initialRSS ) / 1024. - sizeMB )
+  serverTransport.close()
+
+if __name__ == "__main__":
+  if len( sys.argv ) > 1:
+    sizes = [ int( size ) for size in sys.argv[1:] ]
+  else:
+    sizes = [ 1, 10, 100, 500 ]
+  benchmark( sizes )
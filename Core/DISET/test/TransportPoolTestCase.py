@@ -0,0 +1,161 @@
+########################################################################
+# $HeadURL $
+# File: TransportPoolTestCase.py
+########################################################################
+
+""" :mod: TransportPoolTestCase
+    ============================
+
+    .. module: TransportPoolTestCase
+    :synopsis: test cases for the reuse of DISET client connections
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import unittest
+from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.TransportPool import TransportPool
+from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+
+########################################################################
+class TransportPoolTestCase( unittest.TestCase ):
+  """py:class TransportPoolTestCase
+  Idle connections over the loopback interface
+  """
+
+  def setUp( self ):
+    self.server = PlainTransport( ( "", 19880 ), bServerMode = True )
+    self.server.initAsServer()
+    self.pool = TransportPool()
+    self.serverSide = []
+
+  def tearDown( self ):
+    for transport in self.serverSide:
+      transport.close()
+    self.server.close()
+
+  def connect( self ):
+    client = PlainTransport( ( "localhost", 19880 ) )
+    client.initAsClient()
+    self.serverSide.append( self.server.acceptConnection()[ 'Value' ] )
+    return self.pool.add( client )
+
+  def purge( self ):
+    self.pool._TransportPool__purgeIdleTransports()
+
+  def testReuse( self ):
+    """ an idle connection is given back once for its key only """
+    trid = self.connect()
+    self.assert_( self.pool.setIdleTransport( "key", trid )[ 'OK' ] )
+    self.failIf( self.pool.getIdleTransport( "other" ) )
+    self.purge()
+    self.assertEqual( self.pool.getIdleTransport( "key" ), trid )
+    self.failIf( self.pool.getIdleTransport( "key" ) )
+    self.assert_( self.pool.exists( trid ) )
+
+  def testEviction( self ):
+    """ idle connections closed by the server, with unexpected data or too old are closed """
+    closedTrid = self.connect()
+    dataTrid = self.connect()
+    oldTrid = self.connect()
+    for trid in ( closedTrid, dataTrid, oldTrid ):
+      self.pool.setIdleTransport( "key", trid )
+    self.serverSide[0].close()
+    self.serverSide[1].sendData( S_OK() )
+    self.pool.iIdleLifeTime = 1
+    self.pool._TransportPool__idleTransports[ "key" ][2] = ( oldTrid, time.time() - 2 )
+    time.sleep( 0.1 )
+    self.purge()
+    for trid in ( closedTrid, dataTrid, oldTrid ):
+      self.failIf( self.pool.exists( trid ) )
+    self.failIf( self.pool.getIdleTransport( "key" ) )
+
+  def testPendingData( self ):
+    """ data already buffered in the transport counts as readable """
+    trid = self.connect()
+    self.pool.setIdleTransport( "key", trid )
+    self.pool.get( trid ).byteStream = "3:"
+    self.purge()
+    self.failIf( self.pool.exists( trid ) )
+
+########################################################################
+class FakeTransport:
+
+  def __init__( self, reply, failed ):
+    self.reply = reply
+    self.failed = failed
+
+  def sendData( self, data ):
+    return S_OK()
+
+  def receiveData( self ):
+    return dict( self.reply )
+
+  def lastReceiveFailed( self ):
+    return self.failed
+
+class FakeRPCClient( InnerRPCClient ):
+
+  def __init__( self, transport ):
+    self.transport = transport
+    self.disconnected = []
+
+  def _getBaseStub( self ):
+    return ( "Framework/Fake", {} )
+
+  def _reuseConnections( self ):
+    return True
+
+  def _connect( self, reuse = False ):
+    return S_OK( ( "trid", self.transport ) )
+
+  def _proposeAction( self, transport, action, keepConnected = False ):
+    result = S_OK()
+    result[ 'keepConnected' ] = keepConnected
+    return result
+
+  def _disconnect( self, trid, keepConnected = False ):
+    self.disconnected.append( keepConnected )
+
+class InnerRPCClientTestCase( unittest.TestCase ):
+  """py:class InnerRPCClientTestCase
+  Which RPC results keep the connection
+  """
+
+  def testKeepConnected( self ):
+    """ service errors keep the connection, transport errors close it """
+    for reply, failed, kept in ( ( S_OK( 1 ), False, True ),
+                                 ( S_ERROR( "No such file" ), False, True ),
+                                 ( S_ERROR( "Peer closed connection" ), True, False ) ):
+      client = FakeRPCClient( FakeTransport( reply, failed ) )
+      result = client.executeRPC( "ping", () )
+      self.assertEqual( result[ 'OK' ], reply[ 'OK' ] )
+      self.assertEqual( client.disconnected, [ kept ] )
+
+  def testLastReceiveFailed( self ):
+    """ the transport tells decoded errors from failures """
+    server = PlainTransport( ( "", 19881 ), bServerMode = True )
+    server.initAsServer()
+    client = PlainTransport( ( "localhost", 19881 ) )
+    client.initAsClient()
+    serverSide = server.acceptConnection()[ 'Value' ]
+    try:
+      serverSide.sendData( S_ERROR( "No such file" ) )
+      self.failIf( client.receiveData()[ 'OK' ] )
+      self.failIf( client.lastReceiveFailed() )
+      serverSide.close()
+      self.failIf( client.receiveData()[ 'OK' ] )
+      self.assert_( client.lastReceiveFailed() )
+    finally:
+      client.close()
+      server.close()
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( TransportPoolTestCase )
+  SUITE.addTest( TESTLOADER.loadTestsFromTestCase( InnerRPCClientTestCase ) )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
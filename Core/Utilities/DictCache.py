@@ -3,17 +3,115 @@ __RCSID__ = "$Id$"
 
 import threading
 import datetime
+import time
+import heapq
+import itertools
+import collections
+
+class _ListOrderedDict( dict ):
+  """
+  Dict keeping the keys in insertion order for Python versions without OrderedDict.
+  The order is kept in a list, deleting a key is linear in the size of the dict
+  """
+
+  def __init__( self ):
+    dict.__init__( self )
+    self.__keys = []
+
+  def __setitem__( self, key, value ):
+    if key not in self:
+      self.__keys.append( key )
+    dict.__setitem__( self, key, value )
+
+  def __delitem__( self, key ):
+    dict.__delitem__( self, key )
+    self.__keys.remove( key )
+
+  def pop( self, key ):
+    value = dict.pop( self, key )
+    self.__keys.remove( key )
+    return value
+
+  def __iter__( self ):
+    return iter( self.__keys )
+
+  def keys( self ):
+    return list( self.__keys )
+
+  def items( self ):
+    return [ ( key, dict.__getitem__( self, key ) ) for key in self.__keys ]
+
+if 'OrderedDict' in dir( collections ):
+  _OrderedDict = collections.OrderedDict
+else:
+  _OrderedDict = _ListOrderedDict
 
 class DictCache:
 
-  def __init__( self, deleteFunction = False ):
+  def __init__( self, deleteFunction = False, maxSize = 0 ):
     """
     Initialize the dict cache.
       If a delete function is specified it will be invoked when deleting a cached object
+      If maxSize is specified the least recently used records are evicted when the cache is full
     """
     self.__lock = threading.RLock()
-    self.__cache = {}
+    self.__maxSize = max( 0, maxSize )
+    #cKey -> [ expirationTime, value, sequence ]
+    if self.__maxSize:
+      self.__cache = _OrderedDict()
+    else:
+      self.__cache = {}
+    #Time wheel with one second slots: slot -> [ ( sequence, cKey ) ] for every add.
+    #Stale entries of deleted or added again keys are skipped when purging
+    self.__wheel = {}
+    self.__wheelSlots = []
+    self.__wheelEntries = 0
+    self.__sequence = itertools.count()
     self.__deleteFunction = deleteFunction
+    self.__hits = 0
+    self.__misses = 0
+    self.__evictions = 0
+    self.__expirations = 0
+
+  def __lookup( self, cKey, validSeconds ):
+    """
+    Get the record for the key if it is valid for validSeconds, None otherwise.
+    Valid records are found without locking, unless the LRU order has to be updated
+    """
+    record = self.__cache.get( cKey )
+    if record is None:
+      self.__misses += 1
+      return None
+    if record[0] > time.time() + validSeconds:
+      self.__hits += 1
+      if self.__maxSize:
+        self.__touch( cKey, record )
+      return record
+    self.__misses += 1
+    #Delete expired
+    self.__lock.acquire()
+    try:
+      if self.__cache.get( cKey ) is record:
+        self.__expirations += 1
+        self.__delete( cKey )
+    finally:
+      self.__lock.release()
+    return None
+
+  def __touch( self, cKey, record ):
+    self.__lock.acquire()
+    try:
+      if self.__cache.get( cKey ) is record:
+        del( self.__cache[ cKey ] )
+        self.__cache[ cKey ] = record
+    finally:
+      self.__lock.release()
+
+  def __delete( self, cKey ):
+    """ Delete a record, the lock has to be held """
+    record = self.__cache.pop( cKey )
+    if self.__deleteFunction:
+      self.__deleteFunction( record[1] )
 
   def exists( self, cKey, validSeconds = 0 ):
     """
@@ -22,20 +120,7 @@ class DictCache:
         - cKey : identification key of the record
         - validSeconds : The amount of seconds the key has to be valid for
     """
-    self.__lock.acquire()
-    try:
-      #Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[ cKey ][ 'expirationTime' ]
-        #If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ):
-          return True
-        else:
-          #Delete expired
-          self.delete( cKey )
-      return False
-    finally:
-      self.__lock.release()
+    return self.__lookup( cKey, validSeconds ) is not None
 
   def delete( self, cKey ):
     """
@@ -47,9 +132,7 @@ class DictCache:
     try:
       if cKey not in self.__cache:
         return
-      if self.__deleteFunction:
-        self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-      del( self.__cache[ cKey ] )
+      self.__delete( cKey )
     finally:
       self.__lock.release()
 
@@ -63,14 +146,43 @@ class DictCache:
     """
     if max( 0, validSeconds ) == 0:
       return
+    expirationTime = time.time() + validSeconds
     self.__lock.acquire()
     try:
-      vD = { 'expirationTime' : datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ),
-             'value' : value }
-      self.__cache[ cKey ] = vD
+      sequence = self.__sequence.next()
+      if self.__maxSize and cKey in self.__cache:
+        #Move it to the most recently used end
+        del( self.__cache[ cKey ] )
+      self.__cache[ cKey ] = [ expirationTime, value, sequence ]
+      self.__addToWheel( expirationTime, sequence, cKey )
+      if self.__maxSize:
+        while len( self.__cache ) > self.__maxSize:
+          lruKey = iter( self.__cache ).next()
+          self.__evictions += 1
+          self.__delete( lruKey )
+      #Too many stale entries in the wheel
+      if self.__wheelEntries > 2 * len( self.__cache ) + 1024:
+        self.__rebuildWheel()
     finally:
       self.__lock.release()
 
+  def __addToWheel( self, expirationTime, sequence, cKey ):
+    slot = int( expirationTime )
+    bucket = self.__wheel.get( slot )
+    if bucket is None:
+      self.__wheel[ slot ] = [ ( sequence, cKey ) ]
+      heapq.heappush( self.__wheelSlots, slot )
+    else:
+      bucket.append( ( sequence, cKey ) )
+    self.__wheelEntries += 1
+
+  def __rebuildWheel( self ):
+    self.__wheel = {}
+    self.__wheelSlots = []
+    self.__wheelEntries = 0
+    for cKey, record in self.__cache.items():
+      self.__addToWheel( record[0], record[2], cKey )
+
   def get( self, cKey, validSeconds = 0 ):
     """
     Get a record from the cache
@@ -78,20 +190,10 @@ class DictCache:
         - cKey : identification key of the record
         - validSeconds : The amount of seconds the key has to be valid for
     """
-    self.__lock.acquire()
-    try:
-      #Is the key in the cache?
-      if cKey in self.__cache:
-        expTime = self.__cache[ cKey ][ 'expirationTime' ]
-        #If it's valid return True!
-        if expTime > datetime.datetime.now() + datetime.timedelta( seconds = validSeconds ):
-          return self.__cache[ cKey ][ 'value' ]
-        else:
-          #Delete expired
-          self.delete( cKey )
+    record = self.__lookup( cKey, validSeconds )
+    if record is None:
       return False
-    finally:
-      self.__lock.release()
+    return record[1]
 
   def showContentsInString( self ):
     """
@@ -101,10 +203,11 @@ class DictCache:
     try:
       data = []
       for cKey in self.__cache:
+        record = self.__cache[ cKey ]
         data.append( "%s:" % str( cKey ) )
-        data.append( "\tExp: %s" % self.__cache[ cKey ][ 'expirationTime' ] )
-        if self.__cache[ cKey ][ 'value' ]:
-          data.append( "\tVal: %s" % self.__cache[ cKey ][ 'value' ] )
+        data.append( "\tExp: %s" % datetime.datetime.fromtimestamp( record[0] ) )
+        if record[1]:
+          data.append( "\tVal: %s" % record[1] )
       return "\n".join( data )
     finally:
       self.__lock.release()
@@ -115,12 +218,8 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta( seconds = validSeconds )
-      for cKey in self.__cache:
-        if self.__cache[ cKey ][ 'expirationTime' ] > limitTime:
-          keys.append( cKey )
-      return keys
+      limitTime = time.time() + validSeconds
+      return [ cKey for cKey, record in self.__cache.items() if record[0] > limitTime ]
     finally:
       self.__lock.release()
 
@@ -130,15 +229,36 @@ class DictCache:
     """
     self.__lock.acquire()
     try:
-      keys = []
-      limitTime = datetime.datetime.now() + datetime.timedelta( seconds = expiredInSeconds )
-      for cKey in self.__cache:
-        if self.__cache[ cKey ][ 'expirationTime' ] < limitTime:
-          keys.append( cKey )
-      for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-        del( self.__cache[ cKey ] )
+      limitTime = time.time() + expiredInSeconds
+      slots = self.__wheelSlots
+      cache = self.__cache
+      deleteFunction = self.__deleteFunction
+      while slots and slots[0] < limitTime:
+        slot = slots[0]
+        bucket = self.__wheel[ slot ]
+        #The last slot may have records expiring after the limit
+        lastSlot = slot + 1 > limitTime
+        pending = []
+        expired = 0
+        for entry in bucket:
+          record = cache.get( entry[1] )
+          #The key may have been deleted or added again since
+          if record is None or record[2] != entry[0]:
+            continue
+          if lastSlot and record[0] >= limitTime:
+            pending.append( entry )
+            continue
+          del( cache[ entry[1] ] )
+          expired += 1
+          if deleteFunction:
+            deleteFunction( record[1] )
+        self.__expirations += expired
+        self.__wheelEntries -= len( bucket ) - len( pending )
+        if lastSlot and pending:
+          self.__wheel[ slot ] = pending
+          break
+        heapq.heappop( slots )
+        del( self.__wheel[ slot ] )
     finally:
       self.__lock.release()
 
@@ -150,8 +270,21 @@ class DictCache:
     try:
       keys = self.__cache.keys()
       for cKey in keys:
-        if self.__deleteFunction:
-          self.__deleteFunction( self.__cache[ cKey ][ 'value' ] )
-        del( self.__cache[ cKey ] )
+        self.__delete( cKey )
+      self.__wheel = {}
+      self.__wheelSlots = []
+      self.__wheelEntries = 0
     finally:
       self.__lock.release()
+
+  def getStats( self ):
+    """
+    Get the cache counters. Hits and misses are counted without locking,
+    they can miss a few events under heavy concurrency
+    """
+    return { 'size' : len( self.__cache ),
+             'maxSize' : self.__maxSize,
+             'hits' : self.__hits,
+             'misses' : self.__misses,
+             'evictions' : self.__evictions,
+             'expirations' : self.__expirations }
@@ -0,0 +1,589 @@
+# $HeadURL$
+"""
+Alternative DEncode engine producing byte-identical output to DEncode.
+
+Differences with DEncode:
+ - encode dispatches containers and atoms through a type table bound once,
+   emitting as few fragments as possible
+ - decode works on offsets of the received buffer ( no slicing of the message
+   before decoding ) and does not recurse for containers
+ - StreamDecoder decodes messages incrementally while the chunks arrive
+"""
+__RCSID__ = "$Id$"
+
+import types
+import datetime
+
+_dateTimeType = datetime.datetime
+_dateType = datetime.date
+_timeType = datetime.time
+
+_intType = types.IntType
+_longType = types.LongType
+_floatType = types.FloatType
+_boolType = types.BooleanType
+_strType = types.StringType
+_unicodeType = types.UnicodeType
+_noneType = types.NoneType
+_listType = types.ListType
+_tupleType = types.TupleType
+_dictType = types.DictType
+
+#
+# Encoding
+#
+
+def _encodeInt( iValue, eList ):
+  eList.extend( ( "i", str( iValue ), "e" ) )
+
+def _encodeLong( iValue, eList ):
+  eList.extend( ( "I", str( iValue ), "e" ) )
+
+def _encodeFloat( fValue, eList ):
+  eList.extend( ( "f", str( fValue ), "e" ) )
+
+def _encodeBool( bValue, eList ):
+  if bValue:
+    eList.append( "b1" )
+  else:
+    eList.append( "b0" )
+
+def _encodeString( sValue, eList ):
+  eList.extend( ( "s", str( len( sValue ) ), ":", sValue ) )
+
+def _encodeUnicode( sValue, eList ):
+  valueStr = sValue.encode( 'utf-8' )
+  eList.extend( ( "u", str( len( valueStr ) ), ":", valueStr ) )
+
+def _encodeNone( oValue, eList ):
+  eList.append( "n" )
+
+def _encodeDateTime( oValue, eList ):
+  oType = type( oValue )
+  if oType == _dateTimeType:
+    if oValue.tzinfo is None:
+      #Most datetimes come from the DB without tzinfo. Avoid building the tuple
+      eList.extend( ( "zati", str( oValue.year ), "ei", str( oValue.month ), "ei", str( oValue.day ),
+                      "ei", str( oValue.hour ), "ei", str( oValue.minute ), "ei", str( oValue.second ),
+                      "ei", str( oValue.microsecond ), "ene" ) )
+      return
+    eList.append( "za" )
+    _encodeTuple( ( oValue.year, oValue.month, oValue.day,
+                    oValue.hour, oValue.minute, oValue.second,
+                    oValue.microsecond, oValue.tzinfo ), eList )
+  elif oType == _dateType:
+    eList.append( "zd" )
+    _encodeTuple( ( oValue.year, oValue.month, oValue.day ), eList )
+  elif oType == _timeType:
+    eList.append( "zt" )
+    _encodeTuple( ( oValue.hour, oValue.minute, oValue.second, oValue.microsecond, oValue.tzinfo ), eList )
+  else:
+    raise Exception( "Unexpected type %s while encoding a datetime object" % str( oType ) )
+
+def _encodeSequence( marker, lValue, eList ):
+  append = eList.append
+  extend = eList.extend
+  append( marker )
+  for uObject in lValue:
+    oType = type( uObject )
+    #Inline the most common atoms to save a function call per element
+    if oType == _strType:
+      extend( ( "s", str( len( uObject ) ), ":", uObject ) )
+    elif oType == _intType:
+      extend( ( "i", str( uObject ), "e" ) )
+    else:
+      g_encodeFunctions[ oType ]( uObject, eList )
+  append( "e" )
+
+def _encodeList( lValue, eList ):
+  _encodeSequence( "l", lValue, eList )
+
+def _encodeTuple( tValue, eList ):
+  _encodeSequence( "t", tValue, eList )
+
+def _encodeDict( dValue, eList ):
+  append = eList.append
+  extend = eList.extend
+  append( "d" )
+  for key in sorted( dValue ):
+    kType = type( key )
+    if kType == _strType:
+      extend( ( "s", str( len( key ) ), ":", key ) )
+    else:
+      g_encodeFunctions[ kType ]( key, eList )
+    uObject = dValue[ key ]
+    oType = type( uObject )
+    if oType == _strType:
+      extend( ( "s", str( len( uObject ) ), ":", uObject ) )
+    elif oType == _intType:
+      extend( ( "i", str( uObject ), "e" ) )
+    else:
+      g_encodeFunctions[ oType ]( uObject, eList )
+  append( "e" )
+
+g_encodeFunctions = { _intType : _encodeInt,
+                      _longType : _encodeLong,
+                      _floatType : _encodeFloat,
+                      _boolType : _encodeBool,
+                      _strType : _encodeString,
+                      _unicodeType : _encodeUnicode,
+                      _noneType : _encodeNone,
+                      _dateTimeType : _encodeDateTime,
+                      _dateType : _encodeDateTime,
+                      _timeType : _encodeDateTime,
+                      _listType : _encodeList,
+                      _tupleType : _encodeTuple,
+                      _dictType : _encodeDict }
+
+def encode( uObject ):
+  """
+  Encode an object. Same output as DEncode.encode
+  """
+  eList = []
+  g_encodeFunctions[ type( uObject ) ]( uObject, eList )
+  return "".join( eList )
+
+#
+# Decoding
+#
+
+class IncompleteData( Exception ):
+  """
+  Raised internally when the data ends in the middle of a value
+  """
+  def __init__( self, position, required = 0, valueStart = 0 ):
+    Exception.__init__( self, "Incomplete data at position %s" % position )
+    self.position = position
+    #Total length the data needs to have to decode the value ( 0 if unknown )
+    self.required = required
+    #Where the contents of an incomplete string start
+    self.valueStart = valueStart
+
+def _decodeNumber( data, i, dataLen, final, castFunc ):
+  end = data.find( "e", i + 1 )
+  if end == -1:
+    raise IncompleteData( i )
+  return ( castFunc( data[ i + 1 : end ] ), end + 1 )
+
+def _decodeInt( data, i, dataLen, final ):
+  return _decodeNumber( data, i, dataLen, final, int )
+
+def _decodeLong( data, i, dataLen, final ):
+  return _decodeNumber( data, i, dataLen, final, long )
+
+def _decodeFloat( data, i, dataLen, final ):
+  end = data.find( "e", i + 1 )
+  if end == -1:
+    raise IncompleteData( i )
+  if end + 1 >= dataLen:
+    if not final:
+      #Can't know yet if the e is the end or the exponent
+      raise IncompleteData( i, end + 2 )
+  elif data[ end + 1 ] in ( "+", "-" ):
+    eI = end
+    end = data.find( "e", eI + 1 )
+    if end == -1:
+      raise IncompleteData( i )
+    return ( float( data[ i + 1 : eI ] ) * 10 ** int( data[ eI + 1 : end ] ), end + 1 )
+  return ( float( data[ i + 1 : end ] ), end + 1 )
+
+def _decodeBool( data, i, dataLen, final ):
+  if i + 1 >= dataLen:
+    raise IncompleteData( i, i + 2 )
+  return ( data[ i + 1 ] != "0", i + 2 )
+
+def _decodeString( data, i, dataLen, final ):
+  colon = data.find( ":", i + 1 )
+  if colon == -1:
+    raise IncompleteData( i )
+  colon += 1
+  end = colon + int( data[ i + 1 : colon - 1 ] )
+  if end > dataLen:
+    raise IncompleteData( i, end, colon )
+  return ( data[ colon : end ], end )
+
+def _decodeUnicode( data, i, dataLen, final ):
+  value, end = _decodeString( data, i, dataLen, final )
+  return ( unicode( value, 'utf-8' ), end )
+
+def _decodeNone( data, i, dataLen, final ):
+  return ( None, i + 1 )
+
+g_decodeFunctions = { "i" : _decodeInt,
+                      "I" : _decodeLong,
+                      "f" : _decodeFloat,
+                      "b" : _decodeBool,
+                      "s" : _decodeString,
+                      "u" : _decodeUnicode,
+                      "n" : _decodeNone }
+
+#Container markers. The datetime marker holds the tuple that follows it
+_containerMarkers = ( "l", "t", "d", "z" )
+_noKey = object()
+
+def _buildDateTime( dtType, tupleObject ):
+  if dtType == 'a':
+    return datetime.datetime( *tupleObject )
+  elif dtType == 'd':
+    return datetime.date( *tupleObject )
+  elif dtType == 't':
+    return datetime.time( *tupleObject )
+  raise Exception( "Unexpected type %s while decoding a datetime object" % dtType )
+
+def _decodeFrom( data, i, stack, final ):
+  """
+  Decode from position i on. Containers still open are kept in stack so decoding can
+  be resumed with more data. Returns ( value, end position ). Raises IncompleteData
+  when more data is needed.
+  """
+  dataLen = len( data )
+  decodeFunctions = g_decodeFunctions
+  while True:
+    if i >= dataLen:
+      raise IncompleteData( i, i + 1 )
+    marker = data[ i ]
+    if marker == "s":
+      #Strings are the most common values. Inline them
+      colon = data.find( ":", i + 1 )
+      if colon == -1:
+        raise IncompleteData( i )
+      colon += 1
+      end = colon + int( data[ i + 1 : colon - 1 ] )
+      if end > dataLen:
+        raise IncompleteData( i, end, colon )
+      value = data[ colon : end ]
+      i = end
+    elif marker == "e":
+      if not stack:
+        raise ValueError( "Unexpected end of container at position %s" % i )
+      frame = stack.pop()
+      if frame[0] == "l":
+        value = frame[1]
+      elif frame[0] == "t":
+        value = tuple( frame[1] )
+      elif frame[0] == "d":
+        value = frame[1]
+      else:
+        raise ValueError( "Unexpected end of container at position %s" % i )
+      i += 1
+    elif marker in _containerMarkers:
+      if marker == "d":
+        stack.append( [ marker, {}, _noKey ] )
+      elif marker == "z":
+        if i + 1 >= dataLen:
+          raise IncompleteData( i, i + 2 )
+        stack.append( [ marker, data[ i + 1 ] ] )
+        i += 1
+      else:
+        stack.append( [ marker, [] ] )
+      i += 1
+      continue
+    else:
+      value, i = decodeFunctions[ marker ]( data, i, dataLen, final )
+    complete, value = _attachValue( stack, value )
+    if complete:
+      return ( value, i )
+
+def _attachValue( stack, value ):
+  """
+  Put a decoded value in its container. Returns ( True, value ) if there's no open container
+  """
+  while stack:
+    frame = stack[-1]
+    if frame[0] == "z":
+      stack.pop()
+      value = _buildDateTime( frame[1], value )
+      continue
+    if frame[0] == "d":
+      if frame[2] is _noKey:
+        frame[2] = value
+      else:
+        frame[1][ frame[2] ] = value
+        frame[2] = _noKey
+    else:
+      frame[1].append( value )
+    return ( False, None )
+  return ( True, value )
+
+#
+# Decoding of complete data. Containers decode their common atoms inline
+#
+
+def _fullDecodeInt( data, i ):
+  end = data.index( "e", i + 1 )
+  return ( int( data[ i + 1 : end ] ), end + 1 )
+
+def _fullDecodeLong( data, i ):
+  end = data.index( "e", i + 1 )
+  return ( long( data[ i + 1 : end ] ), end + 1 )
+
+def _fullDecodeFloat( data, i ):
+  end = data.index( "e", i + 1 )
+  if end + 1 < len( data ) and data[ end + 1 ] in ( "+", "-" ):
+    eI = end
+    end = data.index( "e", eI + 1 )
+    return ( float( data[ i + 1 : eI ] ) * 10 ** int( data[ eI + 1 : end ] ), end + 1 )
+  return ( float( data[ i + 1 : end ] ), end + 1 )
+
+def _fullDecodeBool( data, i ):
+  return ( data[ i + 1 ] != "0", i + 2 )
+
+def _fullDecodeString( data, i ):
+  colon = data.index( ":", i + 1 ) + 1
+  end = colon + int( data[ i + 1 : colon - 1 ] )
+  return ( data[ colon : end ], end )
+
+def _fullDecodeUnicode( data, i ):
+  colon = data.index( ":", i + 1 ) + 1
+  end = colon + int( data[ i + 1 : colon - 1 ] )
+  return ( unicode( data[ colon : end ], 'utf-8' ), end )
+
+def _fullDecodeNone( data, i ):
+  return ( None, i + 1 )
+
+def _fullDecodeSequence( data, i ):
+  oL = []
+  append = oL.append
+  index = data.index
+  i += 1
+  while True:
+    marker = data[ i ]
+    if marker == "s":
+      colon = index( ":", i + 1 ) + 1
+      end = colon + int( data[ i + 1 : colon - 1 ] )
+      append( data[ colon : end ] )
+      i = end
+    elif marker == "i":
+      end = index( "e", i + 1 )
+      append( int( data[ i + 1 : end ] ) )
+      i = end + 1
+    elif marker == "n":
+      append( None )
+      i += 1
+    elif marker == "e":
+      return ( oL, i + 1 )
+    else:
+      value, i = g_fullDecodeFunctions[ marker ]( data, i )
+      append( value )
+
+def _fullDecodeTuple( data, i ):
+  oL, i = _fullDecodeSequence( data, i )
+  return ( tuple( oL ), i )
+
+def _fullDecodeDict( data, i ):
+  oD = {}
+  index = data.index
+  i += 1
+  while True:
+    marker = data[ i ]
+    if marker == "s":
+      colon = index( ":", i + 1 ) + 1
+      end = colon + int( data[ i + 1 : colon - 1 ] )
+      key = data[ colon : end ]
+      i = end
+    elif marker == "e":
+      return ( oD, i + 1 )
+    else:
+      key, i = g_fullDecodeFunctions[ marker ]( data, i )
+    marker = data[ i ]
+    if marker == "s":
+      colon = index( ":", i + 1 ) + 1
+      end = colon + int( data[ i + 1 : colon - 1 ] )
+      oD[ key ] = data[ colon : end ]
+      i = end
+    else:
+      oD[ key ], i = g_fullDecodeFunctions[ marker ]( data, i )
+
+def _fullDecodeDateTime( data, i ):
+  if data[ i + 1 : i + 4 ] == "ati":
+    #Datetime without tzinfo: seven ints followed by None
+    values = []
+    index = data.index
+    j = i + 3
+    while data[ j ] == "i":
+      end = index( "e", j + 1 )
+      values.append( int( data[ j + 1 : end ] ) )
+      j = end + 1
+    if data[ j : j + 2 ] == "ne":
+      return ( datetime.datetime( *values ), j + 2 )
+  tupleObject, end = g_fullDecodeFunctions[ data[ i + 2 ] ]( data, i + 2 )
+  return ( _buildDateTime( data[ i + 1 ], tupleObject ), end )
+
+g_fullDecodeFunctions = { "i" : _fullDecodeInt,
+                          "I" : _fullDecodeLong,
+                          "f" : _fullDecodeFloat,
+                          "b" : _fullDecodeBool,
+                          "s" : _fullDecodeString,
+                          "u" : _fullDecodeUnicode,
+                          "n" : _fullDecodeNone,
+                          "l" : _fullDecodeSequence,
+                          "t" : _fullDecodeTuple,
+                          "d" : _fullDecodeDict,
+                          "z" : _fullDecodeDateTime }
+
+class _BufferReader:
+  """
+  Read a memoryview, buffer or bytearray like a string without copying it. Only the
+  decoded values are copied. Searches are done byte by byte: the decoder only looks
+  for the end of numbers and string lengths, a few bytes away
+  """
+
+  def __init__( self, data ):
+    self.view = memoryview( data )
+
+  def __len__( self ):
+    return len( self.view )
+
+  def __getitem__( self, key ):
+    if type( key ) == types.SliceType:
+      return self.view[ key ].tobytes()
+    return self.view[ key ]
+
+  def find( self, sub, start = 0 ):
+    view = self.view
+    for i in xrange( start, len( view ) ):
+      if view[ i ] == sub:
+        return i
+    return -1
+
+  def index( self, sub, start = 0 ):
+    i = self.find( sub, start )
+    if i == -1:
+      raise ValueError( "substring not found" )
+    return i
+
+def decode( data, offset = 0 ):
+  """
+  Decode data starting at offset. Same result as DEncode.decode: ( value, end position )
+  """
+  if not data:
+    return data
+  if type( data ) != _strType:
+    #memoryview, buffer or bytearray
+    data = _BufferReader( data )
+  try:
+    value, end = g_fullDecodeFunctions[ data[ offset ] ]( data, offset )
+  except IndexError:
+    raise ValueError( "Data ended before the encoded object" )
+  if end > len( data ):
+    raise ValueError( "Data ended before the encoded object" )
+  return ( value, end )
+
+class StreamDecoder:
+  """
+  Decode a DEncoded object while it arrives in chunks
+
+  feed() returns False until the whole object has been received.
+  Then it returns a tuple ( object, remaining data after the object ).
+  """
+
+  def __init__( self ):
+    self.__stack = []
+    self.__data = ""
+    self.__pos = 0
+    self.__chunks = []
+    self.__chunksLen = 0
+    self.__required = 0
+    self.__valueStart = 0
+
+  def reset( self ):
+    self.__init__()
+
+  def feed( self, chunk ):
+    if chunk:
+      self.__chunks.append( chunk )
+      self.__chunksLen += len( chunk )
+    #Wait until there's enough data to decode the pending value
+    pendingLen = len( self.__data ) - self.__pos + self.__chunksLen
+    if self.__required and pendingLen < self.__required:
+      return False
+    if self.__valueStart:
+      return self.__joinPendingString()
+    if self.__chunks:
+      self.__chunks.insert( 0, self.__data[ self.__pos: ] )
+      self.__data = "".join( self.__chunks )
+      self.__pos = 0
+      self.__chunks = []
+      self.__chunksLen = 0
+    return self.__decodeBuffered()
+
+  def __joinPendingString( self ):
+    """
+    Build a long string directly from the received chunks, copying its contents only once
+    """
+    marker = self.__data[ self.__pos ]
+    valueLen = self.__required - self.__valueStart
+    parts = [ self.__data[ self.__pos + self.__valueStart: ] ]
+    collected = len( parts[0] )
+    chunks = self.__chunks
+    chunk = None
+    remaining = []
+    for iChunk in range( len( chunks ) ):
+      chunk = chunks[ iChunk ]
+      if collected + len( chunk ) >= valueLen:
+        cut = valueLen - collected
+        parts.append( chunk[ :cut ] )
+        remaining = [ chunk[ cut: ] ] + chunks[ iChunk + 1: ]
+        break
+      parts.append( chunk )
+      collected += len( chunk )
+    #Only parts keeps the received data from now on
+    del( chunks, chunk )
+    self.__data = ""
+    self.__pos = 0
+    self.__chunks = []
+    self.__chunksLen = 0
+    self.__required = 0
+    self.__valueStart = 0
+    value = "".join( parts )
+    del( parts )
+    if marker == "u":
+      value = unicode( value, 'utf-8' )
+    try:
+      complete, value = _attachValue( self.__stack, value )
+    except:
+      self.reset()
+      raise
+    if complete:
+      self.reset()
+      return ( value, "".join( remaining ) )
+    self.__data = "".join( remaining )
+    return self.__decodeBuffered()
+
+  def __decodeBuffered( self ):
+    if self.__pos >= len( self.__data ):
+      return False
+    self.__required = 0
+    self.__valueStart = 0
+    try:
+      value, end = _decodeFrom( self.__data, self.__pos, self.__stack, False )
+    except IncompleteData, excp:
+      self.__pos = excp.position
+      if excp.required:
+        self.__required = excp.required - self.__pos
+      if excp.valueStart:
+        self.__valueStart = excp.valueStart - self.__pos
+      return False
+    except:
+      self.reset()
+      raise
+    remaining = self.__data[ end: ]
+    self.reset()
+    return ( value, remaining )
+
+  def finish( self ):
+    """
+    No more data is coming. Decode the last pending value if possible
+    """
+    result = self.feed( "" )
+    if result:
+      return result
+    if self.__pos >= len( self.__data ) and not self.__stack:
+      return False
+    try:
+      value, end = _decodeFrom( self.__data, self.__pos, self.__stack, True )
+    except IncompleteData:
+      raise ValueError( "Data ended before the encoded object" )
+    remaining = self.__data[ end: ]
+    self.reset()
+    return ( value, remaining )
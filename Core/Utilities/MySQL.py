@@ -8,14 +8,14 @@
     These are the coded methods:
 
 
-    __init__( host, user, passwd, name, [maxConnsInQueue=10] )
+    __init__( host, user, passwd, name, [port=3306], [maxQueueSize=3], [debug=False], [minQueueSize=1] )
 
-    Initializes the Queue and tries to connect to the DB server,
+    Initializes the ConnectionPool and tries to connect to the DB server,
     using the _connect method.
-    "maxConnsInQueue" defines the size of the Queue of open connections
-    that are kept for reuse. It also defined the maximum number of open
-    connections available from the object.
-    maxConnsInQueue = 0 means unlimited and it is not supported.
+    "maxQueueSize" defines the maximum number of open connections available
+    from the object, threads wait for a free one when all are in use.
+    "minQueueSize" connections are kept open even when idle.
+    maxQueueSize = 0 means unlimited and it is not supported.
 
 
     _except( methodName, exception, errorMessage )
@@ -35,20 +35,20 @@
     _query( cmd, [conn] )
 
     Executes SQL command "cmd".
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is given back to the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue.
+    is used and is not given back to the pool.
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
 
 
     _update( cmd, [conn] )
 
     Executes SQL command "cmd" and issue a commit
-    Gets a connection from the Queue (or open a new one if none is available),
-    the used connection is  back into the Queue.
+    Gets a connection from the pool (or open a new one if none is available),
+    the used connection is given back to the pool.
     If a connection to the the DB is passed as second argument this connection
-    is used and is not  in the Queue
+    is used and is not given back to the pool.
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
 
 
@@ -59,10 +59,10 @@
 
     _getConnection()
 
-    Gets a connection from the Queue (or open a new one if none is available)
+    Gets a connection from the pool (or open a new one if none is available)
     Returns S_OK with connection in Value or S_ERROR
-    the calling method is responsible for closing this connection once it is no
-    longer needed.
+    The connection is removed from the pool, the calling method is responsible
+    for closing this connection once it is no longer needed.
 
 
 
@@ -108,6 +108,20 @@
       String type values will be appropriately escaped.
 
 
+    insertFieldsBulk( self, tableName, inFields, valuesList, conn = None,
+                      replace = False, batchSize = BULKBATCHSIZE ):
+
+      Insert one row per tuple of values in "valuesList" using multi-row
+      INSERT (or REPLACE) statements of at most batchSize rows.
+
+
+    updateFieldsBulk( self, tableName, keyFields, updateFields, valuesList, conn = None,
+                      batchSize = BULKBATCHSIZE ):
+
+      Update "updateFields" of the rows identified by "keyFields" with a different
+      value per row, sending one UPDATE statement per batch of rows.
+
+
     deleteEntries( self, tableName,
                    condDict = None,
                    limit = False, conn = None,
@@ -124,12 +138,12 @@
                condDict = None,
                limit = False, conn = None,
                older = None, newer = None,
-               timeStamp = None, orderAttribute = None ):
+               timeStamp = None, orderAttribute = None, offset = None ):
 
       Select "outFields" from "tableName" with condDict
       N records can match the condition
       return S_OK( tuple(Field,Value) )
-      if limit is not False, the given limit is set
+      if limit is not False, the given limit is set, skipping the first offset records
       String type values will be appropriately escaped, they can be single values or lists of values.
 
       for compatibility with other methods condDict keyed argument is added
@@ -153,7 +167,7 @@
 __RCSID__ = "$Id$"
 
 
-from DIRAC                                  import gLogger
+from DIRAC                                  import gLogger, gMonitor
 from DIRAC                                  import S_OK, S_ERROR
 from DIRAC                                  import Time
 
@@ -163,13 +177,20 @@ MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/m
 gInstancesCount = 0
 gDebugFile = None
 
-import Queue
+import re
 import types
 import time
+import thread
 import threading
 from types import StringTypes, DictType, ListType
 
 MAXCONNECTRETRY = 10
+# MySQL server has gone away, Lost connection to MySQL server during query
+MYSQLLOSTCONNECTIONERRORS = ( 2006, 2013 )
+# Values starting with these are passed to the DB without quoting
+SPECIALVALUES = ( 'UTC_TIMESTAMP', 'TIMESTAMPADD', 'TIMESTAMPDIFF' )
+# Maximum number of rows sent in a single statement by the bulk methods
+BULKBATCHSIZE = 1000
 
 def _checkQueueSize( maxQueueSize ):
   """
@@ -197,6 +218,13 @@ def _checkFields( inFields, inValues ):
 
   return S_OK()
 
+def _isConnectionLost( excp ):
+  """
+    Helper to tell if a MySQL exception means the connection is no longer usable
+  """
+  return isinstance( excp, MySQLdb.OperationalError ) and excp.args and \
+         excp.args[0] in MYSQLLOSTCONNECTIONERRORS
+
 def _quotedList( fieldList = None ):
   """
     Quote a list of MySQL Field Names with "`"
@@ -217,6 +245,405 @@ def _quotedList( fieldList = None ):
 
   return ', '.join( quotedFields )
 
+# Same characters as mysql_real_escape_string for single byte and utf8 charsets
+_ESCAPECHARS = { '\0' : '\\0', '\n' : '\\n', '\r' : '\\r', '\\' : '\\\\',
+                 "'" : "\\'", '"' : '\\"', '\x1a' : '\\Z' }
+_ESCAPEREGEX = re.compile( '[\0\n\r\\\\\'"\x1a]' )
+
+def _escapeMySQLString( myString ):
+  """
+    Escape a string for MySQL without the need of a connection
+  """
+  if not _ESCAPEREGEX.search( myString ):
+    return myString
+  return _ESCAPEREGEX.sub( lambda match: _ESCAPECHARS[ match.group( 0 ) ], myString )
+
+
+class ConnectionPool( object ):
+  """
+  Bounded pool of MySQLdb connections to one database
+
+  - at most maxConnections are open at any time, threads asking for more
+    wait up to waitTimeout seconds for one to be returned
+  - minConnections are opened upfront and never reaped
+  - with threadAffinity a thread gets back the connection it used last if
+    it is idle, otherwise the most recently used one
+  - connections are only pinged when they have been idle for more than
+    validationInterval seconds, a background thread validates idle
+    connections, closes those idle for more than idleLifeTime and
+    reports the pool activity to gMonitor
+  """
+
+  def __init__( self, hostName, userName, passwd, dbName, port = 3306,
+                maxConnections = 3, minConnections = 1, waitTimeout = 60,
+                validationInterval = 30, idleLifeTime = 600, threadAffinity = True ):
+    self.__hostName = hostName
+    self.__userName = userName
+    self.__passwd = passwd
+    self.__dbName = dbName
+    self.__port = port
+    self.__maxConnections = max( 1, maxConnections )
+    self.__minConnections = max( 0, min( minConnections, self.__maxConnections ) )
+    self.__waitTimeout = waitTimeout
+    self.__validationInterval = validationInterval
+    self.__idleLifeTime = idleLifeTime
+    self.__threadAffinity = threadAffinity
+    self.log = gLogger.getSubLogger( 'ConnectionPool/%s' % dbName )
+    self.__cond = threading.Condition()
+    #Idle connections as [ connection, lastUsed, lastThread, lastChecked ], most recently used last
+    self.__idle = []
+    #id( connection ) -> connection for connections checked out
+    self.__active = {}
+    #Open connections plus connections being opened
+    self.__numConnections = 0
+    self.__closed = False
+    self.__metrics = { 'checkouts' : 0, 'waits' : 0, 'waitTime' : 0.0,
+                       'created' : 0, 'closed' : 0, 'timeouts' : 0 }
+    self.__reportedMetrics = dict( self.__metrics )
+    self.__monitorActivities = False
+    self.__maintenanceThread = False
+
+  def initialize( self ):
+    """
+    Open minConnections (at least one, to check the DB is reachable)
+    and start the maintenance thread
+    """
+    for i in range( max( 1, self.__minConnections ) ):
+      result = self.__openConnection()
+      if not result[ 'OK' ]:
+        return result
+      self.__addIdle( result[ 'Value' ] )
+    if not self.__maintenanceThread:
+      self.__maintenanceThread = threading.Thread( target = self.__maintenanceLoop )
+      self.__maintenanceThread.setDaemon( 1 )
+      self.__maintenanceThread.start()
+    return S_OK()
+
+  def __openConnection( self, reserved = False ):
+    """
+    Open a new connection. If reserved the slot has already been counted
+    """
+    if not reserved:
+      self.__cond.acquire()
+      try:
+        if self.__numConnections >= self.__maxConnections:
+          return S_ERROR( 'Maximum number of connections reached' )
+        self.__numConnections += 1
+      finally:
+        self.__cond.release()
+    try:
+      connection = MySQLdb.connect( host = self.__hostName,
+                                    port = self.__port,
+                                    user = self.__userName,
+                                    passwd = self.__passwd,
+                                    db = self.__dbName )
+    except Exception, x:
+      self.__cond.acquire()
+      try:
+        self.__numConnections -= 1
+        self.__cond.notify()
+      finally:
+        self.__cond.release()
+      self.log.debug( 'Could not open connection', str( x ) )
+      return S_ERROR( 'Could not open connection: %s' % str( x ) )
+    self.__cond.acquire()
+    try:
+      self.__metrics[ 'created' ] += 1
+    finally:
+      self.__cond.release()
+    return S_OK( connection )
+
+  def __addIdle( self, connection ):
+    """
+    Add an already counted connection to the idle ones
+    """
+    self.__cond.acquire()
+    try:
+      if self.__closed:
+        self.__numConnections -= 1
+        try:
+          connection.close()
+        except Exception:
+          pass
+        return
+      now = time.time()
+      self.__idle.append( [ connection, now, None, now ] )
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def __closeConnection( self, connection ):
+    """
+    Close a connection and free its slot
+    """
+    try:
+      connection.close()
+    except Exception:
+      pass
+    self.__cond.acquire()
+    try:
+      self.__numConnections -= 1
+      self.__metrics[ 'closed' ] += 1
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def __popIdle( self, threadId ):
+    """
+    Get an idle connection, called with the lock held
+    """
+    if self.__threadAffinity:
+      for iPos in range( len( self.__idle ) - 1, -1, -1 ):
+        if self.__idle[ iPos ][2] == threadId:
+          return self.__idle.pop( iPos )
+    return self.__idle.pop()
+
+  def getConnection( self, maxRetries = MAXCONNECTRETRY ):
+    """
+    Check out a connection. It has to be given back with putConnection
+    """
+    threadId = thread.get_ident()
+    startTime = time.time()
+    waited = False
+    retries = 0
+    while True:
+      idleEntry = False
+      self.__cond.acquire()
+      try:
+        if self.__closed:
+          return S_ERROR( 'Connection pool is closed' )
+        while not self.__idle and self.__numConnections >= self.__maxConnections:
+          waitLeft = startTime + self.__waitTimeout - time.time()
+          if waitLeft <= 0:
+            self.__metrics[ 'timeouts' ] += 1
+            return S_ERROR( 'Timeout waiting for a DB connection: all %s connections are in use' %
+                            self.__maxConnections )
+          waited = True
+          self.__cond.wait( waitLeft )
+        if self.__idle:
+          idleEntry = self.__popIdle( threadId )
+        else:
+          #Reserve the slot and connect without holding the lock
+          self.__numConnections += 1
+      finally:
+        self.__cond.release()
+
+      if idleEntry:
+        connection = idleEntry[0]
+        if time.time() - idleEntry[3] > self.__validationInterval and not self.__ping( connection ):
+          self.__closeConnection( connection )
+          continue
+      else:
+        result = self.__openConnection( reserved = True )
+        if not result[ 'OK' ]:
+          retries += 1
+          if retries >= maxRetries:
+            return S_ERROR( 'Could not get a connection after %s retries: %s' % ( retries, result[ 'Message' ] ) )
+          time.sleep( min( retries, 5 ) )
+          continue
+        connection = result[ 'Value' ]
+
+      self.__cond.acquire()
+      try:
+        self.__active[ id( connection ) ] = connection
+        self.__metrics[ 'checkouts' ] += 1
+        if waited:
+          self.__metrics[ 'waits' ] += 1
+          self.__metrics[ 'waitTime' ] += time.time() - startTime
+      finally:
+        self.__cond.release()
+      return S_OK( connection )
+
+  def putConnection( self, connection ):
+    """
+    Give back a connection. Connections that do not belong to the pool
+    are adopted if there is room for them, closed otherwise
+    """
+    self.__cond.acquire()
+    try:
+      if self.__active.pop( id( connection ), None ) is None:
+        if self.__closed or self.__numConnections >= self.__maxConnections:
+          try:
+            connection.close()
+          except Exception:
+            pass
+          return
+        self.__numConnections += 1
+      elif self.__closed:
+        self.__numConnections -= 1
+        try:
+          connection.close()
+        except Exception:
+          pass
+        return
+      now = time.time()
+      self.__idle.append( [ connection, now, thread.get_ident(), now ] )
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def discardConnection( self, connection ):
+    """
+    Close a checked out connection that can not be reused
+    """
+    self.__cond.acquire()
+    try:
+      if self.__active.pop( id( connection ), None ) is None:
+        connection = None
+    finally:
+      self.__cond.release()
+    if connection is not None:
+      self.__closeConnection( connection )
+
+  def detachConnection( self, connection ):
+    """
+    Remove a checked out connection from the pool, the caller owns it from now on
+    """
+    self.__cond.acquire()
+    try:
+      if self.__active.pop( id( connection ), None ) is not None:
+        self.__numConnections -= 1
+        self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def __ping( self, connection ):
+    try:
+      # This will try to reconnect if the connection has timeout
+      connection.ping( True )
+      return True
+    except Exception:
+      return False
+
+  def getStats( self ):
+    """
+    Get a snapshot of the pool status and counters
+    """
+    self.__cond.acquire()
+    try:
+      stats = dict( self.__metrics )
+      stats[ 'active' ] = len( self.__active )
+      stats[ 'idle' ] = len( self.__idle )
+      stats[ 'open' ] = self.__numConnections
+      stats[ 'max' ] = self.__maxConnections
+      stats[ 'min' ] = self.__minConnections
+    finally:
+      self.__cond.release()
+    return stats
+
+  def maintain( self ):
+    """
+    Validate connections idle for more than validationInterval and
+    close the ones idle for more than idleLifeTime above minConnections
+    """
+    now = time.time()
+    toValidate = []
+    toClose = []
+    self.__cond.acquire()
+    try:
+      keep = []
+      #Oldest first
+      for entry in self.__idle:
+        if now - entry[1] > self.__idleLifeTime and \
+           self.__numConnections - len( toClose ) > self.__minConnections:
+          toClose.append( entry[0] )
+        elif now - entry[3] > self.__validationInterval:
+          toValidate.append( entry )
+        else:
+          keep.append( entry )
+      self.__idle = keep
+    finally:
+      self.__cond.release()
+    for connection in toClose:
+      self.__closeConnection( connection )
+    for entry in toValidate:
+      if not self.__ping( entry[0] ):
+        self.__closeConnection( entry[0] )
+        continue
+      entry[3] = time.time()
+      self.__cond.acquire()
+      try:
+        if self.__closed:
+          self.__numConnections -= 1
+          entry[0].close()
+        else:
+          #Validated connections are the least recently used ones
+          self.__idle.insert( 0, entry )
+          self.__cond.notify()
+      finally:
+        self.__cond.release()
+    #Keep minConnections open
+    while True:
+      self.__cond.acquire()
+      try:
+        if self.__closed or self.__numConnections >= self.__minConnections:
+          break
+      finally:
+        self.__cond.release()
+      result = self.__openConnection()
+      if not result[ 'OK' ]:
+        break
+      self.__addIdle( result[ 'Value' ] )
+
+  def __reportMetrics( self ):
+    """
+    Send the counters accumulated since the last report to gMonitor
+    """
+    stats = self.getStats()
+    dbName = self.__dbName
+    if not self.__monitorActivities:
+      category = "MySQL %s" % dbName
+      gMonitor.registerActivity( "%sConnCheckouts" % dbName, "DB connection checkouts",
+                                 category, "checkouts/min", gMonitor.OP_SUM )
+      gMonitor.registerActivity( "%sConnWaitTime" % dbName, "Mean wait for a DB connection",
+                                 category, "seconds", gMonitor.OP_MEAN )
+      gMonitor.registerActivity( "%sConnActive" % dbName, "DB connections in use",
+                                 category, "connections", gMonitor.OP_MEAN )
+      gMonitor.registerActivity( "%sConnIdle" % dbName, "Idle DB connections",
+                                 category, "connections", gMonitor.OP_MEAN )
+      self.__monitorActivities = True
+    previous = self.__reportedMetrics
+    checkouts = stats[ 'checkouts' ] - previous[ 'checkouts' ]
+    waits = stats[ 'waits' ] - previous[ 'waits' ]
+    try:
+      gMonitor.addMark( "%sConnCheckouts" % dbName, checkouts )
+      if waits:
+        gMonitor.addMark( "%sConnWaitTime" % dbName, ( stats[ 'waitTime' ] - previous[ 'waitTime' ] ) / waits )
+      gMonitor.addMark( "%sConnActive" % dbName, stats[ 'active' ] )
+      gMonitor.addMark( "%sConnIdle" % dbName, stats[ 'idle' ] )
+    except Exception, x:
+      #gMonitor may have been initialized after the activities were registered
+      self.__monitorActivities = False
+      self.log.debug( 'Cannot report pool activity', str( x ) )
+    self.__reportedMetrics = stats
+
+  def __maintenanceLoop( self ):
+    while not self.__closed:
+      time.sleep( max( 1, min( self.__validationInterval, 60 ) ) )
+      try:
+        self.maintain()
+        self.__reportMetrics()
+      except Exception:
+        self.log.exception( 'Error in connection pool maintenance' )
+
+  def close( self ):
+    """
+    Close all idle connections, active ones are closed when given back
+    """
+    self.__cond.acquire()
+    try:
+      self.__closed = True
+      idle = self.__idle
+      self.__idle = []
+      self.__numConnections -= len( idle )
+      self.__cond.notifyAll()
+    finally:
+      self.__cond.release()
+    for entry in idle:
+      try:
+        entry[0].close()
+      except Exception:
+        pass
 
 
 class MySQL:
@@ -225,7 +652,8 @@ class MySQL:
   """
   __initialized = False
 
-  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False ):
+  def __init__( self, hostName, userName, passwd, dbName, port = 3306, maxQueueSize = 3, debug = False,
+                minQueueSize = 1 ):
     """
     set MySQL connection parameters and try to connect
     """
@@ -249,10 +677,11 @@ class MySQL:
     self.__passwd = str( passwd )
     self.__dbName = str( dbName )
     self.__port = port
-    # Create the connection Queue to reuse connections
-    self.__connectionQueue = Queue.Queue( maxQueueSize )
-    # Create the connection Semaphore to limit total number of open connection
-    self.__connectionSemaphore = threading.Semaphore( maxQueueSize )
+    # Create the connection pool to reuse connections and limit the number of open ones
+    self.__connectionPool = ConnectionPool( self.__hostName, self.__userName, self.__passwd,
+                                            self.__dbName, self.__port,
+                                            maxConnections = maxQueueSize,
+                                            minConnections = minQueueSize )
 
     self.__initialized = True
     self._connect()
@@ -267,14 +696,8 @@ class MySQL:
   def __del__( self ):
     global gInstancesCount
     try:
-      while 1 and self.__initialized:
-        self.__connectionSemaphore.release()
-        try:
-          connection = self.__connectionQueue.get_nowait()
-          connection.close()
-        except Queue.Empty:
-          self.log.debug( 'No more connection in Queue' )
-          break
+      if self.__initialized:
+        self.__connectionPool.close()
       if gInstancesCount == 1:
         # only when the last instance of a MySQL object is deleted, the server
         # can be ended
@@ -300,27 +723,23 @@ class MySQL:
       return S_ERROR( '%s: (%s)' % ( err, str( e ) ) )
 
 
-  def __escapeString( self, myString, connection ):
+  def __escapeString( self, myString ):
     """
     To be used for escaping any MySQL string before passing it to the DB
     this should prevent passing non-MySQL accepted characters to the DB
     It also includes quotation marks " around the given string
+    The escaping is done locally, no connection to the DB is needed
     """
 
-    specialValues = ( 'UTC_TIMESTAMP', 'TIMESTAMPADD', 'TIMESTAMPDIFF' )
-
     try:
       myString = str( myString )
     except ValueError:
       return S_ERROR( "Cannot escape value!" )
 
     try:
-      for sV in specialValues:
-        if myString.find( sV ) == 0:
-          return S_OK( myString )
-      escape_string = connection.escape_string( str( myString ) )
-      self.log.debug( '__scape_string: returns', '"%s"' % escape_string )
-      return S_OK( '"%s"' % escape_string )
+      if myString.startswith( SPECIALVALUES ):
+        return S_OK( myString )
+      return S_OK( '"%s"' % _escapeMySQLString( myString ) )
     except Exception, x:
       self.log.debug( '__escape_string: Could not escape string', '"%s"' % myString )
       return self._except( '__escape_string', x, 'Could not escape string' )
@@ -351,51 +770,25 @@ class MySQL:
   def _escapeString( self, myString, conn = None ):
     """
       Wrapper around the internal method __escapeString
+      conn is kept for backward compatibility, it is not used
     """
-    self.log.debug( '_scapeString:', '"%s"' % myString )
-
-    retDict = self.__getConnection( conn )
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
-
-    retDict = self.__escapeString( myString, connection )
-    if not conn:
-      self.__putConnection( connection )
-
-    return retDict
+    return self.__escapeString( myString )
 
 
   def _escapeValues( self, inValues = None ):
     """
     Escapes all strings in the list of values provided
     """
-    self.log.debug( '_escapeValues:', inValues )
-
-    retDict = self.__getConnection()
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
-
     inEscapeValues = []
 
     if not inValues:
       return S_OK( inEscapeValues )
 
     for value in inValues:
-      if type( value ) in StringTypes:
-        retDict = self.__escapeString( value, connection )
-        if not retDict['OK']:
-          self.__putConnection( connection )
-          return retDict
-        inEscapeValues.append( retDict['Value'] )
-      else:
-        retDict = self.__escapeString( str( value ), connection )
-        if not retDict['OK']:
-          self.__putConnection( connection )
-          return retDict
-        inEscapeValues.append( retDict['Value'] )
-    self.__putConnection( connection )
+      retDict = self.__escapeString( value )
+      if not retDict['OK']:
+        return retDict
+      inEscapeValues.append( retDict['Value'] )
     return S_OK( inEscapeValues )
 
 
@@ -418,7 +811,10 @@ class MySQL:
                        '[%s@%s] by user %s/%s.' %
                        ( self.__dbName, self.__hostName, self.__userName, self.__passwd ) )
     try:
-      self.__newConnection()
+      retDict = self.__connectionPool.initialize()
+      if not retDict['OK']:
+        self.log.debug( '_connect: Could not connect to DB.', retDict['Message'] )
+        return retDict
       self.log.verbose( '_connect: Connected.' )
       self._connected = True
       return S_OK()
@@ -444,13 +840,10 @@ class MySQL:
     if gDebugFile:
       start = time.time()
 
-    if conn:
-      connection = conn
-    else:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     try:
       cursor = connection.cursor()
@@ -477,11 +870,15 @@ class MySQL:
     except Exception , x:
       self.log.warn( '_query:', cmd )
       retDict = self._except( '_query', x, 'Execution failed.' )
+      if _isConnectionLost( x ):
+        retDict[ 'lostConnection' ] = True
 
     try:
       cursor.close()
     except Exception:
       pass
+    if not conn:
+      self.__putConnection( connection, lost = 'lostConnection' in retDict )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -525,13 +922,15 @@ class MySQL:
     except Exception, x:
       self.log.warn( '_update:', cmd )
       retDict = self._except( '_update', x, 'Execution failed.' )
+      if _isConnectionLost( x ):
+        retDict[ 'lostConnection' ] = True
 
     try:
       cursor.close()
     except Exception:
       pass
     if not conn:
-      self.__putConnection( connection )
+      self.__putConnection( connection, lost = 'lostConnection' in retDict )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -553,12 +952,10 @@ class MySQL:
       return S_ERROR( "_transaction: wrong type (%s) for cmdList" % type( cmdList ) )
 
     ## get connection 
-    connection = conn
-    if not connection:
-      retDict = self._getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     ## list with cmds and their results   
     cmdRet = []
@@ -568,14 +965,19 @@ class MySQL:
         cmdRet.append( ( cmd, cursor.execute( cmd ) ) )
       connection.commit()
     except Exception, error:
-      self.logger.execption( error )
+      self.logger.exception( error )
       ## rollback, put back connection to the pool 
-      connection.rollback()
-      self.__putConnection( connection )
+      try:
+        connection.rollback()
+      except Exception:
+        pass
+      if not conn:
+        self.__putConnection( connection, lost = _isConnectionLost( error ) )
       return S_ERROR( error )
     ## close cursor, put back connection to the pool
     cursor.close()
-    self.__putConnection( connection )
+    if not conn:
+      self.__putConnection( connection )
     return S_OK( cmdRet )
 
   def _createTables( self, tableDict, force = False ):
@@ -773,38 +1175,15 @@ class MySQL:
     return param[0].tostring()
 
 
-  def __newConnection( self ):
+  def __putConnection( self, connection, lost = False ):
     """
-    Create a New connection and put it in the Queue
-    """
-    self.log.debug( '__newConnection:' )
-
-    connection = MySQLdb.connect( host = self.__hostName,
-                                  port = self.__port,
-                                  user = self.__userName,
-                                  passwd = self.__passwd,
-                                  db = self.__dbName )
-    self.__putConnection( connection )
-
-
-  def __putConnection( self, connection ):
-    """
-    Put a connection in the Queue, if the queue is full, the connection is closed
+    Give a connection back to the pool, lost connections are closed
     """
     self.log.debug( '__putConnection:' )
-
-    # Release the semaphore first, in case something fails
-    self.__connectionSemaphore.release()
-    try:
-      self.__connectionQueue.put_nowait( connection )
-    except Queue.Full, x:
-      self.log.debug( '__putConnection: Full Queue' )
-      try:
-        connection.close()
-      except:
-        pass
-    except Exception, x:
-      self._except( '__putConnection', x, 'Failed to put Connection in Queue' )
+    if lost:
+      self.__connectionPool.discardConnection( connection )
+    else:
+      self.__connectionPool.putConnection( connection )
 
   def _getConnection( self ):
     """
@@ -818,54 +1197,33 @@ class MySQL:
 
     self.log.debug( '_getConnection:' )
 
-    retDict = self.__getConnection( trial = 0 )
-    self.__connectionSemaphore.release()
+    retDict = self.__getConnection()
+    if retDict['OK']:
+      # The caller owns the connection from now on
+      self.__connectionPool.detachConnection( retDict['Value'] )
     return retDict
 
-  def __getConnection( self, conn = None, trial = 0 ):
+  def __getConnection( self, conn = None ):
     """
-    Return a new connection to the DB,
+    Return a connection to the DB,
     if conn is provided then just return it.
-    then try the Queue, if it is empty add a newConnection to the Queue and retry
-    it will retry MAXCONNECTRETRY to open a new connection and will return
-    an error if it fails.
+    Otherwise check out a connection from the pool, waiting for a free one
+    if all are in use. Opening a new connection is retried MAXCONNECTRETRY
+    times before returning an error.
     """
     self.log.debug( '__getConnection:' )
 
     if conn:
       return S_OK( conn )
 
-    try:
-      self.__connectionSemaphore.acquire()
-      connection = self.__connectionQueue.get_nowait()
-      self.log.debug( '__getConnection: Got a connection from Queue' )
-      if connection:
-        try:
-          # This will try to reconnect if the connection has timeout
-          connection.ping( True )
-        except:
-          # if the ping fails try with a new connection from the Queue
-          self.__connectionSemaphore.release()
-          return self.__getConnection()
-        return S_OK( connection )
-    except Queue.Empty, x:
-      self.__connectionSemaphore.release()
-      self.log.debug( '__getConnection: Empty Queue' )
-      try:
-        if trial == min( 10, MAXCONNECTRETRY ):
-          return S_ERROR( 'Could not get a connection after %s retries.' % MAXCONNECTRETRY )
-        try:
-          self.__newConnection()
-          return self.__getConnection()
-        except Exception, x:
-          self.log.debug( '__getConnection: Fails to get connection from Queue', x )
-          time.sleep( trial * 5.0 )
-          newtrial = trial + 1
-          return self.__getConnection( trial = newtrial )
-      except Exception, x:
-        return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
-    except Exception, x:
-      return self._except( '__getConnection:', x, 'Failed to get connection from Queue' )
+    return self.__connectionPool.getConnection()
+
+  def getPoolStats( self ):
+    """
+    Return S_OK with the connection pool status: open, active and idle connections
+    and the checkouts, waits, waitTime, timeouts, created and closed counters
+    """
+    return S_OK( self.__connectionPool.getStats() )
 
 ########################################################################################
 #
@@ -1134,13 +1492,13 @@ class MySQL:
                  limit = False, conn = None,
                  older = None, newer = None,
                  timeStamp = None, orderAttribute = None,
-                 greater = None, smaller = None ):
+                 greater = None, smaller = None, offset = None ):
     """
       Select "outFields" from "tableName" with condDict
       N records can match the condition
       return S_OK( tuple(Field,Value) )
       if outFields == None all fields in "tableName" are returned
-      if limit is not False, the given limit is set
+      if limit is not False, the given limit is set, skipping the first offset records
       inValues are properly escaped using the _escape_string method, they can be single values or lists of values.
     """
     table = _quotedList( [tableName] )
@@ -1166,7 +1524,7 @@ class MySQL:
     try:
       condition = self.buildCondition( condDict = condDict, older = older, newer = newer,
                         timeStamp = timeStamp, orderAttribute = orderAttribute, limit = limit,
-                        greater = None, smaller = None )
+                        greater = None, smaller = None, offset = offset )
     except Exception, x:
       return S_ERROR( x )
 
@@ -1331,6 +1689,142 @@ class MySQL:
     return self._update( 'INSERT INTO %s %s VALUES %s' %
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
+#############################################################################
+  def insertFieldsBulk( self, tableName, inFields, valuesList, conn = None,
+                        replace = False, batchSize = BULKBATCHSIZE ):
+    """
+      Insert many rows in "tableName", one tuple of values for the fields "inFields"
+      per row in "valuesList". Rows are sent in multi-row statements of at most
+      batchSize rows. If replace is True REPLACE is used instead of INSERT.
+      String type values will be appropriately escaped.
+      return S_OK( number of affected rows )
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      error = 'Invalid tableName argument'
+      self.log.warn( 'insertFieldsBulk:', error )
+      return S_ERROR( error )
+
+    inFieldString = _quotedList( inFields )
+    if inFieldString == None:
+      error = 'Invalid inFields arguments'
+      self.log.warn( 'insertFieldsBulk:', error )
+      return S_ERROR( error )
+
+    if not valuesList:
+      return S_OK( 0 )
+
+    rowStrings = []
+    for inValues in valuesList:
+      retDict = _checkFields( inFields, inValues )
+      if not retDict['OK']:
+        self.log.warn( 'insertFieldsBulk:', retDict['Message'] )
+        return retDict
+      retDict = self._escapeValues( inValues )
+      if not retDict['OK']:
+        self.log.warn( 'insertFieldsBulk:', retDict['Message'] )
+        return retDict
+      rowStrings.append( '( %s )' % ', '.join( retDict['Value'] ) )
+
+    self.log.verbose( 'insertFieldsBulk:', 'inserting %s rows of ( %s ) into table %s'
+                          % ( len( rowStrings ), inFieldString, table ) )
+
+    if replace:
+      statement = 'REPLACE INTO %s ( %s ) VALUES ' % ( table, inFieldString )
+    else:
+      statement = 'INSERT INTO %s ( %s ) VALUES ' % ( table, inFieldString )
+
+    batchSize = max( 1, batchSize )
+    affected = 0
+    for i in range( 0, len( rowStrings ), batchSize ):
+      retDict = self._update( statement + ', '.join( rowStrings[i:i + batchSize] ), conn, debug = True )
+      if not retDict['OK']:
+        return retDict
+      affected += retDict['Value']
+    return S_OK( affected )
+
+#############################################################################
+  def updateFieldsBulk( self, tableName, keyFields, updateFields, valuesList, conn = None,
+                        batchSize = BULKBATCHSIZE ):
+    """
+      Update "updateFields" of many rows of "tableName" with a different value per row.
+      Each entry of valuesList is a tuple with the values of the "keyFields" identifying
+      the row followed by the new values of the "updateFields".
+      Rows are updated in single UPDATE statements of at most batchSize rows.
+      String type values will be appropriately escaped.
+      return S_OK( number of updated rows )
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      error = 'Invalid tableName argument'
+      self.log.warn( 'updateFieldsBulk:', error )
+      return S_ERROR( error )
+
+    if not keyFields or not updateFields:
+      error = 'keyFields and updateFields must be non empty lists'
+      self.log.warn( 'updateFieldsBulk:', error )
+      return S_ERROR( error )
+
+    quotedKeys = [ _quotedList( [ field ] ) for field in keyFields ]
+    quotedFields = [ _quotedList( [ field ] ) for field in updateFields ]
+    if None in quotedKeys or None in quotedFields:
+      error = 'Invalid keyFields or updateFields arguments'
+      self.log.warn( 'updateFieldsBulk:', error )
+      return S_ERROR( error )
+
+    if not valuesList:
+      return S_OK( 0 )
+
+    nKeys = len( keyFields )
+    rows = []
+    for values in valuesList:
+      retDict = _checkFields( list( keyFields ) + list( updateFields ), values )
+      if not retDict['OK']:
+        self.log.warn( 'updateFieldsBulk:', retDict['Message'] )
+        return retDict
+      retDict = self._escapeValues( values )
+      if not retDict['OK']:
+        self.log.warn( 'updateFieldsBulk:', retDict['Message'] )
+        return retDict
+      escapedValues = retDict['Value']
+      if nKeys == 1:
+        keyCond = escapedValues[0]
+      else:
+        keyCond = '( %s )' % ' AND '.join( [ '%s = %s' % ( quotedKeys[k], escapedValues[k] )
+                                              for k in range( nKeys ) ] )
+      rows.append( ( keyCond, escapedValues[nKeys:] ) )
+
+    self.log.verbose( 'updateFieldsBulk:', 'updating fields %s of %s rows from table %s.' %
+                          ( ', '.join( updateFields ), len( rows ), table ) )
+
+    batchSize = max( 1, batchSize )
+    affected = 0
+    for i in range( 0, len( rows ), batchSize ):
+      batch = rows[i:i + batchSize]
+      if nKeys == 1:
+        # CASE `Key` WHEN value THEN newValue ... END
+        setString = ', '.join( [ '%s = CASE %s %s ELSE %s END' %
+                                 ( quotedFields[f], quotedKeys[0],
+                                   ' '.join( [ 'WHEN %s THEN %s' % ( keyCond, newValues[f] )
+                                               for keyCond, newValues in batch ] ),
+                                   quotedFields[f] )
+                                 for f in range( len( quotedFields ) ) ] )
+        condition = '%s IN ( %s )' % ( quotedKeys[0], ', '.join( [ row[0] for row in batch ] ) )
+      else:
+        setString = ', '.join( [ '%s = CASE %s ELSE %s END' %
+                                 ( quotedFields[f],
+                                   ' '.join( [ 'WHEN %s THEN %s' % ( keyCond, newValues[f] )
+                                               for keyCond, newValues in batch ] ),
+                                   quotedFields[f] )
+                                 for f in range( len( quotedFields ) ) ] )
+        condition = ' OR '.join( [ row[0] for row in batch ] )
+      retDict = self._update( 'UPDATE %s SET %s WHERE %s' % ( table, setString, condition ),
+                              conn, debug = True )
+      if not retDict['OK']:
+        return retDict
+      affected += retDict['Value']
+    return S_OK( affected )
+
 #####################################################################################
 #
 #   This is a test code for this class, it requires access to a MySQL DB
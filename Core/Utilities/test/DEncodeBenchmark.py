@@ -0,0 +1,89 @@
+########################################################################
+# $HeadURL $
+# File: DEncodeBenchmark.py
+########################################################################
+
+""" :mod: DEncodeBenchmark
+    =======================
+
+    .. module: DEncodeBenchmark
+    :synopsis: compare DEncode and FastDEncode with DIRAC-like payloads
+
+    Run it with python DEncodeBenchmark.py [ scale ]
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import datetime
+from DIRAC.Core.Utilities import DEncode, FastDEncode
+
+def replicasPayload( nFiles ):
+  """ bulk getReplicas result """
+  successful = {}
+  for i in range( nFiles ):
+    lfn = "/lhcb/MC/2012/ALLSTREAMS.DST/00020000/0000/00020000_%08d_1.allstreams.dst" % i
+    successful[ lfn ] = { 'CERN-DST' : "srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s" % lfn,
+                          'CNAF-DST' : "srm://storm-fe-lhcb.cr.cnaf.infn.it/t0d1%s" % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobSummaryPayload( nJobs ):
+  """ JobMonitoring getJobPageSummaryWeb result """
+  now = datetime.datetime.utcnow()
+  paramNames = [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus', 'Site', 'JobName',
+                 'Owner', 'OwnerGroup', 'LastUpdateTime', 'SubmissionTime', 'RescheduleCounter' ]
+  records = []
+  for i in range( nJobs ):
+    records.append( [ i, 'Running', 'Application', 'Unknown', 'LCG.CERN.ch', '00020000_%08d' % i,
+                      'someuser', 'lhcb_user', now, now, 0 ] )
+  return { 'OK' : True, 'Value' : { 'ParameterNames' : paramNames, 'Records' : records,
+                                    'TotalRecords' : nJobs, 'Extras' : {} } }
+
+def accountingPayload( nBuckets ):
+  """ accounting bucket rows """
+  return { 'OK' : True, 'Value' : [ ( 'LCG.CERN.ch', 1339000000 + i * 900, 900, float( i ) * 1.5, i * 2 )
+                                    for i in range( nBuckets ) ] }
+
+def timeIt( func, *args ):
+  """ best time out of three runs """
+  times = []
+  for i in range( 3 ):
+    start = time.time()
+    result = func( *args )
+    times.append( time.time() - start )
+  return result, min( times )
+
+def streamDecode( data, chunkSize = 1048576 ):
+  decoder = FastDEncode.StreamDecoder()
+  for i in range( 0, len( data ), chunkSize ):
+    result = decoder.feed( data[ i : i + chunkSize ] )
+    if result:
+      return result
+  return decoder.finish()
+
+def benchmark( scale = 1 ):
+  payloads = [ ( "getReplicas", replicasPayload( 100000 * scale ) ),
+               ( "jobSummary", jobSummaryPayload( 100000 * scale ) ),
+               ( "accounting", accountingPayload( 200000 * scale ) ) ]
+  print "%-12s %8s | %9s %9s | %9s %9s %9s" % ( "payload", "MB", "enc", "fastEnc", "dec", "fastDec", "stream" )
+  for name, payload in payloads:
+    data, encTime = timeIt( DEncode.encode, payload )
+    fastData, fastEncTime = timeIt( FastDEncode.encode, payload )
+    if data != fastData:
+      raise Exception( "Engines produced different data for %s" % name )
+    decoded, decTime = timeIt( DEncode.decode, data )
+    fastDecoded, fastDecTime = timeIt( FastDEncode.decode, data )
+    streamed, streamTime = timeIt( streamDecode, data )
+    if not decoded[0] == fastDecoded[0] == streamed[0]:
+      raise Exception( "Engines decoded different objects for %s" % name )
+    print "%-12s %8.1f | %8.3fs %8.3fs | %8.3fs %8.3fs %8.3fs" % ( name, len( data ) / 1048576.,
+                                                                      encTime, fastEncTime,
+                                                                      decTime, fastDecTime, streamTime )
+
+if __name__ == "__main__":
+  scale = 1
+  if len( sys.argv ) > 1:
+    scale = int( sys.argv[1] )
+  benchmark( scale )
@@ -0,0 +1,98 @@
+########################################################################
+# $HeadURL $
+# File: DEncodeTestCase.py
+########################################################################
+
+""" :mod: DEncodeTestCase
+    =======================
+
+    .. module: DEncodeTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.DEncode and FastDEncode
+
+    Both engines have to produce and understand exactly the same data
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import datetime
+import unittest
+from DIRAC.Core.Utilities import DEncode, FastDEncode
+
+########################################################################
+class DEncodeTestCase( unittest.TestCase ):
+  """py:class DEncodeTestCase
+  Test case for DEncode engines
+  """
+
+  def setUp( self ):
+    now = datetime.datetime( 2012, 6, 21, 10, 32, 44, 123456 )
+    self.objects = [ 0, -12, 2 ** 70, 1.5, 2.0 * 10 ** 20, 2.0 * 10 ** -10, True, False, None,
+                     "", "some:string with e", u"unicod\xe9", now, now.date(), now.time(),
+                     [], (), {}, [ 1, "a", [ 2, ( 3, None ) ] ],
+                     { 'OK' : True, 'Value' : { 'Successful' : { '/lhcb/file' : { 'CERN-disk' : 'srm://x' } },
+                                                'Failed' : {} } },
+                     { 2 : "3", True : ( 3, None ), 2.0 * 10 ** 20 : 2.0 * 10 ** -10 },
+                     { 'ParameterNames' : [ 'JobID', 'Status', 'LastUpdateTime' ],
+                       'Records' : [ ( i, 'Running', now ) for i in range( 50 ) ] } ]
+
+  def testSameEncoding( self ):
+    """ both engines produce the same data """
+    for obj in self.objects:
+      self.assertEqual( FastDEncode.encode( obj ), DEncode.encode( obj ) )
+
+  def testDecode( self ):
+    """ FastDEncode decodes what DEncode encodes """
+    for obj in self.objects:
+      data = DEncode.encode( obj )
+      self.assertEqual( FastDEncode.decode( data ), DEncode.decode( data ) )
+      self.assertEqual( FastDEncode.decode( data )[0], obj )
+
+  def testDecodeOffset( self ):
+    """ decode from an offset and from buffers """
+    data = DEncode.encode( { 'a' : [ 1, 2.5, 's' ] } )
+    prefixed = "%s:%s" % ( len( data ), data )
+    offset = prefixed.index( ":" ) + 1
+    self.assertEqual( FastDEncode.decode( prefixed, offset ), ( { 'a' : [ 1, 2.5, 's' ] }, len( prefixed ) ) )
+    self.assertEqual( FastDEncode.decode( bytearray( data ) )[0], { 'a' : [ 1, 2.5, 's' ] } )
+    self.assertEqual( FastDEncode.decode( memoryview( data ) )[0], { 'a' : [ 1, 2.5, 's' ] } )
+    self.assertRaises( ValueError, FastDEncode.decode, data[:-1] )
+
+  def testDecodeBuffers( self ):
+    """ buffers are decoded in place, from an offset and with every type """
+    data = DEncode.encode( self.objects )
+    prefixed = bytearray( "%s:%s" % ( len( data ), data ) )
+    offset = prefixed.index( ":" ) + 1
+    for bufferObj in ( prefixed, buffer( prefixed ), memoryview( prefixed ) ):
+      self.assertEqual( FastDEncode.decode( bufferObj, offset ), ( DEncode.decode( data )[0], len( prefixed ) ) )
+      self.assertRaises( ValueError, FastDEncode.decode, bufferObj[:-1], offset )
+
+  def testStreamDecoder( self ):
+    """ decode while data arrives in chunks """
+    for obj in self.objects:
+      encoded = DEncode.encode( obj )
+      data = encoded + "trailing"
+      for chunkSize in ( 1, 2, 3, 7, 64 ):
+        decoder = FastDEncode.StreamDecoder()
+        result = False
+        for i in range( 0, len( data ), chunkSize ):
+          self.assertEqual( result, False )
+          result = decoder.feed( data[ i : i + chunkSize ] )
+          if result:
+            break
+        if not result:
+          result = decoder.finish()
+        value, remaining = result
+        self.assertEqual( value, obj )
+        self.assertEqual( remaining, "trailing"[ : len( remaining ) ] )
+    #Top level float can only be finished when no more data comes
+    decoder = FastDEncode.StreamDecoder()
+    self.assertEqual( decoder.feed( "f1.5e" ), False )
+    self.assertEqual( decoder.finish(), ( 1.5, "" ) )
+
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DEncodeTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,75 @@
+########################################################################
+# $HeadURL $
+# File: DictCacheBenchmark.py
+########################################################################
+
+""" :mod: DictCacheBenchmark
+    =========================
+
+    .. module: DictCacheBenchmark
+    :synopsis: DictCache throughput with many keys and concurrent threads
+
+    Run it with python DictCacheBenchmark.py [ numKeys ] [ numThreads ]
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import random
+import threading
+from DIRAC.Core.Utilities.DictCache import DictCache
+
+def runThreads( numThreads, target, *args ):
+  """ run target in numThreads threads, return the wall time """
+  threads = [ threading.Thread( target = target, args = ( i, ) + args ) for i in range( numThreads ) ]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return time.time() - start
+
+def benchmark( numKeys = 1000000, numThreads = 8, maxSize = 0 ):
+  cache = DictCache( maxSize = maxSize )
+  perThread = numKeys / numThreads
+
+  def adder( threadId ):
+    add = cache.add
+    for key in xrange( threadId * perThread, ( threadId + 1 ) * perThread ):
+      add( key, 1 + key % 60, key )
+
+  def getter( threadId ):
+    get = cache.get
+    rand = random.Random( threadId ).randrange
+    for i in xrange( perThread ):
+      get( rand( numKeys ) )
+
+  def exister( threadId ):
+    exists = cache.exists
+    for key in xrange( threadId * perThread, ( threadId + 1 ) * perThread ):
+      exists( key, 30 )
+
+  print "%d keys, %d threads, maxSize %d" % ( numKeys, numThreads, maxSize )
+  for name, target in ( ( "add", adder ), ( "get", getter ), ( "exists", exister ) ):
+    elapsed = runThreads( numThreads, target )
+    print "  %-12s %6.2f s %10d ops/s" % ( name, elapsed, numKeys / elapsed )
+  #Half of the keys expire in the next 30 seconds
+  start = time.time()
+  cache.purgeExpired( expiredInSeconds = 30 )
+  print "  %-12s %6.2f s" % ( "purgeExpired", time.time() - start )
+  start = time.time()
+  cache.purgeExpired()
+  print "  %-12s %6.4f s (nothing to purge)" % ( "purgeExpired", time.time() - start )
+  print "  stats %s" % cache.getStats()
+
+if __name__ == "__main__":
+  numKeys = 1000000
+  numThreads = 8
+  if len( sys.argv ) > 1:
+    numKeys = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    numThreads = int( sys.argv[2] )
+  benchmark( numKeys, numThreads )
+  benchmark( numKeys, numThreads, maxSize = numKeys / 2 )
@@ -0,0 +1,122 @@
+########################################################################
+# $HeadURL $
+# File: DictCacheTestCase.py
+########################################################################
+
+""" :mod: DictCacheTestCase
+    ========================
+
+    .. module: DictCacheTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.DictCache
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import threading
+import unittest
+from DIRAC.Core.Utilities.DictCache import DictCache
+DictCacheModule = sys.modules[ DictCache.__module__ ]
+
+########################################################################
+class DictCacheTestCase( unittest.TestCase ):
+  """py:class DictCacheTestCase
+  Test case for the DictCache
+  """
+
+  def setUp( self ):
+    self.deleted = []
+    self.cache = DictCache( deleteFunction = self.deleted.append )
+
+  def testGetExists( self ):
+    """ get, exists and validSeconds """
+    self.cache.add( "a", 10, 1 )
+    self.cache.add( "b", 10 )
+    self.cache.add( "c", 0, 3 )
+    self.assertEqual( self.cache.get( "a" ), 1 )
+    self.assert_( self.cache.exists( "b" ) )
+    self.assertEqual( self.cache.get( "b" ), None )
+    self.failIf( self.cache.exists( "c" ) )
+    self.assertEqual( self.cache.get( "c" ), False )
+    #Not valid for long enough, it's deleted as before
+    self.assertEqual( self.cache.get( "a", 20 ), False )
+    self.failIf( self.cache.exists( "a" ) )
+    self.assertEqual( self.deleted, [ 1 ] )
+    self.assertEqual( sorted( self.cache.getKeys() ), [ "b" ] )
+    stats = self.cache.getStats()
+    self.assertEqual( ( stats[ 'hits' ], stats[ 'misses' ], stats[ 'size' ] ), ( 3, 4, 1 ) )
+
+  def testPurgeExpired( self ):
+    """ only the expired records are purged, re added keys are kept """
+    for i in range( 100 ):
+      self.cache.add( i, 1 + i % 2, i )
+    self.cache.add( 0, 100, "new" )
+    self.cache.delete( 2 )
+    self.cache.purgeExpired( expiredInSeconds = 1.5 )
+    self.assertEqual( sorted( self.cache.getKeys() ), [ 0 ] + range( 1, 100, 2 ) )
+    self.assertEqual( sorted( self.deleted ), range( 2, 100, 2 ) )
+    self.assertEqual( self.cache.getStats()[ 'expirations' ], 48 )
+    self.cache.purgeAll()
+    self.assertEqual( self.cache.getKeys(), [] )
+    self.assert_( "new" in self.deleted )
+
+  def testLRU( self ):
+    """ least recently used records are evicted when full """
+    cache = DictCache( deleteFunction = self.deleted.append, maxSize = 3 )
+    for key in "abc":
+      cache.add( key, 10, key )
+    cache.get( "a" )
+    cache.add( "d", 10, "d" )
+    self.assertEqual( sorted( cache.getKeys() ), [ "a", "c", "d" ] )
+    cache.add( "c", 10, "C" )
+    cache.add( "e", 10, "e" )
+    self.assertEqual( sorted( cache.getKeys() ), [ "c", "d", "e" ] )
+    self.assertEqual( self.deleted, [ "b", "a" ] )
+    self.assertEqual( cache.getStats()[ 'evictions' ], 2 )
+
+  def testLRUWithoutOrderedDict( self ):
+    """ the LRU order is kept in a list on Python versions without OrderedDict """
+    orderedDict = DictCacheModule._OrderedDict
+    DictCacheModule._OrderedDict = DictCacheModule._ListOrderedDict
+    try:
+      self.testLRU()
+      cache = DictCache( maxSize = 3 )
+      for key in "abcd":
+        cache.add( key, 1 + ( key == "c" ), key )
+      cache.purgeExpired( expiredInSeconds = 1.5 )
+      self.assertEqual( cache.getKeys(), [ "c" ] )
+    finally:
+      DictCacheModule._OrderedDict = orderedDict
+
+  def testThreads( self ):
+    """ concurrent readers and writers """
+    cache = DictCache( maxSize = 500 )
+    errors = []
+    def worker( offset ):
+      try:
+        for i in range( 2000 ):
+          key = ( offset + i ) % 1000
+          cache.add( key, 10, key )
+          value = cache.get( ( key + 1 ) % 1000 )
+          if value is not False and value != ( key + 1 ) % 1000:
+            errors.append( value )
+          if i % 500 == 0:
+            cache.purgeExpired()
+      except Exception, excp:
+        errors.append( excp )
+    threads = [ threading.Thread( target = worker, args = ( i * 100, ) ) for i in range( 8 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( errors, [] )
+    self.assert_( cache.getStats()[ 'size' ] <= 500 )
+
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DictCacheTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
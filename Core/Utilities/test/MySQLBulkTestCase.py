@@ -0,0 +1,102 @@
+########################################################################
+# $HeadURL $
+# File: MySQLBulkTestCase.py
+########################################################################
+
+""" :mod: MySQLBulkTestCase
+    ========================
+
+    .. module: MySQLBulkTestCase
+    :synopsis: test cases for the escaping and bulk methods of DIRAC.Core.Utilities.MySQL
+
+    The statements are recorded instead of being executed, no DB server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+from DIRAC import gLogger, S_OK
+from DIRAC.Core.Utilities import MySQL
+
+class RecordingMySQL( MySQL.MySQL ):
+  """ MySQL client recording the update statements """
+
+  def __init__( self ):
+    self.log = gLogger.getSubLogger( "RecordingMySQL" )
+    self.statements = []
+
+  def _update( self, cmd, conn = None, debug = False ):
+    self.statements.append( cmd )
+    return S_OK( 1 )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    self.statements.append( cmd )
+    return S_OK( () )
+
+########################################################################
+class MySQLBulkTestCase( unittest.TestCase ):
+  """py:class MySQLBulkTestCase
+  Test case for the MySQL escaping and bulk statements
+  """
+
+  def setUp( self ):
+    self.db = RecordingMySQL()
+
+  def testEscape( self ):
+    """ escaping without connection """
+    self.assertEqual( self.db._escapeString( "plain" )[ 'Value' ], '"plain"' )
+    self.assertEqual( self.db._escapeString( 'a"b\'c\\d\ne\r\x00\x1a' )[ 'Value' ],
+                      '"a\\"b\\\'c\\\\d\\ne\\r\\0\\Z"' )
+    self.assertEqual( self.db._escapeString( "UTC_TIMESTAMP()" )[ 'Value' ], "UTC_TIMESTAMP()" )
+    self.assertEqual( self.db._escapeValues( [ 1, "x", 2.5 ] )[ 'Value' ], [ '"1"', '"x"', '"2.5"' ] )
+    self.failIf( self.db._escapeString( u"\xe9" )[ 'OK' ] )
+
+  def testInsertBulk( self ):
+    """ multi-row inserts in batches """
+    result = self.db.insertFieldsBulk( "Table", [ "A", "B" ], [ ( 1, "x" ), ( 2, 'y"' ), ( 3, "z" ) ],
+                                       batchSize = 2 )
+    self.assertEqual( result[ 'Value' ], 2 )
+    self.assertEqual( self.db.statements,
+                      [ 'INSERT INTO `Table` ( `A`, `B` ) VALUES ( "1", "x" ), ( "2", "y\\"" )',
+                        'INSERT INTO `Table` ( `A`, `B` ) VALUES ( "3", "z" )' ] )
+    result = self.db.insertFieldsBulk( "Table", [ "A" ], [ ( 1, ) ], replace = True )
+    self.assertEqual( self.db.statements[-1], 'REPLACE INTO `Table` ( `A` ) VALUES ( "1" )' )
+    self.failIf( self.db.insertFieldsBulk( "Table", [ "A", "B" ], [ ( 1, ) ] )[ 'OK' ] )
+    self.assertEqual( self.db.insertFieldsBulk( "Table", [ "A" ], [] )[ 'Value' ], 0 )
+
+  def testUpdateBulk( self ):
+    """ one UPDATE per batch """
+    result = self.db.updateFieldsBulk( "Table", [ "ID" ], [ "A" ], [ ( 1, "x" ), ( 2, "y" ) ] )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( self.db.statements,
+                      [ 'UPDATE `Table` SET `A` = CASE `ID` WHEN "1" THEN "x" WHEN "2" THEN "y" ELSE `A` END '
+                        'WHERE `ID` IN ( "1", "2" )' ] )
+    result = self.db.updateFieldsBulk( "Table", [ "K1", "K2" ], [ "A", "B" ], [ ( 1, 2, "x", "y" ) ] )
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( self.db.statements[-1],
+                      'UPDATE `Table` SET `A` = CASE WHEN ( `K1` = "1" AND `K2` = "2" ) THEN "x" ELSE `A` END, '
+                      '`B` = CASE WHEN ( `K1` = "1" AND `K2` = "2" ) THEN "y" ELSE `B` END '
+                      'WHERE ( `K1` = "1" AND `K2` = "2" )' )
+    self.failIf( self.db.updateFieldsBulk( "Table", [], [ "A" ], [ ( 1, ) ] )[ 'OK' ] )
+
+  def testSelectPage( self ):
+    """ a page of the selection, in a stable order """
+    condition = self.db.buildCondition( { "Owner" : "x" }, orderAttribute = [ "Status:DESC", "JobID" ],
+                                        limit = 20, offset = 40 )
+    self.assertEqual( condition, '  WHERE `Owner` = "x" ORDER BY `Status` DESC, JobID LIMIT 20 OFFSET 40' )
+    self.assertEqual( self.db.buildCondition( limit = 20, offset = 0 ), " LIMIT 20" )
+    # No offset without a limit
+    self.assertEqual( self.db.buildCondition( orderAttribute = "JobID:ASC", offset = 40 ), " ORDER BY `JobID` ASC" )
+    self.failIf( self.db.getFields( "Jobs", [ "JobID" ], orderAttribute = [ "Status:UP" ] )[ 'OK' ] )
+    self.assert_( self.db.getFields( "Jobs", [ "JobID" ], { "Status" : [ "Done", "Failed" ] },
+                                     orderAttribute = [ "Site", "JobID" ], limit = 10, offset = 30 )[ 'OK' ] )
+    self.assertEqual( self.db.statements,
+                      [ 'SELECT `JobID` FROM `Jobs`   WHERE `Status` IN ( "Done", "Failed" ) '
+                        'ORDER BY Site, JobID LIMIT 10 OFFSET 30' ] )
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( MySQLBulkTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
@@ -0,0 +1,150 @@
+########################################################################
+# $HeadURL $
+# File: MySQLConnectionPoolTestCase.py
+########################################################################
+
+""" :mod: MySQLConnectionPoolTestCase
+    ==================================
+
+    .. module: MySQLConnectionPoolTestCase
+    :synopsis: test cases for DIRAC.Core.Utilities.MySQL.ConnectionPool
+
+    MySQLdb.connect is replaced by a fake connection factory, no DB server is needed
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import threading
+import unittest
+from DIRAC.Core.Utilities import MySQL
+
+class FakeConnection( object ):
+  """ connection counting pings and closes """
+
+  def __init__( self, **kwArgs ):
+    self.pings = 0
+    self.closed = False
+    self.alive = True
+
+  def ping( self, reconnect = False ):
+    self.pings += 1
+    if not self.alive:
+      raise Exception( "Gone away" )
+
+  def close( self ):
+    self.closed = True
+
+########################################################################
+class ConnectionPoolTestCase( unittest.TestCase ):
+  """py:class ConnectionPoolTestCase
+  Test case for the MySQL connection pool
+  """
+
+  def setUp( self ):
+    self.connections = []
+    self.connect = MySQL.MySQLdb.connect
+    def fakeConnect( **kwArgs ):
+      connection = FakeConnection( **kwArgs )
+      self.connections.append( connection )
+      return connection
+    MySQL.MySQLdb.connect = fakeConnect
+
+  def tearDown( self ):
+    MySQL.MySQLdb.connect = self.connect
+
+  def getPool( self, **kwArgs ):
+    return MySQL.ConnectionPool( "localhost", "user", "passwd", "TestDB", **kwArgs )
+
+  def testReuse( self ):
+    """ connections are reused and not pinged while recently used """
+    pool = self.getPool( maxConnections = 2, minConnections = 1 )
+    for i in range( 100 ):
+      result = pool.getConnection()
+      self.assert_( result[ 'OK' ] )
+      pool.putConnection( result[ 'Value' ] )
+    self.assertEqual( len( self.connections ), 1 )
+    self.assertEqual( self.connections[0].pings, 0 )
+    stats = pool.getStats()
+    self.assertEqual( stats[ 'checkouts' ], 100 )
+    self.assertEqual( ( stats[ 'open' ], stats[ 'active' ], stats[ 'idle' ] ), ( 1, 0, 1 ) )
+
+  def testBounded( self ):
+    """ never more than maxConnections, waiting threads time out """
+    pool = self.getPool( maxConnections = 2, waitTimeout = 0.2 )
+    first = pool.getConnection()[ 'Value' ]
+    second = pool.getConnection()[ 'Value' ]
+    self.assertNotEqual( first, second )
+    result = pool.getConnection()
+    self.failIf( result[ 'OK' ] )
+    self.assertEqual( pool.getStats()[ 'timeouts' ], 1 )
+    #A waiting thread gets the connection given back
+    threading.Timer( 0.05, pool.putConnection, ( first, ) ).start()
+    result = pool.getConnection()
+    self.assert_( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], first )
+    self.assertEqual( pool.getStats()[ 'waits' ], 1 )
+    self.assertEqual( len( self.connections ), 2 )
+
+  def testThreadAffinity( self ):
+    """ a thread gets back the connection it used last """
+    pool = self.getPool( maxConnections = 2 )
+    mine = pool.getConnection()[ 'Value' ]
+    other = pool.getConnection()[ 'Value' ]
+    pool.putConnection( mine )
+    thread = threading.Thread( target = pool.putConnection, args = ( other, ) )
+    thread.start()
+    thread.join()
+    #other is the most recently used one, but this thread used mine
+    self.assertEqual( pool.getConnection()[ 'Value' ], mine )
+    pool = self.getPool( maxConnections = 2, threadAffinity = False )
+    mine = pool.getConnection()[ 'Value' ]
+    other = pool.getConnection()[ 'Value' ]
+    pool.putConnection( mine )
+    thread = threading.Thread( target = pool.putConnection, args = ( other, ) )
+    thread.start()
+    thread.join()
+    self.assertEqual( pool.getConnection()[ 'Value' ], other )
+
+  def testValidation( self ):
+    """ stale connections are validated, dead ones replaced """
+    pool = self.getPool( maxConnections = 2, validationInterval = 0 )
+    connection = pool.getConnection()[ 'Value' ]
+    pool.putConnection( connection )
+    connection.alive = False
+    time.sleep( 0.01 )
+    newConnection = pool.getConnection()[ 'Value' ]
+    self.assertNotEqual( connection, newConnection )
+    self.assert_( connection.closed )
+    self.assertEqual( pool.getStats()[ 'open' ], 1 )
+
+  def testMaintenance( self ):
+    """ idle connections above minConnections are reaped """
+    pool = self.getPool( maxConnections = 3, minConnections = 1, idleLifeTime = 0 )
+    connections = [ pool.getConnection()[ 'Value' ] for i in range( 3 ) ]
+    for connection in connections:
+      pool.putConnection( connection )
+    time.sleep( 0.01 )
+    pool.maintain()
+    stats = pool.getStats()
+    self.assertEqual( ( stats[ 'open' ], stats[ 'idle' ], stats[ 'closed' ] ), ( 1, 1, 2 ) )
+
+  def testDetachAndDiscard( self ):
+    """ detached and discarded connections free their slot """
+    pool = self.getPool( maxConnections = 1, waitTimeout = 0.1 )
+    connection = pool.getConnection()[ 'Value' ]
+    pool.detachConnection( connection )
+    self.failIf( connection.closed )
+    connection = pool.getConnection()[ 'Value' ]
+    pool.discardConnection( connection )
+    self.assert_( connection.closed )
+    self.assert_( pool.getConnection()[ 'OK' ] )
+    self.assertEqual( pool.getStats()[ 'open' ], 1 )
+
+
+## test suite execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ConnectionPoolTestCase )
+  unittest.TextTestRunner(verbosity=3).run( SUITE )
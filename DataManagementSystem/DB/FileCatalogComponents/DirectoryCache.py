@@ -0,0 +1,89 @@
+########################################################################
+# $Id$
+########################################################################
+""" DIRAC FileCatalog directory cache shared by the catalog components
+
+    Size bounded LRU cache of the directory tree:
+      - path -> ( DirID, Level, Parent )
+      - DirID -> ( path, Level, Parent )
+      - DirID -> directory parameters ( owner, group, mode, status, dates )
+
+    The cache is local to the process and is not invalidated by the other
+    FileCatalog servers: a directory removed and created again elsewhere keeps
+    its old DirID here until the entry expires. It is disabled by default and
+    should only be enabled for a catalog served by a single FileCatalog instance.
+"""
+
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Utilities.DictCache import DictCache
+
+class DirectoryCache:
+
+  def __init__( self, maxSize = 0, lifeTime = 3600 ):
+    self.maxSize = maxSize
+    self.lifeTime = lifeTime
+    self.__paths = DictCache( maxSize = maxSize )
+    self.__ids = DictCache( maxSize = maxSize )
+    self.__parameters = DictCache( maxSize = maxSize )
+
+  def addDirectory( self, path, dirID, level = None, parent = None ):
+    """ Remember the directory ID, level and parent of a path
+    """
+    if not self.maxSize or not dirID:
+      return
+    dirID = int( dirID )
+    self.__paths.add( path, self.lifeTime, ( dirID, level, parent ) )
+    self.__ids.add( dirID, self.lifeTime, ( path, level, parent ) )
+
+  def getDirectory( self, path ):
+    """ Get ( DirID, Level, Parent ) for a path, None if not cached
+    """
+    value = self.__paths.get( path )
+    if value is False:
+      return None
+    return value
+
+  def getPath( self, dirID ):
+    """ Get ( path, Level, Parent ) for a directory ID, None if not cached
+    """
+    value = self.__ids.get( int( dirID ) )
+    if value is False:
+      return None
+    return value
+
+  def addParameters( self, dirID, paramDict ):
+    if not self.maxSize:
+      return
+    self.__parameters.add( int( dirID ), self.lifeTime, dict( paramDict ) )
+
+  def getParameters( self, dirID ):
+    """ Get a copy of the cached directory parameters, None if not cached
+    """
+    value = self.__parameters.get( int( dirID ) )
+    if value is False:
+      return None
+    return dict( value )
+
+  def invalidateParameters( self, dirID ):
+    self.__parameters.delete( int( dirID ) )
+
+  def removeDirectory( self, path = None, dirID = None ):
+    """ Forget a removed directory given by path and/or ID
+    """
+    if path is not None:
+      value = self.__paths.get( path )
+      if value is not False and dirID is None:
+        dirID = value[0]
+      self.__paths.delete( path )
+    if dirID:
+      value = self.__ids.get( int( dirID ) )
+      if value is not False:
+        self.__paths.delete( value[0] )
+      self.__ids.delete( int( dirID ) )
+      self.__parameters.delete( int( dirID ) )
+
+  def clear( self ):
+    self.__paths.purgeAll()
+    self.__ids.purgeAll()
+    self.__parameters.purgeAll()
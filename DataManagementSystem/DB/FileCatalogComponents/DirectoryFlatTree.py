@@ -105,7 +105,10 @@ class DirectoryFlatTree(DirectoryTreeBase):
       return S_OK()
     dirID = res['Value']
     req = "DELETE FROM DirectoryInfo WHERE DirID=%d" % dirID
-    return self.db._update(req)
+    result = self.db._update(req)
+    if result['OK']:
+      self._removeDirectoryFromClosure(dirID)
+    return result
 
 
  
@@ -138,6 +141,7 @@ class DirectoryFlatTree(DirectoryTreeBase):
     if not result['OK']:
       self.removeDir(path)
       return S_ERROR('Failed to create directory %s' % path)
+    self._addDirectoryToClosure(result['lastRowId'])
     return S_OK(result['lastRowId'])
 
   def makeDir(self,path):
@@ -12,6 +12,7 @@ __RCSID__ = "$Id$"
 import time, os, types
 from types import *
 from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryTreeBase     import DirectoryTreeBase
 
 MAX_LEVELS = 15
@@ -30,7 +31,13 @@ class DirectoryLevelTree(DirectoryTreeBase):
     return 'Directory'
 
   def findDir(self,path):
-    req = "SELECT DirID,Level from FC_DirectoryLevelTree WHERE DirName='%s'" % path
+    cached = self.db.dirCache.getDirectory(path)
+    if cached:
+      res = S_OK(cached[0])
+      res['Level'] = cached[1]
+      return res
+
+    req = "SELECT DirID,Level,Parent from FC_DirectoryLevelTree WHERE DirName='%s'" % path
     result = self.db._query(req)
     if not result['OK']:
       return result
@@ -38,9 +45,37 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_OK('')
     
-    res = S_OK(result['Value'][0][0])  
-    res['Level'] = result['Value'][0][1]
+    dirID,level,parentID = result['Value'][0]
+    self.db.dirCache.addDirectory(path,dirID,level,parentID)
+    res = S_OK(dirID)  
+    res['Level'] = level
     return res
+
+  def findDirs(self,paths):
+    """ Get the IDs of the existing directories in the list of paths, the ones
+        not in the cache are resolved in one query
+    """
+    dirDict = {}
+    missing = []
+    for path in paths:
+      cached = self.db.dirCache.getDirectory(path)
+      if cached:
+        dirDict[path] = cached[0]
+      else:
+        missing.append(path)
+    if not missing:
+      return S_OK(dirDict)
+
+    for pathChunk in breakListIntoChunks(missing,1000):
+      pathString = ','.join( [ "'%s'" % path for path in pathChunk ] )
+      req = "SELECT DirID,Level,Parent,DirName from FC_DirectoryLevelTree WHERE DirName in (%s)" % pathString
+      result = self.db._query(req)
+      if not result['OK']:
+        return result
+      for dirID,level,parentID,dirName in result['Value']:
+        self.db.dirCache.addDirectory(dirName,dirID,level,parentID)
+        dirDict[dirName] = dirID
+    return S_OK(dirDict)
   
   def removeDir(self,path):
     """ Remove directory
@@ -57,6 +92,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    self.db.dirCache.removeDirectory(path,dirID)
     result['DirID'] = dirID
     return result
 
@@ -225,6 +261,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     else:
       result = self.db._query("UNLOCK TABLES;",conn)     
       
+    self.db.dirCache.addDirectory(path,dirID,level,parentDirID)
     result = S_OK(dirID)
     result['NewDirectory'] = True
     return result  
@@ -274,14 +311,20 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def getDirectoryPath(self,dirID):
     """ Get directory name by directory ID
     """
-    req = "SELECT DirName FROM FC_DirectoryLevelTree WHERE DirID=%d" % int(dirID)
+    cached = self.db.dirCache.getPath(dirID)
+    if cached:
+      return S_OK(cached[0])
+
+    req = "SELECT DirName,Level,Parent FROM FC_DirectoryLevelTree WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
       return result
     if not result['Value']:
       return S_ERROR('Directory with id %d not found' % int(dirID) )
     
-    return S_OK(result['Value'][0][0])
+    dirName,level,parentID = result['Value'][0]
+    self.db.dirCache.addDirectory(dirName,dirID,level,parentID)
+    return S_OK(dirName)
 
   def getDirectoryPaths(self,dirIDList):
     """ Get directory name by directory ID list
@@ -327,29 +370,14 @@ class DirectoryLevelTree(DirectoryTreeBase):
       dPath += '/'+el
       pelements.append(dPath)
       
-    pathString = [ "'"+p+"'" for p in pelements ]
-    req = "SELECT DirID FROM FC_DirectoryLevelTree WHERE DirName in (%s) ORDER BY DirID" % ','.join(pathString)
-    result = self.db._query(req)
+    result = self.findDirs(pelements)
     if not result['OK']:
       return result
     if not result['Value']:
       return S_ERROR('Directory %s not found' % path)
        
-    return S_OK([ x[0] for x in result['Value'] ])
+    return S_OK(sorted(result['Value'].values()))
   
-  def getPathIDsByID(self,dirID):
-    """ Get IDs of all the directories in the parent hierarchy for a directory
-        specified by its ID
-    """
-    
-    # The method should be rather implemented using enumerated paths
-    
-    result = self.getDirectoryPath(dirID)
-    if not result['OK']:
-      return result
-    dPath = result['Value']
-    return self.getPathIDs(dPath)
-    
   def getChildren(self,path):
     """ Get child directory IDs for the given directory 
     """  
@@ -375,13 +403,17 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """ Get all the subdirectories of the given directory at a given level
     """
 
-    req = "SELECT Level FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
-    result = self.db._query(req)
-    if not result['OK']:
-      return result
-    if not result['Value']:
-      return S_ERROR('Directory %d not found' % dirID)
-    level = result['Value'][0][0]
+    cached = self.db.dirCache.getPath(dirID)
+    if cached and cached[1] is not None:
+      level = cached[1]
+    else:
+      req = "SELECT Level FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
+      result = self.db._query(req)
+      if not result['OK']:
+        return result
+      if not result['Value']:
+        return S_ERROR('Directory %d not found' % dirID)
+      level = result['Value'][0][0]
 
     sPaths = []
     if requestString:
@@ -9,16 +9,19 @@ __RCSID__ = "$Id$"
 
 import time, os, types
 from DIRAC import S_OK, S_ERROR
-from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime, createMetaSelection
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.MetaQueryPlanner import MetaQueryPlanner
 
 class DirectoryMetadata:
 
   def __init__( self, database = None ):
 
     self.db = database
+    self.planner = MetaQueryPlanner( database )
 
   def setDatabase( self, database ):
     self.db = database
+    self.planner.setDatabase( database )
 
 ##############################################################################
 #
@@ -389,51 +392,13 @@ class DirectoryMetadata:
 #
 ############################################################################################  
 
-  def __createMetaSelection( self, meta, value, table = '' ):
-
-    if type( value ) == types.DictType:
-      selectList = []
-      for operation, operand in value.items():
-        if operation in ['>', '<', '>=', '<=']:
-          if type( operand ) == types.ListType:
-            return S_ERROR( 'Illegal query: list of values for comparison operation' )
-          if type( operand ) in [types.IntType, types.LongType]:
-            selectList.append( "%sValue%s%d" % ( table, operation, operand ) )
-          elif type( operand ) == types.FloatType:
-            selectList.append( "%sValue%s%f" % ( table, operation, operand ) )
-          else:
-            selectList.append( "%sValue%s'%s'" % ( table, operation, operand ) )
-        elif operation == 'in' or operation == "=":
-          if type( operand ) == types.ListType:
-            vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
-            selectList.append( "%sValue IN (%s)" % ( table, vString ) )
-          else:
-            selectList.append( "%sValue='%s'" % ( table, operand ) )
-        elif operation == 'nin' or operation == "!=":
-          if type( operand ) == types.ListType:
-            vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
-            selectList.append( "%sValue NOT IN (%s)" % ( table, vString ) )
-          else:
-            selectList.append( "%sValue!='%s'" % ( table, operand ) )
-        selectString = ' AND '.join( selectList )
-    elif type( value ) == types.ListType:
-      vString = ','.join( [ "'" + str( x ) + "'" for x in value] )
-      selectString = "%sValue in %s" % ( table, vString )
-    else:
-      if value == "Any":
-        selectString = ''
-      else:
-        selectString = "%sValue='%s' " % ( table, value )
-
-    return S_OK( selectString )
-
   def __findSubdirByMeta( self, meta, value, pathSelection = '', subdirFlag = True ):
     """ Find directories for the given meta datum. If the the meta datum type is a list,
         combine values in OR. In case the meta datum is 'Any', finds all the subdirectories
         for which the meta datum is defined at all.
     """
 
-    result = self.__createMetaSelection( meta, value, "M." )
+    result = createMetaSelection( value, "M.Value" )
     if not result['OK']:
       return result
     selectString = result['Value']
@@ -521,6 +486,12 @@ class DirectoryMetadata:
     result['ExtraMetadata'] = extraDict
     return result
 
+  def expandMetaQuery( self, metaDict, credDict ):
+    """ Get the directory metadata part of the query with the metadata sets expanded,
+        the other keys are in result['ExtraMetadata']
+    """
+    return self.__expandMetaDictionary( metaDict, credDict )
+
   @queryTime
   def findDirIDsByMetadata( self, queryDict, path, credDict ):
     """ Find Directories satisfying the given metadata and being subdirectories of 
@@ -539,6 +510,18 @@ class DirectoryMetadata:
     if not result['OK']:
       return result
     metaDict = result['Value']
+    if metaDict and self.planner.isAvailable():
+      result = self.planner.findDirectories( metaDict, pathDirID )
+      if not result['OK']:
+        return result
+      dirList = result['Value']
+      result = S_OK( dirList )
+      if dirList:
+        result['Selection'] = 'Done'
+      else:
+        result['Selection'] = 'None'
+      return result
+
     if metaDict:
       pathSelection = ''
       if pathDirID:
@@ -655,6 +638,16 @@ class DirectoryMetadata:
     # - all the subdirectories of the above directory
     # - all the directories in the parent hierarchy of the above directory
 
+    if self.planner.isAvailable():
+      result = self.planner.findCompatibleDirectories( meta, value )
+      if not result['OK']:
+        return result
+      resDirs = result['Value']
+      if fromDirs:
+        fromDirs = set( fromDirs )
+        resDirs = [ d for d in resDirs if d in fromDirs ]
+      return S_OK( resDirs )
+
     # Find directories defining the meta datum and their subdirectories
     subdirs = []
     result = self.__findSubdirByMeta( meta, value )
@@ -74,6 +74,21 @@ class DirectoryNodeTree(DirectoryTreeBase):
       return result
     return S_OK(result['lastRowId'])
   
+  def removeDir(self,path):
+    """ Remove directory
+    """
+    result = self.findDir(path)
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK()
+
+    dirID = result['Value']
+    req = "DELETE FROM FC_DirectoryTreeM WHERE DirID=%d" % dirID
+    result = self.db._update(req)
+    result['DirID'] = dirID
+    return result
+
   def existsDir(self,path):
     """ Check the existence of a directory at the specified path
     """
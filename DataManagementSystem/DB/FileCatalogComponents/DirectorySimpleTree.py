@@ -45,6 +45,7 @@ class DirectorySimpleTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    result['DirID'] = dirID
     return result
 
   def makeDir(self,path):
@@ -7,6 +7,7 @@ __RCSID__ = "$Id$"
 
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities  import * 
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities.List                                      import breakListIntoChunks
 import string, time, datetime,threading, re, os, sys, md5, random
 from types import *
 import stat
@@ -20,6 +21,10 @@ class DirectoryTreeBase:
     self.db = database
     self.lock = threading.Lock()
     self.treeTable = ''
+    self.closureReady = False
+    self.closureCheckTime = 0
+    self.usageReady = False
+    self.usageCheckTime = 0
     
   def getTreeTable(self):
     """ Get the string of the Directory Tree type
@@ -60,6 +65,7 @@ class DirectoryTreeBase:
       req = req + "(%d,%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d,%d)" % (dirID,l_uid,l_gid,self.db.umask,status)            
       result = self.db._update(req)            
       if result['OK']:
+        self._addDirectoryToClosure(dirID)
         resGet = self.getDirectoryParameters(dirID)            
         if resGet['OK']:
           dirDict = resGet['Value']
@@ -101,6 +107,7 @@ class DirectoryTreeBase:
       req = req + "(%d,%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d,%d)" % (dirID,l_uid,l_gid,self.db.umask,status)            
       result = self.db._update(req)            
       if result['OK']:
+        self._addDirectoryToClosure(dirID)
         resGet = self.getDirectoryParameters(dirID)            
         if resGet['OK']:
           dirDict = resGet['Value']
@@ -144,6 +151,30 @@ class DirectoryTreeBase:
 
     return result
 
+#####################################################################
+  def findDirs(self,paths):
+    """ Get the IDs of the existing directories in the list of paths.
+        The trees supporting it resolve all of them in one query
+    """
+    dirDict = {}
+    for path in paths:
+      result = self.findDir(path)
+      if not result['OK']:
+        return result
+      if result['Value']:
+        dirDict[path] = result['Value']
+    return S_OK(dirDict)
+
+#####################################################################
+  def getPathIDsByID(self,dirID):
+    """ Get IDs of all the directories in the parent hierarchy for a directory
+        specified by its ID
+    """
+    result = self.getDirectoryPath(dirID)
+    if not result['OK']:
+      return result
+    return self.getPathIDs(result['Value'])
+
 #####################################################################
   def exists(self,lfns):
     successful = {}
@@ -213,9 +244,12 @@ class DirectoryTreeBase:
     failed = {}
     for dir in dirs:
       result = self.removeDir(dir)
+      self.db.dirCache.removeDirectory(dir,result.get('DirID'))
       if not result['OK']:
         failed[dir] = result['Message']
       else: 
+        if result.get('DirID'):
+          self._removeDirectoryFromClosure(result['DirID'])
         successful[dir] = result
     return S_OK({'Successful':successful,'Failed':failed}) 
 
@@ -245,6 +279,10 @@ class DirectoryTreeBase:
       return result
     dirID = result['Value']
 
+    dirDict = self.db.dirCache.getParameters(dirID)
+    if dirDict:
+      return S_OK(dirDict)
+
     query = "SELECT DirID,UID,GID,Status,Mode,CreationDate,ModificationDate from FC_DirectoryInfo"
     query = query + " WHERE DirID=%d" % dirID
     resQuery = self.db._query(query)
@@ -275,6 +313,7 @@ class DirectoryTreeBase:
     dirDict['CreationDate'] = resQuery['Value'][0][5]
     dirDict['ModificationDate'] = resQuery['Value'][0][6]
 
+    self.db.dirCache.addParameters(dirID,dirDict)
     return S_OK(dirDict)
 
 #####################################################################
@@ -287,6 +326,7 @@ class DirectoryTreeBase:
     dirID = result['Value']
     req = "UPDATE FC_DirectoryInfo SET %s=%d WHERE DirID=%d" % (pname,pvalue,dirID)    
     result = self.db._update(req)
+    self.db.dirCache.invalidateParameters(dirID)
     return result
 
 #####################################################################
@@ -592,7 +632,10 @@ class DirectoryTreeBase:
       return result
     connection = result['Value']
 
-    resultLogical = self._getDirectoryLogicalSize(lfns,connection)
+    if rawFileTables or not self._hasDirectoryUsage():
+      resultLogical = self._getDirectoryLogicalSize(lfns,connection)
+    else:
+      resultLogical = self._getDirectoryLogicalSizeFromUsage(lfns,connection)
     if not resultLogical['OK']:
       connection.close()
       return resultLogical
@@ -620,8 +663,58 @@ class DirectoryTreeBase:
     resultDict['QueryTime'] = time.time() - start
     return S_OK(resultDict)            
   
+  def _getDirectoryLogicalSizeFromUsage(self,lfns,connection):
+    """ Get the total "logical" size of the requested directories from the
+        recursive counters kept in FC_DirectoryUsage
+    """
+    paths = lfns.keys()
+    successful = {}
+    failed = {}
+    toScan = {}
+    for path in paths:
+      result = self.findDir(path)
+      if not result['OK'] or not result['Value']:
+        failed[path] = "Directory not found"
+        continue
+      dirID = result['Value']
+      req = "SELECT SESize, SEFiles FROM FC_DirectoryUsage WHERE DirID=%d AND SEID=%d" % (dirID,LOGICAL_USAGE_SEID)
+      result = self.db._query(req,connection)
+      if not result['OK']:
+        failed[path] = result['Message']
+        continue
+      if not result['Value']:
+        # No file was ever added below it
+        toScan[path] = lfns[path]
+        continue
+      size,files = result['Value'][0]
+      successful[path] = {"LogicalSize":int(size),"LogicalFiles":int(files)}
+      if not files:
+        successful[path]['LogicalDirectories'] = 0
+        continue
+      if path == "/":
+        reqDir = "SELECT count(*) FROM FC_DirectoryInfo"
+      else:
+        result = self.getSubdirectoriesByID(dirID,requestString=True,includeParent=True)
+        if not result['OK']:
+          successful[path]['LogicalDirectories'] = -1
+          continue
+        reqDir = result['Value'].replace('SELECT DirID FROM','SELECT count(*) FROM')
+      result = self.db._query(reqDir,connection)
+      if result['OK'] and result['Value']:
+        successful[path]['LogicalDirectories'] = result['Value'][0][0]
+      else:
+        successful[path]['LogicalDirectories'] = -1
+
+    if toScan:
+      result = self._getDirectoryLogicalSize(toScan,connection)
+      if not result['OK']:
+        return result
+      successful.update(result['Value']['Successful'])
+      failed.update(result['Value']['Failed'])
+    return S_OK({'Successful':successful,'Failed':failed})
+
   def _getDirectoryLogicalSize(self,lfns,connection):
-    """ Get the total "logical" size of the requested directories
+    """ Get the total "logical" size of the requested directories from the file table
     """
     paths = lfns.keys()
     successful = {}
@@ -813,103 +906,201 @@ class DirectoryTreeBase:
           
     return S_OK({'Successful':successful,'Failed':failed}) 
   
-  def _rebuildDirectoryUsage( self ):
-    """ Recreate and replenish the Storage Usage tables
+  def _hasDirectoryUsage( self ):
+    """ Check that the logical usage counters are complete: the catalogs upgraded
+        from the versions without them only get increments until the counters are
+        rebuilt. The marker is checked again every 5 minutes
     """
-    
-    req = "RENAME TABLE FC_DirectoryUsage TO FC_DirectoryUsage_backup"
-    result = self.db._update( req )
-    req = """CREATE TABLE `FC_DirectoryUsage` (
-  `DirID` int(11) NOT NULL,
-  `SEID` int(11) NOT NULL,
-  `SESize` bigint(20) NOT NULL,
-  `SEFiles` bigint(20) NOT NULL,
-  `LastUpdate` datetime NOT NULL,
-  PRIMARY KEY (`DirID`,`SEID`),
-  KEY `DirID` (`DirID`),
-  KEY `SEID` (`SEID`)
-) ENGINE=MyISAM DEFAULT CHARSET=latin1 
-"""
-    result = self.db._update( req )
+    if time.time() - self.usageCheckTime < 300:
+      return self.usageReady
+    req = "SELECT COUNT(*) FROM FC_DirectoryUsage WHERE DirID=%d AND SEID=%d" % ( USAGE_MARKER_DIRID,LOGICAL_USAGE_SEID )
+    result = self.db._query( req )
     if not result['OK']:
-      return result
-    
-    result = self.__rebuildDirectoryUsageLeaves()
+      return False
+    self.usageCheckTime = time.time()
+    self.usageReady = result['Value'][0][0] > 0
+    return self.usageReady
+
+  def _rebuildDirectoryUsage( self ):
+    """ Recreate the Storage Usage counters from the file and replica tables
+    """
+    return self._checkDirectoryUsage( repair = True )
+
+  def _checkDirectoryUsage( self, repair = False ):
+    """ Compare the recursive usage counters in FC_DirectoryUsage with the content of
+        the file and replica tables and, if repair is True, fix the differences.
+        To be run while the catalog is not updated, concurrent changes show up as drift
+    """
+    # Usage of the files directly in each directory
+    directUsage = {}
+    req = "SELECT DirID,SUM(Size),COUNT(*) FROM FC_Files GROUP BY DirID"
+    result = self.db._query( req )
     if not result['OK']:
       return result
-    
-    result = self.db.dtree.findDir( '/' )
+    for dirID,size,files in result['Value']:
+      directUsage.setdefault( int(dirID), {} )[LOGICAL_USAGE_SEID] = ( int(size), int(files) )
+    req = "SELECT F.DirID,R.SEID,SUM(F.Size),COUNT(*) FROM FC_Files as F, FC_Replicas as R "
+    req += "WHERE F.FileID=R.FileID GROUP BY F.DirID,R.SEID"
+    result = self.db._query( req )
     if not result['OK']:
       return result
-    if not result['Value']:
-      return S_ERROR('Directory / not found')
-    dirID = result['Value']
-    result = self.__rebuildDirectoryUsage(dirID)
-    return result
-    
-  def __rebuildDirectoryUsageLeaves( self ):
-    """ Rebuild DirectoryUsage entries for directories having files
-    """  
-    req = 'SELECT DirID FROM FC_Files'
-    result = self.db._query(req)
+    for dirID,seID,size,files in result['Value']:
+      directUsage.setdefault( int(dirID), {} )[int(seID)] = ( int(size), int(files) )
+
+    # Accumulate it in all the ancestors
+    result = self.findDir( '/' )
     if not result['OK']:
       return result
-    
-    dirIDs = [ x[0] for x in result['Value'] ]
-    insertFields = ['DirID','SEID','SESize','SEFiles','LastUpdate']
-    insertCount = 0
-    insertValues = []
-    for dirID in dirIDs:
-      req = "SELECT SUM(F.Size),COUNT(F.Size),R.SEID from FC_Files as F, FC_Replicas as R "
-      req += "WHERE F.FileID=R.FileID AND F.DirID=%d GROUP BY R.SEID" % int(dirID)
-      result = self.db._query( req )
-      if not result['OK']:
-        return result
-      if not result['Value']:
-        return S_ERROR('Empty directory')
-      seSize,seFiles,seID = result['Value'][0]       
-      insertValues = [dirID,seID,seSize,seFiles,'UTC_TIMESTAMP()']
-      result = self.db.insertFields( 'FC_DirectoryUsage', insertFields, insertValues )  
+    rootID = result['Value']
+    expected = {}
+    for dirID,seDict in directUsage.items():
+      result = self.getPathIDsByID( dirID )
       if not result['OK']:
         return result
-    return S_OK()      
-    
-  def __rebuildDirectoryUsage( self, directoryID ):
-    """ Rebuild DirectoryUsage entries recursively for the given path
-    """  
-    result = self.getChildren( directoryID )
+      dirIDs = set( result['Value'] )
+      dirIDs.add( dirID )
+      if rootID:
+        dirIDs.add( rootID )
+      for ancestorID in dirIDs:
+        for seID,( size,files ) in seDict.items():
+          usage = expected.setdefault( ( int(ancestorID),seID ), [0,0] )
+          usage[0] += size
+          usage[1] += files
+
+    req = "SELECT DirID,SEID,SESize,SEFiles FROM FC_DirectoryUsage"
+    result = self.db._query( req )
     if not result['OK']:
       return result
-    dirIDs = result['Value']
-    resultDict = {}
-    for dirID in dirIDs:
-      result = self.__rebuildDirectoryUsage( dirID )
-      if not result['OK']:
-        return result
-      dirDict = result['Value']
-      for seID in dirDict:
-        resultDict.setdefault(seID,{'Size':0,'Files':0})
-        resultDict[seID]['Size'] += dirDict[seID]['Size']
-        resultDict[seID]['Files'] += dirDict[seID]['Files']
-    
-    insertFields = ['DirID','SEID','SESize','SEFiles','LastUpdate']  
-    insertValues = []
-    for seID in resultDict:
-      size = resultDict[seID]['Size']
-      files = resultDict[seID]['Files']
-      req = "UPDATE FC_DirectoryUsage SET SESize=SESize+%d, SEFiles=SEFiles+%d WHERE DirID=%d AND SEID=%d"  
-      req = req % (size,files,directoryID,seID)
+    actual = {}
+    marker = ( USAGE_MARKER_DIRID,LOGICAL_USAGE_SEID )
+    for dirID,seID,size,files in result['Value']:
+      if ( int(dirID),int(seID) ) != marker:
+        actual[( int(dirID),int(seID) )] = ( int(size),int(files) )
+
+    # ( DirID, SEID, SESize, SEFiles, expected SESize, expected SEFiles )
+    mismatches = []
+    toUpdate = []
+    toDelete = []
+    for key in sorted( actual ):
+      if key not in expected:
+        toDelete.append( key )
+        size,files = actual[key]
+        if size or files:
+          mismatches.append( key + ( size,files,0,0 ) )
+    for key in sorted( expected ):
+      size,files = expected[key]
+      if actual.get( key ) != ( size,files ):
+        actualSize,actualFiles = actual.get( key,( 0,0 ) )
+        mismatches.append( key + ( actualSize,actualFiles,size,files ) )
+        toUpdate.append( "(%d,%d,%d,%d,UTC_TIMESTAMP())" % ( key + ( size,files ) ) )
+    if mismatches:
+      gLogger.info( "Found %d directory usage counters out of sync" % len( mismatches ) )
+
+    if repair:
+      for updateChunk in breakListIntoChunks( toUpdate,1000 ):
+        req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) VALUES %s" % ','.join( updateChunk )
+        req += " ON DUPLICATE KEY UPDATE SESize=VALUES(SESize), SEFiles=VALUES(SEFiles), LastUpdate=VALUES(LastUpdate)"
+        result = self.db._update( req )
+        if not result['OK']:
+          return result
+      for deleteChunk in breakListIntoChunks( toDelete,1000 ):
+        req = "DELETE FROM FC_DirectoryUsage WHERE %s" % ' OR '.join( [ "(DirID=%d AND SEID=%d)" % key for key in deleteChunk ] )
+        result = self.db._update( req )
+        if not result['OK']:
+          return result
+      # The logical usage can be trusted from now on
+      req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) VALUES (%d,%d,0,0,UTC_TIMESTAMP())" % marker
+      req += " ON DUPLICATE KEY UPDATE LastUpdate=VALUES(LastUpdate)"
       result = self.db._update( req )
       if not result['OK']:
         return result
-      if not result['Value']:
-        insertValues = [directoryID,seID,size,files] 
-        result = self.db.insertFields( 'FC_DirectoryUsage', insertFields, insertValues )     
+      self.usageCheckTime = 0
+
+    return S_OK( { 'Counters':len( expected ),'Mismatches':mismatches,'Repaired':repair } )
+
+  #####################################################################
+  #
+  #  FC_DirectoryClosure has a row for each directory and each of its ancestors,
+  #  itself included with Depth 0, to select whole subtrees in a join
+  #
+  def _addDirectoryToClosure( self, dirID ):
+    """ Add a new directory below the ancestors of its parent
+    """
+    req = "INSERT INTO FC_DirectoryClosure (AncestorID,DirID,Depth) "
+    req += "SELECT C.AncestorID,T.DirID,C.Depth+1 FROM %s AS T, FC_DirectoryClosure AS C " % self.getTreeTable()
+    req += "WHERE T.DirID=%d AND C.DirID=T.Parent UNION ALL SELECT %d,%d,0" % ( dirID,dirID,dirID )
+    result = self.db._update( req )
+    if not result['OK']:
+      # The queries go back to walking the tree until it's rebuilt
+      self.closureReady = False
+      gLogger.warn( "Failed to add directory %d to the closure table" % dirID, result['Message'] )
+    return result
+
+  def _removeDirectoryFromClosure( self, dirID ):
+    req = "DELETE FROM FC_DirectoryClosure WHERE DirID=%d OR AncestorID=%d" % ( dirID,dirID )
+    return self.db._update( req )
+
+  def _hasDirectoryClosure( self ):
+    """ Check that all the directories are in the closure table. It's checked again
+        every 5 minutes, the directories can be added by other servers failing to
+        update it
+    """
+    if time.time() - self.closureCheckTime < 300:
+      return self.closureReady
+    self.closureCheckTime = time.time()
+    result = self.db._query( "SELECT COUNT(*) FROM %s" % self.getTreeTable() )
+    if not result['OK']:
+      return False
+    dirCount = result['Value'][0][0]
+    result = self.db._query( "SELECT COUNT(*) FROM FC_DirectoryClosure WHERE Depth=0" )
+    if not result['OK']:
+      return False
+    closureCount = result['Value'][0][0]
+    self.closureReady = dirCount > 0 and closureCount == dirCount
+    if dirCount and not self.closureReady:
+      gLogger.warn( "Directory closure table out of sync, metadata queries walk the directory tree",
+                    "%d directories, %d in the closure table, run rebuildDirectoryClosure" % ( dirCount, closureCount ) )
+    return self.closureReady
+
+  def _rebuildDirectoryClosure( self ):
+    """ Recreate the closure table from the directory tree
+    """
+    self.closureReady = False
+    result = self.db._query( "SELECT DirID,Parent FROM %s" % self.getTreeTable() )
+    if not result['OK']:
+      return result
+    children = {}
+    for dirID,parentID in result['Value']:
+      children.setdefault( int(parentID),[] ).append( int(dirID) )
+
+    result = self.db._update( "DELETE FROM FC_DirectoryClosure" )
+    if not result['OK']:
+      return result
+    rows = 0
+    insertList = []
+    # Walk down from the top directories carrying the list of ancestors
+    stack = [ ( dirID,[] ) for dirID in children.get( 0,[] ) ]
+    while stack:
+      dirID,ancestors = stack.pop()
+      ancestors = ancestors + [dirID]
+      depth = len( ancestors ) - 1
+      for ancestorID in ancestors:
+        insertList.append( "(%d,%d,%d)" % ( ancestorID,dirID,depth ) )
+        depth -= 1
+      for childID in children.get( dirID,[] ):
+        stack.append( ( childID,ancestors ) )
+      if len( insertList ) >= 1000 or not stack:
+        req = "INSERT INTO FC_DirectoryClosure (AncestorID,DirID,Depth) VALUES %s" % ','.join( insertList )
+        result = self.db._update( req )
         if not result['OK']:
           return result
-        
-    return S_OK(resultDict)  
-  
+        rows += len( insertList )
+        insertList = []
+
+    self.closureCheckTime = 0
+    self._hasDirectoryClosure()
+    return S_OK( rows )
+
   def getDirectoryCounters( self, connection = False ):
     """ Get the total number of directories
     """
@@ -28,16 +28,17 @@ class FileManager(FileManagerBase):
     dirDict = self._getFileDirectories(lfns)
     failed = {}
     directoryIDs = {}
+    # Resolve all the directories at once
+    res = self.db.dtree.findDirs(dirDict.keys())
     for dirPath in dirDict.keys():
-      res = self.db.dtree.findDir(dirPath)
-      if (not res['OK']) or (not res['Value']):
+      if res['OK'] and dirPath in res['Value']:
+        directoryIDs[dirPath] = res['Value'][dirPath]
+      else:
         error = res.get('Message','No such file or directory')
         for fileName in dirDict[dirPath]:
           fname = '%s/%s' % (dirPath,fileName)
           fname = fname.replace('//','/')
           failed[fname] = error
-      else:
-        directoryIDs[dirPath] = res['Value']
     successful = {}
     for dirPath in directoryIDs.keys():
       fileNames = dirDict[dirPath]
@@ -5,7 +5,8 @@
 __RCSID__ = "$Id$"
 
 from DIRAC                                  import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.List              import stringListToString, intListToString, sortList
+from DIRAC.Core.Utilities.List              import stringListToString, intListToString, sortList, breakListIntoChunks
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import LOGICAL_USAGE_SEID
 from DIRAC.Core.Utilities.Pfn               import pfnparse, pfnunparse
 
 import time, os, stat
@@ -258,55 +259,59 @@ class FileManagerBase:
       if toPurge:
         self._deleteFiles( toPurge, connection = connection )
 
-    # Update storage usage
+    # Update the logical usage, the replicas were accounted when inserted
     dirSEDict = {}
     for lfn in newlyRegistered:
       dirID = lfns[lfn]['DirID']
-      if not dirSEDict.has_key( dirID ):
-        dirSEDict[dirID] = {}
-      res = self.db.seManager.findSE( lfns[lfn]['SE'] )
-      if not res['OK']:
-        continue
-      seID = res['Value']
-      if not dirSEDict[dirID].has_key( seID ):
-        dirSEDict[dirID][seID] = {'Files':0, 'Size':0}
-      dirSEDict[dirID][seID]['Files'] += 1
-      dirSEDict[dirID][seID]['Size'] += lfns[lfn]['Size']
-    #if dirSEDict:
-    #  self._updateDirectoryUsage(dirSEDict,'+',connection=connection)
+      dirSEDict.setdefault( dirID, {} )
+      dirSEDict[dirID].setdefault( LOGICAL_USAGE_SEID, {'Files':0, 'Size':0} )
+      dirSEDict[dirID][LOGICAL_USAGE_SEID]['Files'] += 1
+      dirSEDict[dirID][LOGICAL_USAGE_SEID]['Size'] += lfns[lfn]['Size']
+    if dirSEDict:
+      self._updateDirectoryUsage( dirSEDict, '+', connection = connection )
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
   def _updateDirectoryUsage( self, directorySEDict, change, connection = False ):
+    """ Apply the change of usage of the given directories to them and all their ancestors
+        in FC_DirectoryUsage. directorySEDict is { dirID : { seID : { 'Files':n, 'Size':s } } },
+        the logical usage is kept with SEID LOGICAL_USAGE_SEID.
+    """
     connection = self._getConnection( connection )
-    for directoryID in sortList( directorySEDict.keys() ):
-      result = self.db.tree.getPathIDsByID( directoryID )
+    if change == '+':
+      sign = 1
+    else:
+      sign = -1
+    result = self.db.dtree.findDir( '/' )
+    if not result['OK']:
+      return result
+    rootID = result['Value']
+    usageDict = {}
+    for directoryID in directorySEDict:
+      result = self.db.dtree.getPathIDsByID( directoryID )
       if not result['OK']:
         return result
-      parentIDs = result['Value']
-      dirDict = directorySEDict[directoryID]
-      for seID in sortList( dirDict.keys() ):
-        seDict = dirDict[seID]
-        files = seDict['Files']
-        size = seDict['Size']
-        for dirID in [directoryID] + parentIDs:
-          req = "UPDATE FC_DirectoryUsage SET SESize=SESize%s%d, SEFiles=SEFiles%s%d, LastUpdate=UTC_TIMESTAMP() " \
-                                                           % ( change, size, change, files )
-          req += "WHERE DirID=%d AND SEID=%d;" % ( dirID, seID )
-          res = self.db._update( req )
-          if not res['OK']:
-            gLogger.warn( "Failed to update FC_DirectoryUsage", res['Message'] )
-          if res['Value']:
-            continue
-          if  change != '+':
-            gLogger.warn( "Decrement of usage for DirID,SEID that didnt exist", "%d %d" % ( dirID, seID ) )
-            continue
-          req = "INSERT INTO FC_DirectoryUsage (DirID, SEID, SESize, SEFiles, LastUpdate)"
-          req += " VALUES (%d, %d, %d, %d, UTC_TIMESTAMP());" % ( dirID, seID, size, files )
-          res = self.db._update( req )
-          if not res['OK']:
-            gLogger.warn( "Failed to insert FC_DirectoryUsage", res['Message'] )
+      dirIDs = set( result['Value'] )
+      dirIDs.add( directoryID )
+      if rootID:
+        dirIDs.add( rootID )
+      for seID, seDict in directorySEDict[directoryID].items():
+        for dirID in dirIDs:
+          usage = usageDict.setdefault( ( int( dirID ), int( seID ) ), [0, 0] )
+          usage[0] += seDict['Size']
+          usage[1] += seDict['Files']
+    # Always update the rows in the same order to avoid deadlocks between concurrent updates
+    values = [ "(%d,%d,%d,%d,UTC_TIMESTAMP())" % ( dirID, seID, sign * size, sign * files )
+               for ( dirID, seID ), ( size, files ) in sortList( usageDict.items() ) ]
+    for valueChunk in breakListIntoChunks( values, 1000 ):
+      req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) VALUES %s" % ','.join( valueChunk )
+      req += " ON DUPLICATE KEY UPDATE SESize=SESize+VALUES(SESize), SEFiles=SEFiles+VALUES(SEFiles),"
+      req += " LastUpdate=VALUES(LastUpdate)"
+      res = self.db._update( req, connection )
+      if not res['OK']:
+        gLogger.warn( "Failed to update FC_DirectoryUsage", res['Message'] )
+        return res
     return S_OK()
-    
+
   def _populateFileAncestors( self, lfns, connection = False ):
     connection = self._getConnection( connection )
     successful = {}
@@ -568,6 +573,12 @@ class FileManagerBase:
           directorySESizeDict[dirID][seID] = {'Files':0, 'Size':0}
         directorySESizeDict[dirID][seID]['Size'] += size
         directorySESizeDict[dirID][seID]['Files'] += 1
+    for lfn, lfnDict in lfns.items():
+      dirID = lfnDict['DirID']
+      directorySESizeDict.setdefault( dirID, {} )
+      directorySESizeDict[dirID].setdefault( LOGICAL_USAGE_SEID, {'Files':0, 'Size':0} )
+      directorySESizeDict[dirID][LOGICAL_USAGE_SEID]['Size'] += lfnDict['Size']
+      directorySESizeDict[dirID][LOGICAL_USAGE_SEID]['Files'] += 1
 
     # Now do removal  
     res = self._deleteFiles( fileIDLfns.keys(), connection = connection )
@@ -704,14 +715,22 @@ class FileManagerBase:
         continue
       newSE = info['NewSE']
       se = info['SE']
-      res = self._findFiles( [lfn], ['FileID'], connection = connection )
+      res = self._findFiles( [lfn], ['FileID', 'DirID', 'Size'], connection = connection )
       if not res['Value']['Successful'].has_key( lfn ):
         failed[lfn] = res['Value']['Failed'][lfn]
         continue
-      fileID = res['Value']['Successful'][lfn]['FileID']
+      fileDict = res['Value']['Successful'][lfn]
+      fileID = fileDict['FileID']
       res = self._setReplicaHost( fileID, se, newSE, connection = connection )
       if res['OK']:
         successful[lfn] = res['Value']
+        # Move the replica usage to the new SE
+        oldSEID = self.db.seManager.findSE( se )
+        newSEID = self.db.seManager.findSE( newSE )
+        if res['Value'] and oldSEID['OK'] and newSEID['OK']:
+          usageDict = {'Files':1, 'Size':fileDict['Size']}
+          self._updateDirectoryUsage( {fileDict['DirID']:{oldSEID['Value']:usageDict}}, '-', connection = connection )
+          self._updateDirectoryUsage( {fileDict['DirID']:{newSEID['Value']:usageDict}}, '+', connection = connection )
       else:
         failed[lfn] = res['Message']
     return S_OK( {'Successful':successful, 'Failed':failed} )
@@ -25,15 +25,15 @@ class FileManagerFlat(FileManagerBase):
     dirDict = self._getFileDirectories(lfns)
     failed = {}
     directoryIDs = {}
+    # Resolve all the directories at once
+    res = self.db.dtree.findDirs(dirDict.keys())
     for dirPath in dirDict.keys():
-      startTime = time.time()
-      res = self.db.dtree.findDir(dirPath)
-      if (not res['OK']) or (not res['Value']):
+      if res['OK'] and dirPath in res['Value']:
+        directoryIDs[dirPath] = res['Value'][dirPath]
+      else:
         error = res.get('Message','No such file or directory')
         for fileName in dirDict[dirPath]:
           failed['%s/%s' % (dirPath,fileName)] = error
-      else:
-        directoryIDs[dirPath] = res['Value']
     successful = {}
     for dirPath in directoryIDs.keys():
       fileNames = dirDict[dirPath]
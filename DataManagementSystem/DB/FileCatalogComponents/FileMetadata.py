@@ -10,16 +10,19 @@ __RCSID__ = "$Id$"
 
 import time, os, types
 from DIRAC import S_OK, S_ERROR
-from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime, createMetaSelection
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.MetaQueryPlanner import MetaQueryPlanner
 
 class FileMetadata:
 
   def __init__(self,database = None):
           
     self.db = database
+    self.planner = MetaQueryPlanner( database )
     
   def setDatabase( self, database ):
     self.db = database
+    self.planner.setDatabase( database )
         
 ##############################################################################
 #
@@ -292,50 +295,12 @@ class FileMetadata:
     result = self.db._update( req )
     return result
 
-  def __createMetaSelection( self,meta,value,table='' ):
-
-    if type( value ) == types.DictType:
-      selectList = []
-      for operation, operand in value.items():
-        if operation in ['>', '<', '>=', '<=']:
-          if type( operand ) == types.ListType:
-            return S_ERROR( 'Illegal query: list of values for comparison operation' )
-          if type( operand ) in [types.IntType, types.LongType]:
-            selectList.append( "%sValue%s%d" % ( table, operation, operand ) )
-          elif type( operand ) == types.FloatType:
-            selectList.append( "%sValue%s%f" % ( table, operation, operand ) )
-          else:
-            selectList.append( "%sValue%s'%s'" % ( table, operation, operand ) )
-        elif operation == 'in' or operation == "=":
-          if type( operand ) == types.ListType:
-            vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
-            selectList.append( "%sValue IN (%s)" % ( table, vString) )
-          else:
-            selectList.append( "%sValue='%s'" % ( table, operand ) )
-        elif operation == 'nin' or operation == "!=":
-          if type( operand ) == types.ListType:
-            vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
-            selectList.append( "%sValue NOT IN (%s)" % ( table, vString ) )
-          else:
-            selectList.append( "%sValue!='%s'" % ( table, operand ) )
-        selectString = ' AND '.join( selectList )
-    elif type( value ) == types.ListType:
-      vString = ','.join( [ "'" + str( x ) + "'" for x in value] )
-      selectString = "%sValue in %s" % ( table, vString )
-    else:
-      if value == "Any":
-        selectString = ''
-      else:
-        selectString = "%sValue='%s' " % ( table, value )
-
-    return S_OK(selectString)
-
   def __findFilesForMetaValue( self, meta, value, dirList ):
     """ Find files in the given list of directories corresponding to the given
         selection criteria
     """
 
-    result = self.__createMetaSelection( meta, value, "M." )
+    result = createMetaSelection( value, "M.Value" )
     if not result['OK']:
       return result
     selectString = result['Value']
@@ -390,6 +355,34 @@ class FileMetadata:
 
     return S_OK(fileList)
 
+  def __findFilesByMetaQuery( self, metaDict, path, credDict ):
+    """ Find files satisfying the directory and file metadata with one query of the planner
+    """
+    pathDirID = 0
+    if path != '/':
+      result = self.db.dtree.findDir( path )
+      if not result['OK']:
+        return result
+      if not result['Value']:
+        return S_OK( [] )
+      pathDirID = int( result['Value'] )
+
+    result = self.db.dmeta.expandMetaQuery( metaDict, credDict )
+    if not result['OK']:
+      return result
+    dirMetaDict = result['Value']
+    result = self.getFileMetadataFields( credDict )
+    if not result['OK']:
+      return result
+    fileMetaDict = {}
+    for key,value in metaDict.items():
+      if key in result['Value']:
+        fileMetaDict[key] = value
+
+    if not dirMetaDict and not fileMetaDict and not pathDirID:
+      return S_OK( [] )
+    return self.planner.findFiles( dirMetaDict, fileMetaDict, pathDirID )
+
   @queryTime
   def findFilesByMetadata( self, metaDict, path, credDict ):
     """ Find Files satisfying the given metadata
@@ -400,6 +393,9 @@ class FileMetadata:
     if not path:
       path = '/'
 
+    if self.planner.isAvailable():
+      return self.__findFilesByMetaQuery( metaDict, path, credDict )
+
     result = self.db.dmeta.findDirIDsByMetadata( metaDict, path, credDict )
     if not result['OK']:
       return result
@@ -0,0 +1,245 @@
+########################################################################
+# $HeadURL$
+########################################################################
+
+""" DIRAC FileCatalog metadata query planner
+
+    A metadata query is turned into one SQL statement joining the metadata
+    index tables FC_Meta_<name> and FC_FileMeta_<name>. The directory metadata
+    is inherited by the subdirectories through FC_DirectoryClosure. The terms
+    are joined starting from the one selecting the fewest files, estimated from
+    the recursive usage counters of the directories and the value indexes.
+"""
+
+__RCSID__ = "$Id$"
+
+from DIRAC import S_OK
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import LOGICAL_USAGE_SEID, createMetaSelection
+
+# The estimates don't count further than this
+MAX_ESTIMATE = 100000
+
+class MetaQueryPlanner:
+
+  def __init__( self, database = None ):
+    self.db = database
+
+  def setDatabase( self, database ):
+    self.db = database
+
+  def isAvailable( self ):
+    """ The planner needs the complete directory closure table
+    """
+    return self.db.dtree._hasDirectoryClosure()
+
+  def __estimateDirTerm( self, meta, selection ):
+    """ Get the number of directories defining the meta datum with the selected values
+        and the number of files they contain
+    """
+    req = "SELECT DirID FROM FC_Meta_%s" % meta
+    if selection:
+      req += " WHERE %s" % selection
+    req = "SELECT COUNT(*),SUM(U.SEFiles) FROM ( %s LIMIT %d ) AS M " % ( req, MAX_ESTIMATE )
+    req += "LEFT JOIN FC_DirectoryUsage AS U ON U.DirID=M.DirID AND U.SEID=%d" % LOGICAL_USAGE_SEID
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    dirs, files = result['Value'][0]
+    if files is None:
+      files = dirs
+    return S_OK( ( int( dirs ), int( files ) ) )
+
+  def __estimateFileTerm( self, meta, selection ):
+    """ Get the number of files with the selected meta datum values
+    """
+    req = "SELECT FileID FROM FC_FileMeta_%s" % meta
+    if selection:
+      req += " WHERE %s" % selection
+    result = self.db._query( "SELECT COUNT(*) FROM ( %s LIMIT %d ) AS M" % ( req, MAX_ESTIMATE ) )
+    if not result['OK']:
+      return result
+    return S_OK( int( result['Value'][0][0] ) )
+
+  def __estimatePath( self, pathDirID ):
+    req = "SELECT SEFiles FROM FC_DirectoryUsage WHERE DirID=%d AND SEID=%d" % ( pathDirID, LOGICAL_USAGE_SEID )
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK( MAX_ESTIMATE )
+    return S_OK( int( result['Value'][0][0] ) )
+
+  def __getTerms( self, dirMetaDict, fileMetaDict, pathDirID ):
+    """ Get the positive terms of the query with their estimated number of files, and the
+        metadata that has to be missing. None if a term selects nothing
+    """
+    terms = []
+    missing = []
+    index = 0
+    for meta, value in dirMetaDict.items():
+      if value == "Missing":
+        missing.append( ( 'Dir', meta ) )
+        continue
+      index += 1
+      result = createMetaSelection( value, "Value" )
+      if not result['OK']:
+        return result
+      result = self.__estimateDirTerm( meta, result['Value'] )
+      if not result['OK']:
+        return result
+      dirs, files = result['Value']
+      if not dirs:
+        return S_OK( None )
+      result = createMetaSelection( value, "M%d.Value" % index )
+      conditions = [ "C%d.AncestorID=M%d.DirID" % ( index, index ) ]
+      if result['Value']:
+        conditions.append( result['Value'] )
+      terms.append( { 'Type' : 'Dir',
+                      'Estimate' : files,
+                      'Tables' : [ "FC_Meta_%s AS M%d" % ( meta, index ), "FC_DirectoryClosure AS C%d" % index ],
+                      'Conditions' : conditions,
+                      'DirColumn' : "C%d.DirID" % index } )
+    if pathDirID:
+      result = self.__estimatePath( pathDirID )
+      if not result['OK']:
+        return result
+      terms.append( { 'Type' : 'Dir',
+                      'Estimate' : result['Value'],
+                      'Tables' : [ "FC_DirectoryClosure AS P" ],
+                      'Conditions' : [ "P.AncestorID=%d" % pathDirID ],
+                      'DirColumn' : "P.DirID" } )
+    for meta, value in fileMetaDict.items():
+      if value == "Missing":
+        missing.append( ( 'File', meta ) )
+        continue
+      index += 1
+      result = createMetaSelection( value, "Value" )
+      if not result['OK']:
+        return result
+      result = self.__estimateFileTerm( meta, result['Value'] )
+      if not result['OK']:
+        return result
+      if not result['Value']:
+        return S_OK( None )
+      estimate = result['Value']
+      result = createMetaSelection( value, "FM%d.Value" % index )
+      conditions = [ "FM%d.FileID=F.FileID" % index ]
+      if result['Value']:
+        conditions.append( result['Value'] )
+      terms.append( { 'Type' : 'File',
+                      'Estimate' : estimate,
+                      'Tables' : [ "FC_FileMeta_%s AS FM%d" % ( meta, index ) ],
+                      'Conditions' : conditions } )
+
+    # The cheapest first, MySQL is told to keep this order
+    terms.sort( key = lambda term: term['Estimate'] )
+    return S_OK( ( terms, missing ) )
+
+  def __buildQuery( self, terms, missing, withFiles ):
+    """ Get the FROM and WHERE parts of the query and the directory ID column
+    """
+    tables = []
+    conditions = []
+    dirColumn = ''
+    filesJoined = False
+    for term in terms:
+      tables += term['Tables']
+      conditions += term['Conditions']
+      if term['Type'] == 'File' and not filesJoined:
+        tables.append( "FC_Files AS F" )
+        filesJoined = True
+        if not dirColumn:
+          dirColumn = "F.DirID"
+      elif term['Type'] == 'Dir':
+        if dirColumn:
+          conditions.append( "%s=%s" % ( term['DirColumn'], dirColumn ) )
+        else:
+          dirColumn = term['DirColumn']
+    if withFiles and not filesJoined:
+      tables.append( "FC_Files AS F" )
+      filesJoined = True
+    if not dirColumn:
+      if filesJoined:
+        dirColumn = "F.DirID"
+      else:
+        tables.append( "%s AS T" % self.db.dtree.getTreeTable() )
+        dirColumn = "T.DirID"
+    if filesJoined and dirColumn != "F.DirID":
+      conditions.append( "F.DirID=%s" % dirColumn )
+    if withFiles:
+      # The directory names, looked up last by the primary key
+      tables.append( "%s AS D" % self.db.dtree.getTreeTable() )
+      conditions.append( "D.DirID=F.DirID" )
+
+    for index, ( metaType, meta ) in enumerate( missing ):
+      if metaType == 'Dir':
+        req = "SELECT XC%d.AncestorID FROM FC_DirectoryClosure AS XC%d, FC_Meta_%s AS XM%d " % ( index, index, meta, index )
+        req += "WHERE XC%d.DirID=%s AND XM%d.DirID=XC%d.AncestorID" % ( index, dirColumn, index, index )
+      else:
+        req = "SELECT XM%d.FileID FROM FC_FileMeta_%s AS XM%d WHERE XM%d.FileID=F.FileID" % ( index, meta, index, index )
+      conditions.append( "NOT EXISTS ( %s )" % req )
+
+    req = "FROM %s" % ', '.join( tables )
+    if conditions:
+      req += " WHERE %s" % ' AND '.join( conditions )
+    return S_OK( ( req, dirColumn ) )
+
+  def findDirectories( self, dirMetaDict, pathDirID = 0 ):
+    """ Get the IDs of the directories satisfying the directory metadata query,
+        pathDirID and its subdirectories only if given
+    """
+    result = self.__getTerms( dirMetaDict, {}, pathDirID )
+    if not result['OK']:
+      return result
+    if result['Value'] is None:
+      return S_OK( [] )
+    terms, missing = result['Value']
+    result = self.__buildQuery( terms, missing, False )
+    if not result['OK']:
+      return result
+    fromWhere, dirColumn = result['Value']
+    result = self.db._query( "SELECT STRAIGHT_JOIN DISTINCT %s %s" % ( dirColumn, fromWhere ) )
+    if not result['OK']:
+      return result
+    return S_OK( [ row[0] for row in result['Value'] ] )
+
+  def findFiles( self, dirMetaDict, fileMetaDict, pathDirID = 0 ):
+    """ Get the files satisfying the directory and file metadata query, only those
+        below pathDirID if given. The result is { directory path : [ file names ] }
+    """
+    result = self.__getTerms( dirMetaDict, fileMetaDict, pathDirID )
+    if not result['OK']:
+      return result
+    if result['Value'] is None:
+      return S_OK( {} )
+    terms, missing = result['Value']
+    result = self.__buildQuery( terms, missing, True )
+    if not result['OK']:
+      return result
+    fromWhere = result['Value'][0]
+    result = self.db._query( "SELECT STRAIGHT_JOIN DISTINCT D.DirName, F.FileName %s" % fromWhere )
+    if not result['OK']:
+      return result
+    lfnDict = {}
+    for dirName, fileName in result['Value']:
+      lfnDict.setdefault( dirName, [] ).append( fileName )
+    return S_OK( lfnDict )
+
+  def findCompatibleDirectories( self, meta, value ):
+    """ Get the IDs of the directories where the meta datum can take the value: the ones
+        defining it, their subdirectories and their parent directories
+    """
+    result = createMetaSelection( value, "M.Value" )
+    if not result['OK']:
+      return result
+    selection = result['Value']
+    reqList = []
+    for dirColumn, joinColumn in ( ( 'DirID', 'AncestorID' ), ( 'AncestorID', 'DirID' ) ):
+      req = "SELECT C.%s FROM FC_Meta_%s AS M, FC_DirectoryClosure AS C WHERE C.%s=M.DirID" % ( dirColumn, meta, joinColumn )
+      if selection:
+        req += " AND %s" % selection
+      reqList.append( req )
+    result = self.db._query( ' UNION '.join( reqList ) )
+    if not result['OK']:
+      return result
+    return S_OK( [ row[0] for row in result['Value'] ] )
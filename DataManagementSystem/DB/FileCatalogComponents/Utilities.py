@@ -16,6 +16,12 @@ import random, os, time
 from types import *
 from DIRAC import S_OK, S_ERROR
 
+# SEID of the FC_DirectoryUsage rows holding the logical usage of the directories
+LOGICAL_USAGE_SEID = 0
+# DirID of the FC_DirectoryUsage row marking the logical usage as complete, written
+# when the counters are rebuilt from the file tables
+USAGE_MARKER_DIRID = 0
+
 def checkArgumentFormat( path ):
   """ Bring the various possible form of arguments to FileCatalog methods to
       the standard dictionary form
@@ -57,6 +63,40 @@ def checkArgumentDict( path ):
     return S_ERROR( "checkArgumentDict: Supplied path is not of the correct format" )
   return S_OK( urls )
 
+def createMetaSelection( value, column = 'Value' ):
+  """ Get the SQL condition on the column for a metadata query value, empty for 'Any'
+  """
+  selectList = []
+  if type( value ) == DictType:
+    for operation, operand in value.items():
+      if operation in ['>', '<', '>=', '<=']:
+        if type( operand ) == ListType:
+          return S_ERROR( 'Illegal query: list of values for comparison operation' )
+        if type( operand ) in [IntType, LongType]:
+          selectList.append( "%s%s%d" % ( column, operation, operand ) )
+        elif type( operand ) == FloatType:
+          selectList.append( "%s%s%f" % ( column, operation, operand ) )
+        else:
+          selectList.append( "%s%s'%s'" % ( column, operation, operand ) )
+      elif operation == 'in' or operation == "=":
+        if type( operand ) == ListType:
+          vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
+          selectList.append( "%s IN (%s)" % ( column, vString ) )
+        else:
+          selectList.append( "%s='%s'" % ( column, operand ) )
+      elif operation == 'nin' or operation == "!=":
+        if type( operand ) == ListType:
+          vString = ','.join( [ "'" + str( x ) + "'" for x in operand] )
+          selectList.append( "%s NOT IN (%s)" % ( column, vString ) )
+        else:
+          selectList.append( "%s!='%s'" % ( column, operand ) )
+  elif type( value ) == ListType:
+    vString = ','.join( [ "'" + str( x ) + "'" for x in value] )
+    selectList.append( "%s IN (%s)" % ( column, vString ) )
+  elif value != "Any":
+    selectList.append( "%s='%s'" % ( column, value ) )
+  return S_OK( ' AND '.join( selectList ) )
+
 def generateGuid( checksum, checksumtype ):
   """ Generate a GUID based on the file checksum
   """
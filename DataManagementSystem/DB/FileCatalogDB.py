@@ -13,6 +13,7 @@ from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectorySimpleTree   i
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryNodeTree     import DirectoryNodeTree 
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryLevelTree    import DirectoryLevelTree
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryFlatTree     import DirectoryFlatTree
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryCache        import DirectoryCache
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManagerFlat       import FileManagerFlat
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManager           import FileManager
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.SEManager             import SEManagerCS,SEManagerDB
@@ -54,6 +55,10 @@ class FileCatalogDB(DB):
     self.umask = databaseConfig['DefaultUmask']
     self.visibleStatus = databaseConfig['VisibleStatus']
 
+    # Directory tree cache shared by the components, disabled unless configured
+    self.dirCache = DirectoryCache( maxSize = databaseConfig.get( 'DirectoryCacheSize', 0 ),
+                                    lifeTime = databaseConfig.get( 'DirectoryCacheLifeTime', 3600 ) )
+
     try:
       # Obtain the plugins to be used for DB interaction
       self.ugManager = eval("%s(self)" % databaseConfig['UserGroupManager'])
@@ -549,6 +554,17 @@ class FileCatalogDB(DB):
     
     result = self.dtree._rebuildDirectoryUsage()
     return result
+
+  def checkDirectoryUsage(self,repair=False):
+    """ Check the DirectoryUsage counters against the file and replica tables,
+        fix the differences if repair is True
+    """
+    return self.dtree._checkDirectoryUsage(repair)
+
+  def rebuildDirectoryClosure(self):
+    """ Rebuild DirectoryClosure table used by the metadata queries from scratch
+    """
+    return self.dtree._rebuildDirectoryClosure()
     
   #######################################################################
   #
@@ -225,6 +225,7 @@ CREATE TABLE FC_DirectoryLevelTree (
 );
 
 -- ------------------------------------------------------------------------------
+-- Recursive usage of the directories per SE, SEID 0 holds the logical usage
 DROP TABLE IF EXISTS FC_DirectoryUsage;
 CREATE TABLE FC_DirectoryUsage(
    DirID INTEGER NOT NULL,
@@ -236,6 +237,20 @@ CREATE TABLE FC_DirectoryUsage(
    LastUpdate DATETIME NOT NULL,
    PRIMARY KEY (DirID,SEID)
 );
+-- The logical usage (SEID 0) of a new catalog is complete
+INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) VALUES (0,0,0,0,UTC_TIMESTAMP());
+
+-- ------------------------------------------------------------------------------
+-- Each directory with each of its ancestors and itself at Depth 0, used to resolve
+-- the inherited directory metadata
+DROP TABLE IF EXISTS FC_DirectoryClosure;
+CREATE TABLE FC_DirectoryClosure(
+   AncestorID INTEGER NOT NULL,
+   DirID INTEGER NOT NULL,
+   Depth INTEGER NOT NULL,
+   PRIMARY KEY (AncestorID,DirID),
+   INDEX(DirID)
+);
 
 -- ------------------------------------------------------------------------------
 drop table if exists FC_MetaFields;
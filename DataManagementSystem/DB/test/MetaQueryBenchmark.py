@@ -0,0 +1,142 @@
+########################################################################
+# $HeadURL $
+# File: MetaQueryBenchmark.py
+########################################################################
+
+""" :mod: MetaQueryBenchmark
+    =========================
+
+    .. module: MetaQueryBenchmark
+    :synopsis: metadata queries of the FileCatalogDB on a synthetic catalog
+
+    Run it with python MetaQueryBenchmark.py [ numFiles ] against an empty test
+    FileCatalogDB defined in the local configuration. The catalog gets
+    /bench/<production>/<data type>/<run> directories with directory metadata
+    defined at each level and files with two file metadata, then the same
+    queries are timed with the query planner and with the tree walking queries
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+from DIRAC.Core.Base import Script
+Script.parseCommandLine( ignoreErrors = True )
+
+import time
+import random
+from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
+
+CRED_DICT = { 'username' : 'bench', 'group' : 'bench', 'properties' : [ 'FileCatalogManagement' ] }
+DATA_TYPES = [ 'RAW', 'SIM', 'DST', 'MDST' ]
+
+CONFIG = { 'UserGroupManager' : 'UserAndGroupManagerDB',
+           'SEManager' : 'SEManagerDB',
+           'SecurityManager' : 'NoSecurityManager',
+           'DirectoryManager' : 'DirectoryLevelTree',
+           'FileManager' : 'FileManager',
+           'DirectoryMetadata' : 'DirectoryMetadata',
+           'FileMetadata' : 'FileMetadata',
+           'UniqueGUID' : False,
+           'GlobalReadAccess' : True,
+           'LFNPFNConvention' : True,
+           'ResolvePFN' : True,
+           'DefaultUmask' : 0775,
+           'VisibleStatus' : [ 'AprioriGood' ] }
+
+def check( result ):
+  if not result[ 'OK' ]:
+    raise RuntimeError( result[ 'Message' ] )
+  return result[ 'Value' ]
+
+def populate( db, numFiles, numProductions = 20, numRuns = 50 ):
+  """ create the synthetic catalog, about numFiles / numProductions / 4 / numRuns files per run directory """
+  for meta, metaType in ( ( 'BenchProduction', 'INT' ), ( 'BenchDataType', 'VARCHAR(16)' ),
+                          ( 'BenchRunNumber', 'INT' ) ):
+    check( db.dmeta.addMetadataField( meta, metaType, CRED_DICT ) )
+  for meta in ( 'BenchQuality', 'BenchEvents' ):
+    check( db.fmeta.addMetadataField( meta, 'INT', CRED_DICT ) )
+
+  runDirs = []
+  run = 0
+  for production in range( numProductions ):
+    prodPath = '/bench/prod%04d' % production
+    check( db.dtree.makeDirectories( prodPath, CRED_DICT ) )
+    check( db.dmeta.setMetadata( prodPath, { 'BenchProduction' : production }, CRED_DICT ) )
+    for dataType in DATA_TYPES:
+      typePath = '%s/%s' % ( prodPath, dataType )
+      check( db.dtree.makeDirectories( typePath, CRED_DICT ) )
+      check( db.dmeta.setMetadata( typePath, { 'BenchDataType' : dataType }, CRED_DICT ) )
+      for _i in range( numRuns ):
+        run += 1
+        runPath = '%s/%06d' % ( typePath, run )
+        dirID = check( db.dtree.makeDirectories( runPath, CRED_DICT ) )
+        check( db.dmeta.setMetadata( runPath, { 'BenchRunNumber' : run }, CRED_DICT ) )
+        runDirs.append( int( dirID ) )
+
+  uid, gid = check( db.ugManager.getUserAndGroupID( CRED_DICT ) )
+  result = db._query( "SELECT MAX(FileID) FROM FC_Files" )
+  fileID = check( result )[0][0] or 0
+  rand = random.Random( 1234 )
+  fileRows = []
+  qualityRows = []
+  eventRows = []
+  for i in xrange( numFiles ):
+    fileID += 1
+    fileRows.append( ( fileID, runDirs[ i % len( runDirs ) ], 1000, uid, gid, 0, 'file%08d' % i ) )
+    qualityRows.append( ( fileID, rand.randint( 0, 9 ) ) )
+    eventRows.append( ( fileID, rand.randint( 1, 100000 ) ) )
+    if len( fileRows ) == 10000 or i == numFiles - 1:
+      check( db.insertFieldsBulk( 'FC_Files', [ 'FileID', 'DirID', 'Size', 'UID', 'GID', 'Status', 'FileName' ],
+                                  fileRows ) )
+      check( db.insertFieldsBulk( 'FC_FileMeta_BenchQuality', [ 'FileID', 'Value' ], qualityRows ) )
+      check( db.insertFieldsBulk( 'FC_FileMeta_BenchEvents', [ 'FileID', 'Value' ], eventRows ) )
+      fileRows = []
+      qualityRows = []
+      eventRows = []
+  check( db.rebuildDirectoryUsage() )
+  check( db.rebuildDirectoryClosure() )
+  return run
+
+def timeQuery( db, metaDict, path, usePlanner ):
+  """ run the query with or without the planner, return the time and the number of files """
+  if usePlanner:
+    db.dtree.closureCheckTime = 0
+  else:
+    db.dtree.closureReady = False
+    db.dtree.closureCheckTime = time.time()
+  start = time.time()
+  result = check( db.fmeta.findFilesByMetadata( metaDict, path, CRED_DICT ) )
+  elapsed = time.time() - start
+  if type( result ) == type( {} ):
+    count = sum( [ len( fileNames ) for fileNames in result.values() ] )
+  else:
+    count = len( result )
+  return elapsed, count
+
+def benchmark( numFiles = 1000000 ):
+  db = FileCatalogDB()
+  check( db.setConfig( CONFIG ) )
+  start = time.time()
+  lastRun = populate( db, numFiles )
+  print "%d files catalogued in %.1f s" % ( numFiles, time.time() - start )
+
+  queries = [ ( { 'BenchDataType' : 'DST' }, '/' ),
+              ( { 'BenchProduction' : 3, 'BenchDataType' : 'DST' }, '/' ),
+              ( { 'BenchProduction' : [ 3, 4, 5 ], 'BenchDataType' : 'RAW', 'BenchQuality' : { '>' : 7 } }, '/' ),
+              ( { 'BenchRunNumber' : { '>' : lastRun / 2, '<' : lastRun / 2 + 20 }, 'BenchQuality' : 9 }, '/' ),
+              ( { 'BenchEvents' : { '<' : 100 } }, '/bench/prod0007' ),
+              ( { 'BenchProduction' : 2, 'BenchQuality' : { 'nin' : [ 0, 1 ] } }, '/' ) ]
+  print "%10s %10s %9s  %s" % ( "planner", "tree walk", "files", "query" )
+  for metaDict, path in queries:
+    plannerTime, plannerCount = timeQuery( db, metaDict, path, True )
+    walkTime, walkCount = timeQuery( db, metaDict, path, False )
+    if plannerCount != walkCount:
+      print "Different number of files: %d with the planner, %d walking the tree" % ( plannerCount, walkCount )
+    print "%9.3fs %9.3fs %9d  %s %s" % ( plannerTime, walkTime, plannerCount, path, metaDict )
+
+if __name__ == "__main__":
+  numFiles = 1000000
+  args = Script.getPositionalArgs()
+  if args:
+    numFiles = int( args[0] )
+  benchmark( numFiles )
@@ -0,0 +1,64 @@
+""" Unit tests of the FileCatalog directory cache
+"""
+
+import unittest
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryCache import DirectoryCache
+
+class DirectoryCacheTestCase( unittest.TestCase ):
+
+  def test_disabledByDefault( self ):
+    cache = DirectoryCache()
+    self.assertEqual( cache.maxSize, 0 )
+    cache.addDirectory( '/vo/dir', 10, 2, 1 )
+    cache.addParameters( 10, { 'Owner' : 'user' } )
+    self.assertEqual( cache.getDirectory( '/vo/dir' ), None )
+    self.assertEqual( cache.getPath( 10 ), None )
+    self.assertEqual( cache.getParameters( 10 ), None )
+
+  def test_directories( self ):
+    cache = DirectoryCache( maxSize = 10 )
+    cache.addDirectory( '/vo/dir', '10', 2, 1 )
+    self.assertEqual( cache.getDirectory( '/vo/dir' ), ( 10, 2, 1 ) )
+    self.assertEqual( cache.getPath( 10 ), ( '/vo/dir', 2, 1 ) )
+    cache.addDirectory( '/vo/none', 0 )
+    self.assertEqual( cache.getDirectory( '/vo/none' ), None )
+
+  def test_parameters( self ):
+    cache = DirectoryCache( maxSize = 10 )
+    params = { 'Owner' : 'user' }
+    cache.addParameters( 10, params )
+    params[ 'Owner' ] = 'other'
+    cached = cache.getParameters( 10 )
+    self.assertEqual( cached, { 'Owner' : 'user' } )
+    cached[ 'Owner' ] = 'other'
+    self.assertEqual( cache.getParameters( 10 ), { 'Owner' : 'user' } )
+    cache.invalidateParameters( 10 )
+    self.assertEqual( cache.getParameters( 10 ), None )
+
+  def test_remove( self ):
+    cache = DirectoryCache( maxSize = 10 )
+    cache.addDirectory( '/vo/a', 10, 2, 1 )
+    cache.addParameters( 10, { 'Owner' : 'user' } )
+    cache.addDirectory( '/vo/b', 11, 2, 1 )
+    cache.removeDirectory( path = '/vo/a' )
+    self.assertEqual( cache.getDirectory( '/vo/a' ), None )
+    self.assertEqual( cache.getPath( 10 ), None )
+    self.assertEqual( cache.getParameters( 10 ), None )
+    cache.removeDirectory( dirID = 11 )
+    self.assertEqual( cache.getDirectory( '/vo/b' ), None )
+    self.assertEqual( cache.getPath( 11 ), None )
+
+  def test_sizeAndClear( self ):
+    cache = DirectoryCache( maxSize = 2 )
+    for dirID in range( 1, 4 ):
+      cache.addDirectory( '/vo/%s' % dirID, dirID )
+    self.assertEqual( cache.getDirectory( '/vo/1' ), None )
+    self.assertEqual( cache.getDirectory( '/vo/3' ), ( 3, None, None ) )
+    cache.clear()
+    self.assertEqual( cache.getDirectory( '/vo/3' ), None )
+    self.assertEqual( cache.getPath( 3 ), None )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,97 @@
+""" Unit tests of the FileCatalog directory closure table,
+    the MySQL statements are run on an in memory sqlite database
+"""
+
+import unittest, sqlite3
+from DIRAC import S_OK
+import DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryTreeBase as DirectoryTreeBaseModule
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryTreeBase import DirectoryTreeBase
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectorySimpleTree import DirectorySimpleTree
+
+class FakeDirCache:
+
+  def removeDirectory( self, path, dirID ):
+    pass
+
+class FakeDB:
+
+  def __init__( self ):
+    self.conn = sqlite3.connect( ':memory:' )
+    self.conn.execute( "CREATE TABLE FC_DirectoryLevelTree( DirID INTEGER PRIMARY KEY, Parent INTEGER )" )
+    self.conn.execute( "CREATE TABLE FC_DirectoryTree( DirID INTEGER PRIMARY KEY, DirName VARCHAR(255), Parent INTEGER )" )
+    self.conn.execute( "CREATE TABLE FC_DirectoryClosure( AncestorID INTEGER, DirID INTEGER, Depth INTEGER )" )
+    self.dirCache = FakeDirCache()
+
+  def _query( self, req, connection = False ):
+    return S_OK( tuple( self.conn.execute( req ).fetchall() ) )
+
+  def _update( self, req, connection = False ):
+    return S_OK( self.conn.execute( req ).rowcount )
+
+class DirectoryClosureTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeDB()
+    self.tree = DirectoryTreeBase( self.db )
+    self.tree.treeTable = 'FC_DirectoryLevelTree'
+    # / -> /a -> /a/b
+    for dirID, parentID in ( ( 1, 0 ), ( 2, 1 ), ( 3, 2 ) ):
+      self.addDirectory( dirID, parentID )
+
+  def addDirectory( self, dirID, parentID ):
+    self.db.conn.execute( "INSERT INTO FC_DirectoryLevelTree VALUES (%d,%d)" % ( dirID, parentID ) )
+
+  def ancestors( self, dirID ):
+    req = "SELECT AncestorID, Depth FROM FC_DirectoryClosure WHERE DirID=%d ORDER BY Depth" % dirID
+    return self.db._query( req )['Value']
+
+  def test_rebuild( self ):
+    """ every directory is below all its ancestors, new directories too """
+    self.failIf( self.tree._hasDirectoryClosure() )
+    result = self.tree._rebuildDirectoryClosure()
+    self.assert_( result['OK'] )
+    self.assertEqual( result['Value'], 6 )
+    self.assert_( self.tree._hasDirectoryClosure() )
+    self.assertEqual( self.ancestors( 3 ), ( ( 3, 0 ), ( 2, 1 ), ( 1, 2 ) ) )
+    self.addDirectory( 4, 3 )
+    self.assert_( self.tree._addDirectoryToClosure( 4 )['OK'] )
+    self.assertEqual( self.ancestors( 4 ), ( ( 4, 0 ), ( 3, 1 ), ( 2, 2 ), ( 1, 3 ) ) )
+
+  def test_recheck( self ):
+    """ a directory missing from the closure table is noticed even once it was complete, and logged """
+    self.tree._rebuildDirectoryClosure()
+    self.assert_( self.tree._hasDirectoryClosure() )
+    # Another server failed to add it
+    self.addDirectory( 4, 3 )
+    self.assert_( self.tree._hasDirectoryClosure() )
+    self.tree.closureCheckTime -= 300
+    warnings = []
+    warn = DirectoryTreeBaseModule.gLogger.warn
+    DirectoryTreeBaseModule.gLogger.warn = lambda msg, varMsg = '' : warnings.append( varMsg )
+    try:
+      self.failIf( self.tree._hasDirectoryClosure() )
+    finally:
+      DirectoryTreeBaseModule.gLogger.warn = warn
+    self.assertEqual( len( warnings ), 1 )
+    self.assert_( "4 directories, 3 in the closure table" in warnings[0] )
+    self.tree._addDirectoryToClosure( 4 )
+    self.tree.closureCheckTime -= 300
+    self.assert_( self.tree._hasDirectoryClosure() )
+
+  def test_simpleTree( self ):
+    """ the removed directories leave the closure table with the trees not using levels too """
+    tree = DirectorySimpleTree( self.db )
+    for dirID, dirName, parentID in ( ( 1, '/', 0 ), ( 2, '/a', 1 ), ( 3, '/a/b', 2 ) ):
+      self.db.conn.execute( "INSERT INTO FC_DirectoryTree VALUES (%d,'%s',%d)" % ( dirID, dirName, parentID ) )
+    tree._rebuildDirectoryClosure()
+    self.assert_( tree._hasDirectoryClosure() )
+    result = tree.removeDirectory( [ '/a/b' ] )
+    self.assert_( '/a/b' in result['Value']['Successful'] )
+    self.assertEqual( self.ancestors( 3 ), () )
+    tree.closureCheckTime -= 300
+    self.assert_( tree._hasDirectoryClosure() )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryClosureTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
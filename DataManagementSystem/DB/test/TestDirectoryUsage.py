@@ -0,0 +1,135 @@
+""" Unit tests of the recursive directory usage counters of the FileCatalog,
+    the MySQL statements are run on an in memory sqlite database
+"""
+
+import unittest, re, sqlite3
+from DIRAC import S_OK
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import LOGICAL_USAGE_SEID, USAGE_MARKER_DIRID
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManagerBase import FileManagerBase
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryTreeBase import DirectoryTreeBase
+
+paths = { 1 : '/', 2 : '/a', 3 : '/a/b', 4 : '/c' }
+pathIDs = dict( [ ( path, dirID ) for dirID, path in paths.items() ] )
+
+class FakeTree( DirectoryTreeBase ):
+
+  def findDir( self, path ):
+    return S_OK( pathIDs.get( path, 0 ) )
+
+  def getPathIDs( self, path ):
+    dirIDs = [ pathIDs['/'] ]
+    current = ''
+    for name in path.split( '/' )[1:]:
+      if name:
+        current += '/' + name
+        dirIDs.append( pathIDs[current] )
+    return S_OK( dirIDs )
+
+  def getDirectoryPath( self, dirID ):
+    return S_OK( paths[dirID] )
+
+  def getSubdirectoriesByID( self, dirID, requestString = False, includeParent = False ):
+    ids = [ subID for subID, path in paths.items() if path == paths[dirID] or path.startswith( paths[dirID] + '/' ) ]
+    return S_OK( "SELECT DirID FROM FC_DirectoryInfo WHERE DirID IN (%s)" % ','.join( [ str( i ) for i in ids ] ) )
+
+class FakeConnection:
+
+  def close( self ):
+    pass
+
+class FakeDB:
+
+  def __init__( self ):
+    self.conn = sqlite3.connect( ':memory:' )
+    self.conn.execute( "CREATE TABLE FC_DirectoryUsage( DirID INTEGER, SEID INTEGER, SESize INTEGER, SEFiles INTEGER, LastUpdate TEXT, PRIMARY KEY (DirID,SEID) )" )
+    self.conn.execute( "CREATE TABLE FC_DirectoryInfo( DirID INTEGER )" )
+    self.conn.execute( "CREATE TABLE FC_Files( FileID INTEGER, DirID INTEGER, Size INTEGER )" )
+    self.conn.execute( "CREATE TABLE FC_Replicas( FileID INTEGER, SEID INTEGER )" )
+    for dirID in paths:
+      self.conn.execute( "INSERT INTO FC_DirectoryInfo VALUES (%d)" % dirID )
+    self.dtree = FakeTree( self )
+
+  def __sql( self, req ):
+    req = req.replace( "UTC_TIMESTAMP()", "CURRENT_TIMESTAMP" )
+    req = req.replace( "ON DUPLICATE KEY UPDATE", "ON CONFLICT(DirID,SEID) DO UPDATE SET" )
+    return re.sub( r"VALUES\((\w+)\)", r"excluded.\1", req )
+
+  def _query( self, req, connection = False ):
+    return S_OK( tuple( self.conn.execute( self.__sql( req ) ).fetchall() ) )
+
+  def _update( self, req, connection = False ):
+    return S_OK( self.conn.execute( self.__sql( req ) ).rowcount )
+
+  def _getConnection( self, connection = False ):
+    return S_OK( FakeConnection() )
+
+class DirectoryUsageTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeDB()
+    self.tree = self.db.dtree
+    self.fm = FileManagerBase( self.db )
+    self.fm._getConnection = lambda connection : connection
+    self.fileID = 0
+
+  def addFile( self, path, size, seID = 1, account = True ):
+    self.fileID += 1
+    dirID = pathIDs[path]
+    self.db.conn.execute( "INSERT INTO FC_Files VALUES (%d,%d,%d)" % ( self.fileID, dirID, size ) )
+    self.db.conn.execute( "INSERT INTO FC_Replicas VALUES (%d,%d)" % ( self.fileID, seID ) )
+    if account:
+      usage = { 'Files' : 1, 'Size' : size }
+      self.assert_( self.fm._updateDirectoryUsage( { dirID : { LOGICAL_USAGE_SEID : usage, seID : usage } }, '+' )['OK'] )
+    return self.fileID
+
+  def removeFile( self, fileID, path, size, seID = 1 ):
+    self.db.conn.execute( "DELETE FROM FC_Files WHERE FileID=%d" % fileID )
+    self.db.conn.execute( "DELETE FROM FC_Replicas WHERE FileID=%d" % fileID )
+    usage = { 'Files' : 1, 'Size' : size }
+    self.assert_( self.fm._updateDirectoryUsage( { pathIDs[path] : { LOGICAL_USAGE_SEID : usage, seID : usage } }, '-' )['OK'] )
+
+  def logicalSize( self, path ):
+    self.tree.usageCheckTime = 0
+    result = self.tree.getDirectorySize( { path : True } )
+    self.assert_( result['OK'] )
+    sizeDict = result['Value']['Successful'][path]
+    return sizeDict['LogicalSize'], sizeDict['LogicalFiles']
+
+  def test_upgrade( self ):
+    """ files registered before the counters existed are found until they are rebuilt """
+    self.addFile( '/a/b', 100, account = False )
+    self.addFile( '/a/b', 10 )
+    self.failIf( self.tree._hasDirectoryUsage() )
+    # Only the last file is in the counters, the scan gives the right size
+    self.assertEqual( self.logicalSize( '/a' ), ( 110, 2 ) )
+    result = self.tree._checkDirectoryUsage( repair = True )
+    self.assert_( result['OK'] )
+    self.assert_( result['Value']['Mismatches'] )
+    self.assert_( self.tree._hasDirectoryUsage() )
+    self.assertEqual( self.logicalSize( '/a' ), ( 110, 2 ) )
+    # The marker is not a counter
+    result = self.tree._checkDirectoryUsage()
+    self.assertEqual( result['Value']['Mismatches'], [] )
+    req = "SELECT COUNT(*) FROM FC_DirectoryUsage WHERE DirID=%d" % USAGE_MARKER_DIRID
+    self.assertEqual( self.db._query( req )['Value'][0][0], 1 )
+
+  def test_addRemove( self ):
+    """ the counters of the directory and its ancestors follow the added and removed files """
+    self.assert_( self.tree._rebuildDirectoryUsage()['OK'] )
+    self.assert_( self.tree._hasDirectoryUsage() )
+    fileID = self.addFile( '/a/b', 100 )
+    self.addFile( '/a', 10, seID = 2 )
+    self.addFile( '/c', 1 )
+    self.assertEqual( self.logicalSize( '/' ), ( 111, 3 ) )
+    self.assertEqual( self.logicalSize( '/a' ), ( 110, 2 ) )
+    self.assertEqual( self.logicalSize( '/a/b' ), ( 100, 1 ) )
+    self.removeFile( fileID, '/a/b', 100 )
+    self.assertEqual( self.logicalSize( '/' ), ( 11, 2 ) )
+    self.assertEqual( self.logicalSize( '/a' ), ( 10, 1 ) )
+    self.assertEqual( self.logicalSize( '/a/b' ), ( 0, 0 ) )
+    self.assertEqual( self.tree._checkDirectoryUsage()['Value']['Mismatches'], [] )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryUsageTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,155 @@
+""" Unit tests of the SQL generated for the FileCatalog metadata queries
+"""
+
+import unittest, sqlite3
+from DIRAC import S_OK
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import createMetaSelection
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.MetaQueryPlanner import MetaQueryPlanner
+
+class FakeTree:
+
+  def getTreeTable( self ):
+    return 'FC_DirectoryLevelTree'
+
+class FakeDB:
+  """ Gives the estimates of the terms by the metadata table
+  """
+
+  def __init__( self, estimates ):
+    self.estimates = estimates
+    self.dtree = FakeTree()
+    self.queries = []
+
+  def _query( self, req ):
+    self.queries.append( req )
+    for table, estimate in self.estimates.items():
+      if "FROM %s " % table in req or req.endswith( "FROM %s" % table ):
+        return S_OK( ( estimate, ) )
+    if "FROM FC_DirectoryUsage" in req:
+      return S_OK( ( ( 1000, ), ) )
+    return S_OK( () )
+
+class SQLiteDB:
+  """ Runs the metadata queries on an in memory sqlite database
+  """
+
+  def __init__( self ):
+    self.dtree = FakeTree()
+    self.conn = sqlite3.connect( ':memory:' )
+    for req in ( "CREATE TABLE FC_DirectoryLevelTree( DirID INTEGER PRIMARY KEY, DirName VARCHAR(255) )",
+                 "CREATE TABLE FC_DirectoryClosure( AncestorID INTEGER, DirID INTEGER, Depth INTEGER )",
+                 "CREATE TABLE FC_DirectoryUsage( DirID INTEGER, SEID INTEGER, SEFiles INTEGER )",
+                 "CREATE TABLE FC_Files( FileID INTEGER PRIMARY KEY, DirID INTEGER, FileName VARCHAR(128) )",
+                 "CREATE TABLE FC_Meta_Run( DirID INTEGER, Value INTEGER )" ):
+      self.conn.execute( req )
+
+  def _query( self, req ):
+    return S_OK( tuple( self.conn.execute( req.replace( 'STRAIGHT_JOIN ', '' ) ).fetchall() ) )
+
+class CreateMetaSelectionTestCase( unittest.TestCase ):
+
+  def test_values( self ):
+    self.assertEqual( createMetaSelection( 5 ), S_OK( "Value='5'" ) )
+    self.assertEqual( createMetaSelection( 'Any', 'M.Value' ), S_OK( '' ) )
+    self.assertEqual( createMetaSelection( [ 'RAW', 'DST' ], 'M.Value' ), S_OK( "M.Value IN ('RAW','DST')" ) )
+    self.assertEqual( createMetaSelection( { '>' : 5 } ), S_OK( "Value>5" ) )
+    self.assertEqual( createMetaSelection( { '<=' : 1.5 } ), S_OK( "Value<=1.500000" ) )
+    self.assertEqual( createMetaSelection( { '>=' : 'b' } ), S_OK( "Value>='b'" ) )
+    self.assertEqual( createMetaSelection( { 'in' : [ 1, 2 ] } ), S_OK( "Value IN ('1','2')" ) )
+    self.assertEqual( createMetaSelection( { '=' : 'a' } ), S_OK( "Value='a'" ) )
+    self.assertEqual( createMetaSelection( { 'nin' : [ 1, 2 ] } ), S_OK( "Value NOT IN ('1','2')" ) )
+    self.assertEqual( createMetaSelection( { '!=' : 'a' } ), S_OK( "Value!='a'" ) )
+    self.failIf( createMetaSelection( { '>' : [ 1, 2 ] } )['OK'] )
+
+class MetaQueryPlannerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = FakeDB( { 'FC_Meta_Run' : ( 2, 50 ),
+                        'FC_Meta_Empty' : ( 0, None ),
+                        'FC_FileMeta_Type' : ( 10, ) } )
+    self.planner = MetaQueryPlanner( self.db )
+
+  def getQuery( self, dirMetaDict, fileMetaDict, pathDirID, withFiles ):
+    result = self.planner._MetaQueryPlanner__getTerms( dirMetaDict, fileMetaDict, pathDirID )
+    self.assert_( result['OK'] )
+    if result['Value'] is None:
+      return None
+    terms, missing = result['Value']
+    result = self.planner._MetaQueryPlanner__buildQuery( terms, missing, withFiles )
+    self.assert_( result['OK'] )
+    return result['Value']
+
+  def test_terms( self ):
+    """ the terms are joined from the most selective one, the list values in one condition """
+    result = self.planner._MetaQueryPlanner__getTerms( { 'Run' : 5 }, { 'Type' : [ 'RAW', 'DST' ] }, 7 )
+    terms, missing = result['Value']
+    self.assertEqual( [ term['Estimate'] for term in terms ], [ 10, 50, 1000 ] )
+    self.assertEqual( missing, [] )
+    self.assert_( "SELECT DirID FROM FC_Meta_Run WHERE Value='5'" in self.db.queries[0] )
+    self.assert_( "SELECT FileID FROM FC_FileMeta_Type WHERE Value IN ('RAW','DST')" in self.db.queries[2] )
+    fromWhere, dirColumn = self.getQuery( { 'Run' : 5 }, { 'Type' : [ 'RAW', 'DST' ] }, 7, True )
+    self.assertEqual( dirColumn, "F.DirID" )
+    self.assertEqual( fromWhere, "FROM FC_FileMeta_Type AS FM2, FC_Files AS F, FC_Meta_Run AS M1, "
+                                 "FC_DirectoryClosure AS C1, FC_DirectoryClosure AS P, FC_DirectoryLevelTree AS D "
+                                 "WHERE FM2.FileID=F.FileID AND FM2.Value IN ('RAW','DST') AND "
+                                 "C1.AncestorID=M1.DirID AND M1.Value='5' AND C1.DirID=F.DirID AND "
+                                 "P.AncestorID=7 AND P.DirID=F.DirID AND D.DirID=F.DirID" )
+
+  def test_any( self ):
+    fromWhere, dirColumn = self.getQuery( { 'Run' : 'Any' }, {}, 0, False )
+    self.assertEqual( dirColumn, "C1.DirID" )
+    self.assertEqual( fromWhere, "FROM FC_Meta_Run AS M1, FC_DirectoryClosure AS C1 WHERE C1.AncestorID=M1.DirID" )
+
+  def test_empty( self ):
+    """ a term selecting nothing gives an empty result without querying further """
+    self.assertEqual( self.getQuery( { 'Empty' : 1 }, { 'Type' : 'RAW' }, 0, True ), None )
+    self.assertEqual( self.planner.findFiles( { 'Empty' : 1 }, {} ), S_OK( {} ) )
+    self.assertEqual( self.planner.findDirectories( { 'Empty' : 1 } ), S_OK( [] ) )
+
+  def test_missing( self ):
+    """ the missing metadata is excluded, inherited from the ancestors for the directories """
+    fromWhere, dirColumn = self.getQuery( { 'Run' : 'Missing' }, {}, 0, False )
+    self.assertEqual( dirColumn, "T.DirID" )
+    self.assertEqual( fromWhere, "FROM FC_DirectoryLevelTree AS T WHERE NOT EXISTS ( "
+                                 "SELECT XC0.AncestorID FROM FC_DirectoryClosure AS XC0, FC_Meta_Run AS XM0 "
+                                 "WHERE XC0.DirID=T.DirID AND XM0.DirID=XC0.AncestorID )" )
+    fromWhere, dirColumn = self.getQuery( {}, { 'Type' : 'Missing' }, 7, True )
+    self.assertEqual( dirColumn, "P.DirID" )
+    self.assertEqual( fromWhere, "FROM FC_DirectoryClosure AS P, FC_Files AS F, FC_DirectoryLevelTree AS D "
+                                 "WHERE P.AncestorID=7 AND F.DirID=P.DirID AND D.DirID=F.DirID AND NOT EXISTS ( "
+                                 "SELECT XM0.FileID FROM FC_FileMeta_Type AS XM0 WHERE XM0.FileID=F.FileID )" )
+
+  def test_pathOnly( self ):
+    fromWhere, dirColumn = self.getQuery( {}, {}, 7, False )
+    self.assertEqual( dirColumn, "P.DirID" )
+    self.assertEqual( fromWhere, "FROM FC_DirectoryClosure AS P WHERE P.AncestorID=7" )
+    self.planner.findDirectories( {}, 7 )
+    self.assertEqual( self.db.queries[-1], "SELECT STRAIGHT_JOIN DISTINCT P.DirID FROM FC_DirectoryClosure AS P "
+                                           "WHERE P.AncestorID=7" )
+
+class MetaQueryResultTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.db = SQLiteDB()
+    self.planner = MetaQueryPlanner( self.db )
+    # / -> /a -> /a/b, the run defined on / and again on /a
+    for dirID, dirName in ( ( 1, '/' ), ( 2, '/a' ), ( 3, '/a/b' ) ):
+      self.db.conn.execute( "INSERT INTO FC_DirectoryLevelTree VALUES (%d,'%s')" % ( dirID, dirName ) )
+    for ancestorID, dirID, depth in ( ( 1, 1, 0 ), ( 2, 2, 0 ), ( 3, 3, 0 ), ( 1, 2, 1 ), ( 2, 3, 1 ), ( 1, 3, 2 ) ):
+      self.db.conn.execute( "INSERT INTO FC_DirectoryClosure VALUES (%d,%d,%d)" % ( ancestorID, dirID, depth ) )
+    for dirID in ( 1, 2 ):
+      self.db.conn.execute( "INSERT INTO FC_Meta_Run VALUES (%d,5)" % dirID )
+    self.db.conn.execute( "INSERT INTO FC_Files VALUES (1,3,'f')" )
+
+  def test_inherited( self ):
+    """ the files and directories below several ancestors defining the meta datum are found once """
+    self.assertEqual( self.planner.findFiles( { 'Run' : 5 }, {} ), S_OK( { '/a/b' : [ 'f' ] } ) )
+    self.assertEqual( self.planner.findFiles( { 'Run' : 5 }, {}, 2 ), S_OK( { '/a/b' : [ 'f' ] } ) )
+    self.assertEqual( sorted( self.planner.findDirectories( { 'Run' : 5 } )['Value'] ), [ 1, 2, 3 ] )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( CreateMetaSelectionTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MetaQueryPlannerTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MetaQueryResultTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -56,7 +56,9 @@ def initializeFileCatalogHandler(serviceInfo):
                     'LFNPFNConvention'  : True,
                     'ResolvePFN'        : True,
                     'DefaultUmask'      : 0775,
-                    'VisibleStatus'     : ['AprioriGood']}
+                    'VisibleStatus'     : ['AprioriGood'],
+                    'DirectoryCacheSize'     : 0,
+                    'DirectoryCacheLifeTime' : 3600}
   for configKey in sortList( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = gConfig.getValue( '%s/%s' % ( serviceCS, configKey), defaultValue )
@@ -310,6 +312,19 @@ class FileCatalogHandler(RequestHandler):
     """ Rebuild DirectoryUsage table from scratch """
     return gFileCatalogDB.rebuildDirectoryUsage()
 
+  types_checkDirectoryUsage = [ BooleanType ]
+  @staticmethod
+  def export_checkDirectoryUsage( repair = False ):
+    """ Check the DirectoryUsage table against the file and replica tables,
+        fix the differences if repair is True """
+    return gFileCatalogDB.checkDirectoryUsage( repair )
+
+  types_rebuildDirectoryClosure = []
+  @staticmethod
+  def export_rebuildDirectoryClosure():
+    """ Rebuild DirectoryClosure table from scratch """
+    return gFileCatalogDB.rebuildDirectoryClosure()
+
   ########################################################################
   # Metadata Catalog Operations
   #
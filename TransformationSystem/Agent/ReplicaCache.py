@@ -0,0 +1,117 @@
+""" ReplicaCache keeps the replicas of the transformation input files in a local sqlite file.
+    Each file is cached with its update time, expired entries are purged in one statement
+    and only the new replicas are written.
+"""
+
+__RCSID__ = "$Id$"
+
+import time, threading
+try:
+  import sqlite3
+except ImportError:
+  # Only in python 2.5 and later
+  sqlite3 = None
+from DIRAC                                                          import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities                                           import DEncode
+from DIRAC.Core.Utilities.List                                      import breakListIntoChunks
+
+class ReplicaCache( object ):
+  """ Replicas of the LFNs keyed by transformation and LFN
+  """
+
+  def __init__( self, dbPath, validity = 2 * 86400 ):
+    """ c'tor
+
+    :param self: self reference
+    :param str dbPath: sqlite file, created on first use
+    :param int validity: seconds after which the cached replicas expire
+    """
+    self.dbPath = dbPath
+    self.validity = validity
+    self.dbConn = None
+    self.lock = threading.Lock()
+    self.log = gLogger.getSubLogger( 'ReplicaCache' )
+
+  def initialize( self ):
+    """ Check that the sqlite file can be used
+    """
+    return self.__execute( lambda: None )
+
+  def __connect( self ):
+    """ Open the sqlite file and create the table if needed
+    """
+    if self.dbConn:
+      return
+    dbConn = sqlite3.connect( self.dbPath, timeout = 30, check_same_thread = False )
+    dbConn.execute( "CREATE TABLE IF NOT EXISTS Replicas ( TransformationID INTEGER NOT NULL, "
+                    "LFN TEXT NOT NULL, Replicas BLOB NOT NULL, UpdateTime REAL NOT NULL, "
+                    "PRIMARY KEY ( TransformationID, LFN ) )" )
+    dbConn.execute( "CREATE INDEX IF NOT EXISTS UpdateTime ON Replicas ( UpdateTime )" )
+    dbConn.commit()
+    self.dbConn = dbConn
+
+  def __execute( self, method, *args ):
+    """ Call method with the connection under the lock, roll back on failure
+    """
+    if not sqlite3:
+      return S_ERROR( "Replica cache needs the sqlite3 module of python 2.5 or later" )
+    self.lock.acquire()
+    try:
+      try:
+        self.__connect()
+        result = method( *args )
+        self.dbConn.commit()
+        return S_OK( result )
+      except sqlite3.Error, x:
+        if self.dbConn:
+          self.dbConn.rollback()
+        self.log.error( "Replica cache error", "%s: %s" % ( self.dbPath, x ) )
+        return S_ERROR( "Replica cache error: %s" % x )
+    finally:
+      self.lock.release()
+
+  def __getReplicas( self, transID, lfns ):
+    limit = time.time() - self.validity
+    replicas = {}
+    for lfnChunk in breakListIntoChunks( lfns, 500 ):
+      req = "SELECT LFN, Replicas FROM Replicas WHERE TransformationID=? AND UpdateTime>? AND LFN IN ( %s )"
+      req = req % ','.join( ['?'] * len( lfnChunk ) )
+      for lfn, encoded in self.dbConn.execute( req, [transID, limit] + lfnChunk ):
+        replicas[str( lfn )] = DEncode.decode( str( encoded ) )[0]
+    return replicas
+
+  def getReplicas( self, transID, lfns ):
+    """ Get { lfn : { se : pfn } } for the LFNs with valid cached replicas
+    """
+    return self.__execute( self.__getReplicas, long( transID ), list( lfns ) )
+
+  def __setReplicas( self, transID, replicaDict ):
+    now = time.time()
+    rows = [ ( transID, lfn, sqlite3.Binary( DEncode.encode( replicas ) ), now )
+             for lfn, replicas in replicaDict.items() ]
+    self.dbConn.executemany( "INSERT OR REPLACE INTO Replicas ( TransformationID, LFN, Replicas, UpdateTime ) "
+                             "VALUES ( ?, ?, ?, ? )", rows )
+    return len( rows )
+
+  def setReplicas( self, transID, replicaDict ):
+    """ Store the replicas obtained from the catalog
+    """
+    if not replicaDict:
+      return S_OK( 0 )
+    return self.__execute( self.__setReplicas, long( transID ), replicaDict )
+
+  def __removeTransformation( self, transID ):
+    return self.dbConn.execute( "DELETE FROM Replicas WHERE TransformationID=?", ( transID, ) ).rowcount
+
+  def removeTransformation( self, transID ):
+    """ Forget the cached replicas of a transformation
+    """
+    return self.__execute( self.__removeTransformation, long( transID ) )
+
+  def __purgeExpired( self ):
+    return self.dbConn.execute( "DELETE FROM Replicas WHERE UpdateTime<=?", ( time.time() - self.validity, ) ).rowcount
+
+  def purgeExpired( self ):
+    """ Remove the expired replicas, returns the number of removed entries
+    """
+    return self.__execute( self.__purgeExpired )
@@ -3,12 +3,13 @@
 
 __RCSID__ = "$Id$"
 
-import time, re, random, Queue, threading, os, datetime, pickle
+import time, re, random, Queue, threading, os
 from DIRAC                                                          import  S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule                                    import AgentModule
 from DIRAC.Core.Utilities.ThreadPool                                import ThreadPool
 from DIRAC.TransformationSystem.Client.TransformationClient         import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Agent.ReplicaCache                  import ReplicaCache
 from DIRAC.DataManagementSystem.Client.ReplicaManager               import ReplicaManager
 
 AGENT_NAME = 'Transformation/TransformationAgent'
@@ -44,13 +45,13 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     self.transInQueue = []
     self.lock = threading.Lock()
 
-    #for caching using a pickle file
+    #for caching in a sqlite file
     self.workDirectory = self.am_getWorkDirectory()
-    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
+    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.db' )
 
     # Validity of the cache in days
-    self.replicaCacheValidity = 2
-    self.__readCache()
+    self.replicaCacheValidity = self.am_getOption( 'ReplicaCacheValidity', 2 )
+    self.replicaCache = ReplicaCache( self.cacheFile, self.replicaCacheValidity * 86400 )
 
     self.unusedFiles = {}
 
@@ -60,6 +61,10 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
 
     self.am_setOption( 'shifterProxy', 'ProductionManager' )
 
+    res = self.replicaCache.initialize()
+    if not res['OK']:
+      return res
+
     # Get it threaded
     maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
     threadPool = ThreadPool( maxNumberOfThreads, maxNumberOfThreads )
@@ -68,11 +73,18 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     for _i in xrange( maxNumberOfThreads ):
       threadPool.generateJobAndQueueIt( self._execute )
 
+    # The whole cache used to be pickled in this file
+    oldCacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
+    if os.path.exists( oldCacheFile ):
+      os.remove( oldCacheFile )
+
     return S_OK()
 
   def execute( self ):
     """ Just puts threads in the queue
     """
+    self.__cleanCache()
+
     # Get the transformations to process
     res = self.getTransformations()
     if not res['OK']:
@@ -244,17 +256,9 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     """ Standard plugin callback
     """
     if invalidateCache:
-      self.lock.acquire()
-      try:
-        self.__readCache( lock = False )
-        if transID in self.replicaCache:
-          self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
-          self.replicaCache.pop( transID )
-          self.__writeCache( lock = False )
-      except:
-        pass
-      finally:
-        self.lock.release()
+      res = self.replicaCache.removeTransformation( transID )
+      if res['OK'] and res['Value']:
+        self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
 
   def _getTransformationFiles( self, transDict, clients ):
     """ get the data replicas for a certain transID
@@ -322,42 +326,32 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     plugin_o.setCallback( self.pluginCallback )
 
   def __getDataReplicas( self, transID, lfns, clients, active = True ):
-    """ Get the replicas for the LFNs and check their statuses. It first looks within the cache.
+    """ Get the replicas for the LFNs and check their statuses. It first looks within the cache,
+        the catalog is only asked for the LFNs missing from it or expired.
     """
     self._logVerbose( "Getting replicas for %d files" % len( lfns ), method = '__getDataReplicas', transID = transID )
-    self.lock.acquire()
-    try:
-      cachedReplicaSets = self.replicaCache.get( transID, {} )
+    res = self.replicaCache.getReplicas( transID, lfns )
+    if res['OK']:
+      dataReplicas = res['Value']
+    else:
+      self._logWarn( "Failed to read the replica cache", res['Message'] )
       dataReplicas = {}
-      newLFNs = []
-      for crs in cachedReplicaSets:
-        cachedReplicas = cachedReplicaSets[crs]
-        for lfn in [lfn for lfn in lfns if lfn in cachedReplicas]:
-          dataReplicas[lfn] = cachedReplicas[lfn]
-        # Remove files from the cache that are not in the required list
-        for lfn in [lfn for lfn in cachedReplicas if lfn not in lfns]:
-          self.replicaCache[transID][crs].pop( lfn )
-    except:
-      pass
-    finally:
-      self.lock.release()
     if dataReplicas:
       self._logVerbose( "ReplicaCache hit for %d out of %d LFNs" % ( len( dataReplicas ), len( lfns ) ),
                          method = '__getDataReplicas', transID = transID )
-    newLFNs += [lfn for lfn in lfns if lfn not in dataReplicas]
+    newLFNs = [lfn for lfn in lfns if lfn not in dataReplicas]
     if newLFNs:
       self._logVerbose( "Getting replicas for %d files from catalog" % len( newLFNs ),
                          method = '__getDataReplicas', transID = transID )
       res = self.__getDataReplicasRM( transID, newLFNs, clients, active )
       if res['OK']:
         newReplicas = res['Value']
-        self.lock.acquire()
-        self.replicaCache.setdefault( transID, {} )[datetime.datetime.utcnow()] = newReplicas
-        self.lock.release()
+        cacheRes = self.replicaCache.setReplicas( transID, newReplicas )
+        if not cacheRes['OK']:
+          self._logWarn( "Failed to cache replicas for %d files" % len( newReplicas ), cacheRes['Message'] )
         dataReplicas.update( newReplicas )
       else:
         self._logWarn( "Failed to get replicas for %d files" % len( newLFNs ), res['Message'] )
-    self.__cleanCache()
     return S_OK( dataReplicas )
 
 
@@ -400,56 +394,10 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     return S_OK( dataReplicas )
 
   def __cleanCache( self ):
-    """ Cleans the cache
-    """
-    self.lock.acquire()
-    try:
-      timeLimit = datetime.datetime.utcnow() - datetime.timedelta( days = self.replicaCacheValidity )
-      for transID in [transID for transID in self.replicaCache]:
-        for updateTime in self.replicaCache[transID].copy():
-          if updateTime < timeLimit or not self.replicaCache[transID][updateTime]:
-            self._logVerbose( "Clear %d cached replicas for transformation %s" % ( len( self.replicaCache[transID][updateTime] ),
-                                                                                    str( transID ) ),
-                              method = '__cleanCache' )
-            self.replicaCache[transID].pop( updateTime )
-        # Remove empty transformations
-        if not self.replicaCache[transID]:
-          self.replicaCache.pop( transID )
-      self.__writeCache( lock = False )
-    except:
-      pass
-    finally:
-      self.lock.release()
-
-  def __readCache( self, lock = True ):
-    """ Reads from the cache
+    """ Removes the expired replicas from the cache
     """
-    if lock:
-      self.lock.acquire()
-    try:
-      cacheFile = open( self.cacheFile, 'r' )
-      self.replicaCache = pickle.load( cacheFile )
-      cacheFile.close()
-      self._logVerbose( "Successfully loaded replica cache from file %s" % self.cacheFile )
-    except:
-      self._logVerbose( "Failed to load replica cache from file %s" % self.cacheFile )
-      self.replicaCache = {}
-    finally:
-      if lock:
-        self.lock.release()
-
-  def __writeCache( self, lock = True ):
-    """ Writes the cache
-    """
-    if lock:
-      self.lock.acquire()
-    try:
-      f = open( self.cacheFile, 'w' )
-      pickle.dump( self.replicaCache, f )
-      f.close()
-      self._logVerbose( "Successfully wrote replica cache file %s" % self.cacheFile )
-    except:
-      self._logError( "Could not write replica cache file %s" % self.cacheFile )
-    finally:
-      if lock:
-        self.lock.release()
+    res = self.replicaCache.purgeExpired()
+    if not res['OK']:
+      self._logWarn( "Failed to clean the replica cache", res['Message'], method = '__cleanCache' )
+    elif res['Value']:
+      self._logVerbose( "Cleared %d expired cached replicas" % res['Value'], method = '__cleanCache' )
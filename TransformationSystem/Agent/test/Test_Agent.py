@@ -1,4 +1,4 @@
-import unittest, datetime, sys
+import unittest, datetime, sys, os, tempfile, time
 
 from mock import Mock
 
@@ -61,6 +61,44 @@ class TransformationAgentSuccess( AgentsTestCase ):
       self.assertTrue( res['OK'] )
 
 
+class ReplicaCacheSuccess( unittest.TestCase ):
+
+  def setUp( self ):
+    from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+    fd, self.dbPath = tempfile.mkstemp()
+    os.close( fd )
+    self.cache = ReplicaCache( self.dbPath, validity = 60 )
+
+  def tearDown( self ):
+    os.remove( self.dbPath )
+
+  def test_replicas( self ):
+    replicas = { '/a/f1': { 'CERN-DST': 'srm://cern/a/f1' },
+                 '/a/f2': { 'CERN-DST': 'srm://cern/a/f2', 'RAL-DST': 'srm://ral/a/f2' } }
+    self.assertEqual( self.cache.setReplicas( 1, replicas )['Value'], 2 )
+    self.assertEqual( self.cache.getReplicas( 1, ['/a/f1', '/a/f2', '/a/f3'] )['Value'], replicas )
+    self.assertEqual( self.cache.getReplicas( 2, ['/a/f1'] )['Value'], {} )
+    self.assertEqual( self.cache.removeTransformation( 1 )['Value'], 2 )
+    self.assertEqual( self.cache.getReplicas( 1, ['/a/f1'] )['Value'], {} )
+
+  def test_expiry( self ):
+    self.cache.setReplicas( 1, { '/a/f1': { 'CERN-DST': 'srm://cern/a/f1' } } )
+    self.cache.validity = 0
+    time.sleep( 0.01 )
+    self.assertEqual( self.cache.getReplicas( 1, ['/a/f1'] )['Value'], {} )
+    self.assertEqual( self.cache.purgeExpired()['Value'], 1 )
+
+  def test_noSqlite( self ):
+    import DIRAC.TransformationSystem.Agent.ReplicaCache as ReplicaCacheModule
+    sqlite3 = ReplicaCacheModule.sqlite3
+    ReplicaCacheModule.sqlite3 = None
+    try:
+      self.assertFalse( self.cache.initialize()['OK'] )
+      self.assertFalse( self.cache.getReplicas( 1, ['/a/f1'] )['OK'] )
+    finally:
+      ReplicaCacheModule.sqlite3 = sqlite3
+    self.assertTrue( self.cache.initialize()['OK'] )
+
 
 #############################################################################
 # Test Suite run
@@ -69,6 +107,7 @@ class TransformationAgentSuccess( AgentsTestCase ):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( AgentsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TransformationAgentSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCacheSuccess ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 #EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#
@@ -50,12 +50,14 @@ __RCSID__ = "$Id$"
 
 import sys, types
 import time, operator
+import threading
 
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight               import ClassAd
 from DIRAC                                                   import S_OK, S_ERROR, Time
 from DIRAC.ConfigurationSystem.Client.Config                 import gConfig
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getVOForGroup, getVOOption
 from DIRAC.Core.Base.DB                                      import DB
+from DIRAC.Core.Utilities.DictCache                          import DictCache
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getUsernameForDN, getDNForUsername
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest   import JobManifest
 
@@ -80,6 +82,11 @@ JOB_DYNAMIC_ATTRIBUTES = [ 'LastUpdateTime', 'HeartBeatTime',
 #############################################################################
 class JobDB( DB ):
 
+  #Site mask cache shared by all the JobDB instances of the process
+  __siteMaskCache = DictCache()
+  __siteMaskVersion = 0
+  __siteMaskLock = threading.Lock()
+
   def __init__( self, maxQueueSize = 10 ):
     """ Standard Constructor
     """
@@ -87,6 +94,8 @@ class JobDB( DB ):
     DB.__init__( self, 'JobDB', 'WorkloadManagement/JobDB', maxQueueSize, debug = DEBUG )
 
     self.maxRescheduling = gConfig.getValue( self.cs_path + '/MaxRescheduling', 3 )
+    #Changes done by other processes are seen after this time
+    self.siteMaskCacheTime = gConfig.getValue( self.cs_path + '/SiteMaskCacheTime', 10 )
 
     self.jobAttributeNames = []
     self.nJobAttributeNames = 0
@@ -499,6 +508,37 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.getJobOptParameters: failed to retrieve parameters' )
 
+#############################################################################
+  def getJobsOptParameters( self, jobIDList, paramList = None ):
+    """ Get optimizer parameters for the given list of jobs as { jobID : { name : value } }.
+        If the list of parameter names is empty, get all the parameters then
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    try:
+      jobIDString = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    except ValueError:
+      return S_ERROR( 'JobDB.getJobsOptParameters: job IDs must be integers' )
+
+    cmd = "SELECT JobID, Name, Value from OptimizerParameters WHERE JobID in (%s)" % jobIDString
+    if paramList:
+      ret = self._escapeValues( paramList )
+      if not ret['OK']:
+        return ret
+      cmd = "%s and Name in (%s)" % ( cmd, ','.join( ret['Value'] ) )
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.getJobsOptParameters: failed to retrieve parameters' )
+    resultDict = dict( [ ( int( jobID ), {} ) for jobID in jobIDList ] )
+    for jobID, name, value in result['Value']:
+      try:
+        value = value.tostring()
+      except Exception:
+        pass
+      resultDict[ int( jobID ) ][ name ] = value
+    return S_OK( resultDict )
+
 #############################################################################
   def getTimings( self, site, period = 3600 ):
     """ Get CPU and wall clock times for the jobs finished in the last hour
@@ -628,19 +668,20 @@ class JobDB( DB ):
 
 #############################################################################
   def selectJobs( self, condDict, older = None, newer = None, timeStamp = 'LastUpdateTime',
-                  orderAttribute = None, limit = None ):
+                  orderAttribute = None, limit = None, offset = None ):
     """ Select jobs matching the following conditions:
         - condDict dictionary of required Key = Value pairs;
         - with the last update date older and/or newer than given dates;
 
         The result is ordered by JobID if requested, the result is limited to a given
-        number of jobs if requested.
+        number of jobs if requested, skipping the first offset jobs.
     """
 
     self.log.debug( 'JobDB.selectJobs: retrieving jobs.' )
 
     res = self.getFields( 'Jobs', ['JobID'], condDict = condDict, limit = limit,
-                            older = older, newer = newer, timeStamp = timeStamp, orderAttribute = orderAttribute )
+                            older = older, newer = newer, timeStamp = timeStamp, orderAttribute = orderAttribute,
+                            offset = offset )
 
     if not res['OK']:
       return res
@@ -690,14 +731,23 @@ class JobDB( DB ):
 
 #############################################################################
   def setJobAttributes( self, jobID, attrNames, attrValues, update = False, myDate = None ):
-    """ Set an attribute value for job specified by jobID.
+    """ Set an attribute value for job specified by jobID or for a list of jobIDs.
         The LastUpdate time stamp is refreshed if explicitely requested
     """
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    jobID = ret['Value']
+    if type( jobID ) in ( types.ListType, types.TupleType ):
+      if not jobID:
+        return S_OK( 0 )
+      try:
+        jobIDString = ','.join( [ str( int( jID ) ) for jID in jobID ] )
+      except ValueError:
+        return S_ERROR( 'JobDB.setAttributes: job IDs must be integers' )
+      jobCond = 'JobID in ( %s )' % jobIDString
+    else:
+      ret = self._escapeString( jobID )
+      if not ret['OK']:
+        return ret
+      jobCond = 'JobID=%s' % ret['Value']
 
     if len( attrNames ) != len( attrValues ):
       return S_ERROR( 'JobDB.setAttributes: incompatible Argument length' )
@@ -715,7 +765,7 @@ class JobDB( DB ):
     if len( attr ) == 0:
       return S_ERROR( 'JobDB.setAttributes: Nothing to do' )
 
-    cmd = 'UPDATE Jobs SET %s WHERE JobID=%s' % ( ', '.join( attr ), jobID )
+    cmd = 'UPDATE Jobs SET %s WHERE %s' % ( ', '.join( attr ), jobCond )
 
     if myDate:
       cmd += ' AND LastUpdateTime < %s' % myDate
@@ -891,20 +941,9 @@ class JobDB( DB ):
     if not parameters:
       return S_OK()
 
-    insertValueList = []
-    for name, value in parameters:
-      ret = self._escapeString( name )
-      if not ret['OK']:
-        return ret
-      e_name = ret['Value']
-      ret = self._escapeString( value )
-      if not ret['OK']:
-        return ret
-      e_value = ret['Value']
-      insertValueList.append( '(%s,%s,%s)' % ( jobID, e_name, e_value ) )
-
-    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
-    result = self._update( cmd )
+    valuesList = [ ( jobID, name, value ) for name, value in parameters ]
+    result = self.insertFieldsBulk( 'JobParameters', [ 'JobID', 'Name', 'Value' ], valuesList,
+                                    replace = True )
     if not result['OK']:
       return S_ERROR( 'JobDB.setJobParameters: operation failed.' )
 
@@ -1109,6 +1148,27 @@ class JobDB( DB ):
     else:
       return result
 
+#############################################################################
+  def getJobJDLs( self, jobIDList, original = False ):
+    """ Get the JDLs for a list of jobs as { jobID : JDL }. Jobs without JDL are not included
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    try:
+      jobIDString = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    except ValueError:
+      return S_ERROR( 'JobDB.getJobJDLs: job IDs must be integers' )
+
+    if original:
+      cmd = "SELECT JobID, OriginalJDL FROM JobJDLs WHERE JobID in (%s)" % jobIDString
+    else:
+      cmd = "SELECT JobID, JDL FROM JobJDLs WHERE JobID in (%s)" % jobIDString
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    return S_OK( dict( [ ( int( jobID ), jdl ) for jobID, jdl in result['Value'] ] ) )
+
 #############################################################################
   def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
     """ Insert the initial JDL into the Job database,
@@ -1609,26 +1669,51 @@ class JobDB( DB ):
 
 #############################################################################
   def getSiteMask( self, siteState = 'Active' ):
-    """ Get the currently active site list
+    """ Get the currently active site list. The result is cached for SiteMaskCacheTime
+        seconds, changes done through this process invalidate the cache immediately
     """
+    siteList = JobDB.__siteMaskCache.get( siteState )
+    if siteList is not False:
+      return S_OK( list( siteList ) )
+    version = JobDB.__siteMaskVersion
 
     ret = self._escapeString( siteState )
     if not ret['OK']:
       return ret
-    siteState = ret['Value']
+    e_siteState = ret['Value']
 
     if siteState == "All":
       cmd = "SELECT Site FROM SiteMask"
     else:
-      cmd = "SELECT Site FROM SiteMask WHERE Status=%s" % siteState
+      cmd = "SELECT Site FROM SiteMask WHERE Status=%s" % e_siteState
 
     result = self._query( cmd )
     siteList = []
     if result['OK']:
       siteList = [ x[0] for x in result['Value']]
+      JobDB.__siteMaskLock.acquire()
+      try:
+        #Do not cache a mask read before a change
+        if version == JobDB.__siteMaskVersion:
+          JobDB.__siteMaskCache.add( siteState, self.siteMaskCacheTime, tuple( siteList ) )
+      finally:
+        JobDB.__siteMaskLock.release()
 
     return S_OK( siteList )
 
+  def getSiteMaskVersion( self ):
+    """ Version of the site mask, increased with every change done by this process
+    """
+    return JobDB.__siteMaskVersion
+
+  def __invalidateSiteMask( self ):
+    JobDB.__siteMaskLock.acquire()
+    try:
+      JobDB.__siteMaskVersion += 1
+      JobDB.__siteMaskCache.purgeAll()
+    finally:
+      JobDB.__siteMaskLock.release()
+
 #############################################################################
   def getSiteMaskStatus( self ):
     """ Get the currently site mask status
@@ -1696,6 +1781,7 @@ class JobDB( DB ):
       else:
         req = "INSERT INTO SiteMask VALUES (%s,%s,UTC_TIMESTAMP(),%s,%s)" % ( site, status, authorDN, comment )
       result = self._update( req )
+      self.__invalidateSiteMask()
       if not result['OK']:
         return S_ERROR( 'Failed to update the Site Mask' )
       # update the site mask logging record
@@ -1737,7 +1823,9 @@ class JobDB( DB ):
       req = "DELETE FROM SiteMask"
     else:
       req = "DELETE FROM SiteMask WHERE Site=%s" % site
-    return self._update( req )
+    result = self._update( req )
+    self.__invalidateSiteMask()
+    return result
 
 #############################################################################
   def getSiteMaskLogging( self, siteList ):
@@ -2135,27 +2223,10 @@ class JobDB( DB ):
       self.log.warn( result['Message'] )
 
     # Add dynamic data to the job heart beat log
-    # start = time.time()
-    valueList = []
-    for key, value in dynamicDataDict.items():
-      result = self._escapeString( key )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + key )
-        continue
-      e_key = result['Value']
-      result = self._escapeString( value )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + value )
-        continue
-      e_value = result['Value']
-      valueList.append( "( %s, %s,%s,UTC_TIMESTAMP())" % ( e_jobID, e_key, e_value ) )
-
-    if valueList:
-
-      valueString = ','.join( valueList )
-      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES "
-      req += valueString
-      result = self._update( req )
+    valuesList = [ ( jobID, key, value, 'UTC_TIMESTAMP()' ) for key, value in dynamicDataDict.items() ]
+    if valuesList:
+      result = self.insertFieldsBulk( 'HeartBeatLoggingInfo', [ 'JobID', 'Name', 'Value', 'HeartBeatTime' ],
+                                      valuesList )
       if not result['OK']:
         ok = False
         self.log.warn( result['Message'] )
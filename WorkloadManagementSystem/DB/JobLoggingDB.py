@@ -5,6 +5,7 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()    
 """    
@@ -48,12 +49,33 @@ class JobLoggingDB(DB):
         components can be specified. Optionaly the time stamp of the status can
         be provided in a form of a string in a format '%Y-%m-%d %H:%M:%S' or
         as datetime.datetime object. If the time stamp is not provided the current
-        UTC time is used. 
+        UTC time is used. jobID can also be a list of job IDs, then the same record
+        is added for all of them in one statement.
     """
   
+    if type( jobID ) in ( ListType, TupleType ):
+      jobIDList = jobID
+      if not jobIDList:
+        return S_OK( 0 )
+    else:
+      jobIDList = [ jobID ]
+
     event = 'status/minor/app=%s/%s/%s' % (status,minor,application)
-    self.gLogger.info("Adding record for job "+str(jobID)+": '"+event+"' from "+source)
+    self.gLogger.info("Adding record for job "+','.join( [ str( jID ) for jID in jobIDList ] )+": '"+event+"' from "+source)
   
+    _date, time_order = self.__getStatusTime( date )
+
+    values = [ "(%d,'%s','%s','%s','%s',%f,'%s')" % \
+               (int(jID),status,minor,application,str(_date),time_order,source) for jID in jobIDList ]
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES " + ','.join( values )
+            
+    return self._update( cmd )
+    
+#############################################################################
+  def __getStatusTime( self, date ):
+    """ Get the UTC datetime and the time order value for the given logging record date
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -80,13 +102,28 @@ class JobLoggingDB(DB):
         _date = Time.dateTime()
         epoc = time.mktime(_date.timetuple()) - MAGIC_EPOC_NUMBER
         time_order = round(epoc,3)     
+    return _date, time_order
+
+#############################################################################
+  def addLoggingRecords( self, recordList ):
+    """ Add many entries to the JobLoggingDB table in one statement. Each record is
+        a ( jobID, status, minor, application, date, source ) tuple, the date can be
+        empty as in addLoggingRecord()
+    """
+    if not recordList:
+      return S_OK( 0 )
 
+    self.gLogger.info( "Adding %d logging records" % len( recordList ) )
+    values = []
+    for jobID, status, minor, application, date, source in recordList:
+      _date, time_order = self.__getStatusTime( date )
+      values.append( "(%d,'%s','%s','%s','%s',%f,'%s')" % \
+                     (int(jobID),status,minor,application,str(_date),time_order,source) )
     cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           (int(jobID),status,minor,application,str(_date),time_order,source)
-            
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES " + ','.join( values )
+
     return self._update( cmd )
-    
+
 #############################################################################
   def getJobLoggingInfo(self, jobID):
     """ Returns a Status,MinorStatus,ApplicationStatus,StatusTime,StatusSource tuple 
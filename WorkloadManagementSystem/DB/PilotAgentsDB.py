@@ -447,18 +447,27 @@ class PilotAgentsDB(DB):
 
 ##########################################################################################
   def setJobForPilot(self,jobID,pilotRef,site=None,updateStatus=True):
-    """ Store the jobID of the job executed by the pilot with reference pilotRef
+    """ Store the jobID of the job executed by the pilot with reference pilotRef.
+        jobID can also be a list of job IDs matched at once by the pilot
     """
 
+    if type( jobID ) in ( ListType, TupleType ):
+      jobIDList = jobID
+      if not jobIDList:
+        return S_OK( 0 )
+    else:
+      jobIDList = [ jobID ]
+
     pilotID = self.__getPilotID(pilotRef)
     if pilotID:
       if updateStatus:
-        reason = 'Report from job %d' % int(jobID)
+        reason = 'Report from job %d' % int(jobIDList[0])
         result = self.setPilotStatus(pilotRef,status='Running',statusReason=reason,
                                      gridSite=site )
         if not result['OK']:
           return result
-      req = "INSERT INTO JobToPilotMapping VALUES (%d,%d,UTC_TIMESTAMP())" % (pilotID,jobID)
+      values = [ "(%d,%d,UTC_TIMESTAMP())" % (pilotID,int(jID)) for jID in jobIDList ]
+      req = "INSERT INTO JobToPilotMapping VALUES %s" % ','.join( values )
       result = self._update(req)
       return result
     else:
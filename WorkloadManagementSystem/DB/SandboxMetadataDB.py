@@ -20,8 +20,12 @@ class SandboxMetadataDB( DB ):
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise RuntimeError( "Can't create tables: %s" % result[ 'Message' ] )
+    result = self.__checkDBVersion()
+    if not result[ 'OK' ]:
+      raise RuntimeError( "Can't update tables: %s" % result[ 'Message' ] )
     self.__assignedSBGraceDays = 0
     self.__unassignedSBGraceDays = 15
+    self.__unreferencedBlobGraceHours = 1
 
   def __initializeDB( self ):
     """
@@ -51,14 +55,35 @@ class SandboxMetadataDB( DB ):
                                                          'RegistrationTime' : 'DATETIME NOT NULL',
                                                          'LastAccessTime' : 'DATETIME NOT NULL',
                                                          'Assigned' : 'TINYINT NOT NULL DEFAULT 0',
+                                                         'BlobId' : 'INTEGER UNSIGNED NOT NULL DEFAULT 0',
                                                         },
                                             'PrimaryKey' : 'SBId',
                                             'Indexes': { 'SBOwner': [ 'OwnerId' ],
+                                                         'SBBlob': [ 'BlobId' ],
                                                        },
-                                            'UniqueIndexes' : { 'Location' : [ 'SEName', 'SEPFN' ] }
+                                            'UniqueIndexes' : { 'Location' : [ 'SEName', 'SEPFN', 'OwnerId' ] }
 
                                           }
 
+    #Stored sandbox contents, shared by all the sandboxes with the same hash
+    #RefCount is the number of sandboxes using it, -1 while it's being purged
+    #Stored is set once the content is at its location, only stored blobs are shared
+    self.__tablesDesc[ 'sb_Blobs' ] = { 'Fields' : { 'BlobId' : 'INTEGER UNSIGNED AUTO_INCREMENT NOT NULL',
+                                                     'Hash' : 'VARCHAR(64) NOT NULL',
+                                                     'SEName' : 'VARCHAR(64) NOT NULL',
+                                                     'SEPFN' : 'VARCHAR(512) NOT NULL',
+                                                     'Bytes' : 'BIGINT NOT NULL DEFAULT 0',
+                                                     'RefCount' : 'INTEGER NOT NULL DEFAULT 0',
+                                                     'RegistrationTime' : 'DATETIME NOT NULL',
+                                                     'LastAccessTime' : 'DATETIME NOT NULL',
+                                                     'Stored' : 'TINYINT NOT NULL DEFAULT 0',
+                                                    },
+                                        'PrimaryKey' : 'BlobId',
+                                        'Indexes': { 'BlobRefCount': [ 'RefCount' ],
+                                                   },
+                                        'UniqueIndexes' : { 'Location' : [ 'SEName', 'SEPFN' ] }
+                                      }
+
     self.__tablesDesc[ 'sb_EntityMapping' ] = { 'Fields' : { 'SBId' : 'INTEGER UNSIGNED NOT NULL',
                                                              'EntitySetup' : 'VARCHAR(64) NOT NULL',
                                                              'EntityId' : 'VARCHAR(128) NOT NULL',
@@ -76,6 +101,33 @@ class SandboxMetadataDB( DB ):
 
     return self._createTables( tablesToCreate )
 
+  def __checkDBVersion( self ):
+    """
+    Sandboxes registered before the contents were shared have no BlobId and one location per sandbox.
+    Blobs registered before the Stored flag are taken as stored, the handler checks they are there
+    """
+    result = self._query( "describe `sb_SandBoxes`" )
+    if not result[ 'OK' ]:
+      return result
+    if 'BlobId' not in [ row[0] for row in result[ 'Value' ] ]:
+      self.log.notice( "BlobId missing in table sb_SandBoxes schema. Adding it" )
+      sqlCmd = "ALTER TABLE `sb_SandBoxes` ADD COLUMN BlobId INTEGER UNSIGNED NOT NULL DEFAULT 0,"
+      sqlCmd = "%s ADD INDEX `SBBlob` ( `BlobId` ), DROP INDEX `Location`," % sqlCmd
+      sqlCmd = "%s ADD UNIQUE INDEX `Location` ( `SEName`, `SEPFN`, `OwnerId` )" % sqlCmd
+      result = self._update( sqlCmd )
+      if not result[ 'OK' ]:
+        return result
+    result = self._query( "describe `sb_Blobs`" )
+    if not result[ 'OK' ]:
+      return result
+    if 'Stored' in [ row[0] for row in result[ 'Value' ] ]:
+      return S_OK()
+    self.log.notice( "Stored missing in table sb_Blobs schema. Adding it" )
+    result = self._update( "ALTER TABLE `sb_Blobs` ADD COLUMN Stored TINYINT NOT NULL DEFAULT 0" )
+    if not result[ 'OK' ]:
+      return result
+    return self._update( "UPDATE `sb_Blobs` SET Stored=1" )
+
   def registerAndGetOwnerId( self, owner, ownerDN, ownerGroup ):
     """
     Get the owner ID and register it if it's not there
@@ -103,7 +155,7 @@ class SandboxMetadataDB( DB ):
       return S_ERROR( "Can't determine owner id after insertion" )
     return S_OK( result[ 'Value' ][0][0] )
 
-  def registerAndGetSandbox( self, owner, ownerDN, ownerGroup, sbSE, sbPFN, size = 0 ):
+  def registerAndGetSandbox( self, owner, ownerDN, ownerGroup, sbSE, sbPFN, size = 0, blobId = 0 ):
     """
     Register a new sandbox in the metadata catalog
     Returns ( sbid, newSandbox )
@@ -112,9 +164,9 @@ class SandboxMetadataDB( DB ):
     if not result[ 'OK' ]:
       return result
     ownerId = result[ 'Value' ]
-    sqlCmd = "INSERT INTO `sb_SandBoxes` ( SBId, OwnerId, SEName, SEPFN, Bytes, RegistrationTime, LastAccessTime )"
-    sqlCmd = "%s VALUES ( 0, '%s', '%s', '%s', %d, UTC_TIMESTAMP(), UTC_TIMESTAMP() )" % ( sqlCmd, ownerId, sbSE,
-                                                                                           sbPFN, size )
+    sqlCmd = "INSERT INTO `sb_SandBoxes` ( SBId, OwnerId, SEName, SEPFN, Bytes, RegistrationTime, LastAccessTime, BlobId )"
+    sqlCmd = "%s VALUES ( 0, '%s', '%s', '%s', %d, UTC_TIMESTAMP(), UTC_TIMESTAMP(), %d )" % ( sqlCmd, ownerId, sbSE,
+                                                                                               sbPFN, size, blobId )
     result = self._update( sqlCmd )
     if not result[ 'OK' ]:
       if result[ 'Message' ].find( "Duplicate entry" ) == -1 :
@@ -138,6 +190,110 @@ class SandboxMetadataDB( DB ):
       return S_ERROR( "Can't determine sand box id after insertion" )
     return S_OK( ( result[ 'Value' ][0][0], True ) )
 
+  def acquireBlob( self, blobHash, sbSE, sbPFN, size = 0 ):
+    """
+    Take a reference to the content at a location, registering it if it's not there
+    Returns ( blobId, mustStore ). The caller has to store new blobs and the ones nobody
+    has stored yet, and then mark them as stored
+    """
+    sqlSE = self._escapeString( sbSE )[ 'Value' ]
+    sqlPFN = self._escapeString( sbPFN )[ 'Value' ]
+    sqlLocation = "SEName=%s AND SEPFN=%s" % ( sqlSE, sqlPFN )
+    for retry in range( 3 ):
+      sqlCmd = "UPDATE `sb_Blobs` SET RefCount=RefCount+1, LastAccessTime=UTC_TIMESTAMP()"
+      result = self._update( "%s WHERE %s AND RefCount >= 0" % ( sqlCmd, sqlLocation ) )
+      if not result[ 'OK' ]:
+        return result
+      if result[ 'Value' ]:
+        result = self._query( "SELECT BlobId, Stored FROM `sb_Blobs` WHERE %s" % sqlLocation )
+        if not result[ 'OK' ]:
+          return result
+        if result[ 'Value' ]:
+          blobId, stored = result[ 'Value' ][0]
+          return S_OK( ( blobId, not stored ) )
+      sqlCmd = "INSERT INTO `sb_Blobs` ( BlobId, Hash, SEName, SEPFN, Bytes, RefCount, RegistrationTime, LastAccessTime )"
+      sqlCmd = "%s VALUES ( 0, %s, %s, %s, %d, 1, UTC_TIMESTAMP(), UTC_TIMESTAMP() )" % ( sqlCmd,
+                                                                                          self._escapeString( blobHash )[ 'Value' ],
+                                                                                          sqlSE, sqlPFN, size )
+      result = self._update( sqlCmd )
+      if result[ 'OK' ]:
+        if 'lastRowId' in result:
+          return S_OK( ( result[ 'lastRowId' ], True ) )
+        result = self._query( "SELECT BlobId FROM `sb_Blobs` WHERE %s" % sqlLocation )
+        if not result[ 'OK' ] or not result[ 'Value' ]:
+          return S_ERROR( "Can't determine blob id after insertion" )
+        return S_OK( ( result[ 'Value' ][0][0], True ) )
+      if result[ 'Message' ].find( "Duplicate entry" ) == -1:
+        return result
+      #Registered meanwhile or being purged, try again
+      time.sleep( 1 )
+    return S_ERROR( "Sandbox content at %s is being purged, try again later" % sbPFN )
+
+  def markBlobStored( self, blobId ):
+    """
+    Mark the content of a blob as stored at its location
+    Returns False if the blob is not referenced any more
+    """
+    result = self._update( "UPDATE `sb_Blobs` SET Stored=1 WHERE BlobId=%d AND RefCount > 0" % int( blobId ) )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( result[ 'Value' ] > 0 )
+
+  def isSandboxStored( self, sbId ):
+    """
+    Check that the content of a sandbox has been stored. Sandboxes without blob are
+    the ones registered after storing them, before the contents were shared
+    """
+    sqlCmd = "SELECT s.BlobId, b.Stored FROM `sb_SandBoxes` s LEFT JOIN `sb_Blobs` b ON s.BlobId=b.BlobId"
+    result = self._query( "%s WHERE s.SBId=%d" % ( sqlCmd, int( sbId ) ) )
+    if not result[ 'OK' ]:
+      return result
+    if not result[ 'Value' ]:
+      return S_OK( False )
+    blobId, stored = result[ 'Value' ][0]
+    return S_OK( not blobId or bool( stored ) )
+
+  def releaseBlob( self, blobId ):
+    """
+    Drop a reference to a blob
+    """
+    return self._update( "UPDATE `sb_Blobs` SET RefCount=RefCount-1 WHERE BlobId=%d AND RefCount > 0" % int( blobId ) )
+
+  def getUnreferencedBlobs( self ):
+    """
+    Get the blobs no sandbox has used for a while, and the ones never stored
+    by an upload that did not finish
+    """
+    sqlCmd = "SELECT BlobId, SEName, SEPFN FROM `sb_Blobs` WHERE ( RefCount = 0 OR ( RefCount > 0 AND Stored = 0 ) ) AND"
+    sqlCmd = "%s TIMESTAMPDIFF( HOUR, LastAccessTime, UTC_TIMESTAMP() ) >= %d" % ( sqlCmd,
+                                                                                   self.__unreferencedBlobGraceHours )
+    return self._query( sqlCmd )
+
+  def claimBlobForDeletion( self, blobId ):
+    """
+    Mark an unreferenced or never stored blob as being purged so nobody takes a reference
+    to it meanwhile. Returns True if the caller has to delete it
+    """
+    blobId = int( blobId )
+    sqlCond = [ "BlobId=%d" % blobId, "( RefCount = 0 OR ( RefCount > 0 AND Stored = 0 ) )",
+                "TIMESTAMPDIFF( HOUR, LastAccessTime, UTC_TIMESTAMP() ) >= %d" % self.__unreferencedBlobGraceHours,
+                "NOT EXISTS ( SELECT SBId FROM `sb_SandBoxes` WHERE BlobId=%d )" % blobId ]
+    result = self._update( "UPDATE `sb_Blobs` SET RefCount=-1 WHERE %s" % " AND ".join( sqlCond ) )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( result[ 'Value' ] > 0 )
+
+  def unclaimBlob( self, blobId ):
+    """
+    Give back a blob that could not be purged
+    """
+    return self._update( "UPDATE `sb_Blobs` SET RefCount=0 WHERE BlobId=%d AND RefCount = -1" % int( blobId ) )
+
+  def deleteBlob( self, blobId ):
+    """
+    Delete a purged blob
+    """
+    return self._update( "DELETE FROM `sb_Blobs` WHERE BlobId=%d AND RefCount = -1" % int( blobId ) )
 
   def accessedSandboxById( self, sbId ):
     """
@@ -310,19 +466,33 @@ class SandboxMetadataDB( DB ):
     """
     sqlCond = [ "Assigned AND SBId NOT IN ( SELECT SBId FROM `sb_EntityMapping` ) AND TIMESTAMPDIFF( DAY, LastAccessTime, UTC_TIMESTAMP() ) >= %d" % self.__assignedSBGraceDays,
                 "! Assigned AND TIMESTAMPDIFF( DAY, LastAccessTime, UTC_TIMESTAMP() ) >= %s" % self.__unassignedSBGraceDays]
-    sqlCmd = "SELECT SBId, SEName, SEPFN FROM `sb_SandBoxes` WHERE ( %s )" % " ) OR ( ".join( sqlCond )
+    sqlCmd = "SELECT SBId, SEName, SEPFN, BlobId FROM `sb_SandBoxes` WHERE ( %s )" % " ) OR ( ".join( sqlCond )
     return self._query( sqlCmd )
 
   def deleteSandboxes( self, SBIdList ):
     """
-    Delete sandboxes
+    Delete sandboxes and drop their references to the blobs
     """
     sqlSBList = ", ".join( [ str( sbid ) for sbid in SBIdList ] )
+    sqlCmd = "SELECT BlobId, COUNT(*) FROM `sb_SandBoxes` WHERE SBId IN ( %s ) AND BlobId > 0 GROUP BY BlobId" % sqlSBList
+    result = self._query( sqlCmd )
+    if not result[ 'OK' ]:
+      return result
+    blobsByRefs = {}
+    for blobId, refs in result[ 'Value' ]:
+      blobsByRefs.setdefault( int( refs ), [] ).append( str( blobId ) )
     for table in ( 'sb_SandBoxes', 'sb_EntityMapping' ):
       sqlCmd = "DELETE FROM `%s` WHERE SBId IN ( %s )" % ( table, sqlSBList )
       result = self._update( sqlCmd )
       if not result[ 'OK' ]:
         return result
+    #References are dropped once the sandboxes are gone, a failure can only keep a blob stored
+    for refs in blobsByRefs:
+      sqlCmd = "UPDATE `sb_Blobs` SET RefCount=GREATEST( RefCount - %d, 0 )" % refs
+      sqlCmd = "%s WHERE RefCount > 0 AND BlobId IN ( %s )" % ( sqlCmd, ", ".join( blobsByRefs[ refs ] ) )
+      result = self._update( sqlCmd )
+      if not result[ 'OK' ]:
+        return result
     return S_OK()
 
   def setLocation( self, SBId, location ):
@@ -333,7 +503,8 @@ class SandboxMetadataDB( DB ):
 
   def getSandboxId( self, SEName, SEPFN, requesterName, requesterGroup ):
     """
-    Get the sandboxId if it exists
+    Get the sandboxId if it exists. Several owners can share a location, the requester's
+    own sandbox is preferred, then one of the requester's group, then the oldest one
     """
     sqlCond = [ "s.SEPFN=%s" % self._escapeString( SEPFN )['Value'],
                 "s.SEName=%s" % self._escapeString( SEName )['Value'],
@@ -350,12 +521,15 @@ class SandboxMetadataDB( DB ):
       sqlCond.append( "o.Owner='%s'" % requesterName )
     else:
       return S_ERROR( "Not authorized to access sandbox" )
-    result = self._query( "%s %s" % ( sqlCmd, " AND ".join( sqlCond ) ) )
+    sqlName = self._escapeString( requesterName )[ 'Value' ]
+    sqlGroup = self._escapeString( requesterGroup )[ 'Value' ]
+    sqlOrder = "ORDER BY ( o.Owner=%s AND o.OwnerGroup=%s ) DESC, o.OwnerGroup=%s DESC, s.SBId LIMIT 1" % ( sqlName,
+                                                                                                          sqlGroup,
+                                                                                                          sqlGroup )
+    result = self._query( "%s %s %s" % ( sqlCmd, " AND ".join( sqlCond ), sqlOrder ) )
     if not result[ 'OK' ]:
       return result
     data = result[ 'Value' ]
-    if len( data ) > 1:
-      self.log.error( "More than one sandbox registered with the same Id!", data )
     if len( data ) == 0:
       return S_ERROR( "No sandbox matches the requirements" )
     return S_OK( data[0][0] )
@@ -9,8 +9,10 @@ __RCSID__ = "ebed3a8 (2012-07-06 20:33:11 +0200) Adri Casajs <adria@ecm.ub.es>"
 import types
 import random
 import time
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List, DictCache
@@ -41,6 +43,12 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    self.__tqIndex = TaskQueueIndex( self.__singleValueDefFields, self.__multiValueDefFields,
+                                     self.__multiValueMatchFields, self.__bannedJobMatchFields,
+                                     self.__strictRequireMatchFields )
+    self.__tqIndexLock = threading.Lock()
+    self.__tqIndexLastSync = 0
+    self.__tqIndexLastResync = 0
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -76,6 +84,9 @@ class TaskQueueDB( DB ):
   def getValidPilotTypes( self ):
     return self.__getCSOption( "AllPilotTypes", [ 'private' ] )
 
+  def isTaskQueueIndexEnabled( self ):
+    return self.__getCSOption( "UseTaskQueueIndex", False )
+
   def __initializeDB( self ):
     """
     Create the tables
@@ -327,6 +338,8 @@ class TaskQueueDB( DB ):
                              conn = connObj )
       if not result[ 'OK' ]:
         return result
+    #Forget the deleted task queues at the next match
+    self.__tqIndexLastSync = 0
     return S_OK()
 
   def setTaskQueueState( self, tqId, enabled = True, connObj = False ):
@@ -398,8 +411,17 @@ class TaskQueueDB( DB ):
         self.recalculateTQSharesForEntity( tqDefDict[ 'OwnerDN' ], tqDefDict[ 'OwnerGroup' ], connObj = connObj )
     finally:
       self.setTaskQueueState( tqId, True )
+    if newTQ and self.__tqIndexLastResync:
+      self.__addToTaskQueueIndex( [ tqId ] )
     return S_OK()
 
+  def putBackJob( self, jobId, tqId, jobPriority ):
+    """
+    Put back in its task queue a job extracted by matchAndGetJob that could not be assigned
+    """
+    self.log.info( "Putting back job %s in TQ %s" % ( jobId, tqId ) )
+    return self.__insertJobInTaskQueue( jobId, tqId, int( jobPriority ) )
+
   def __insertJobInTaskQueue( self, jobId, tqId, jobPriority, checkTQExists = True, connObj = False ):
     """
     Insert a job in a given task queue
@@ -498,6 +520,7 @@ class TaskQueueDB( DB ):
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
     self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
+    rawMatchDict = self.__rawMatchDefinition( tqMatchDict )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
       self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
@@ -512,14 +535,13 @@ class TaskQueueDB( DB ):
     for matchTry in range( self.__maxMatchRetry ):
       if 'JobID' in tqMatchDict:
         # A certain JobID is required by the resource, so all TQ are to be considered
-        retVal = self.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = 0, skipMatchDictDef = True, connObj = connObj )
+        retVal = self.__matchTaskQueues( tqMatchDict, rawMatchDict, numQueuesToGet = 0, connObj = connObj )
         preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
       else:
-        retVal = self.matchAndGetTaskQueue( tqMatchDict,
-                                            numQueuesToGet = numQueuesPerTry,
-                                            skipMatchDictDef = True,
-                                            negativeCond = negativeCond,
-                                            connObj = connObj )
+        retVal = self.__matchTaskQueues( tqMatchDict, rawMatchDict,
+                                         numQueuesToGet = numQueuesPerTry,
+                                         negativeCond = negativeCond,
+                                         connObj = connObj )
       if not retVal[ 'OK' ]:
         return retVal
       tqList = retVal[ 'Value' ]
@@ -552,7 +574,8 @@ class TaskQueueDB( DB ):
             return S_ERROR( msgFix + msgVar )
           if retVal[ 'Value' ] == True :
             self.log.info( "Extracted job %s with prio %s from TQ %s" % ( jobId, prio, tqId ) )
-            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
+            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'jobPriority' : prio,
+                           'tqMatch' : tqMatchDict } )
         self.log.info( "No jobs could be extracted from TQ %s" % tqId )
     self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
     return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
@@ -564,10 +587,35 @@ class TaskQueueDB( DB ):
     """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
+    rawMatchDict = False
     if not skipMatchDictDef:
+      rawMatchDict = self.__rawMatchDefinition( tqMatchDict )
       retVal = self._checkMatchDefinition( tqMatchDict )
       if not retVal[ 'OK' ]:
         return retVal
+    return self.__matchTaskQueues( tqMatchDict, rawMatchDict, numQueuesToGet = numQueuesToGet,
+                                   negativeCond = negativeCond, connObj = connObj )
+
+  def __rawMatchDefinition( self, tqMatchDict ):
+    """
+    Copy of the match dict before escaping, as required by the task queue index
+    """
+    rawMatchDict = dict( tqMatchDict )
+    if 'LHCbPlatform' in rawMatchDict and not "Platform" in rawMatchDict:
+      rawMatchDict['Platform'] = rawMatchDict['LHCbPlatform']
+    return rawMatchDict
+
+  def __matchTaskQueues( self, tqMatchDict, rawMatchDict, numQueuesToGet = 1, negativeCond = {}, connObj = False ):
+    """
+    Get the task queues that match the requirements from the in memory index if enabled,
+    or from the DB. tqMatchDict has to be already checked and rawMatchDict is its unescaped version
+    """
+    if rawMatchDict and self.isTaskQueueIndexEnabled():
+      retVal = self.__syncTaskQueueIndex()
+      if retVal[ 'OK' ]:
+        return S_OK( self.__tqIndex.match( rawMatchDict, numQueuesToGet = numQueuesToGet,
+                                           negativeCond = negativeCond ) )
+      self.log.warn( "Cannot sync the task queue index, matching in the DB", retVal[ 'Message' ] )
     retVal = self.__generateTQMatchSQL( tqMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
     if not retVal[ 'OK' ]:
       return retVal
@@ -577,6 +625,91 @@ class TaskQueueDB( DB ):
       return retVal
     return S_OK( [ ( row[0], row[1], row[2] ) for row in retVal[ 'Value' ] ] )
 
+  def __loadTaskQueueDefinitions( self, tqIdList = False ):
+    """
+    Get the definitions of the enabled task queues as { tqId : { field : value(s) } }
+    Task queues are enabled once all their multi value fields have been inserted
+    """
+    sqlFields = [ 'TQId', 'Priority' ] + list( self.__singleValueDefFields )
+    sqlCmd = "SELECT %s FROM `tq_TaskQueues` WHERE Enabled >= 1" % ", ".join( sqlFields )
+    sqlTQCond = ""
+    if tqIdList != False:
+      if len( tqIdList ) == 0:
+        return S_OK( {} )
+      sqlTQCond = " WHERE TQId in ( %s )" % ", ".join( [ str( tqId ) for tqId in tqIdList ] )
+      sqlCmd = "%s AND TQId in ( %s )" % ( sqlCmd, ", ".join( [ str( tqId ) for tqId in tqIdList ] ) )
+    retVal = self._query( sqlCmd )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't retrieve task queues definitions: %s" % retVal[ 'Message' ] )
+    tqDefs = {}
+    for record in retVal[ 'Value' ]:
+      tqDefs[ record[0] ] = dict( zip( sqlFields[1:], record[1:] ) )
+    if not tqDefs:
+      return S_OK( tqDefs )
+    for field in self.__multiValueDefFields:
+      retVal = self._query( "SELECT TQId, Value FROM `tq_TQTo%s`%s" % ( field, sqlTQCond ) )
+      if not retVal[ 'OK' ]:
+        return S_ERROR( "Can't retrieve task queues field %s: %s" % ( field, retVal[ 'Message' ] ) )
+      for tqId, value in retVal[ 'Value' ]:
+        if tqId in tqDefs:
+          tqDefs[ tqId ].setdefault( field, [] ).append( value )
+    return S_OK( tqDefs )
+
+  def __addToTaskQueueIndex( self, tqIdList ):
+    retVal = self.__loadTaskQueueDefinitions( tqIdList )
+    if not retVal[ 'OK' ]:
+      self.log.error( "Cannot add task queues to the index", retVal[ 'Message' ] )
+      return retVal
+    self.__tqIndex.addTaskQueues( retVal[ 'Value' ] )
+    return S_OK()
+
+  def __syncTaskQueueIndex( self ):
+    """
+    Bring the task queue index up to date at most every TaskQueueIndexSyncTime seconds:
+    add the new enabled task queues, remove the deleted ones and update the priorities.
+    Everything is reloaded every TaskQueueIndexResyncTime seconds
+    """
+    syncTime = self.__getCSOption( "TaskQueueIndexSyncTime", 5 )
+    if time.time() - self.__tqIndexLastSync < syncTime:
+      return S_OK()
+    #Only one thread syncs, the rest keep using the index unless it has never been loaded
+    if not self.__tqIndexLock.acquire( self.__tqIndexLastResync == 0 ):
+      return S_OK()
+    try:
+      now = time.time()
+      if now - self.__tqIndexLastSync < syncTime:
+        return S_OK()
+      if now - self.__tqIndexLastResync > self.__getCSOption( "TaskQueueIndexResyncTime", 600 ):
+        retVal = self.__loadTaskQueueDefinitions()
+        if not retVal[ 'OK' ]:
+          return retVal
+        self.__tqIndex.reset( retVal[ 'Value' ] )
+        self.log.info( "Loaded %s task queues in the index" % len( retVal[ 'Value' ] ) )
+        self.__tqIndexLastResync = now
+        self.__tqIndexLastSync = now
+        return S_OK()
+      retVal = self._query( "SELECT TQId, Priority, Enabled FROM `tq_TaskQueues`" )
+      if not retVal[ 'OK' ]:
+        return retVal
+      knownTQs = self.__tqIndex.getTaskQueueIds()
+      prioDict = {}
+      newTQs = []
+      for tqId, priority, enabled in retVal[ 'Value' ]:
+        if tqId in knownTQs:
+          prioDict[ tqId ] = priority
+        elif enabled >= 1:
+          newTQs.append( tqId )
+      self.__tqIndex.removeTaskQueues( knownTQs.difference( prioDict ) )
+      self.__tqIndex.setPriorities( prioDict )
+      if newTQs:
+        retVal = self.__addToTaskQueueIndex( newTQs )
+        if not retVal[ 'OK' ]:
+          return retVal
+      self.__tqIndexLastSync = now
+      return S_OK()
+    finally:
+      self.__tqIndexLock.release()
+
   def __generateSQLSubCond( self, sqlString, value, boolOp = 'OR' ):
     if type( value ) not in ( types.ListType, types.TupleType ):
       return sqlString % str( value ).strip()
@@ -845,6 +978,7 @@ class TaskQueueDB( DB ):
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
           return retVal
+      self.__tqIndex.removeTaskQueues( [ tqId ] )
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       self.log.info( "Deleted empty and enabled TQ %s" % tqId )
       return S_OK( True )
@@ -873,12 +1007,13 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
+    self.__tqIndex.removeTaskQueues( [ tqId ] )
     sqlCmd = "DELETE FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s" % tqId
     retVal = self._update( sqlCmd, conn = connObj )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     for mvField in self.__multiValueDefFields:
-      retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % tqId, conn = connObj )
+      retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
       if not retVal[ 'OK' ]:
         return retVal
     if delTQ > 0:
@@ -1090,7 +1225,9 @@ class TaskQueueDB( DB ):
     for prio in prioDict:
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+      result = self._update( updateSQL, conn = connObj )
+      if result[ 'OK' ]:
+        self.__tqIndex.setPriorities( dict( [ ( tqId, prio ) for tqId in prioDict[ prio ] ] ) )
     return S_OK()
 
   def getGroupShares( self ):
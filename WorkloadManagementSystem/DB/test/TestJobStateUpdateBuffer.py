@@ -0,0 +1,172 @@
+""" Test cases for the write-behind buffer of the JobStateUpdate service
+"""
+
+import unittest
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer import JobStateUpdateBuffer
+
+class FakeDB:
+  """ Records the write calls
+  """
+
+  def __init__( self ):
+    self.calls = []
+    #Methods failing once
+    self.failures = []
+    #Rows always refused
+    self.badRows = []
+    #LastUpdateTime of the jobs in the DB
+    self.lastUpdate = {}
+
+  def getAttributesForJobList( self, jobIDList, attrList ):
+    return S_OK( dict( [ ( jobID, { 'LastUpdateTime' : self.lastUpdate[ jobID ] } )
+                         for jobID in jobIDList if jobID in self.lastUpdate ] ) )
+
+  def __getattr__( self, name ):
+    def method( *args, **kwargs ):
+      if name in self.failures:
+        self.failures.remove( name )
+        return S_ERROR( "Lost connection to the DB" )
+      for arg in args:
+        if type( arg ) == type( [] ) and [ row for row in arg if row in self.badRows ]:
+          return S_ERROR( "Data too long" )
+      self.calls.append( ( name, args, kwargs ) )
+      return S_OK()
+    return method
+
+class JobStateUpdateBufferTestCase( unittest.TestCase ):
+  """ Coalescing and flushing of the updates
+  """
+
+  def setUp( self ):
+    self.jobDB = FakeDB()
+    self.logDB = FakeDB()
+    self.buffer = JobStateUpdateBuffer( self.jobDB, self.logDB )
+
+  def test_coalesce( self ):
+    self.buffer.setJobStatus( 1, 'Running', 'Application' )
+    self.buffer.setJobStatus( 1, '', 'Done step 1' )
+    self.buffer.setJobStatus( 2, 'Stalled', 'Application' )
+    self.buffer.setJobParameter( 1, 'CPU', '1' )
+    self.buffer.setJobParameters( 1, [ ( 'CPU', '2' ), ( 'Memory', '10' ) ] )
+    self.buffer.addLoggingRecord( 1, 'Running', 'Application', source = 'Test' )
+    attrs = self.buffer.getAttributes( 1 )
+    self.assertEqual( attrs[ 'Status' ], 'Running' )
+    self.assertEqual( attrs[ 'MinorStatus' ], 'Done step 1' )
+    self.assert_( 'LastUpdateTime' in attrs )
+    #Stalled does not refresh the LastUpdateTime
+    self.failIf( 'LastUpdateTime' in self.buffer.getAttributes( 2 ) )
+    self.assertEqual( self.buffer.getParameters( 1 ), { 'CPU' : '2', 'Memory' : '10' } )
+    self.failIf( self.jobDB.calls )
+
+    self.buffer.flush()
+    self.assertEqual( self.buffer.getAttributes( 1 ), {} )
+    methods = [ call[0] for call in self.jobDB.calls ]
+    self.assertEqual( sorted( methods ), [ 'insertFieldsBulk', 'setJobAttributes', 'setJobAttributes' ] )
+    bulk = [ call for call in self.jobDB.calls if call[0] == 'insertFieldsBulk' ][0]
+    self.assertEqual( sorted( bulk[1][2] ), [ ( 1, 'CPU', '2' ), ( 1, 'Memory', '10' ) ] )
+    self.assertEqual( self.logDB.calls[0][0], 'addLoggingRecords' )
+    self.assertEqual( len( self.logDB.calls[0][1][0] ), 1 )
+
+  def test_heartBeats( self ):
+    for jobID in range( 10 ):
+      self.buffer.setHeartBeatData( jobID, { 'Static' : 'x' }, { 'CPUConsumed' : '1', 'Memory' : '2' } )
+    self.assertEqual( self.buffer.getStats()[ 'pendingHeartBeatSamples' ], 20 )
+    self.buffer.flush()
+    attrCalls = [ call for call in self.jobDB.calls if call[0] == 'setJobAttributes' ]
+    #All the jobs have the same new values, at most one statement per second of heart beats
+    self.assert_( len( attrCalls ) <= 2 )
+    self.assertEqual( sum( [ len( call[1][0] ) for call in attrCalls ] ), 10 )
+    tables = sorted( [ call[1][0] for call in self.jobDB.calls if call[0] == 'insertFieldsBulk' ] )
+    self.assertEqual( tables, [ 'HeartBeatLoggingInfo', 'JobParameters' ] )
+    self.assertEqual( self.buffer.getStats()[ 'pendingHeartBeatSamples' ], 0 )
+
+  def test_failedFlush( self ):
+    self.buffer.setJobStatus( 1, 'Running', 'Application' )
+    self.buffer.setJobStatus( 2, 'Running', 'Input' )
+    self.buffer.setJobParameter( 1, 'CPU', '1' )
+    self.buffer.addLoggingRecord( 1, 'Running', 'Application', source = 'Test' )
+    self.jobDB.failures = [ 'setJobAttributes', 'insertFieldsBulk' ]
+    self.logDB.failures = [ 'addLoggingRecords' ]
+    self.buffer.flush()
+    #One group of attributes was written, the rest is still pending
+    self.assertEqual( len( self.jobDB.calls ), 1 )
+    written = self.jobDB.calls[0][1][0][0]
+    failed = 3 - written
+    self.assertEqual( self.buffer.getAttributes( written ), {} )
+    self.assertEqual( self.buffer.getAttributes( failed )[ 'Status' ], 'Running' )
+    self.assertEqual( self.buffer.getParameters( 1 ), { 'CPU' : '1' } )
+    self.assertEqual( self.buffer.getStats()[ 'pendingLoggingRecords' ], 1 )
+    #Newer values are not overwritten by the failed ones
+    self.buffer.setJobStatus( failed, 'Done', 'Execution Complete' )
+    self.buffer.setJobParameter( 1, 'CPU', '2' )
+    self.buffer.addLoggingRecord( 1, 'Done', 'Execution Complete', source = 'Test' )
+    self.jobDB.calls = []
+    self.buffer.flush()
+    attrCall = [ call for call in self.jobDB.calls if call[0] == 'setJobAttributes' ][0]
+    self.assertEqual( attrCall[1][0], [ failed ] )
+    self.assertEqual( dict( zip( attrCall[1][1], attrCall[1][2] ) )[ 'Status' ], 'Done' )
+    bulk = [ call for call in self.jobDB.calls if call[0] == 'insertFieldsBulk' ][0]
+    self.assertEqual( bulk[1][2], [ ( 1, 'CPU', '2' ) ] )
+    records = self.logDB.calls[0][1][0]
+    self.assertEqual( [ record[1] for record in records ], [ 'Running', 'Done' ] )
+    stats = self.buffer.getStats()
+    self.assertEqual( ( stats[ 'pendingJobs' ], stats[ 'pendingLoggingRecords' ], stats[ 'errors' ] ), ( 0, 0, 3 ) )
+
+  def test_badRows( self ):
+    """ the rows refused by the DB do not hold back the others, and are dropped in the end """
+    for jobID in range( 1, 9 ):
+      self.buffer.setJobParameter( jobID, 'CPU', str( jobID ) )
+    self.jobDB.badRows = [ ( 5, 'CPU', '5' ) ]
+    self.buffer.flush()
+    written = []
+    for call in self.jobDB.calls:
+      written += call[1][2]
+    self.assertEqual( sorted( written ), [ ( jobID, 'CPU', str( jobID ) ) for jobID in range( 1, 9 ) if jobID != 5 ] )
+    self.assertEqual( self.buffer.getParameters( 5 ), { 'CPU' : '5' } )
+    self.assertEqual( self.buffer.getStats()[ 'pendingJobs' ], 1 )
+    self.buffer.flush()
+    self.assertEqual( self.buffer.getParameters( 5 ), { 'CPU' : '5' } )
+    # Retried for too long
+    failures = self.buffer._JobStateUpdateBuffer__failures
+    for key in failures:
+      failures[ key ] -= 3600
+    self.buffer.flush()
+    stats = self.buffer.getStats()
+    self.assertEqual( ( stats[ 'pendingJobs' ], stats[ 'dropped' ] ), ( 0, 1 ) )
+
+  def test_stale( self ):
+    """ the failed attribute values are not written over a newer status of the JobDB """
+    self.buffer.setJobStatus( 1, 'Running', 'Application' )
+    self.buffer.setJobParameter( 1, 'CPU', '1' )
+    self.jobDB.failures = [ 'setJobAttributes', 'insertFieldsBulk' ]
+    # Killed meanwhile by the JobManager
+    self.jobDB.lastUpdate[ 1 ] = '2999-01-01 00:00:00'
+    self.buffer.flush()
+    self.assertEqual( self.buffer.getAttributes( 1 ), {} )
+    self.assertEqual( self.buffer.getParameters( 1 ), { 'CPU' : '1' } )
+    self.assertEqual( self.buffer.getStats()[ 'dropped' ], 3 )
+    # Older updates of the JobDB do not matter
+    self.jobDB.lastUpdate[ 1 ] = '2000-01-01 00:00:00'
+    self.buffer.setJobStatus( 1, 'Done', 'Execution Complete' )
+    self.jobDB.failures = [ 'setJobAttributes' ]
+    self.buffer.flush()
+    self.assertEqual( self.buffer.getAttributes( 1 )[ 'Status' ], 'Done' )
+
+  def test_maxQueued( self ):
+    """ the oldest logging records are dropped if too many are pending """
+    self.buffer = JobStateUpdateBuffer( self.jobDB, self.logDB, maxQueued = 5 )
+    for i in range( 8 ):
+      self.buffer.addLoggingRecord( 1, 'Running', 'Step %d' % i, source = 'Test' )
+    # The DB is down, the halves fail too
+    self.logDB.failures = [ 'addLoggingRecords' ] * 100
+    self.buffer.flush()
+    stats = self.buffer.getStats()
+    self.assertEqual( ( stats[ 'pendingLoggingRecords' ], stats[ 'dropped' ] ), ( 5, 3 ) )
+    self.logDB.failures = []
+    self.buffer.flush()
+    self.assertEqual( [ record[2] for record in self.logDB.calls[0][1][0] ], [ 'Step %d' % i for i in range( 3, 8 ) ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobStateUpdateBufferTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,168 @@
+""" Unit tests of the shared sandbox contents of the SandboxMetadataDB,
+    the MySQL statements are run on an in memory sqlite database
+"""
+
+import unittest, re, sqlite3
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Security import Properties
+import DIRAC.WorkloadManagementSystem.DB.SandboxMetadataDB as SandboxMetadataDBModule
+
+class FakeSandboxMetadataDB( SandboxMetadataDBModule.SandboxMetadataDB ):
+
+  def __init__( self ):
+    self.conn = sqlite3.connect( ':memory:' )
+    self.conn.execute( "CREATE TABLE sb_Owners( OwnerId INTEGER PRIMARY KEY AUTOINCREMENT, Owner, OwnerDN, OwnerGroup )" )
+    self.conn.execute( "CREATE TABLE sb_SandBoxes( SBId INTEGER PRIMARY KEY AUTOINCREMENT, OwnerId, SEName, SEPFN, Bytes, "
+                       "RegistrationTime, LastAccessTime, Assigned DEFAULT 0, BlobId DEFAULT 0, UNIQUE( SEName, SEPFN, OwnerId ) )" )
+    self.conn.execute( "CREATE TABLE sb_EntityMapping( SBId, EntitySetup, EntityId, Type )" )
+    self.conn.execute( "CREATE TABLE sb_Blobs( BlobId INTEGER PRIMARY KEY AUTOINCREMENT, Hash, SEName, SEPFN, Bytes, "
+                       "RefCount DEFAULT 0, RegistrationTime, LastAccessTime, Stored DEFAULT 0, UNIQUE( SEName, SEPFN ) )" )
+    self._SandboxMetadataDB__assignedSBGraceDays = 0
+    self._SandboxMetadataDB__unassignedSBGraceDays = 15
+    self._SandboxMetadataDB__unreferencedBlobGraceHours = 1
+    self.log = gLogger
+
+  def __sql( self, sqlCmd ):
+    sqlCmd = re.sub( r"TIMESTAMPDIFF\( (\w+), (\w+), UTC_TIMESTAMP\(\) \)",
+                     lambda m : "((julianday('now')-julianday(%s))*%s)" % ( m.group( 2 ), { 'HOUR' : 24, 'DAY' : 1 }[ m.group( 1 ) ] ),
+                     sqlCmd )
+    sqlCmd = sqlCmd.replace( "UTC_TIMESTAMP()", "datetime('now')" ).replace( "GREATEST", "MAX" )
+    sqlCmd = sqlCmd.replace( "! Assigned", "NOT Assigned" )
+    #AUTO_INCREMENT columns get their value when inserted as 0 in MySQL
+    return sqlCmd.replace( "( 0,", "( NULL," )
+
+  def _escapeString( self, myString ):
+    return S_OK( "'%s'" % myString )
+
+  def _query( self, sqlCmd, conn = False ):
+    return S_OK( tuple( self.conn.execute( self.__sql( sqlCmd ) ).fetchall() ) )
+
+  def _update( self, sqlCmd, conn = False ):
+    try:
+      cursor = self.conn.execute( self.__sql( sqlCmd ) )
+    except sqlite3.IntegrityError, x:
+      return S_ERROR( "Duplicate entry: %s" % x )
+    result = S_OK( cursor.rowcount )
+    result[ 'lastRowId' ] = cursor.lastrowid
+    return result
+
+  def refCount( self, blobId ):
+    return self.conn.execute( "SELECT RefCount FROM sb_Blobs WHERE BlobId=%d" % blobId ).fetchall()[0][0]
+
+  def age( self, hours ):
+    self.conn.execute( "UPDATE sb_Blobs SET LastAccessTime=datetime('now','-%d hours')" % hours )
+
+userProperties = { 'admin' : [ Properties.JOB_ADMINISTRATOR ],
+                   'sharing' : [ Properties.JOB_SHARING ] }
+
+class SandboxMetadataDBTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.getProperties = SandboxMetadataDBModule.CS.getPropertiesForEntity
+    SandboxMetadataDBModule.CS.getPropertiesForEntity = lambda group, name = None : userProperties.get( name, [ Properties.NORMAL_USER ] )
+    self.db = FakeSandboxMetadataDB()
+
+  def tearDown( self ):
+    SandboxMetadataDBModule.CS.getPropertiesForEntity = self.getProperties
+
+  def register( self, owner, group, blobHash = 'abc', pfn = '/Blobs/abc.tar.bz2' ):
+    result = self.db.acquireBlob( blobHash, 'SandboxSE', pfn, 10 )
+    self.assert_( result[ 'OK' ] )
+    blobId, mustStore = result[ 'Value' ]
+    if mustStore:
+      self.assertEqual( self.db.markBlobStored( blobId ), S_OK( True ) )
+    result = self.db.registerAndGetSandbox( owner, '/%s' % owner, group, 'SandboxSE', pfn, 10, blobId )
+    self.assert_( result[ 'OK' ] )
+    return result[ 'Value' ][0], blobId, result[ 'Value' ][1]
+
+  def test_dedup( self ):
+    """ the same content is stored once, every owner gets a sandbox referencing it """
+    result = self.db.acquireBlob( 'abc', 'SandboxSE', '/Blobs/abc.tar.bz2', 10 )
+    self.assertEqual( result[ 'Value' ][1], True )
+    self.db.releaseBlob( result[ 'Value' ][0] )
+    sbId1, blobId1, new1 = self.register( 'user1', 'group1' )
+    sbId2, blobId2, new2 = self.register( 'user2', 'group2' )
+    self.assertEqual( blobId1, blobId2 )
+    self.assertNotEqual( sbId1, sbId2 )
+    self.assert_( new1 and new2 )
+    self.assertEqual( self.db.refCount( blobId1 ), 2 )
+    self.assertEqual( self.db.conn.execute( "SELECT COUNT(*) FROM sb_Blobs" ).fetchall()[0][0], 1 )
+    self.register( 'user1', 'group1', 'def', '/Blobs/def.tar.bz2' )
+    self.assertEqual( self.db.conn.execute( "SELECT COUNT(*) FROM sb_Blobs" ).fetchall()[0][0], 2 )
+
+  def test_sandboxId( self ):
+    """ the requester gets its own sandbox for a shared location, or always the same one """
+    pfn = '/Blobs/abc.tar.bz2'
+    sbIds = {}
+    for owner, group in ( ( 'user1', 'group1' ), ( 'user2', 'group2' ), ( 'user3', 'group2' ),
+                          ( 'sharing', 'group2' ), ( 'admin', 'group3' ) ):
+      sbIds[ owner ] = self.register( owner, group )[0]
+    for owner, group in ( ( 'user1', 'group1' ), ( 'user2', 'group2' ), ( 'user3', 'group2' ),
+                          ( 'sharing', 'group2' ), ( 'admin', 'group3' ) ):
+      self.assertEqual( self.db.getSandboxId( 'SandboxSE', pfn, owner, group ), S_OK( sbIds[ owner ] ) )
+    # Without a sandbox of their own, the one of the group, then the oldest
+    self.assertEqual( self.db.getSandboxId( 'SandboxSE', pfn, 'sharing', 'group1' ), S_OK( sbIds[ 'user1' ] ) )
+    self.assertEqual( self.db.getSandboxId( 'SandboxSE', pfn, 'admin', 'group2' ), S_OK( sbIds[ 'user2' ] ) )
+    self.assertEqual( self.db.getSandboxId( 'SandboxSE', pfn, 'admin', 'group4' ), S_OK( sbIds[ 'user1' ] ) )
+    self.failIf( self.db.getSandboxId( 'SandboxSE', pfn, 'user4', 'group1' )[ 'OK' ] )
+
+  def test_refCount( self ):
+    """ the blob is only purged once no sandbox references it """
+    sbId1, blobId, new = self.register( 'user1', 'group1' )
+    sbId2 = self.register( 'user2', 'group2' )[0]
+    # Registering the same sandbox again does not take another reference
+    self.db.releaseBlob( self.register( 'user1', 'group1' )[1] )
+    self.assertEqual( self.db.refCount( blobId ), 2 )
+    self.db.age( 2 )
+    self.assertEqual( self.db.getUnreferencedBlobs()[ 'Value' ], () )
+    self.assert_( self.db.deleteSandboxes( [ sbId1 ] )[ 'OK' ] )
+    self.assertEqual( self.db.refCount( blobId ), 1 )
+    self.assertEqual( self.db.claimBlobForDeletion( blobId ), S_OK( False ) )
+    self.assert_( self.db.deleteSandboxes( [ sbId2 ] )[ 'OK' ] )
+    self.assertEqual( self.db.refCount( blobId ), 0 )
+    self.db.age( 2 )
+    self.assertEqual( [ row[0] for row in self.db.getUnreferencedBlobs()[ 'Value' ] ], [ blobId ] )
+    self.assertEqual( self.db.claimBlobForDeletion( blobId ), S_OK( True ) )
+    # Given back, the blob can be referenced again
+    self.db.unclaimBlob( blobId )
+    self.assertEqual( self.register( 'user3', 'group3' )[1], blobId )
+    self.assertEqual( self.db.refCount( blobId ), 1 )
+    self.db.releaseBlob( blobId )
+    self.db.conn.execute( "DELETE FROM sb_SandBoxes" )
+    self.db.age( 2 )
+    self.assertEqual( self.db.claimBlobForDeletion( blobId ), S_OK( True ) )
+    self.assert_( self.db.deleteBlob( blobId )[ 'OK' ] )
+    self.assertEqual( self.db.conn.execute( "SELECT COUNT(*) FROM sb_Blobs" ).fetchall()[0][0], 0 )
+
+  def test_stored( self ):
+    """ only stored contents are shared, the ones never stored are purged """
+    blobId, mustStore = self.db.acquireBlob( 'abc', 'SandboxSE', '/Blobs/abc.tar.bz2', 10 )[ 'Value' ]
+    self.assert_( mustStore )
+    # Another upload before the first one has stored it has to store it too
+    self.assertEqual( self.db.acquireBlob( 'abc', 'SandboxSE', '/Blobs/abc.tar.bz2', 10 ), S_OK( ( blobId, True ) ) )
+    self.assertEqual( self.db.refCount( blobId ), 2 )
+    self.assertEqual( self.db.markBlobStored( blobId ), S_OK( True ) )
+    self.assertEqual( self.db.acquireBlob( 'abc', 'SandboxSE', '/Blobs/abc.tar.bz2', 10 ), S_OK( ( blobId, False ) ) )
+    # Sandboxes registered on contents never stored, and the ones registered before the blobs
+    sbId = self.db.registerAndGetSandbox( 'user1', '/user1', 'group1', 'SandboxSE', '/Blobs/abc.tar.bz2', 10, blobId )[ 'Value' ][0]
+    self.assertEqual( self.db.isSandboxStored( sbId ), S_OK( True ) )
+    self.db.conn.execute( "UPDATE sb_Blobs SET Stored=0" )
+    self.assertEqual( self.db.isSandboxStored( sbId ), S_OK( False ) )
+    self.db.conn.execute( "UPDATE sb_Blobs SET Stored=1" )
+    self.db.conn.execute( "UPDATE sb_SandBoxes SET BlobId=0" )
+    self.assertEqual( self.db.isSandboxStored( sbId ), S_OK( True ) )
+    self.assertEqual( self.db.isSandboxStored( sbId + 1 ), S_OK( False ) )
+    # An upload that did not store the contents keeps its reference, they are purged after a while
+    blobId = self.db.acquireBlob( 'def', 'SandboxSE', '/Blobs/def.tar.bz2', 10 )[ 'Value' ][0]
+    self.assertEqual( [ row[0] for row in self.db.getUnreferencedBlobs()[ 'Value' ] ], [] )
+    self.db.age( 2 )
+    self.assertEqual( [ row[0] for row in self.db.getUnreferencedBlobs()[ 'Value' ] ], [ blobId ] )
+    self.assertEqual( self.db.claimBlobForDeletion( blobId ), S_OK( True ) )
+    # Too late to store them
+    self.assertEqual( self.db.markBlobStored( blobId ), S_OK( False ) )
+    self.assert_( self.db.deleteBlob( blobId )[ 'OK' ] )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( SandboxMetadataDBTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,73 @@
+""" Unit tests of the site mask cache of the JobDB,
+    the MySQL statements are run on an in memory sqlite database
+"""
+
+import unittest, sqlite3
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+
+class FakeJobDB( JobDB ):
+
+  def __init__( self ):
+    self.conn = sqlite3.connect( ':memory:' )
+    for table in ( 'SiteMask', 'SiteMaskLogging' ):
+      self.conn.execute( "CREATE TABLE %s( Site, Status, LastUpdateTime, Author, Comment )" % table )
+    self.siteMaskCacheTime = 10
+    self.maskQueries = 0
+
+  def _escapeString( self, myString ):
+    return S_OK( "'%s'" % myString )
+
+  def _query( self, cmd, conn = False ):
+    if cmd.startswith( "SELECT Site FROM SiteMask" ):
+      self.maskQueries += 1
+    return S_OK( tuple( self.conn.execute( cmd ).fetchall() ) )
+
+  def _update( self, cmd, conn = False ):
+    cmd = cmd.replace( "UTC_TIMESTAMP()", "datetime('now')" )
+    return S_OK( self.conn.execute( cmd ).rowcount )
+
+class SiteMaskCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.jobDB = FakeJobDB()
+    self.jobDB.removeSiteFromMask( 'All' )
+    self.jobDB.setSiteMask( [ ( 'Site1', 'Active' ), ( 'Site2', 'Active' ) ] )
+
+  def test_cached( self ):
+    """ the mask is read once, the callers get their own copy """
+    siteMask = self.jobDB.getSiteMask()[ 'Value' ]
+    self.assertEqual( sorted( siteMask ), [ 'Site1', 'Site2' ] )
+    siteMask.append( 'Site3' )
+    self.assertEqual( sorted( self.jobDB.getSiteMask()[ 'Value' ] ), [ 'Site1', 'Site2' ] )
+    self.assertEqual( self.jobDB.maskQueries, 1 )
+    # Every state is cached on its own
+    self.assertEqual( self.jobDB.getSiteMask( 'Banned' )[ 'Value' ], [] )
+    self.assertEqual( self.jobDB.maskQueries, 2 )
+
+  def test_changes( self ):
+    """ the changes done through the JobDB are seen at once """
+    self.jobDB.getSiteMask()
+    version = self.jobDB.getSiteMaskVersion()
+    self.jobDB.banSiteInMask( 'Site1' )
+    self.assertEqual( self.jobDB.getSiteMask()[ 'Value' ], [ 'Site2' ] )
+    self.assertEqual( self.jobDB.getSiteMask( 'Banned' )[ 'Value' ], [ 'Site1' ] )
+    self.jobDB.allowSiteInMask( 'Site1' )
+    self.assertEqual( sorted( self.jobDB.getSiteMask()[ 'Value' ] ), [ 'Site1', 'Site2' ] )
+    self.jobDB.removeSiteFromMask( 'Site2' )
+    self.assertEqual( self.jobDB.getSiteMask()[ 'Value' ], [ 'Site1' ] )
+    self.assert_( self.jobDB.getSiteMaskVersion() > version )
+    self.assertEqual( self.jobDB.maskQueries, 5 )
+
+  def test_expiry( self ):
+    """ the changes done by other processes are seen once the cache expires """
+    self.jobDB.siteMaskCacheTime = 0
+    self.jobDB.getSiteMask()
+    self.jobDB.conn.execute( "DELETE FROM SiteMask WHERE Site='Site2'" )
+    self.assertEqual( self.jobDB.getSiteMask()[ 'Value' ], [ 'Site1' ] )
+    self.assertEqual( self.jobDB.maskQueries, 2 )
+
+if __name__ == '__main__':
+
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( SiteMaskCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
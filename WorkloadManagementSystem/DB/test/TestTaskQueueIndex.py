@@ -0,0 +1,81 @@
+""" Test cases for the in memory task queue index used by the TaskQueueDB to match resources
+"""
+
+import unittest
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+SINGLE_FIELDS = ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' )
+MULTI_FIELDS = ( 'Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites',
+                 'Platforms', 'PilotTypes', 'SubmitPools', 'JobTypes' )
+MATCH_FIELDS = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform',
+                 'PilotType', 'SubmitPool', 'JobType' )
+
+def tqDef( dn = '/DN=user', group = 'user', setup = 'Production', cpuTime = 3600, priority = 1.0, **multi ):
+  tqDict = { 'OwnerDN' : dn, 'OwnerGroup' : group, 'Setup' : setup,
+             'CPUTime' : cpuTime, 'Priority' : priority }
+  tqDict.update( multi )
+  return tqDict
+
+class TaskQueueIndexTestCase( unittest.TestCase ):
+  """ Matching rules of the index, the same as the TaskQueueDB SQL
+  """
+
+  def setUp( self ):
+    self.index = TaskQueueIndex( SINGLE_FIELDS, MULTI_FIELDS, MATCH_FIELDS, ( 'Site', ),
+                                 ( 'SubmitPool', 'Platform', 'PilotType' ) )
+    self.index.reset( { 1 : tqDef(),
+                        2 : tqDef( cpuTime = 86400, Sites = [ 'LCG.CERN.ch', 'LCG.PIC.es' ] ),
+                        3 : tqDef( dn = '/DN=other', BannedSites = [ 'LCG.CERN.ch' ] ),
+                        4 : tqDef( group = 'prod', JobTypes = [ 'MCSimulation' ] ),
+                        5 : tqDef( Platforms = [ 'x86_64-slc5' ] ),
+                        6 : tqDef( GridCEs = [ 'ce.cern.ch' ] ),
+                        7 : tqDef( setup = 'Certification' ) } )
+    self.resource = { 'Setup' : 'Production', 'CPUTime' : 100000 }
+
+  def match( self, tqMatchDict, negativeCond = {} ):
+    resource = dict( self.resource )
+    resource.update( tqMatchDict )
+    return sorted( [ tq[0] for tq in self.index.match( resource, numQueuesToGet = 0,
+                                                           negativeCond = negativeCond ) ] )
+
+  def test_singleValues( self ):
+    self.assertEqual( self.match( {} ), [ 1, 2, 3, 4, 6 ] )
+    self.assertEqual( self.match( { 'CPUTime' : 3600 } ), [ 1, 3, 4, 6 ] )
+    self.assertEqual( self.match( { 'Setup' : 'certification ' } ), [ 7 ] )
+    self.assertEqual( self.match( { 'OwnerGroup' : 'prod' } ), [ 4 ] )
+    self.assertEqual( self.match( { 'OwnerDN' : '/DN=other', 'OwnerGroup' : [ 'user', 'prod' ] } ), [ 3 ] )
+
+  def test_multiValues( self ):
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch' } ), [ 1, 2, 4, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.RAL.uk' } ), [ 1, 3, 4, 6 ] )
+    self.assertEqual( self.match( { 'Site' : 'LCG.CERN.ch', 'BannedSite' : [ 'LCG.PIC.es' ] } ), [ 1, 4, 6 ] )
+    self.assertEqual( self.match( { 'JobType' : 'User' } ), [ 1, 2, 3, 6 ] )
+    #Masked site: the GridCE has to be required explicitly
+    self.assertEqual( self.match( { 'GridCE' : 'ce.cern.ch' } ), [ 6 ] )
+    self.assertEqual( self.match( { 'GridCE' : 'ce.cern.ch', 'Site' : 'LCG.CERN.ch' } ), [ 1, 2, 4, 6 ] )
+    #Strict fields
+    self.assertEqual( self.match( { 'Platform' : 'x86_64-slc5' } ), [ 1, 2, 3, 4, 5, 6 ] )
+
+  def test_negativeCond( self ):
+    self.assertEqual( self.match( {}, { 'JobType' : [ 'MCSimulation' ] } ), [ 1, 2, 3, 6 ] )
+    self.assertEqual( self.match( {}, { 'Site' : 'LCG.PIC.es', 'OwnerDN' : [ '/DN=other' ] } ), [ 1, 4, 6 ] )
+    self.assertEqual( self.match( {}, [ { 'Site' : 'LCG.PIC.es' }, { 'JobType' : [ 'MCSimulation' ] } ] ),
+                      [ 1, 2, 3, 4, 6 ] )
+
+  def test_updates( self ):
+    self.index.removeTaskQueues( [ 1, 6 ] )
+    self.assertEqual( self.match( {} ), [ 2, 3, 4 ] )
+    self.index.addTaskQueues( { 8 : tqDef( Sites = [ 'LCG.RAL.uk' ] ) } )
+    self.assertEqual( self.match( { 'Site' : 'LCG.RAL.uk' } ), [ 3, 4, 8 ] )
+    self.assertEqual( self.index.getTaskQueueIds(), set( [ 2, 3, 4, 5, 7, 8 ] ) )
+
+  def test_priorities( self ):
+    self.index.setPriorities( { 1 : 1000000.0, 2 : 0.000001, 3 : 0.000001, 4 : 0.000001, 6 : 0.000001 } )
+    first = [ self.index.match( self.resource )[0][0] for i in range( 100 ) ]
+    self.assert_( first.count( 1 ) > 95 )
+    self.assertEqual( len( self.index.match( self.resource, numQueuesToGet = 2 ) ), 2 )
+
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
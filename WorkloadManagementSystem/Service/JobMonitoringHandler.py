@@ -14,11 +14,14 @@
 __RCSID__ = "$Id$"
 
 from types import *
+import threading
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private import JobStateUpdateBuffer
 import DIRAC.Core.Utilities.Time as Time
 
 # These are global instances of the DB classes
@@ -33,14 +36,100 @@ SUMMARY = []
 PRIMARY_SUMMARY = []
 FINAL_STATES = ['Done', 'Completed', 'Stalled', 'Failed', 'Killed']
 
+# Selection -> { Status : number of jobs }, shared by all the clients of the service
+gStatusCountersCache = DictCache()
+gStatusCountersLock = threading.Lock()
+# Selection -> lock held while its counters are being computed
+gStatusCountersPending = {}
+countersCacheTime = 10
+
 def initializeJobMonitoringHandler( serviceInfo ):
 
-  global jobDB, jobLoggingDB, taskQueueDB
+  global jobDB, jobLoggingDB, taskQueueDB, countersCacheTime
   jobDB = JobDB()
   jobLoggingDB = JobLoggingDB()
   taskQueueDB = TaskQueueDB()
+  countersCacheTime = gConfig.getValue( '%s/CountersCacheTime' % serviceInfo['serviceSectionPath'],
+                                        countersCacheTime )
   return S_OK()
 
+def getStatusCounters( selectDict, startDate, endDate ):
+  """ Get the number of jobs per Status for the selection. The counters are cached
+      for countersCacheTime seconds and computed once for concurrent requests
+  """
+  cacheKey = str( ( sorted( selectDict.items() ), startDate, endDate ) )
+  statusDict = gStatusCountersCache.get( cacheKey )
+  if statusDict is not False:
+    return S_OK( dict( statusDict ) )
+
+  gStatusCountersLock.acquire()
+  try:
+    keyLock = gStatusCountersPending.setdefault( cacheKey, threading.Lock() )
+  finally:
+    gStatusCountersLock.release()
+
+  keyLock.acquire()
+  try:
+    # Another request may have computed them meanwhile
+    statusDict = gStatusCountersCache.get( cacheKey )
+    if statusDict is not False:
+      return S_OK( dict( statusDict ) )
+    result = jobDB.getCounters( 'Jobs', ['Status'], selectDict,
+                                newer = startDate,
+                                older = endDate,
+                                timeStamp = 'LastUpdateTime' )
+    if not result['OK']:
+      return result
+    statusDict = {}
+    for stDict, count in result['Value']:
+      statusDict[stDict['Status']] = count
+    gStatusCountersCache.add( cacheKey, countersCacheTime, statusDict )
+    return S_OK( dict( statusDict ) )
+  finally:
+    keyLock.release()
+    gStatusCountersLock.acquire()
+    try:
+      if gStatusCountersPending.get( cacheKey ) is keyLock:
+        del gStatusCountersPending[cacheKey]
+    finally:
+      gStatusCountersLock.release()
+
+def overlayPendingAttributes( result, attrList = None ):
+  """ Apply the job attribute updates not yet written by the JobStateUpdate service
+      to a { jobID : { attribute : value } } result when both run in the same process
+  """
+  writeBuffer = JobStateUpdateBuffer.gJobStateUpdateBuffer
+  if not writeBuffer or not result['OK']:
+    return result
+  for jobID, attrDict in result['Value'].items():
+    for attrName, value in writeBuffer.getAttributes( jobID ).items():
+      if not attrList or attrName in attrList:
+        attrDict[attrName] = value
+  return result
+
+def overlayPendingParameters( jobID, result, paramList = None ):
+  """ Same as overlayPendingAttributes for the parameters of one job
+  """
+  writeBuffer = JobStateUpdateBuffer.gJobStateUpdateBuffer
+  if not writeBuffer or not result['OK']:
+    return result
+  for name, value in writeBuffer.getParameters( jobID ).items():
+    if not paramList or name in paramList:
+      result['Value'][name] = value
+  return result
+
+def getJobAttributes( jobID, attrList = None ):
+  result = jobDB.getJobAttributes( jobID, attrList )
+  if result['OK'] and result['Value']:
+    overlayPendingAttributes( S_OK( { jobID : result['Value'] } ), attrList )
+  return result
+
+def getJobAttribute( jobID, attribute ):
+  result = getJobAttributes( jobID, [ attribute ] )
+  if not result['OK']:
+    return result
+  return S_OK( result['Value'][attribute] )
+
 class JobMonitoringHandler( RequestHandler ):
 
 
@@ -190,19 +279,19 @@ class JobMonitoringHandler( RequestHandler ):
   types_getJobStatus = [ IntType ]
   def export_getJobStatus ( self, jobID ):
 
-    return jobDB.getJobAttribute( jobID, 'Status' )
+    return getJobAttribute( jobID, 'Status' )
 
 ##############################################################################
   types_getJobOwner = [ IntType ]
   def export_getJobOwner ( self, jobID ):
 
-    return jobDB.getJobAttribute( jobID, 'Owner' )
+    return getJobAttribute( jobID, 'Owner' )
 
 ##############################################################################
   types_getJobSite = [ IntType ]
   def export_getJobSite ( self, jobID ):
 
-    return jobDB.getJobAttribute( jobID, 'Site' )
+    return getJobAttribute( jobID, 'Site' )
 
 ##############################################################################
   types_getJobJDL = [ IntType ]
@@ -222,35 +311,35 @@ class JobMonitoringHandler( RequestHandler ):
   def export_getJobsStatus ( self, jobIDs ):
     if not jobIDs:
       return S_OK( {} )
-    return jobDB.getAttributesForJobList( jobIDs, ['Status'] )
+    return overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, ['Status'] ), ['Status'] )
 
 ##############################################################################
   types_getJobsMinorStatus = [ ListType ]
   def export_getJobsMinorStatus ( self, jobIDs ):
 
-    return jobDB.getAttributesForJobList( jobIDs, ['MinorStatus'] )
+    return overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, ['MinorStatus'] ), ['MinorStatus'] )
 
 ##############################################################################
   types_getJobsApplicationStatus = [ ListType ]
   def export_getJobsApplicationStatus ( self, jobIDs ):
 
-    return jobDB.getAttributesForJobList( jobIDs, ['ApplicationStatus'] )
+    return overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, ['ApplicationStatus'] ), ['ApplicationStatus'] )
 
 ##############################################################################
   types_getJobsSites = [ ListType ]
   def export_getJobsSites ( self, jobIDs ):
 
-    return jobDB.getAttributesForJobList( jobIDs, ['Site'] )
+    return overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, ['Site'] ), ['Site'] )
 
 ##############################################################################
   types_getJobSummary = [ IntType ]
   def export_getJobSummary( self, jobID ):
-    return jobDB.getJobAttributes( jobID, SUMMARY )
+    return getJobAttributes( jobID, SUMMARY )
 
 ##############################################################################
   types_getJobPrimarySummary = [ IntType ]
   def export_getJobPrimarySummary( self, jobID ):
-    return jobDB.getJobAttributes( jobID, PRIMARY_SUMMARY )
+    return getJobAttributes( jobID, PRIMARY_SUMMARY )
 
 ##############################################################################
   types_getJobsSummary = [ ListType ]
@@ -259,7 +348,7 @@ class JobMonitoringHandler( RequestHandler ):
     if not jobIDs:
       return S_ERROR( 'JobMonitoring.getJobsSummary: Received empty job list' )
 
-    result = jobDB.getAttributesForJobList( jobIDs, SUMMARY )
+    result = overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, SUMMARY ), SUMMARY )
     #return result
     restring = str( result['Value'] )
     return S_OK( restring )
@@ -287,29 +376,44 @@ class JobMonitoringHandler( RequestHandler ):
     if sortList:
       orderAttribute = sortList[0][0] + ":" + sortList[0][1]
     else:
-      orderAttribute = None
+      orderAttribute = 'JobID'
+    # Stable order across pages
+    if orderAttribute.split( ':' )[0] != 'JobID':
+      orderAttribute = [ orderAttribute, 'JobID' ]
 
-    if selectJobs:
-      result = jobDB.selectJobs( selectDict, orderAttribute = orderAttribute,
-                                newer = startDate, older = endDate )
-      if not result['OK']:
+    # The total number of jobs is the sum of the Status counters for the same selection
+    result = getStatusCounters( selectDict, startDate, endDate )
+    if not result['OK']:
+      if selectJobs:
         return S_ERROR( 'Failed to select jobs: ' + result['Message'] )
+      statusDict = {}
+    else:
+      statusDict = result['Value']
 
-      jobList = result['Value']
-      nJobs = len( jobList )
+    if selectJobs:
+      nJobs = sum( statusDict.values() )
       resultDict['TotalRecords'] = nJobs
       if nJobs == 0:
         return S_OK( resultDict )
 
-      iniJob = startItem
-      lastJob = iniJob + maxItems
-      if iniJob >= nJobs:
+      if startItem >= nJobs:
         return S_ERROR( 'Item number out of range' )
 
-      if lastJob > nJobs:
-        lastJob = nJobs
+      summaryJobList = []
+      if maxItems > 0:
+        result = jobDB.selectJobs( selectDict, orderAttribute = orderAttribute,
+                                   newer = startDate, older = endDate,
+                                   limit = maxItems, offset = startItem )
+        if not result['OK']:
+          return S_ERROR( 'Failed to select jobs: ' + result['Message'] )
+        summaryJobList = result['Value']
+
+      # The cached total may be larger than the actual number of jobs
+      if not summaryJobList:
+        resultDict['Records'] = []
+        resultDict['Extras'] = statusDict
+        return S_OK( resultDict )
 
-      summaryJobList = jobList[iniJob:lastJob]
       result = jobDB.getAttributesForJobList( summaryJobList, SUMMARY )
       if not result['OK']:
         return S_ERROR( 'Failed to get job summary: ' + result['Message'] )
@@ -337,8 +441,12 @@ class JobMonitoringHandler( RequestHandler ):
       key = summaryDict.keys()[0]
       paramNames = summaryDict[key].keys()
 
+      # Keep the order of the page
       records = []
-      for jobID, jobDict in summaryDict.items():
+      for jobID in [ int( jobID ) for jobID in summaryJobList ]:
+        if jobID not in summaryDict:
+          continue
+        jobDict = summaryDict[jobID]
         jParList = []
         for pname in paramNames:
           jParList.append( jobDict[pname] )
@@ -351,14 +459,6 @@ class JobMonitoringHandler( RequestHandler ):
       resultDict['ParameterNames'] = paramNames + ['TaskQueueID']
       resultDict['Records'] = records
 
-    statusDict = {}
-    result = jobDB.getCounters( 'Jobs', ['Status'], selectDict,
-                               newer = startDate,
-                               older = endDate,
-                               timeStamp = 'LastUpdateTime' )
-    if result['OK']:
-      for stDict, count in result['Value']:
-        statusDict[stDict['Status']] = count
     resultDict['Extras'] = statusDict
 
     return S_OK( resultDict )
@@ -394,17 +494,17 @@ class JobMonitoringHandler( RequestHandler ):
 ##############################################################################
   types_getJobsPrimarySummary = [ ListType ]
   def export_getJobsPrimarySummary ( self, jobIDs ):
-    return jobDB.getAttributesForJobList( jobIDs, PRIMARY_SUMMARY )
+    return overlayPendingAttributes( jobDB.getAttributesForJobList( jobIDs, PRIMARY_SUMMARY ), PRIMARY_SUMMARY )
 
 ##############################################################################
   types_getJobParameter = [ [IntType, LongType] , StringType ]
   def export_getJobParameter( self, jobID, parName ):
-    return jobDB.getJobParameters( jobID, [parName] )
+    return overlayPendingParameters( jobID, jobDB.getJobParameters( jobID, [parName] ), [parName] )
 
 ##############################################################################
   types_getJobParameters = [ [IntType, LongType] ]
   def export_getJobParameters( self, jobID ):
-    return jobDB.getJobParameters( jobID )
+    return overlayPendingParameters( jobID, jobDB.getJobParameters( jobID ) )
 
 ##############################################################################
   types_getAtticJobParameters = [ [IntType, LongType] ]
@@ -414,7 +514,7 @@ class JobMonitoringHandler( RequestHandler ):
 ##############################################################################
   types_getJobAttributes = [ IntType ]
   def export_getJobAttributes( self, jobID ):
-    return jobDB.getJobAttributes( jobID )
+    return getJobAttributes( jobID )
 
 ##############################################################################
   types_getSiteSummary = [ ]
@@ -9,19 +9,26 @@
 
     setJobStatus()
 
+    If the WriteBehind option is set in the service section, the updates are
+    coalesced in a JobStateUpdateBuffer and written to the DBs every
+    WriteBehindFlushInterval seconds by a background thread.
 """
 
 __RCSID__ = "$Id$"
 
 from types import *
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
-from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private import JobStateUpdateBuffer
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
+# Where the updates are written: the DBs or the write-behind buffer
+jobWriter = False
+logWriter = False
 
 JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
 
@@ -29,10 +36,41 @@ def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global jobWriter
+  global logWriter
   jobDB = JobDB()
   logDB = JobLoggingDB()
+  jobWriter = jobDB
+  logWriter = logDB
+
+  csSection = serviceInfo['serviceSectionPath']
+  if gConfig.getValue( '%s/WriteBehind' % csSection, False ):
+    flushInterval = gConfig.getValue( '%s/WriteBehindFlushInterval' % csSection, 2. )
+    maxJobs = gConfig.getValue( '%s/WriteBehindMaxJobs' % csSection, 10000 )
+    maxRetryTime = gConfig.getValue( '%s/WriteBehindMaxRetryTime' % csSection, 600 )
+    maxQueued = gConfig.getValue( '%s/WriteBehindMaxQueued' % csSection, 100000 )
+    writeBuffer = JobStateUpdateBuffer.JobStateUpdateBuffer( jobDB, logDB, flushInterval, maxJobs,
+                                                             maxRetryTime, maxQueued )
+    writeBuffer.start()
+    # Make the pending updates visible to the JobMonitoring service in the same process
+    JobStateUpdateBuffer.gJobStateUpdateBuffer = writeBuffer
+    jobWriter = writeBuffer
+    logWriter = writeBuffer
+    gLogger.info( 'Job state updates are written every %s seconds' % flushInterval )
   return S_OK()
 
+def getJobAttributes( jobID, attrList ):
+  """ Get job attributes including the updates not yet written to the JobDB
+  """
+  result = jobDB.getJobAttributes( jobID, attrList )
+  if not result['OK'] or not result['Value'] or jobWriter is jobDB:
+    return result
+  pending = jobWriter.getAttributes( jobID )
+  for attrName in attrList:
+    if attrName in pending:
+      result['Value'][attrName] = pending[attrName]
+  return result
+
 class JobStateUpdateHandler( RequestHandler ):
 
   ###########################################################################
@@ -48,7 +86,7 @@ class JobStateUpdateHandler( RequestHandler ):
     else:
       return S_ERROR( "updateJobFromStager: %s status not known." % status )
 
-    result = jobDB.getJobAttributes( jobID, ['Status'] )
+    result = getJobAttributes( jobID, ['Status'] )
     if not result['OK']:
       return result
     if not result['Value']:
@@ -86,17 +124,17 @@ class JobStateUpdateHandler( RequestHandler ):
 
   def __setJobStatus( self, jobID, status, minorStatus, source, datetime ):
     """ update the job status. """
-    result = jobDB.setJobStatus( jobID, status, minorStatus )
+    result = jobWriter.setJobStatus( jobID, status, minorStatus )
     if not result['OK']:
       return result
 
     if status in JOB_FINAL_STATES:
-      result = jobDB.setEndExecTime( jobID )
+      result = jobWriter.setEndExecTime( jobID )
 
     if status == 'Running' and minorStatus == 'Application':
-      result = jobDB.setStartExecTime( jobID )
+      result = jobWriter.setStartExecTime( jobID )
 
-    result = jobDB.getJobAttributes( jobID, ['Status', 'MinorStatus'] )
+    result = getJobAttributes( jobID, ['Status', 'MinorStatus'] )
     if not result['OK']:
       return result
     if not result['Value']:
@@ -105,9 +143,9 @@ class JobStateUpdateHandler( RequestHandler ):
     status = result['Value']['Status']
     minorStatus = result['Value']['MinorStatus']
     if datetime:
-      result = logDB.addLoggingRecord( jobID, status, minorStatus, datetime, source )
+      result = logWriter.addLoggingRecord( jobID, status, minorStatus, datetime, source )
     else:
-      result = logDB.addLoggingRecord( jobID, status, minorStatus, source = source )
+      result = logWriter.addLoggingRecord( jobID, status, minorStatus, source = source )
     return result
 
   ###########################################################################
@@ -129,7 +167,7 @@ class JobStateUpdateHandler( RequestHandler ):
     startDate = ''
     startFlag = ''
 
-    result = jobDB.getJobAttributes( jobID, ['Status'] )
+    result = getJobAttributes( jobID, ['Status'] )
     if not result['OK']:
       return result
 
@@ -171,14 +209,14 @@ class JobStateUpdateHandler( RequestHandler ):
     if appCounter:
       attrNames.append( 'ApplicationCounter' )
       attrValues.append( appCounter )
-    result = jobDB.setJobAttributes( jobID, attrNames, attrValues, update = True )
+    result = jobWriter.setJobAttributes( jobID, attrNames, attrValues, update = True )
     if not result['OK']:
       return result
 
     if endDate:
-      result = jobDB.setEndExecTime( jobID, endDate )
+      result = jobWriter.setEndExecTime( jobID, endDate )
     if startDate:
-      result = jobDB.setStartExecTime( jobID, startDate )
+      result = jobWriter.setStartExecTime( jobID, startDate )
 
     # Update the JobLoggingDB records
     for date, sDict in statusDict.items():
@@ -196,7 +234,7 @@ class JobStateUpdateHandler( RequestHandler ):
         status = "Running"
         minor = "Application"
       source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
+      result = logWriter.addLoggingRecord( jobID, status, minor, application, date, source )
       if not result['OK']:
         return result
 
@@ -207,7 +245,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_setJobSite( self, jobID, site ):
     """Allows the site attribute to be set for a job specified by its jobID.
     """
-    result = jobDB.setJobAttribute( jobID, 'Site', site )
+    result = jobWriter.setJobAttribute( jobID, 'Site', site )
     return result
 
   ###########################################################################
@@ -215,7 +253,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_setJobFlag( self, jobID, flag ):
     """ Set job flag for job with jobID
     """
-    result = jobDB.setJobAttribute( jobID, flag, 'True' )
+    result = jobWriter.setJobAttribute( jobID, flag, 'True' )
     return result
 
   ###########################################################################
@@ -223,7 +261,7 @@ class JobStateUpdateHandler( RequestHandler ):
   def export_unsetJobFlag( self, jobID, flag ):
     """ Unset job flag for job with jobID
     """
-    result = jobDB.setJobAttribute( jobID, flag, 'False' )
+    result = jobWriter.setJobAttribute( jobID, flag, 'False' )
     return result
 
   ###########################################################################
@@ -232,7 +270,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set the application status for job specified by its JobId.
     """
 
-    result = jobDB.getJobAttributes( jobID, ['Status', 'MinorStatus'] )
+    result = getJobAttributes( jobID, ['Status', 'MinorStatus'] )
     if not result['OK']:
       return result
 
@@ -247,11 +285,11 @@ class JobStateUpdateHandler( RequestHandler ):
       new_status = status
     minorStatus = result['Value']['MinorStatus']
 
-    result = jobDB.setJobStatus( jobID, new_status, application = appStatus )
+    result = jobWriter.setJobStatus( jobID, new_status, application = appStatus )
     if not result['OK']:
       return result
 
-    result = logDB.addLoggingRecord( jobID, new_status, minorStatus, appStatus, source = source )
+    result = logWriter.addLoggingRecord( jobID, new_status, minorStatus, appStatus, source = source )
     return result
 
   ###########################################################################
@@ -261,7 +299,7 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
 
-    result = jobDB.setJobParameter( jobID, name, value )
+    result = jobWriter.setJobParameter( jobID, name, value )
     return result
 
   ###########################################################################
@@ -271,7 +309,7 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
     for jobID in jobsParameterDict:
-      jobDB.setJobParameter( jobID, str( jobsParameterDict[jobID][0] ), str( jobsParameterDict[jobID][1] ) )
+      jobWriter.setJobParameter( jobID, str( jobsParameterDict[jobID][0] ), str( jobsParameterDict[jobID][1] ) )
     return S_OK()
 
   ###########################################################################
@@ -281,7 +319,7 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
 
-    result = jobDB.setJobParameters( jobID, parameters )
+    result = jobWriter.setJobParameters( jobID, parameters )
     if not result['OK']:
       return S_ERROR( 'Failed to store some of the parameters' )
 
@@ -293,7 +331,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData( jobID, staticData, dynamicData )
+    result = jobWriter.setHeartBeatData( jobID, staticData, dynamicData )
     if not result['OK']:
       gLogger.warn( 'Failed to set the heart beat data for job %d ' % jobID )
 
@@ -10,7 +10,7 @@ It also provides an XMLRPC interface to the Matcher
 __RCSID__ = "$Id$"
 
 import time
-from   types import StringType, DictType, StringTypes
+from   types import StringType, DictType, StringTypes, IntType, LongType
 import threading
 
 from DIRAC.ConfigurationSystem.Client.Helpers          import Registry, Operations
@@ -34,6 +34,8 @@ gJobDB = False
 gJobLoggingDB = False
 gTaskQueueDB = False
 gPilotAgentsDB = False
+#( opsHelper, optionPath ) -> value, reset with every new CS version
+gOpsValuesCache = {}
 
 def initializeMatcherHandler( serviceInfo ):
   """  Matcher Service initialization
@@ -61,11 +63,30 @@ def initializeMatcherHandler( serviceInfo ):
   gTaskQueueDB.recalculateTQSharesForAll()
   gThreadScheduler.addPeriodicTask( 120, gTaskQueueDB.recalculateTQSharesForAll )
   gThreadScheduler.addPeriodicTask( 60, sendNumTaskQueues )
+  gConfig.addListenerToNewVersionEvent( resetCSCaches )
 
   sendNumTaskQueues()
 
   return S_OK()
 
+def resetCSCaches( eventName = False, csVersion = False ):
+  """ Forget the values taken from the CS when a new CS version arrives
+  """
+  gOpsValuesCache.clear()
+  Limiter.resetCSCache()
+  return S_OK()
+
+def getOpsValue( opsHelper, optionPath, defaultValue ):
+  """ Get an Operations option through the process cache
+  """
+  cKey = ( opsHelper, optionPath )
+  try:
+    return gOpsValuesCache[ cKey ]
+  except KeyError:
+    value = opsHelper.getValue( optionPath, defaultValue )
+    gOpsValuesCache[ cKey ] = value
+    return value
+
 def sendNumTaskQueues():
   result = gTaskQueueDB.getNumTaskQueues()
   if result[ 'OK' ]:
@@ -87,17 +108,22 @@ class Limiter:
     self.__matchingDelaySection = "JobScheduling/MatchingDelay"
     self.__opsHelper = opsHelper
 
+  @classmethod
+  def resetCSCache( cls ):
+    cls.__csDictCache.purgeAll()
+    cls.__condCache.purgeAll()
+
   def checkJobLimit( self ):
-    return self.__opsHelper.getValue( "JobScheduling/CheckJobLimits", True )
+    return getOpsValue( self.__opsHelper, "JobScheduling/CheckJobLimits", True )
 
   def checkMatchingDelay( self ):
-    return self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True )
+    return getOpsValue( self.__opsHelper, "JobScheduling/CheckMatchingDelay", True )
 
   def getNegativeCond( self ):
     """ Get negative condition for ALL sites
     """
     orCond = Limiter.__condCache.get( "GLOBAL" )
-    if orCond:
+    if orCond is not False:
       return orCond
     negCond = {}
     #Run Limit
@@ -135,13 +161,14 @@ class Limiter:
     Limiter.__condCache.add( "GLOBAL", 10, orCond )
     return orCond
 
-  def getNegativeCondForSite( self, siteName ):
-    """ Generate a negative query based on the limits set on the site
+  def getNegativeCondForSite( self, siteName, matchedCounters = None ):
+    """ Generate a negative query based on the limits set on the site. matchedCounters
+        holds the jobs already matched and not yet counted, as built by countMatchedJob
     """
     # Check if Limits are imposed onto the site
     negativeCond = {}
     if self.checkJobLimit():
-      result = self.__getRunningCondition( siteName )
+      result = self.__getRunningCondition( siteName, matchedCounters )
       if result['OK']:
         negativeCond = result['Value']
       gLogger.verbose( 'Negative conditions for site %s after checking limits are: %s' % ( siteName, str( negativeCond ) ) )
@@ -175,12 +202,15 @@ class Limiter:
         { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     """
     stuffDict = Limiter.__csDictCache.get( section )
-    if stuffDict:
+    #Empty sections are cached as well
+    if stuffDict is not False:
       return S_OK( stuffDict )
 
     result = self.__opsHelper.getSections( section )
     if not result['OK']:
-      return result
+      #No limits defined, remember it until the next CS version
+      Limiter.__csDictCache.add( section, 300, {} )
+      return S_OK( {} )
     attribs = result['Value']
     stuffDict = {}
     for attName in attribs:
@@ -199,9 +229,11 @@ class Limiter:
     Limiter.__csDictCache.add( section, 300, stuffDict )
     return S_OK( stuffDict )
 
-  def __getRunningCondition( self, siteName ):
+  def __getRunningCondition( self, siteName, matchedCounters = None ):
     """ Get extra conditions allowing site throttling
     """
+    if not matchedCounters:
+      matchedCounters = {}
     siteSection = "%s/%s" % ( self.__runningLimitSection, siteName )
     result = self.__extractCSData( siteSection )
     if not result['OK']:
@@ -218,16 +250,17 @@ class Limiter:
         continue
       cK = "Running:%s:%s" % ( siteName, attName )
       data = self.__condCache.get( cK )
-      if not data:
+      if data is False:
         result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
         if not result[ 'OK' ]:
           return result
         data = result[ 'Value' ]
         data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
         self.__condCache.add( cK, 10, data )
+      matched = matchedCounters.get( attName, {} )
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
-        running = data.get( attValue, 0 )
+        running = data.get( attValue, 0 ) + matched.get( attValue, 0 )
         if running >= limit:
           gLogger.verbose( 'Job Limit imposed at %s on %s/%s=%d,'
                            ' %d jobs already deployed' % ( siteName, attName, attValue, limit, running ) )
@@ -237,6 +270,36 @@ class Limiter:
     #negCond is something like : {'JobType': ['Merge']}
     return S_OK( negCond )
 
+  def countMatchedJob( self, siteName, jid, matchedCounters ):
+    """ Count a matched job in matchedCounters { attName : { attValue : jobs } } for the
+        attributes limited at the site. The job is not yet Matched in the JobDB
+    """
+    siteSection = "%s/%s" % ( self.__runningLimitSection, siteName )
+    result = self.__extractCSData( siteSection )
+    if not result['OK']:
+      return result
+    attNames = [ attName for attName in result[ 'Value' ] if attName in gJobDB.jobAttributeNames ]
+    if not attNames:
+      return S_OK()
+    result = gJobDB.getJobAttributes( jid, attNames )
+    if not result[ 'OK' ]:
+      return result
+    for attName, attValue in result[ 'Value' ].items():
+      attCounters = matchedCounters.setdefault( attName, {} )
+      attCounters[ attValue ] = attCounters.get( attValue, 0 ) + 1
+    return S_OK()
+
+  def addMatchedCounters( self, siteName, matchedCounters ):
+    """ Add the jobs counted with countMatchedJob to the cached running counters,
+        the cached values were read before these jobs were Matched in the JobDB
+    """
+    for attName in matchedCounters:
+      data = self.__condCache.get( "Running:%s:%s" % ( siteName, attName ) )
+      if data is False:
+        continue
+      for attValue, jobs in matchedCounters[ attName ].items():
+        data[ attValue ] = data.get( attValue, 0 ) + jobs
+
   def updateDelayCounters( self, siteName, jid ):
     #Get the info from the CS
     siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
@@ -360,12 +423,10 @@ class MatcherHandler( RequestHandler ):
 
     return resourceDict
 
-  def selectJob( self, resourceDescription ):
-    """ Main job selection function to find the highest priority job
-        matching the resource capacity
+  def __prepareResource( self, resourceDescription ):
+    """ Build the resource dictionary used for matching, applying the credentials
+        restrictions, checking the pilot version and the site mask
     """
-
-    startTime = time.time()
     resourceDict = self.__processResourceDescription( resourceDescription )
 
     credDict = self.getRemoteCredentials()
@@ -399,7 +460,7 @@ class MatcherHandler( RequestHandler ):
         resourceDict[ 'OwnerGroup' ] = credDict[ 'group' ]
 
     # Check the pilot DIRAC version
-    if self.__opsHelper.getValue( "Pilot/CheckVersion", True ):
+    if getOpsValue( self.__opsHelper, "Pilot/CheckVersion", True ):
       if 'ReleaseVersion' not in resourceDict:
         if not 'DIRACVersion' in resourceDict:
           return S_ERROR( 'Version check requested and not provided by Pilot' )
@@ -408,12 +469,12 @@ class MatcherHandler( RequestHandler ):
       else:
         pilotVersion = resourceDict['ReleaseVersion']
 
-      validVersions = self.__opsHelper.getValue( "Pilot/Version", [] )
+      validVersions = getOpsValue( self.__opsHelper, "Pilot/Version", [] )
       if validVersions and pilotVersion not in validVersions:
         return S_ERROR( 'Pilot version does not match the production version %s not in ( %s )' % \
                        ( pilotVersion, ",".join( validVersions ) ) )
       #Check project if requested
-      validProject = self.__opsHelper.getValue( "Pilot/Project", "" )
+      validProject = getOpsValue( self.__opsHelper, "Pilot/Project", "" )
       if validProject:
         if 'ReleaseProject' not in resourceDict:
           return S_ERROR( "Version check requested but expected project %s not received" % validProject )
@@ -460,75 +521,146 @@ class MatcherHandler( RequestHandler ):
     for key in resourceDict:
      gLogger.verbose( "%s : %s" % ( key.rjust( 20 ), resourceDict[ key ] ) )
 
-    negativeCond = self.__limiter.getNegativeCondForSite( siteName )
-    result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+    return S_OK( ( resourceDict, siteName, pilotReference, pilotInfoReported ) )
 
-    if DEBUG:
-      print result
-
-    if not result['OK']:
+  def selectJob( self, resourceDescription ):
+    """ Main job selection function to find the highest priority job
+        matching the resource capacity
+    """
+    result = self.selectJobs( resourceDescription, 1 )
+    if not result[ 'OK' ]:
       return result
-    result = result['Value']
-    if not result['matchFound']:
+    jobList = result[ 'Value' ]
+    if not jobList:
       return S_ERROR( 'No match found' )
+    return S_OK( jobList[0] )
+
+  def selectJobs( self, resourceDescription, nJobs ):
+    """ Select up to nJobs jobs matching the resource capacity. The resource checks
+        are done once and the job records are updated in bulk. Each job is still
+        extracted atomically from its task queue. Returns a list of job dictionaries,
+        the same as selectJob returns for a single job
+    """
+    startTime = time.time()
+    result = self.__prepareResource( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict, siteName, pilotReference, pilotInfoReported = result[ 'Value' ]
+
+    checkDelay = self.__limiter.checkMatchingDelay()
+    checkLimits = self.__limiter.checkJobLimit()
+    #The jobs matched in this call are not Matched yet in the JobDB
+    matchedCounters = {}
+    #jobID -> ( TQ, priority ) to put back the jobs that can not be assigned
+    jobTQs = {}
+    jobIDs = []
+    while len( jobIDs ) < nJobs:
+      # The limits and delays change with every matched job
+      negativeCond = self.__limiter.getNegativeCondForSite( siteName, matchedCounters )
+      result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+
+      if DEBUG:
+        print result
+
+      if not result['OK']:
+        if not jobIDs:
+          return result
+        gLogger.error( "Failed to match more jobs", result[ 'Message' ] )
+        break
+      result = result['Value']
+      if not result['matchFound']:
+        break
+      jobID = result['jobId']
+      jobIDs.append( jobID )
+      jobTQs[ jobID ] = ( result['taskQueueId'], result['jobPriority'] )
+      if checkLimits:
+        result = self.__limiter.countMatchedJob( siteName, jobID, matchedCounters )
+        if not result[ 'OK' ]:
+          gLogger.error( "Failed to count the matched job, stop matching", result[ 'Message' ] )
+          break
+      if checkDelay:
+        self.__limiter.updateDelayCounters( siteName, jobID )
+
+    if not jobIDs:
+      return S_OK( [] )
 
-    jobID = result['jobId']
-    resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
+    resAtt = gJobDB.getAttributesForJobList( jobIDs, ['OwnerDN', 'OwnerGroup', 'Status'] )
     if not resAtt['OK']:
+      self.__putBackJobs( jobIDs, jobTQs )
       return S_ERROR( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      return S_ERROR( 'No attributes returned for job' )
-    if not resAtt['Value']['Status'] == 'Waiting':
-      gLogger.error( 'Job %s matched by the TQ is not in Waiting state' % str( jobID ) )
-      result = gTaskQueueDB.deleteJob( jobID )
-      if not result[ 'OK' ]:
-        return result
-      return S_ERROR( "Job %s is not in Waiting state" % str( jobID ) )
+    jobAttrs = resAtt['Value']
+    waitingJobs = []
+    lastError = 'No attributes returned for job'
+    for jobID in jobIDs:
+      if jobID not in jobAttrs or not jobAttrs[ jobID ]:
+        continue
+      if not jobAttrs[ jobID ]['Status'] == 'Waiting':
+        gLogger.error( 'Job %s matched by the TQ is not in Waiting state' % str( jobID ) )
+        result = gTaskQueueDB.deleteJob( jobID )
+        if not result[ 'OK' ]:
+          lastError = result[ 'Message' ]
+        else:
+          lastError = "Job %s is not in Waiting state" % str( jobID )
+        continue
+      waitingJobs.append( jobID )
+    if not waitingJobs:
+      return S_ERROR( lastError )
 
-    attNames = ['Status','MinorStatus','ApplicationStatus','Site']
-    attValues = ['Matched','Assigned','Unknown',siteName]
-    result = gJobDB.setJobAttributes( jobID, attNames, attValues )
-    # result = gJobDB.setJobStatus( jobID, status = 'Matched', minor = 'Assigned' )
-    result = gJobLoggingDB.addLoggingRecord( jobID,
-                                           status = 'Matched',
-                                           minor = 'Assigned',
-                                           source = 'Matcher' )
-
-    result = gJobDB.getJobJDL( jobID )
+    result = gJobDB.getJobJDLs( waitingJobs )
     if not result['OK']:
+      self.__putBackJobs( waitingJobs, jobTQs )
       return S_ERROR( 'Failed to get the job JDL' )
+    jdlDict = result['Value']
 
-    resultDict = {}
-    resultDict['JDL'] = result['Value']
-    resultDict['JobID'] = jobID
+    attNames = ['Status','MinorStatus','ApplicationStatus','Site']
+    attValues = ['Matched','Assigned','Unknown',siteName]
+    result = gJobDB.setJobAttributes( waitingJobs, attNames, attValues )
+    if not result[ 'OK' ]:
+      self.__putBackJobs( waitingJobs, jobTQs )
+      return S_ERROR( 'Failed to set the jobs as matched: %s' % result[ 'Message' ] )
+    self.__limiter.addMatchedCounters( siteName, matchedCounters )
+    result = gJobLoggingDB.addLoggingRecord( waitingJobs,
+                                             status = 'Matched',
+                                             minor = 'Assigned',
+                                             source = 'Matcher' )
 
     matchTime = time.time() - startTime
-    gLogger.info( "Match time: [%s]" % str( matchTime ) )
+    gLogger.info( "Match time: [%s] for %d jobs" % ( str( matchTime ), len( waitingJobs ) ) )
     gMonitor.addMark( "matchTime", matchTime )
 
     # Get some extra stuff into the response returned
-    resOpt = gJobDB.getJobOptParameters( jobID )
+    resOpt = gJobDB.getJobsOptParameters( waitingJobs )
     if resOpt['OK']:
-      for key, value in resOpt['Value'].items():
-        resultDict[key] = value
-    resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup'] )
-    if not resAtt['OK']:
-      return S_ERROR( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      return S_ERROR( 'No attributes returned for job' )
-
-    if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
-      self.__limiter.updateDelayCounters( siteName, jobID )
+      optDict = resOpt['Value']
+    else:
+      optDict = {}
 
     # Report pilot-job association
     if pilotReference:
-      result = gPilotAgentsDB.setCurrentJobID( pilotReference, jobID )
-      result = gPilotAgentsDB.setJobForPilot( jobID, pilotReference, updateStatus=False )
-
-    resultDict['DN'] = resAtt['Value']['OwnerDN']
-    resultDict['Group'] = resAtt['Value']['OwnerGroup']
-    resultDict['PilotInfoReportedFlag'] = pilotInfoReported
-    return S_OK( resultDict )
+      result = gPilotAgentsDB.setCurrentJobID( pilotReference, waitingJobs[-1] )
+      result = gPilotAgentsDB.setJobForPilot( waitingJobs, pilotReference, updateStatus=False )
+
+    jobList = []
+    for jobID in waitingJobs:
+      resultDict = {}
+      resultDict['JDL'] = jdlDict.get( jobID, '' )
+      resultDict['JobID'] = jobID
+      for key, value in optDict.get( jobID, {} ).items():
+        resultDict[key] = value
+      resultDict['DN'] = jobAttrs[ jobID ]['OwnerDN']
+      resultDict['Group'] = jobAttrs[ jobID ]['OwnerGroup']
+      resultDict['PilotInfoReportedFlag'] = pilotInfoReported
+      jobList.append( resultDict )
+    return S_OK( jobList )
+
+  def __putBackJobs( self, jobIDs, jobTQs ):
+    """ Put back in their task queues the matched jobs that could not be assigned
+    """
+    for jobID in jobIDs:
+      tqID, jobPriority = jobTQs[ jobID ]
+      result = gTaskQueueDB.putBackJob( jobID, tqID, jobPriority )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot put back job %s in TQ %s" % ( jobID, tqID ), result[ 'Message' ] )
 
 ##############################################################################
   types_requestJob = [ [StringType, DictType] ]
@@ -543,6 +675,21 @@ class MatcherHandler( RequestHandler ):
       gMonitor.addMark( "matchesOK" )
     return result
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, nJobs ):
+    """ Serve up to nJobs jobs in one call to an agent able to run several jobs
+        at once. The number of jobs is limited by JobScheduling/MaxJobsPerRequest.
+        Returns a possibly empty list of job dictionaries as requestJob does
+    """
+    maxJobs = getOpsValue( self.__opsHelper, "JobScheduling/MaxJobsPerRequest", 100 )
+    nJobs = max( 1, min( nJobs, maxJobs ) )
+    result = self.selectJobs( resourceDescription, nJobs )
+    gMonitor.addMark( "matchesDone" )
+    if result[ 'OK' ] and result[ 'Value' ]:
+      gMonitor.addMark( "matchesOK", len( result[ 'Value' ] ) )
+    return result
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -24,7 +24,6 @@ from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
 from DIRAC.RequestManagementSystem.Client.RequestClient import RequestClient
 from DIRAC.RequestManagementSystem.Client.RequestContainer import RequestContainer
 from DIRAC.Resources.Storage.StorageElement import StorageElement
-from DIRAC.Core.Security import Properties
 from DIRAC.Core.Utilities import List
 
 sandboxDB = False
@@ -61,15 +60,11 @@ class SandboxStoreHandler( RequestHandler ):
       threading.Thread( target = self.purgeUnusedSandboxes ).start()
 
   def __getSandboxPath( self, md5 ):
-    """ Generate the sandbox path
+    """ Generate the sandbox path. It only depends on the contents so
+        identical sandboxes of all the owners are stored once
     """
     prefix = self.getCSOption( "SandboxPrefix", "SandBox" )
-    credDict = self.getRemoteCredentials()
-    if Properties.JOB_SHARING in credDict[ 'properties' ]:
-      idField = credDict[ 'group' ]
-    else:
-      idField = "%s.%s" % ( credDict[ 'username' ], credDict[ 'group' ] )
-    pathItems = [ "/", prefix, idField[0], idField ]
+    pathItems = [ "/", prefix, "Blobs" ]
     pathItems.extend( [ md5[0:3], md5[3:6], md5 ] )
     return os.path.join( *pathItems )
 
@@ -110,9 +105,10 @@ class SandboxStoreHandler( RequestHandler ):
     seName, sePFN = result[ 'Value' ]
 
     result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
-    if result[ 'OK' ]:
+    if result[ 'OK' ] and self.__isSandboxStored( result[ 'Value' ], seName, sePFN, sbPath ):
       gLogger.info( "Sandbox already exists. Skipping upload" )
       fileHelper.markAsTransferred()
+      sandboxDB.accessedSandboxById( result[ 'Value' ] )
       sbURL = "SB:%s|%s" % ( seName, sePFN )
       assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
       result = self.export_assignSandboxesToEntities( assignTo )
@@ -120,39 +116,25 @@ class SandboxStoreHandler( RequestHandler ):
         return result
       return S_OK( sbURL )
 
-    if self.__useLocalStorage:
-      hdPath = self.__sbToHDPath( sbPath )
-    else:
-      hdPath = False
-    #Write to local file
-    result = self.__networkToFile( fileHelper, hdPath )
+    #Write to a temporal file, the hash is calculated while receiving
+    result = self.__networkToFile( fileHelper )
     if not result[ 'OK' ]:
       gLogger.error( "Error while receiving file: %s" % result['Message'] )
       return result
-    hdPath = result[ 'Value' ]
-    gLogger.info( "Wrote sandbox to file %s" % hdPath )
+    tmpFilePath = result[ 'Value' ]
+    gLogger.info( "Wrote sandbox to file %s" % tmpFilePath )
     #Check hash!
     if fileHelper.getHash() != hash:
-      self.__secureUnlinkFile( hdPath )
+      self.__secureUnlinkFile( tmpFilePath )
       gLogger.error( "Hashes don't match! Client defined hash is different with received data hash!" )
       return S_ERROR( "Hashes don't match!" )
-    #If using remote storage, copy there!
-    if not self.__useLocalStorage:
-      gLogger.info( "Uploading sandbox to external storage" )
-      result = self.__copyToExternalSE( hdPath, sbPath )
-      self.__secureUnlinkFile( hdPath )
-      if not result[ 'OK' ]:
-        return result
-      sbPath = result[ 'Value' ][1]
-    #Register!
-    gLogger.info( "Registering sandbox in the DB with", "SB:%s|%s" % ( self.__seNameToUse, sbPath ) )
-    result = sandboxDB.registerAndGetSandbox( credDict[ 'username' ], credDict[ 'DN' ], credDict[ 'group' ],
-                                              self.__seNameToUse, sbPath, fileHelper.getTransferedBytes() )
+    #Store it if the contents are not there yet and register!
+    gLogger.info( "Registering sandbox in the DB with", "SB:%s|%s" % ( seName, sePFN ) )
+    result = self.__storeSandbox( tmpFilePath, hash, sbPath, seName, sePFN, fileHelper.getTransferedBytes() )
     if not result[ 'OK' ]:
-      self.__secureUnlinkFile( hdPath )
       return result
 
-    sbURL = "SB:%s|%s" % ( self.__seNameToUse, sbPath )
+    sbURL = "SB:%s|%s" % ( seName, sePFN )
     assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
     result = self.export_assignSandboxesToEntities( assignTo )
     if not result[ 'OK' ]:
@@ -166,7 +148,7 @@ class SandboxStoreHandler( RequestHandler ):
     result = self.__networkToFile( fileHelper )
     if not result[ 'OK' ]:
       return result
-    tmpFilePath = result[ 'OK' ]
+    tmpFilePath = result[ 'Value' ]
     gLogger.info( "Got Sandbox to local storage", tmpFilePath )
 
     extension = fileId[ fileId.find( ".tar" ) + 1: ]
@@ -175,33 +157,96 @@ class SandboxStoreHandler( RequestHandler ):
     #Generate the location
     result = self.__generateLocation( sbPath )
     if not result[ 'OK' ]:
+      self.__secureUnlinkFile( tmpFilePath )
       return result
     seName, sePFN = result[ 'Value' ]
     #Register in DB
     credDict = self.getRemoteCredentials()
     result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
-    if result[ 'OK' ]:
+    if result[ 'OK' ] and self.__isSandboxStored( result[ 'Value' ], seName, sePFN, sbPath ):
+      sandboxDB.accessedSandboxById( result[ 'Value' ] )
+      self.__secureUnlinkFile( tmpFilePath )
       return S_OK( "SB:%s|%s" % ( seName, sePFN ) )
 
-    result = sandboxDB.registerAndGetSandbox( credDict[ 'username' ], credDict[ 'DN' ], credDict[ 'group' ],
-                                              seName, sePFN, fileHelper.getTransferedBytes() )
+    result = self.__storeSandbox( tmpFilePath, fileHelper.getHash(), sbPath, seName, sePFN,
+                                  fileHelper.getTransferedBytes() )
+    if not result[ 'OK' ]:
+      gLogger.error( "Could not store sandbox", result[ 'Message' ] )
+      return result
+    gLogger.info( "Registered in DB", "with SBId %s" % result[ 'Value' ] )
+    return S_OK( "SB:%s|%s" % ( seName, sePFN ) )
+
+  def __storeSandbox( self, tmpFilePath, hash, sbPath, seName, sePFN, size ):
+    """
+    Move a received sandbox to its final location unless the same contents are already
+    stored, and register it for the requester. The temporal file is always removed
+    """
+    credDict = self.getRemoteCredentials()
+    result = sandboxDB.acquireBlob( hash, seName, sePFN, size )
     if not result[ 'OK' ]:
       self.__secureUnlinkFile( tmpFilePath )
       return result
-    sbid, newSandbox = result[ 'Value' ]
-    gLogger.info( "Registered in DB", "with SBId %s" % sbid )
+    #Contents registered but not stored yet by another upload are stored again from this one
+    blobId, mustStore = result[ 'Value' ]
+    if not mustStore and not self.__contentExists( seName, sePFN, sbPath ):
+      gLogger.warn( "Sandbox contents registered as stored are missing, storing them again", sbPath )
+      mustStore = True
+    if mustStore:
+      result = self.__moveToFinalLocation( tmpFilePath, sbPath )
+      if result[ 'OK' ]:
+        result = sandboxDB.markBlobStored( blobId )
+        if result[ 'OK' ] and not result[ 'Value' ]:
+          result = S_ERROR( "Sandbox contents at %s are being purged, try again later" % sbPath )
+      if not result[ 'OK' ]:
+        gLogger.error( "Could not store sandbox contents", result[ 'Message' ] )
+        if os.path.isfile( tmpFilePath ):
+          self.__secureUnlinkFile( tmpFilePath )
+        sandboxDB.releaseBlob( blobId )
+        return result
+    else:
+      gLogger.info( "Sandbox contents already stored", sbPath )
+    if os.path.isfile( tmpFilePath ):
+      self.__secureUnlinkFile( tmpFilePath )
 
-    result = self.__moveToFinalLocation( tmpFilePath, sbPath )
-    self.__secureUnlinkFile( tmpFilePath )
+    result = sandboxDB.registerAndGetSandbox( credDict[ 'username' ], credDict[ 'DN' ], credDict[ 'group' ],
+                                              seName, sePFN, size, blobId )
     if not result[ 'OK' ]:
-      gLogger.error( "Could not move sandbox to final destination", result[ 'Message' ] )
+      sandboxDB.releaseBlob( blobId )
       return result
+    sbId, newSandbox = result[ 'Value' ]
+    #The requester already had it, it keeps the reference it had
+    if not newSandbox:
+      sandboxDB.releaseBlob( blobId )
+    return S_OK( sbId )
 
-    gLogger.info( "Moved to final destination" )
+  def __isSandboxStored( self, sbId, seName, sePFN, sbPath ):
+    """
+    The upload of a registered sandbox is only skipped if its contents are really stored
+    """
+    result = sandboxDB.isSandboxStored( sbId )
+    if not result[ 'OK' ]:
+      gLogger.error( "Cannot check the sandbox contents", result[ 'Message' ] )
+      return False
+    if not result[ 'Value' ] or not self.__contentExists( seName, sePFN, sbPath ):
+      gLogger.info( "Sandbox is registered without its contents, receiving them", sbPath )
+      return False
+    return True
 
-    #Unlink temporal file if it's there
-    self.__secureUnlinkFile( tmpFilePath )
-    return S_OK( "SB:%s|%s" % ( seName, sePFN ) )
+  def __contentExists( self, seName, sePFN, sbPath ):
+    """
+    Check that the contents of a sandbox are at their location
+    """
+    if self.__useLocalStorage:
+      return os.path.isfile( self.__sbToHDPath( sbPath ) )
+    try:
+      result = StorageElement( seName ).exists( sePFN, singleFile = True )
+    except Exception, e:
+      gLogger.error( "Cannot check the sandbox contents in the SE", "%s: %s" % ( sePFN, str( e ) ) )
+      return False
+    if not result[ 'OK' ]:
+      gLogger.error( "Cannot check the sandbox contents in the SE", "%s: %s" % ( sePFN, result[ 'Message' ] ) )
+      return False
+    return bool( result[ 'Value' ] )
 
   def __generateLocation( self, sbPath ):
     """
@@ -236,8 +281,17 @@ class SandboxStoreHandler( RequestHandler ):
     """
     tfd = False
     if not destFileName:
+      #Local sandboxes are received in the storage so they can be renamed into place
+      tmpDir = None
+      if self.__useLocalStorage:
+        tmpDir = self.__sbToHDPath( "tmp" )
+        if not os.path.isdir( tmpDir ):
+          try:
+            os.makedirs( tmpDir )
+          except:
+            pass
       try:
-        tfd, destFileName = tempfile.mkstemp( prefix = "DSB." )
+        tfd, destFileName = tempfile.mkstemp( prefix = "DSB.", dir = tmpDir )
       except Exception, e:
         return S_ERROR( "Cannot create temporal file: %s" % str( e ) )
     destFileName = os.path.realpath( destFileName )
@@ -250,11 +304,12 @@ class SandboxStoreHandler( RequestHandler ):
     except Exception, e:
       return S_ERROR( "Cannot open to write destination file %s" % destFileName )
     result = fileHelper.networkToDataSink( fd, maxFileSize = self.__maxUploadBytes )
-    if not result[ 'OK' ]:
-      return result
     if tfd:
       os.close( tfd )
     fd.close()
+    if not result[ 'OK' ]:
+      self.__secureUnlinkFile( destFileName )
+      return result
     return S_OK( destFileName )
 
   def __secureUnlinkFile( self, filePath ):
@@ -408,13 +463,40 @@ class SandboxStoreHandler( RequestHandler ):
       return result
     sbList = result[ 'Value' ]
     gLogger.info( "Got %s sandboxes to purge" % len( sbList ) )
-    deletedFromSE = []
-    for sbId, SEName, SEPFN in sbList:
-      self.__purgeSandbox( sbId, SEName, SEPFN )
+    #Sandboxes with shared contents only drop their reference, the contents go when nobody uses them
+    sbIds = [ sbId for sbId, SEName, SEPFN, blobId in sbList if blobId ]
+    for i in range( 0, len( sbIds ), 1000 ):
+      result = sandboxDB.deleteSandboxes( sbIds[ i: i + 1000 ] )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot delete sandboxes from DB", result[ 'Message' ] )
+    for sbId, SEName, SEPFN, blobId in sbList:
+      if not blobId:
+        self.__purgeSandbox( sbId, SEName, SEPFN )
+    self.__purgeUnreferencedBlobs()
 
     SandboxStoreHandler.__purgeWorking = False
     return S_OK()
 
+  def __purgeUnreferencedBlobs( self ):
+    result = sandboxDB.getUnreferencedBlobs()
+    if not result[ 'OK' ]:
+      gLogger.error( "Error while retrieving unreferenced sandbox contents", result[ 'Message' ] )
+      return
+    gLogger.info( "Got %s unreferenced sandbox contents to purge" % len( result[ 'Value' ] ) )
+    for blobId, SEName, SEPFN in result[ 'Value' ]:
+      #Nobody can take a reference once it's claimed
+      result = sandboxDB.claimBlobForDeletion( blobId )
+      if not result[ 'OK' ] or not result[ 'Value' ]:
+        continue
+      result = self.__deleteSandboxFromBackend( SEName, SEPFN )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot delete sandbox contents from backend", result[ 'Message' ] )
+        sandboxDB.unclaimBlob( blobId )
+        continue
+      result = sandboxDB.deleteBlob( blobId )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot delete sandbox contents from DB", result[ 'Message' ] )
+
   def __purgeSandbox( self, sbId, SEName, SEPFN ):
     result = self.__deleteSandboxFromBackend( SEName, SEPFN )
     if not result[ 'OK' ]:
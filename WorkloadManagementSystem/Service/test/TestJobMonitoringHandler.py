@@ -0,0 +1,83 @@
+""" Test cases for the paging and the cached Status counters of the JobMonitoring service
+"""
+
+import unittest, time
+from DIRAC import S_OK
+from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.WorkloadManagementSystem.Service import JobMonitoringHandler as Monitoring
+
+class FakeJobDB:
+  """ Jobs 1 to 5, 3 Done and 2 Running
+  """
+
+  def __init__( self ):
+    self.counterQueries = 0
+    self.selections = []
+
+  def getCounters( self, table, attrList, condDict, newer = None, older = None, timeStamp = None ):
+    self.counterQueries += 1
+    return S_OK( [ ( { 'Status' : 'Done' }, 3 ), ( { 'Status' : 'Running' }, 2 ) ] )
+
+  def selectJobs( self, condDict, orderAttribute = None, newer = None, older = None, limit = None, offset = None ):
+    self.selections.append( ( orderAttribute, limit, offset ) )
+    return S_OK( range( 5, 0, -1 )[offset:offset + limit] )
+
+  def getAttributesForJobList( self, jobIDList, attrList ):
+    return S_OK( dict( [ ( jobID, { 'JobID' : jobID, 'Status' : 'Done', 'HeartBeatTime' : 'None',
+                                    'LastUpdateTime' : '2013-01-01 00:00:00' } ) for jobID in jobIDList ] ) )
+
+class FakeTaskQueueDB:
+
+  def getTaskQueueForJobs( self, jobIDList ):
+    return S_OK( { 3 : 7 } )
+
+class JobMonitoringHandlerTestCase( unittest.TestCase ):
+  """ Pages of the job monitor and Status counters
+  """
+
+  def setUp( self ):
+    Monitoring.jobDB = FakeJobDB()
+    Monitoring.taskQueueDB = FakeTaskQueueDB()
+    Monitoring.gStatusCountersCache = DictCache()
+    Monitoring.countersCacheTime = 10
+    self.handler = Monitoring.JobMonitoringHandler.__new__( Monitoring.JobMonitoringHandler )
+
+  def getPage( self, sortList, startItem, maxItems ):
+    result = self.handler.export_getJobPageSummaryWeb( { 'Owner' : 'user' }, sortList, startItem, maxItems )
+    self.assert_( result['OK'] )
+    return result['Value']
+
+  def test_page( self ):
+    """ the page is selected in the DB, ordered by JobID for equal values """
+    page = self.getPage( [ [ 'Status', 'DESC' ] ], 2, 2 )
+    self.assertEqual( Monitoring.jobDB.selections, [ ( [ 'Status:DESC', 'JobID' ], 2, 2 ) ] )
+    self.assertEqual( page['TotalRecords'], 5 )
+    self.assertEqual( page['Extras'], { 'Done' : 3, 'Running' : 2 } )
+    jobIndex = page['ParameterNames'].index( 'JobID' )
+    self.assertEqual( [ record[jobIndex] for record in page['Records'] ], [ 3, 2 ] )
+    self.assertEqual( [ record[-1] for record in page['Records'] ], [ 7, 0 ] )
+    # The last page is shorter
+    page = self.getPage( [ [ 'JobID', 'ASC' ] ], 4, 2 )
+    self.assertEqual( Monitoring.jobDB.selections[-1], ( 'JobID:ASC', 2, 4 ) )
+    self.assertEqual( len( page['Records'] ), 1 )
+    result = self.handler.export_getJobPageSummaryWeb( { 'Owner' : 'user' }, [], 5, 2 )
+    self.failIf( result['OK'] )
+
+  def test_countersCache( self ):
+    """ the counters are queried once per selection until they expire """
+    Monitoring.countersCacheTime = 1
+    for _i in range( 3 ):
+      self.getPage( [], 0, 2 )
+    self.assertEqual( Monitoring.jobDB.counterQueries, 1 )
+    result = Monitoring.getStatusCounters( { 'Owner' : 'user' }, None, None )
+    result['Value']['Done'] = 0
+    self.assertEqual( Monitoring.getStatusCounters( { 'Owner' : 'user' }, None, None )['Value']['Done'], 3 )
+    Monitoring.getStatusCounters( { 'Owner' : 'other' }, None, None )
+    self.assertEqual( Monitoring.jobDB.counterQueries, 2 )
+    time.sleep( 1.1 )
+    self.getPage( [], 0, 2 )
+    self.assertEqual( Monitoring.jobDB.counterQueries, 3 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobMonitoringHandlerTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
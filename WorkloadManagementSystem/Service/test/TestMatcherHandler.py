@@ -0,0 +1,147 @@
+""" Test cases for the batched job matching of the Matcher service
+"""
+
+import unittest
+from DIRAC import S_OK, S_ERROR, gConfig
+from DIRAC.Core.Utilities.EventDispatcher import gEventDispatcher
+from DIRAC.WorkloadManagementSystem.Service import MatcherHandler as Matcher
+
+LIMIT_SECTION = "JobScheduling/RunningLimit"
+
+class FakeOperations:
+  """ RunningLimit/Site1/JobType/MCSimulation = 3
+  """
+
+  def __init__( self ):
+    self.calls = 0
+
+  def getSections( self, section ):
+    self.calls += 1
+    if section == "%s/Site1" % LIMIT_SECTION:
+      return S_OK( [ 'JobType' ] )
+    return S_ERROR( "No section %s" % section )
+
+  def getOptionsDict( self, section ):
+    return S_OK( { 'MCSimulation' : '3' } )
+
+  def getValue( self, optionPath, defaultValue ):
+    self.calls += 1
+    if optionPath == "JobScheduling/CheckMatchingDelay":
+      return False
+    return defaultValue
+
+class FakeJobDB:
+  """ One MCSimulation job already running at Site1
+  """
+
+  jobAttributeNames = [ 'JobType', 'Status', 'Site' ]
+
+  def __init__( self ):
+    self.failSetAttributes = False
+    self.matched = []
+    self.counterQueries = 0
+
+  def getCounters( self, table, attNames, condDict ):
+    self.counterQueries += 1
+    return S_OK( [ ( { 'JobType' : 'MCSimulation' }, 1 ) ] )
+
+  def getJobAttributes( self, jobID, attNames ):
+    return S_OK( { 'JobType' : 'MCSimulation' } )
+
+  def getAttributesForJobList( self, jobIDs, attNames ):
+    return S_OK( dict( [ ( jobID, { 'OwnerDN' : '/DN=user', 'OwnerGroup' : 'user', 'Status' : 'Waiting' } )
+                         for jobID in jobIDs ] ) )
+
+  def getJobJDLs( self, jobIDs ):
+    return S_OK( dict( [ ( jobID, '[]' ) for jobID in jobIDs ] ) )
+
+  def setJobAttributes( self, jobIDs, attNames, attValues ):
+    if self.failSetAttributes:
+      return S_ERROR( "Lost connection to the JobDB" )
+    self.matched += jobIDs
+    return S_OK()
+
+  def getJobsOptParameters( self, jobIDs ):
+    return S_OK( {} )
+
+class FakeJobLoggingDB:
+
+  def addLoggingRecord( self, jobIDs, **kwargs ):
+    return S_OK()
+
+class FakeTaskQueueDB:
+  """ A task queue with MCSimulation jobs
+  """
+
+  def __init__( self, jobIDs ):
+    self.jobs = [ ( jobID, 1, 1 ) for jobID in jobIDs ]
+
+  def matchAndGetJob( self, resourceDict, negativeCond = {} ):
+    if 'MCSimulation' in negativeCond.get( 'JobType', [] ) or not self.jobs:
+      return S_OK( { 'matchFound' : False } )
+    jobID, tqID, priority = self.jobs.pop( 0 )
+    return S_OK( { 'matchFound' : True, 'jobId' : jobID, 'taskQueueId' : tqID, 'jobPriority' : priority } )
+
+  def putBackJob( self, jobID, tqID, priority ):
+    self.jobs.append( ( jobID, tqID, priority ) )
+    return S_OK()
+
+class MatcherHandlerTestCase( unittest.TestCase ):
+  """ Running limits and failures while matching several jobs
+  """
+
+  def setUp( self ):
+    Matcher.resetCSCaches()
+    Matcher.gJobDB = FakeJobDB()
+    Matcher.gJobLoggingDB = FakeJobLoggingDB()
+    Matcher.gTaskQueueDB = FakeTaskQueueDB( range( 1, 11 ) )
+    self.opsHelper = opsHelper = FakeOperations()
+    self.handler = Matcher.MatcherHandler.__new__( Matcher.MatcherHandler )
+    self.handler._MatcherHandler__opsHelper = opsHelper
+    self.handler._MatcherHandler__limiter = Matcher.Limiter( opsHelper )
+    resource = ( { 'Site' : 'Site1' }, 'Site1', '', False )
+    self.handler._MatcherHandler__prepareResource = lambda resourceDescription: S_OK( resource )
+
+  def test_runningLimit( self ):
+    """ the jobs matched in a batch count for the limit of the site """
+    result = self.handler.selectJobs( {}, 10 )
+    self.assert_( result['OK'] )
+    self.assertEqual( [ job['JobID'] for job in result['Value'] ], [ 1, 2 ] )
+    # The cached counters include the batch
+    result = self.handler.selectJobs( {}, 10 )
+    self.assert_( result['OK'] )
+    self.assertEqual( result['Value'], [] )
+    self.assertEqual( Matcher.gJobDB.matched, [ 1, 2 ] )
+
+  def test_putBack( self ):
+    """ the jobs are put back in the task queue if they can not be assigned """
+    Matcher.gJobDB.failSetAttributes = True
+    result = self.handler.selectJobs( {}, 10 )
+    self.failIf( result['OK'] )
+    self.assertEqual( sorted( [ job[0] for job in Matcher.gTaskQueueDB.jobs ] ), range( 1, 11 ) )
+    # Not counted as running
+    Matcher.gJobDB.failSetAttributes = False
+    result = self.handler.selectJobs( {}, 10 )
+    self.assert_( result['OK'] )
+    self.assertEqual( len( result['Value'] ), 2 )
+
+  def test_csCache( self ):
+    """ the CS options and the running counters are read once until a new CS version arrives """
+    limiter = self.handler._MatcherHandler__limiter
+    for _i in range( 3 ):
+      self.assertEqual( limiter.getNegativeCondForSite( 'Site1' ), {} )
+      self.assertEqual( limiter.getNegativeCondForSite( 'Site2' ), {} )
+      self.assertEqual( limiter.checkMatchingDelay(), False )
+    # Site1 limits, the empty Site2 section and the two options
+    self.assertEqual( self.opsHelper.calls, 4 )
+    self.assertEqual( Matcher.gJobDB.counterQueries, 1 )
+    gConfig.addListenerToNewVersionEvent( Matcher.resetCSCaches )
+    gEventDispatcher.triggerEvent( "CSNewVersion", "2", threaded = False )
+    limiter.getNegativeCondForSite( 'Site1' )
+    limiter.checkMatchingDelay()
+    self.assertEqual( self.opsHelper.calls, 7 )
+    self.assertEqual( Matcher.gJobDB.counterQueries, 2 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MatcherHandlerTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
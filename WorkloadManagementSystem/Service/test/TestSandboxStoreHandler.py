@@ -0,0 +1,299 @@
+""" Test cases for the sandbox uploads to the SandboxStore service, sent by a TransferClient
+    over a loopback connection with the negotiated window
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
+from DIRAC import gConfig, S_OK, S_ERROR
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.LockManager import LockManager
+from DIRAC.Core.DISET.TransferClient import TransferClient
+import DIRAC.WorkloadManagementSystem.Service.SandboxStoreHandler as SandboxStoreModule
+
+CS_PATH = "/Systems/WorkloadManagement/Test/Services/SandboxStore"
+CRED_DICT = { 'username' : 'user', 'group' : 'user_group', 'DN' : '/O=DIRAC/CN=user' }
+
+class FakeSandboxDB:
+  """ Blobs and sandboxes in memory, each owner sees its own sandboxes only """
+
+  def __init__( self ):
+    #( SEName, SEPFN ) : { BlobId, RefCount, Stored }
+    self.blobs = {}
+    #( SEName, SEPFN, owner ) : ( SBId, BlobId )
+    self.sandboxes = {}
+
+  def getBlob( self, blobId ):
+    for blob in self.blobs.values():
+      if blob[ 'BlobId' ] == blobId:
+        return blob
+
+  def getSandboxId( self, seName, sePFN, requesterName, requesterGroup ):
+    if ( seName, sePFN, requesterName ) in self.sandboxes:
+      return S_OK( self.sandboxes[ ( seName, sePFN, requesterName ) ][0] )
+    return S_ERROR( "Sandbox %s:%s does not exist" % ( seName, sePFN ) )
+
+  def accessedSandboxById( self, sbId ):
+    return S_OK()
+
+  def acquireBlob( self, blobHash, sbSE, sbPFN, size = 0 ):
+    if ( sbSE, sbPFN ) in self.blobs:
+      blob = self.blobs[ ( sbSE, sbPFN ) ]
+      blob[ 'RefCount' ] += 1
+      return S_OK( ( blob[ 'BlobId' ], not blob[ 'Stored' ] ) )
+    self.blobs[ ( sbSE, sbPFN ) ] = { 'BlobId' : len( self.blobs ) + 1, 'RefCount' : 1, 'Stored' : False }
+    return S_OK( ( len( self.blobs ), True ) )
+
+  def markBlobStored( self, blobId ):
+    blob = self.getBlob( blobId )
+    blob[ 'Stored' ] = blob[ 'RefCount' ] > 0
+    return S_OK( blob[ 'Stored' ] )
+
+  def isSandboxStored( self, sbId ):
+    for sandboxId, blobId in self.sandboxes.values():
+      if sandboxId == sbId:
+        return S_OK( self.getBlob( blobId )[ 'Stored' ] )
+    return S_OK( False )
+
+  def releaseBlob( self, blobId ):
+    blob = self.getBlob( blobId )
+    blob[ 'RefCount' ] = max( 0, blob[ 'RefCount' ] - 1 )
+    return S_OK()
+
+  def registerAndGetSandbox( self, owner, ownerDN, ownerGroup, sbSE, sbPFN, size = 0, blobId = 0 ):
+    if ( sbSE, sbPFN, owner ) in self.sandboxes:
+      return S_OK( ( self.sandboxes[ ( sbSE, sbPFN, owner ) ][0], False ) )
+    self.sandboxes[ ( sbSE, sbPFN, owner ) ] = ( len( self.sandboxes ) + 1, blobId )
+    return S_OK( ( len( self.sandboxes ), True ) )
+
+  def assignSandboxesToEntities( self, enDict, requesterName, requesterGroup, enSetup, ownerName = "", ownerGroup = "" ):
+    return S_OK( 0 )
+
+class FakeStorageElement:
+  """ External SE keeping the files in memory """
+
+  files = {}
+
+  def __init__( self, seName ):
+    self.seName = seName
+
+  def isValid( self ):
+    return S_OK()
+
+  def getPfnForLfn( self, lfn ):
+    return S_OK( "srm://external%s" % lfn )
+
+  def exists( self, pfn, singleFile = False ):
+    return S_OK( pfn in FakeStorageElement.files )
+
+class FakeReplicaManager:
+  """ Puts to the FakeStorageElement, failing the first failPuts ones """
+
+  puts = 0
+  failPuts = 0
+
+  def put( self, lfn, localFile, diracSE ):
+    FakeReplicaManager.puts += 1
+    if FakeReplicaManager.failPuts:
+      FakeReplicaManager.failPuts -= 1
+      return S_ERROR( "put: Failed to put file to Storage Element." )
+    pfn = FakeStorageElement( diracSE ).getPfnForLfn( lfn )[ 'Value' ]
+    FakeStorageElement.files[ pfn ] = open( localFile ).read()
+    return S_OK( { 'Successful' : { lfn : pfn }, 'Failed' : {} } )
+
+class FakeTransportPool:
+
+  def __init__( self, transport ):
+    self.transport = transport
+
+  def get( self, trid ):
+    return self.transport
+
+  def send( self, trid, msg ):
+    return self.transport.sendData( msg )
+
+  def receive( self, trid, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
+    return self.transport.receiveData( maxBufferSize )
+
+class FakeMessageBroker:
+
+  def __init__( self, transport ):
+    self.trPool = FakeTransportPool( transport )
+
+  def getTransportPool( self ):
+    return self.trPool
+
+class LoopbackTransferClient( TransferClient ):
+  """ TransferClient over an already connected transport, without proposing the action """
+
+  def __init__( self, transport, **kwargs ):
+    self.kwargs = kwargs
+    self.transport = transport
+    self.fileHelpers = []
+
+  def _connect( self, reuse = False ):
+    return S_OK( ( 0, self.transport ) )
+
+  def _proposeAction( self, transport, action, keepConnected = False ):
+    return S_OK()
+
+  def _disconnect( self, trid, keepConnected = False ):
+    pass
+
+  def _getFileHelper( self, transport = None ):
+    fileHelper = TransferClient._getFileHelper( self, transport )
+    self.fileHelpers.append( fileHelper )
+    return fileHelper
+
+class SandboxStoreHandlerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.basePath = tempfile.mkdtemp()
+    gConfig.setOptionValue( "%s/BasePath" % CS_PATH, self.basePath )
+    gConfig.setOptionValue( "%s/MaxSandboxSizeMiB" % CS_PATH, "1" )
+    gConfig.setOptionValue( "%s/Backend" % CS_PATH, "local" )
+    SandboxStoreModule.sandboxDB = FakeSandboxDB()
+    self.storageElement = SandboxStoreModule.StorageElement
+    self.replicaManager = SandboxStoreModule.ReplicaManager
+    SandboxStoreModule.StorageElement = FakeStorageElement
+    SandboxStoreModule.ReplicaManager = FakeReplicaManager
+    FakeStorageElement.files = {}
+    FakeReplicaManager.puts = 0
+    FakeReplicaManager.failPuts = 0
+    #No purge thread
+    SandboxStoreModule.SandboxStoreHandler._SandboxStoreHandler__purgeCount = 0
+    self.listener = PlainTransport( ( "127.0.0.1", 0 ), bServerMode = True )
+    self.listener.initAsServer()
+
+  def tearDown( self ):
+    SandboxStoreModule.StorageElement = self.storageElement
+    SandboxStoreModule.ReplicaManager = self.replicaManager
+    self.listener.close()
+    shutil.rmtree( self.basePath )
+
+  def serve( self, credDict ):
+    transport = self.listener.acceptConnection()[ 'Value' ]
+    transport.peerCredentials = dict( credDict )
+    srvInfoDict = { 'serviceName' : "WorkloadManagement/SandboxStore", 'csPaths' : [ CS_PATH ],
+                    'URL' : "dips://localhost/WorkloadManagement/SandboxStore" }
+    handlerClass = SandboxStoreModule.SandboxStoreHandler
+    handlerClass._rh__initializeClass( srvInfoDict, LockManager(), FakeMessageBroker( transport ), None )
+    handler = handlerClass( { 'clientSetup' : 'Test' }, 0 )
+    handler.initialize()
+    try:
+      handler._rh_executeAction( ( None, ( "FileTransfer", "FromClient" ) ) )
+    finally:
+      transport.close()
+
+  def upload( self, data, declareSize = True, owner = 'user', **kwargs ):
+    """ Upload data as a sandbox, returns the result and the client window """
+    credDict = dict( CRED_DICT )
+    credDict[ 'username' ] = owner
+    serverThread = threading.Thread( target = self.serve, args = ( credDict, ) )
+    serverThread.setDaemon( 1 )
+    serverThread.start()
+    transport = PlainTransport( self.listener.getLocalAddress(), timeout = 30 )
+    transport.initAsClient()
+    fd, filePath = tempfile.mkstemp()
+    os.write( fd, data )
+    os.close( fd )
+    sbFile = open( filePath, "rb" )
+    try:
+      client = LoopbackTransferClient( transport, **kwargs )
+      fileId = ( "%s.tar.bz2" % md5( data ).hexdigest(), {} )
+      #The size is not known when sending a file descriptor
+      if declareSize:
+        result = client.sendFile( filePath, fileId )
+      else:
+        result = client.sendFile( sbFile.fileno(), fileId )
+    finally:
+      sbFile.close()
+      os.unlink( filePath )
+      transport.close()
+    serverThread.join( 30 )
+    return result, client.fileHelpers[0].windowSize
+
+  def storedFiles( self ):
+    return [ fileName for dirPath, dirNames, fileNames in os.walk( os.path.join( self.basePath, "SandBox" ) )
+             for fileName in fileNames ]
+
+  def test_upload( self ):
+    """ a sandbox sent with the default window is stored under its hash """
+    data = os.urandom( 300000 )
+    result, windowSize = self.upload( data, transferChunkSize = 16384 )
+    self.assertEqual( windowSize, 8 )
+    self.assert_( result[ 'OK' ] )
+    sbHash = md5( data ).hexdigest()
+    self.assertEqual( result[ 'Value' ], "SB:SandboxSE|/SandBox/Blobs/%s/%s/%s.tar.bz2" % ( sbHash[0:3], sbHash[3:6], sbHash ) )
+    self.assertEqual( self.storedFiles(), [ "%s.tar.bz2" % sbHash ] )
+    # The same window as the stop-and-wait transfer
+    result, windowSize = self.upload( data, transferWindow = 1 )
+    self.assertEqual( windowSize, 1 )
+    self.assert_( result[ 'OK' ] )
+
+  def test_tooBig( self ):
+    """ the uploads over the size limit are refused and the client gets the error """
+    data = os.urandom( 1048576 + 100000 )
+    # Refused before receiving anything
+    result, windowSize = self.upload( data, transferChunkSize = 65536 )
+    self.assertEqual( windowSize, 8 )
+    self.failIf( result[ 'OK' ] )
+    self.assert_( result[ 'Message' ].find( "Sandbox is too big" ) > -1 )
+    # Stopped once the limit is reached
+    for window in ( 1, 8 ):
+      result, windowSize = self.upload( data, declareSize = False, transferWindow = window, transferChunkSize = 65536 )
+      self.assertEqual( windowSize, window )
+      self.failIf( result[ 'OK' ] )
+      self.assertEqual( result[ 'Message' ], "Exceeded maximum file size" )
+    self.assertEqual( self.storedFiles(), [] )
+    self.assertEqual( os.listdir( os.path.join( self.basePath, "tmp" ) ), [] )
+
+  def test_externalSE( self ):
+    """ the contents uploaded to an external SE are shared only once they are stored """
+    gConfig.setOptionValue( "%s/Backend" % CS_PATH, "ExternalSE" )
+    data = os.urandom( 100000 )
+    sbHash = md5( data ).hexdigest()
+    sbPFN = "srm://external/SandBox/Blobs/%s/%s/%s.tar.bz2" % ( sbHash[0:3], sbHash[3:6], sbHash )
+    # The copy of the first upload fails, the next upload of the same contents stores them
+    FakeReplicaManager.failPuts = 1
+    self.failIf( self.upload( data, owner = 'user1' )[0][ 'OK' ] )
+    self.assertEqual( SandboxStoreModule.sandboxDB.sandboxes, {} )
+    self.assertEqual( self.upload( data, owner = 'user2' )[0], S_OK( "SB:ExternalSE|%s" % sbPFN ) )
+    self.assertEqual( FakeReplicaManager.puts, 2 )
+    self.assertEqual( FakeStorageElement.files, { sbPFN : data } )
+    # Stored contents are shared
+    self.assert_( self.upload( data, owner = 'user3' )[0][ 'OK' ] )
+    self.assertEqual( FakeReplicaManager.puts, 2 )
+    # Skipped upload of a sandbox registered without its contents
+    del FakeStorageElement.files[ sbPFN ]
+    self.assert_( self.upload( data, owner = 'user3' )[0][ 'OK' ] )
+    self.assertEqual( FakeReplicaManager.puts, 3 )
+    self.assertEqual( FakeStorageElement.files, { sbPFN : data } )
+    self.assert_( self.upload( data, owner = 'user3' )[0][ 'OK' ] )
+    self.assertEqual( FakeReplicaManager.puts, 3 )
+    blob = SandboxStoreModule.sandboxDB.blobs[ ( "ExternalSE", sbPFN ) ]
+    self.assertEqual( ( blob[ 'RefCount' ], blob[ 'Stored' ] ), ( 2, True ) )
+
+  def test_unfinishedUpload( self ):
+    """ contents registered by an upload that did not store them are stored by the next one """
+    data = os.urandom( 100000 )
+    sbHash = md5( data ).hexdigest()
+    sbPath = "/SandBox/Blobs/%s/%s/%s.tar.bz2" % ( sbHash[0:3], sbHash[3:6], sbHash )
+    blobId = SandboxStoreModule.sandboxDB.acquireBlob( sbHash, "SandboxSE", sbPath, len( data ) )[ 'Value' ][0]
+    self.assertEqual( self.upload( data )[0], S_OK( "SB:SandboxSE|%s" % sbPath ) )
+    self.assertEqual( self.storedFiles(), [ "%s.tar.bz2" % sbHash ] )
+    self.assert_( SandboxStoreModule.sandboxDB.getBlob( blobId )[ 'Stored' ] )
+    # Contents lost after they were stored
+    os.unlink( os.path.join( self.basePath, sbPath[1:] ) )
+    self.assert_( self.upload( data, owner = 'user2' )[0][ 'OK' ] )
+    self.assertEqual( self.storedFiles(), [ "%s.tar.bz2" % sbHash ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( SandboxStoreHandlerTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
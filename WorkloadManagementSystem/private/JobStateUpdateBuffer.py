@@ -0,0 +1,412 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Write-behind buffer of the job state updates received by the JobStateUpdate
+    service. Updates are coalesced per job, only the last value of every job
+    attribute and parameter is kept, and they are written to the JobDB and the
+    JobLoggingDB by a background thread every flushInterval seconds:
+
+    - jobs with the same pending attribute values are updated in one statement
+    - parameters and heart beat samples are inserted in bulk
+    - logging records are inserted in one statement
+
+    The updates that fail to be written are kept for the next flush, unless
+    newer values have arrived in the meantime. A failing bulk insert is split
+    to isolate the rows refused by the DB. The failed updates are dropped once
+    they have been retried for maxRetryTime seconds, the attribute values
+    received before the last update of the job in the JobDB are not retried,
+    and at most maxQueued logging records and heart beat samples are kept.
+
+    The write methods have the same signatures as the JobDB and JobLoggingDB
+    ones. The pending values can be read with getAttributes/getParameters to
+    overlay them on the values read from the JobDB.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading, time
+from DIRAC import gLogger, S_OK, Time
+
+gJobStateUpdateBuffer = None
+
+#Extra statements allowed per flush to isolate the rows of a failing bulk insert
+MAX_SPLIT_STATEMENTS = 32
+
+def _now():
+  """ UTC time stamp string with a precision of one second """
+  return str( Time.dateTime().replace( microsecond = 0 ) )
+
+class JobStateUpdateBuffer:
+
+  def __init__( self, jobDB, logDB, flushInterval = 2, maxJobs = 10000,
+                maxRetryTime = 600, maxQueued = 100000 ):
+    self.__jobDB = jobDB
+    self.__logDB = logDB
+    self.__flushInterval = max( 0.1, flushInterval )
+    self.__maxJobs = max( 1, maxJobs )
+    self.__maxRetryTime = maxRetryTime
+    self.__maxQueued = max( 1, maxQueued )
+    self.log = gLogger.getSubLogger( "JobStateUpdateBuffer" )
+    self.__lock = threading.Lock()
+    #Only one flush at a time
+    self.__flushLock = threading.Lock()
+    self.__wakeUp = threading.Event()
+    self.__pending = self.__newState()
+    #State being written, still visible to the readers
+    self.__flushing = self.__newState()
+    #Time of the first failure of the updates being retried
+    self.__failures = {}
+    self.__stats = { 'flushes' : 0, 'statements' : 0, 'updates' : 0, 'errors' : 0, 'requeued' : 0,
+                     'dropped' : 0 }
+    self.__thread = None
+
+  def __newState( self ):
+    return { 'attributes' : {},
+             #When the attribute values were received
+             'attributeTimes' : {},
+             'startExecTime' : {},
+             'endExecTime' : {},
+             'parameters' : {},
+             'loggingRecords' : [],
+             'heartBeatSamples' : [] }
+
+  def start( self ):
+    """ Start the background flushing thread
+    """
+    if self.__thread:
+      return S_OK()
+    self.__thread = threading.Thread( target = self.__flushLoop )
+    self.__thread.setDaemon( True )
+    self.__thread.start()
+    return S_OK()
+
+  def __flushLoop( self ):
+    while True:
+      self.__wakeUp.wait( self.__flushInterval )
+      self.__wakeUp.clear()
+      try:
+        self.flush()
+      except Exception:
+        self.log.exception( "Failed to flush the job state updates" )
+
+  def __jobAdded( self ):
+    """ Flush earlier if there are too many jobs pending, the lock has to be held """
+    if len( self.__pending[ 'attributes' ] ) + len( self.__pending[ 'parameters' ] ) >= self.__maxJobs:
+      self.__wakeUp.set()
+
+  def setJobAttributes( self, jobID, attrNames, attrValues, update = False ):
+    """ Same as JobDB.setJobAttributes for one job, LastUpdateTime is refreshed if update is True
+    """
+    jobID = int( jobID )
+    now = _now()
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'updates' ] += 1
+      jobAttrs = self.__pending[ 'attributes' ].setdefault( jobID, {} )
+      jobAttrs.update( zip( attrNames, attrValues ) )
+      attrTimes = self.__pending[ 'attributeTimes' ].setdefault( jobID, {} )
+      attrTimes.update( dict.fromkeys( attrNames, now ) )
+      if update:
+        jobAttrs[ 'LastUpdateTime' ] = now
+        attrTimes[ 'LastUpdateTime' ] = now
+      self.__jobAdded()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def setJobAttribute( self, jobID, attrName, attrValue, update = False ):
+    return self.setJobAttributes( jobID, [ attrName ], [ attrValue ], update )
+
+  def setJobStatus( self, jobID, status = '', minor = '', application = '', appCounter = None ):
+    """ Same as JobDB.setJobStatus
+    """
+    attrNames = []
+    attrValues = []
+    for attrName, attrValue in ( ( 'Status', status ), ( 'MinorStatus', minor ),
+                                 ( 'ApplicationStatus', application ),
+                                 ( 'ApplicationNumStatus', appCounter ) ):
+      if attrValue:
+        attrNames.append( attrName )
+        attrValues.append( attrValue )
+    # Do not update the LastUpdate time stamp if setting the Stalled status
+    return self.setJobAttributes( jobID, attrNames, attrValues, update = status != 'Stalled' )
+
+  def setStartExecTime( self, jobID, startDate = None ):
+    self.__setExecTime( 'startExecTime', jobID, startDate )
+    return S_OK()
+
+  def setEndExecTime( self, jobID, endDate = None ):
+    self.__setExecTime( 'endExecTime', jobID, endDate )
+    return S_OK()
+
+  def __setExecTime( self, execTime, jobID, execDate ):
+    if not execDate:
+      execDate = _now()
+    self.__lock.acquire()
+    try:
+      #As in the JobDB, only the first time stamp is kept
+      self.__pending[ execTime ].setdefault( int( jobID ), execDate )
+    finally:
+      self.__lock.release()
+
+  def setJobParameters( self, jobID, parameters ):
+    """ Set the job parameters given as a list of ( name, value ) pairs
+    """
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'updates' ] += 1
+      self.__pending[ 'parameters' ].setdefault( int( jobID ), {} ).update( parameters )
+      self.__jobAdded()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def setJobParameter( self, jobID, name, value ):
+    return self.setJobParameters( jobID, [ ( name, value ) ] )
+
+  def addLoggingRecord( self, jobID, status = 'idem', minor = 'idem', application = 'idem',
+                        date = '', source = 'Unknown' ):
+    """ Add a logging record, the time stamp is taken now if not given
+    """
+    if not date:
+      date = Time.dateTime()
+    self.__lock.acquire()
+    try:
+      self.__pending[ 'loggingRecords' ].append( ( int( jobID ), status, minor, application, date, source ) )
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def setHeartBeatData( self, jobID, staticDataDict, dynamicDataDict ):
+    """ Same as JobDB.setHeartBeatData, the samples keep the time they were received
+    """
+    jobID = int( jobID )
+    now = _now()
+    self.__lock.acquire()
+    try:
+      self.__stats[ 'updates' ] += 1
+      jobAttrs = self.__pending[ 'attributes' ].setdefault( jobID, {} )
+      jobAttrs[ 'HeartBeatTime' ] = now
+      jobAttrs[ 'Status' ] = 'Running'
+      self.__pending[ 'attributeTimes' ].setdefault( jobID, {} ).update( { 'HeartBeatTime' : now, 'Status' : now } )
+      if staticDataDict:
+        self.__pending[ 'parameters' ].setdefault( jobID, {} ).update( staticDataDict )
+      samples = self.__pending[ 'heartBeatSamples' ]
+      for key, value in dynamicDataDict.items():
+        samples.append( ( jobID, key, value, now ) )
+      self.__jobAdded()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def getAttributes( self, jobID ):
+    """ Get the attribute values not yet written to the JobDB for the job
+    """
+    return self.__getPending( 'attributes', jobID )
+
+  def getParameters( self, jobID ):
+    """ Get the parameter values not yet written to the JobDB for the job
+    """
+    return self.__getPending( 'parameters', jobID )
+
+  def __getPending( self, field, jobID ):
+    try:
+      jobID = int( jobID )
+    except ( ValueError, TypeError ):
+      return {}
+    self.__lock.acquire()
+    try:
+      valuesDict = dict( self.__flushing[ field ].get( jobID, {} ) )
+      valuesDict.update( self.__pending[ field ].get( jobID, {} ) )
+      return valuesDict
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'pendingJobs' ] = len( set( self.__pending[ 'attributes' ] ) | set( self.__pending[ 'parameters' ] ) )
+      stats[ 'pendingLoggingRecords' ] = len( self.__pending[ 'loggingRecords' ] )
+      stats[ 'pendingHeartBeatSamples' ] = len( self.__pending[ 'heartBeatSamples' ] )
+      return stats
+    finally:
+      self.__lock.release()
+
+  def flush( self ):
+    """ Write all the pending updates to the DBs
+    """
+    self.__flushLock.acquire()
+    try:
+      self.__lock.acquire()
+      try:
+        state = self.__pending
+        self.__flushing = state
+        self.__pending = self.__newState()
+      finally:
+        self.__lock.release()
+      #Whatever is not written goes back to the pending updates
+      failed = state
+      try:
+        failed = self.__write( state )
+        self.__dropStale( failed )
+      finally:
+        self.__lock.acquire()
+        try:
+          self.__requeue( failed )
+          self.__flushing = self.__newState()
+        finally:
+          self.__lock.release()
+    finally:
+      self.__flushLock.release()
+    return S_OK()
+
+  def __dropStale( self, failed ):
+    """ Do not retry the attribute values received before the job was last updated in the
+        JobDB, e.g. killed by the JobManager while they could not be written
+    """
+    jobIDList = [ jobID for jobID, attrDict in failed[ 'attributes' ].items() if attrDict ]
+    if not jobIDList:
+      return
+    result = self.__jobDB.getAttributesForJobList( jobIDList, [ 'LastUpdateTime' ] )
+    if not result[ 'OK' ]:
+      #Can not tell, checked again with the next flush
+      return
+    dropped = 0
+    for jobID in jobIDList:
+      lastUpdate = result[ 'Value' ].get( jobID, {} ).get( 'LastUpdateTime' )
+      if not lastUpdate or lastUpdate == 'None':
+        continue
+      attrDict = failed[ 'attributes' ][ jobID ]
+      attrTimes = failed[ 'attributeTimes' ].get( jobID, {} )
+      newer = dict( [ ( name, value ) for name, value in attrDict.items()
+                      if attrTimes.get( name, lastUpdate ) >= lastUpdate ] )
+      dropped += len( attrDict ) - len( newer )
+      failed[ 'attributes' ][ jobID ] = newer
+    if dropped:
+      self.__stats[ 'dropped' ] += dropped
+      self.log.warn( "%s failed attribute updates are older than the JobDB values, dropped" % dropped )
+
+  def __retry( self, key, failures, now ):
+    """ Returns True if the failed update has to be retried, its first failure is kept in failures
+    """
+    firstFailure = self.__failures.get( key, now )
+    if now - firstFailure > self.__maxRetryTime:
+      return False
+    failures[ key ] = firstFailure
+    return True
+
+  def __requeue( self, failed ):
+    """ Put back the updates that could not be written, the newer pending values win.
+        The lock has to be held
+    """
+    pending = self.__pending
+    now = time.time()
+    failures = {}
+    expired = 0
+    for field in ( 'attributes', 'parameters' ):
+      for jobID, valuesDict in failed[ field ].items():
+        if not valuesDict:
+          continue
+        if not self.__retry( ( field, jobID ), failures, now ):
+          expired += len( valuesDict )
+          continue
+        pendingDict = pending[ field ].setdefault( jobID, {} )
+        for name, value in valuesDict.items():
+          pendingDict.setdefault( name, value )
+        if field == 'attributes':
+          pendingTimes = pending[ 'attributeTimes' ].setdefault( jobID, {} )
+          for name, received in failed[ 'attributeTimes' ].get( jobID, {} ).items():
+            if name in valuesDict:
+              pendingTimes.setdefault( name, received )
+    #The first time stamp is kept
+    for field in ( 'startExecTime', 'endExecTime' ):
+      for jobID, execDate in failed[ field ].items():
+        if self.__retry( ( field, jobID ), failures, now ):
+          pending[ field ][ jobID ] = execDate
+        else:
+          expired += 1
+    overflow = 0
+    for field in ( 'loggingRecords', 'heartBeatSamples' ):
+      retried = [ entry for entry in failed[ field ] if self.__retry( ( field, repr( entry ) ), failures, now ) ]
+      expired += len( failed[ field ] ) - len( retried )
+      pending[ field ][:0] = retried
+      #The oldest entries go first
+      excess = len( pending[ field ] ) - self.__maxQueued
+      if excess > 0:
+        del pending[ field ][:excess]
+        overflow += excess
+    self.__failures = failures
+    if expired:
+      self.log.error( "%s updates dropped, failed for more than %s seconds" % ( expired, self.__maxRetryTime ) )
+    if overflow:
+      self.log.error( "%s logging records and heart beat samples dropped" % overflow,
+                      "more than %s pending" % self.__maxQueued )
+    self.__stats[ 'dropped' ] += expired + overflow
+    requeued = len( set( [ key[1] for key in failures if key[0] in ( 'attributes', 'parameters' ) ] ) )
+    if requeued:
+      self.__stats[ 'requeued' ] += requeued
+      self.log.warn( "Updates of %s jobs will be written with the next flush" % requeued )
+
+  def __check( self, result, what ):
+    """ Returns True if the write succeeded """
+    self.__stats[ 'statements' ] += 1
+    if not result[ 'OK' ]:
+      self.__stats[ 'errors' ] += 1
+      self.log.error( "Failed to write the %s" % what, result[ 'Message' ] )
+      return False
+    return True
+
+  def __writeRows( self, writeRows, rows, what, budget = None ):
+    """ Write the rows in one statement, a failing batch is split in halves to isolate
+        the rows refused by the DB, within a budget of statements. Returns the rows not written
+    """
+    if not rows:
+      return []
+    if budget is None:
+      budget = [ MAX_SPLIT_STATEMENTS ]
+    if self.__check( writeRows( rows ), what ):
+      return []
+    if len( rows ) == 1 or budget[0] < 2:
+      return list( rows )
+    budget[0] -= 2
+    half = len( rows ) / 2
+    return self.__writeRows( writeRows, rows[:half], what, budget ) + \
+           self.__writeRows( writeRows, rows[half:], what, budget )
+
+  def __write( self, state ):
+    """ Write the updates, returns the ones that failed """
+    self.__stats[ 'flushes' ] += 1
+    failed = self.__newState()
+    #Jobs with the same new values are updated together
+    groups = {}
+    for jobID, attrDict in state[ 'attributes' ].items():
+      if not attrDict:
+        continue
+      groups.setdefault( tuple( sorted( attrDict.items() ) ), [] ).append( jobID )
+    for attrItems, jobIDList in groups.items():
+      result = self.__jobDB.setJobAttributes( jobIDList, [ item[0] for item in attrItems ],
+                                              [ item[1] for item in attrItems ] )
+      if not self.__check( result, "job attributes" ):
+        for jobID in jobIDList:
+          failed[ 'attributes' ][ jobID ] = state[ 'attributes' ][ jobID ]
+          failed[ 'attributeTimes' ][ jobID ] = state[ 'attributeTimes' ].get( jobID, {} )
+    for jobID, startDate in state[ 'startExecTime' ].items():
+      if not self.__check( self.__jobDB.setStartExecTime( jobID, startDate ), "start time" ):
+        failed[ 'startExecTime' ][ jobID ] = startDate
+    for jobID, endDate in state[ 'endExecTime' ].items():
+      if not self.__check( self.__jobDB.setEndExecTime( jobID, endDate ), "end time" ):
+        failed[ 'endExecTime' ][ jobID ] = endDate
+    valuesList = []
+    for jobID, paramDict in state[ 'parameters' ].items():
+      valuesList.extend( [ ( jobID, name, value ) for name, value in paramDict.items() ] )
+    insertParameters = lambda rows: self.__jobDB.insertFieldsBulk( 'JobParameters', [ 'JobID', 'Name', 'Value' ],
+                                                                    rows, replace = True )
+    for jobID, name, value in self.__writeRows( insertParameters, valuesList, "job parameters" ):
+      failed[ 'parameters' ].setdefault( jobID, {} )[ name ] = value
+    insertSamples = lambda rows: self.__jobDB.insertFieldsBulk( 'HeartBeatLoggingInfo',
+                                                                 [ 'JobID', 'Name', 'Value', 'HeartBeatTime' ], rows )
+    failed[ 'heartBeatSamples' ] = self.__writeRows( insertSamples, state[ 'heartBeatSamples' ], "heart beat data" )
+    failed[ 'loggingRecords' ] = self.__writeRows( self.__logDB.addLoggingRecords, state[ 'loggingRecords' ],
+                                                   "logging records" )
+    return failed
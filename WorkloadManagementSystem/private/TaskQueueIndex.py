@@ -0,0 +1,260 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" In memory index of the task queue definitions to match resources
+    without querying the TaskQueueDB. It applies the same rules as the
+    SQL generated by TaskQueueDB.__generateTQMatchSQL using set operations.
+    Values are compared case insensitive and ignoring trailing spaces as
+    MySQL does.
+"""
+
+__RCSID__ = "$Id$"
+
+import heapq
+import random
+import threading
+from types import ListType, TupleType, DictType, StringTypes
+from DIRAC.Core.Security import Properties, CS
+
+def _normalize( value ):
+  if type( value ) in StringTypes:
+    return value.rstrip().lower()
+  return value
+
+def _asList( value ):
+  if type( value ) in ( ListType, TupleType ):
+    return value
+  return [ value ]
+
+class TaskQueueIndex:
+
+  def __init__( self, singleValueDefFields, multiValueDefFields, multiValueMatchFields,
+                bannedJobMatchFields, strictRequireMatchFields ):
+    self.__singleValueDefFields = singleValueDefFields
+    self.__multiValueDefFields = multiValueDefFields
+    self.__multiValueMatchFields = multiValueMatchFields
+    self.__bannedJobMatchFields = bannedJobMatchFields
+    self.__strictRequireMatchFields = strictRequireMatchFields
+    self.__lock = threading.Lock()
+    self.__reset()
+
+  def __reset( self ):
+    #tqId -> ( OwnerDN, OwnerGroup )
+    self.__taskQueues = {}
+    #tqId -> 1 / Priority
+    self.__invPriorities = {}
+    #field -> normalized value -> set of tqIds
+    self.__singleValues = dict( [ ( field, {} ) for field in self.__singleValueDefFields ] )
+    self.__multiValues = dict( [ ( field, {} ) for field in self.__multiValueDefFields ] )
+    #field -> set of tqIds without values for that field
+    self.__unrestricted = dict( [ ( field, set() ) for field in self.__multiValueDefFields ] )
+    #( OwnerDN, OwnerGroup ) -> set of tqIds
+    self.__owners = {}
+    #tqId -> [ ( index dict, key ) ] where the tqId has been added
+    self.__entries = {}
+
+  def __len__( self ):
+    return len( self.__taskQueues )
+
+  def getTaskQueueIds( self ):
+    self.__lock.acquire()
+    try:
+      return set( self.__taskQueues )
+    finally:
+      self.__lock.release()
+
+  def reset( self, tqDefs ):
+    """ Replace the contents of the index with the given definitions
+    """
+    self.__lock.acquire()
+    try:
+      self.__reset()
+      for tqId in tqDefs:
+        self.__add( tqId, tqDefs[ tqId ] )
+    finally:
+      self.__lock.release()
+
+  def addTaskQueues( self, tqDefs ):
+    """ Add task queues definitions as { tqId : { field : value(s), 'Priority' : prio } }
+    """
+    self.__lock.acquire()
+    try:
+      for tqId in tqDefs:
+        if tqId in self.__taskQueues:
+          self.__remove( tqId )
+        self.__add( tqId, tqDefs[ tqId ] )
+    finally:
+      self.__lock.release()
+
+  def removeTaskQueues( self, tqIdList ):
+    self.__lock.acquire()
+    try:
+      for tqId in tqIdList:
+        if tqId in self.__taskQueues:
+          self.__remove( tqId )
+    finally:
+      self.__lock.release()
+
+  def setPriorities( self, prioDict ):
+    """ Update the priorities as { tqId : priority }
+    """
+    self.__lock.acquire()
+    try:
+      for tqId in prioDict:
+        if tqId in self.__taskQueues:
+          self.__invPriorities[ tqId ] = self.__invPriority( prioDict[ tqId ] )
+    finally:
+      self.__lock.release()
+
+  def __invPriority( self, priority ):
+    return 1.0 / max( priority, 0.000001 )
+
+  def __add( self, tqId, tqDef ):
+    self.__taskQueues[ tqId ] = ( tqDef[ 'OwnerDN' ], tqDef[ 'OwnerGroup' ] )
+    self.__invPriorities[ tqId ] = self.__invPriority( tqDef[ 'Priority' ] )
+    entries = []
+    for field in self.__singleValueDefFields:
+      entries.append( ( self.__singleValues[ field ], _normalize( tqDef[ field ] ) ) )
+    entries.append( ( self.__owners, ( _normalize( tqDef[ 'OwnerDN' ] ), _normalize( tqDef[ 'OwnerGroup' ] ) ) ) )
+    for field in self.__multiValueDefFields:
+      values = [ value for value in tqDef.get( field, [] ) if value.strip() ]
+      if not values:
+        self.__unrestricted[ field ].add( tqId )
+        continue
+      for value in values:
+        entries.append( ( self.__multiValues[ field ], _normalize( value ) ) )
+    for indexDict, key in entries:
+      indexDict.setdefault( key, set() ).add( tqId )
+    self.__entries[ tqId ] = entries
+
+  def __discard( self, indexDict, key, tqId ):
+    tqSet = indexDict.get( key )
+    if tqSet is None:
+      return
+    tqSet.discard( tqId )
+    if not tqSet:
+      del( indexDict[ key ] )
+
+  def __remove( self, tqId ):
+    del( self.__taskQueues[ tqId ] )
+    del( self.__invPriorities[ tqId ] )
+    for indexDict, key in self.__entries.pop( tqId ):
+      self.__discard( indexDict, key, tqId )
+    for field in self.__multiValueDefFields:
+      self.__unrestricted[ field ].discard( tqId )
+
+  def __withValues( self, field, values ):
+    """ Task queues having any of the values in a multi value field
+    """
+    tqSet = set()
+    valuesDict = self.__multiValues[ field ]
+    for value in _asList( values ):
+      tqSet.update( valuesDict.get( _normalize( value ), () ) )
+    return tqSet
+
+  def __withSingleValues( self, field, values ):
+    tqSet = set()
+    valuesDict = self.__singleValues[ field ]
+    for value in _asList( values ):
+      tqSet.update( valuesDict.get( _normalize( value ), () ) )
+    return tqSet
+
+  def __ownerCond( self, tqMatchDict ):
+    """ Task queues allowed by the OwnerDN/OwnerGroup conditions, None if no condition
+    """
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      tqSet = set()
+      dns = _asList( tqMatchDict[ 'OwnerDN' ] )
+      for group in _asList( tqMatchDict[ 'OwnerGroup' ] ):
+        if Properties.JOB_SHARING in CS.getPropertiesForGroup( group ):
+          tqSet.update( self.__withSingleValues( 'OwnerGroup', group ) )
+        else:
+          for dn in dns:
+            tqSet.update( self.__owners.get( ( _normalize( dn ), _normalize( group ) ), () ) )
+      return tqSet
+    tqSet = None
+    for field in ( 'OwnerGroup', 'OwnerDN' ):
+      if field in tqMatchDict:
+        fieldSet = self.__withSingleValues( field, tqMatchDict[ field ] )
+        if tqSet is None:
+          tqSet = fieldSet
+        else:
+          tqSet &= fieldSet
+    return tqSet
+
+  def __negativeDictCond( self, negativeCond ):
+    """ Task queues excluded by a negative condition dict
+    """
+    excluded = set()
+    for field in negativeCond:
+      if field in self.__multiValueMatchFields:
+        excluded.update( self.__withValues( "%ss" % field, negativeCond[ field ] ) )
+      elif field in self.__singleValueDefFields:
+        excluded.update( self.__withSingleValues( field, negativeCond[ field ] ) )
+    return excluded
+
+  def __candidates( self, tqMatchDict, negativeCond ):
+    candidates = self.__ownerCond( tqMatchDict )
+    if candidates is None:
+      candidates = set( self.__taskQueues )
+    if 'CPUTime' in tqMatchDict:
+      maxCPU = max( _asList( tqMatchDict[ 'CPUTime' ] ) )
+      cpuDict = self.__singleValues[ 'CPUTime' ]
+      cpuSet = set()
+      for cpuTime in cpuDict:
+        if cpuTime <= maxCPU:
+          cpuSet.update( cpuDict[ cpuTime ] )
+      candidates &= cpuSet
+    if 'Setup' in tqMatchDict:
+      candidates &= self.__withSingleValues( 'Setup', tqMatchDict[ 'Setup' ] )
+    for field in self.__multiValueMatchFields:
+      defField = "%ss" % field
+      if field in tqMatchDict and tqMatchDict[ field ]:
+        fieldSet = self.__withValues( defField, tqMatchDict[ field ] )
+        # Jobs for masked sites can be matched if they specified a GridCE,
+        # then the GridCE has to be explicitly required
+        if field != 'GridCE' or 'Site' in tqMatchDict:
+          fieldSet |= self.__unrestricted[ defField ]
+        candidates &= fieldSet
+        #In case of Site, check it's not in job banned sites
+        if field in self.__bannedJobMatchFields:
+          candidates -= self.__withValues( "Banned%s" % defField, tqMatchDict[ field ] )
+      #Resource banning
+      bannedField = "Banned%s" % field
+      if bannedField in tqMatchDict and tqMatchDict[ bannedField ]:
+        candidates -= self.__withValues( defField, tqMatchDict[ bannedField ] )
+      if not candidates:
+        return candidates
+    #For certain fields, the require is strict. If it is not in the tqMatchDict, the job cannot require it
+    for field in self.__strictRequireMatchFields:
+      if field not in tqMatchDict:
+        candidates &= self.__unrestricted[ "%ss" % field ]
+    if negativeCond:
+      if type( negativeCond ) == DictType:
+        candidates -= self.__negativeDictCond( negativeCond )
+      else:
+        allowed = set()
+        for condDict in negativeCond:
+          allowed |= candidates - self.__negativeDictCond( condDict )
+        candidates = allowed
+    return candidates
+
+  def match( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {} ):
+    """ Get the task queues matching the requirements as [ ( tqId, OwnerDN, OwnerGroup ) ]
+        sorted randomly weighted by their priority. tqMatchDict values must not be escaped
+    """
+    self.__lock.acquire()
+    try:
+      candidates = self.__candidates( tqMatchDict, negativeCond )
+      invPriorities = self.__invPriorities
+      rand = random.random
+      #Same as ORDER BY RAND() / Priority
+      weights = [ ( rand() * invPriorities[ tqId ], tqId ) for tqId in candidates ]
+      if numQueuesToGet:
+        weights = heapq.nsmallest( numQueuesToGet, weights )
+      else:
+        weights.sort()
+      taskQueues = self.__taskQueues
+      return [ ( tqId, ) + taskQueues[ tqId ] for weight, tqId in weights ]
+    finally:
+      self.__lock.release()